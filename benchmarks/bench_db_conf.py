@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmark of per-request cost of reading database configuration.
+
+Compares the original implementation that parsed db.properties on every
+call with the cached get_db_conf() that only stat()s the file.
+
+Usage: python benchmarks/bench_db_conf.py [iterations]
+"""
+
+import os
+import re
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import csapi  # noqa: E402 pylint: disable=wrong-import-position
+
+DB_PROPERTIES = '''adapter=postgresql
+encoding=utf8
+username=centerui_user
+password=centerui_pass
+database=centerui_production
+reconnect=true
+'''
+
+
+def legacy_get_db_conf():
+    """Original implementation: parse the file with uncompiled regexes on every call"""
+    conf = {
+        'database': '',
+        'username': '',
+        'password': ''
+    }
+    try:
+        with open(csapi.SETTINGS['db_conf_file'], 'r') as db_conf:
+            for line in db_conf:
+                match_res = re.match('^database\\s*=\\s*(.+)$', line)
+                if match_res:
+                    conf['database'] = match_res.group(1)
+
+                match_res = re.match('^username\\s*=\\s*(.+)$', line)
+                if match_res:
+                    conf['username'] = match_res.group(1)
+
+                match_res = re.match('^password\\s*=\\s*(.+)$', line)
+                if match_res:
+                    conf['password'] = match_res.group(1)
+    except IOError:
+        pass
+    return conf
+
+
+def main():
+    """Run benchmark"""
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csapi.configure({'db_conf_file': os.path.join(tmp_dir, 'db.properties')})
+        with open(csapi.SETTINGS['db_conf_file'], 'w') as db_conf:
+            db_conf.write(DB_PROPERTIES)
+
+        assert legacy_get_db_conf() == csapi.get_db_conf()
+        for name, func in (('uncached', legacy_get_db_conf), ('cached', csapi.get_db_conf)):
+            seconds = min(timeit.repeat(func, number=iterations, repeat=3))
+            print('{:<10} {:8.2f} us/call'.format(name, seconds / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main()
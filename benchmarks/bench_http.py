@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+
+"""End-to-end load test of CS API against a local PostgreSQL fixture.
+
+Creates a throw-away database with the subset of Central Server schema used
+by CS API (benchmarks/schema.sql), runs the real server.py application under
+gunicorn against it and sends /status, /member and /subsystem requests at
+each concurrency level. Throughput, latency percentiles and CPU time used by
+database server per request are printed and can be written as JSON in order
+to compare results of different versions or settings.
+
+The database is created either in a temporary PostgreSQL cluster (initdb and
+pg_ctl are looked up from --pg-bin, PATH or pg_config, must not be run as
+root) or in an existing server given with --admin-dsn (role must be allowed
+to create databases, the database is dropped afterwards).
+
+Usage: python benchmarks/bench_http.py [--pg-bin DIR | --admin-dsn DSN]
+    [--scenarios status,member,subsystem] [--concurrency 1,16,64] [--requests N]
+    [--workers N] [--members N] [--config FILE] [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from bench_sync_async import run_level
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+DB_NAME = 'csapi_bench'
+DB_USER = 'csapi_bench'
+DB_PASSWORD = 'csapi_bench'
+INSTANCE = 'BENCH'
+MEMBER_CLASS = 'GOV'
+
+
+def free_port():
+    """Get free TCP port on loopback interface"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def find_pg_bin(pg_bin):
+    """Get directory of PostgreSQL server binaries or None if not found"""
+    if pg_bin:
+        return pg_bin
+    initdb = shutil.which('initdb')
+    if initdb:
+        return os.path.dirname(initdb)
+    pg_config = shutil.which('pg_config')
+    if pg_config:
+        return subprocess.check_output([pg_config, '--bindir'], universal_newlines=True).strip()
+    return None
+
+
+@contextmanager
+def temporary_cluster(pg_bin, work_dir):
+    """Run temporary PostgreSQL cluster and yield its admin connection string"""
+    data_dir = os.path.join(work_dir, 'pgdata')
+    port = free_port()
+    subprocess.run(
+        [os.path.join(pg_bin, 'initdb'), '-D', data_dir, '-U', 'postgres', '--auth=trust',
+         '--no-sync'], check=True, stdout=subprocess.DEVNULL)
+    subprocess.run(
+        [os.path.join(pg_bin, 'pg_ctl'), '-D', data_dir, '-w', '-l',
+         os.path.join(work_dir, 'postgres.log'), '-o',
+         '-p {} -k {} -c listen_addresses=127.0.0.1'.format(port, work_dir), 'start'],
+        check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield 'host=127.0.0.1 port={} user=postgres dbname=postgres'.format(port)
+    finally:
+        subprocess.run(
+            [os.path.join(pg_bin, 'pg_ctl'), '-D', data_dir, '-w', '-m', 'fast', 'stop'],
+            check=False, stdout=subprocess.DEVNULL)
+
+
+@contextmanager
+def temporary_database(admin_dsn, create_role):
+    """Create database for benchmark and yield its connection parameters
+
+    New login role is created when create_role is set, otherwise database is
+    owned by admin role.
+    """
+    conn = psycopg2.connect(admin_dsn)
+    conn.autocommit = True
+    user, password = conn.info.user, conn.info.password or DB_PASSWORD
+    name = '{}_{}'.format(DB_NAME, os.getpid())
+    with conn.cursor() as cur:
+        if create_role:
+            user, password = DB_USER, DB_PASSWORD
+            cur.execute('create role {} login password %s'.format(user), (password,))
+        cur.execute('create database {} owner {}'.format(name, user))
+    try:
+        yield {
+            'host': conn.info.host, 'port': conn.info.port, 'user': user,
+            'password': password, 'dbname': name}
+    finally:
+        with conn.cursor() as cur:
+            # "drop database ... with (force)" needs PostgreSQL 13, connections left by
+            # API workers are terminated first instead (drop waits for them to exit)
+            cur.execute(
+                'select pg_terminate_backend(pid) from pg_stat_activity '
+                'where datname = %s and pid <> pg_backend_pid()', (name,))
+            cur.execute('drop database if exists {}'.format(name))
+            if create_role:
+                cur.execute('drop role if exists {}'.format(user))
+        conn.close()
+
+
+def load_fixture(db_params, members):
+    """Create schema and add instance identifier, member classes and members"""
+    with open(os.path.join(BENCH_DIR, 'schema.sql'), 'r') as schema_file:
+        schema = schema_file.read()
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(schema)
+            cur.execute(
+                """
+                    insert into system_parameters (key, value, created_at, updated_at)
+                    values ('instanceIdentifier', %(instance)s, now(), now())
+                """, {'instance': INSTANCE})
+            cur.execute(
+                """
+                    insert into member_classes (code, description, created_at, updated_at)
+                    values (%(class)s, 'Benchmark', now(), now())
+                """, {'class': MEMBER_CLASS})
+            # Members of subsystem scenario
+            cur.execute(
+                """
+                    insert into identifiers (
+                        object_type, xroad_instance, member_class, member_code, type,
+                        created_at, updated_at)
+                    select 'MEMBER', %(instance)s, %(class)s, 'SEED-' || i, 'ClientId',
+                        now(), now()
+                    from generate_series(1, %(members)s) as i
+                """, {'instance': INSTANCE, 'class': MEMBER_CLASS, 'members': members})
+            cur.execute(
+                """
+                    insert into security_server_clients (
+                        member_code, name, member_class_id, server_client_id, type,
+                        created_at, updated_at)
+                    select i.member_code, 'Seed member ' || i.member_code, mc.id, i.id,
+                        'XRoadMember', now(), now()
+                    from identifiers i
+                    join member_classes mc on mc.code=i.member_class
+                """)
+            cur.execute('show server_version')
+            server_version = cur.fetchone()[0]
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute('analyze')
+    finally:
+        conn.close()
+    return server_version
+
+
+def wait_ready(port, proc, timeout=30):
+    """Wait until application responds to /status"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('Application exited with code {}'.format(proc.returncode))
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/status')
+            if conn.getresponse().status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+        time.sleep(0.2)
+    raise RuntimeError('Application is not ready after {} seconds'.format(timeout))
+
+
+@contextmanager
+def run_app(db_params, work_dir, workers, config):
+    """Run server.py under gunicorn and yield its URL
+
+    Application logs are written into work_dir.
+    """
+    app_dir = os.path.join(work_dir, 'app')
+    os.makedirs(app_dir)
+    with open(os.path.join(app_dir, 'db.properties'), 'w') as db_conf:
+        db_conf.write(
+            'database={dbname}\nusername={user}\npassword={password}\nhost={host}\n'
+            'port={port}\n'.format(**db_params))
+    app_config = {'allow_all': True}
+    app_config.update(config)
+    app_config['db_conf_file'] = os.path.join(app_dir, 'db.properties')
+    with open(os.path.join(app_dir, 'config.json'), 'w') as config_file:
+        json.dump(app_config, config_file)
+
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, CSAPI_LOG_DIR=app_dir)
+    with open(os.path.join(app_dir, 'gunicorn.log'), 'w') as log_file:
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind',
+             '127.0.0.1:{}'.format(port), '--chdir', app_dir, 'server:app'],
+            env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(port, proc)
+        yield 'http://127.0.0.1:{}'.format(port)
+    finally:
+        proc.terminate()
+        proc.wait(30)
+
+
+def request_factory(scenario, prefix, members):
+    """Create function returning (method, path, body) of next request"""
+    counter = iter(range(1 << 62))
+    lock = threading.Lock()
+
+    def make_request():
+        if scenario == 'status':
+            return 'GET', '/status', None
+        with lock:
+            number = next(counter)
+        if scenario == 'member':
+            return 'POST', '/member', json.dumps({
+                'member_class': MEMBER_CLASS, 'member_code': '{}-{}'.format(prefix, number),
+                'member_name': 'Benchmark member {}'.format(number)})
+        return 'POST', '/subsystem', json.dumps({
+            'member_class': MEMBER_CLASS, 'member_code': 'SEED-{}'.format(number % members + 1),
+            'subsystem_code': '{}-{}'.format(prefix, number)})
+
+    return make_request
+
+
+def db_cpu_times(db_params):
+    """Get CPU time in seconds of database server backends by process id
+
+    Only backends connected to benchmark database are included. Returns None
+    when CPU time of backends is not available (server on another host or
+    without /proc).
+    """
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                    select pid from pg_stat_activity
+                    where datname=current_database() and pid <> pg_backend_pid()
+                """)
+            pids = [row[0] for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+    times = {}
+    for pid in pids:
+        try:
+            with open('/proc/{}/stat'.format(pid), 'r') as stat_file:
+                # Fields following process name, utime and stime are fields 14 and 15
+                fields = stat_file.read().rpartition(')')[2].split()
+        except OSError:
+            return None
+        times[pid] = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return times
+
+
+def db_cpu_ms(before, after, requests):
+    """Get database CPU time in milliseconds per request between two measurements
+
+    CPU time of backends that exited between measurements is not included.
+    """
+    if before is None or after is None or not requests:
+        return None
+    used = sum(cpu - before.get(pid, 0.0) for pid, cpu in after.items())
+    return used * 1000 / requests
+
+
+def git_version():
+    """Get version of CS API being benchmarked"""
+    try:
+        return subprocess.check_output(
+            ['git', '-C', REPO_DIR, 'describe', '--always', '--dirty'],
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(baseline, report):
+    """Print change of results compared to baseline report"""
+    previous = {
+        (result['scenario'], result['concurrency']): result for result in baseline['results']}
+    print('Compared to {}:'.format(baseline.get('version', 'baseline')))
+    for result in report['results']:
+        old = previous.get((result['scenario'], result['concurrency']))
+        if old is None:
+            continue
+        line = '{:<10} {:>4} clients  req/s {:+7.1f}%  p95 {:+7.1f}%  p99 {:+7.1f}%'.format(
+            result['scenario'], result['concurrency'],
+            *[(result[key] / old[key] - 1) * 100 if old[key] else 0.0
+              for key in ('rps', 'p95_ms', 'p99_ms')])
+        # Older reports do not contain database CPU time
+        if result.get('db_cpu_ms') and old.get('db_cpu_ms'):
+            line += '  db cpu {:+7.1f}%'.format((result['db_cpu_ms'] / old['db_cpu_ms'] - 1) * 100)
+        print(line)
+
+
+def run(args, db_params, work_dir):
+    """Load fixture, start application and run all scenarios"""
+    server_version = load_fixture(db_params, args.members)
+    config = {}
+    if args.config:
+        with open(args.config, 'r') as config_file:
+            config = json.load(config_file)
+
+    report = {
+        'version': git_version(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(), 'postgres': server_version,
+        'workers': args.workers, 'members': args.members, 'requests': args.requests,
+        'config': config, 'results': []}
+    with run_app(db_params, work_dir, args.workers, config) as url:
+        for scenario in args.scenarios.split(','):
+            # Let workers open their database connections
+            run_level(url, args.workers, args.warmup, request_factory(
+                scenario, 'WARMUP-{}'.format(scenario), args.members))
+            for concurrency in [int(value) for value in args.concurrency.split(',')]:
+                cpu_before = db_cpu_times(db_params)
+                result = run_level(url, concurrency, args.requests, request_factory(
+                    scenario, 'BENCH-{}'.format(concurrency), args.members))
+                result['scenario'] = scenario
+                result['db_cpu_ms'] = db_cpu_ms(
+                    cpu_before, db_cpu_times(db_params), result['requests'])
+                report['results'].append(result)
+                print(
+                    '{scenario:<10} {concurrency:>4} clients {requests:>6} requests '
+                    '{errors:>4} errors {rps:>9.1f} req/s  p50 {p50_ms:7.2f} ms  '
+                    'p95 {p95_ms:7.2f} ms  p99 {p99_ms:7.2f} ms'.format(**result) + (
+                        '  db cpu {:.3f} ms/req'.format(result['db_cpu_ms'])
+                        if result['db_cpu_ms'] is not None else ''))
+    return report
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description='Load test CS API with local database')
+    parser.add_argument('--pg-bin', help='directory of PostgreSQL binaries (initdb, pg_ctl)')
+    parser.add_argument('--admin-dsn', help='use existing PostgreSQL server instead of '
+                        'temporary cluster, e.g. "host=localhost user=postgres"')
+    parser.add_argument('--scenarios', default='status,member,subsystem',
+                        help='comma separated list of status, member and subsystem')
+    parser.add_argument('--concurrency', default='1,16,64',
+                        help='comma separated list of concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='number of requests per scenario and concurrency level')
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='number of warm-up requests per scenario')
+    parser.add_argument('--workers', type=int, default=4, help='number of gunicorn workers')
+    parser.add_argument('--members', type=int, default=1000,
+                        help='number of members created before benchmark')
+    parser.add_argument('--config', help='JSON file with CS API settings (config.json)')
+    parser.add_argument('--output', help='write results as JSON into file')
+    parser.add_argument('--compare', help='JSON results of previous run to compare with')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='csapi-bench-') as work_dir:
+        if args.admin_dsn:
+            with temporary_database(args.admin_dsn, create_role=False) as db_params:
+                report = run(args, db_params, work_dir)
+        else:
+            pg_bin = find_pg_bin(args.pg_bin)
+            if pg_bin is None:
+                parser.error('PostgreSQL binaries not found, use --pg-bin or --admin-dsn')
+            with temporary_cluster(pg_bin, work_dir) as admin_dsn:
+                with temporary_database(admin_dsn, create_role=True) as db_params:
+                    report = run(args, db_params, work_dir)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            compare(json.load(baseline_file), report)
+
+
+if __name__ == '__main__':
+    main()
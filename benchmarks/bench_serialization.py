@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmark of serialization cost of large request and response bodies.
+
+Compares stdlib json with default settings (as used before JSON codecs were
+added to CS API) with JSON codecs of CS API (compact stdlib json and orjson when
+installed) and MessagePack (when msgpack package is installed) on:
+* batch request of members (decoded by the API);
+* job status response with results of all items (encoded by the API);
+* export lines of members and subsystems (encoded by the API).
+
+Usage: python benchmarks/bench_serialization.py [--items N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import csapi  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def payloads(items):
+    """Create sample payloads with given number of items"""
+    batch = [
+        {'member_class': 'COM', 'member_code': str(10000000 + n),
+         'member_name': 'Member {} OÜ'.format(n)}
+        for n in range(items)]
+    job = {
+        'code': 'OK', 'msg': 'Job found', 'job_id': 'f' * 32, 'type': 'members',
+        'status': 'COMPLETED', 'total': items, 'processed': items, 'created': items,
+        'results': [
+            {'member_class': item['member_class'], 'member_code': item['member_code'],
+             'code': 'CREATED', 'msg': 'New Member added'}
+            for item in batch]}
+    export = [
+        {'member_class': 'COM', 'member_code': str(10000000 + n // 2),
+         'subsystem_code': 'SUBSYSTEM-{}'.format(n) if n % 2 else None,
+         'name': 'Member {} OÜ'.format(n // 2), 'created_at': '2020-01-02T03:04:05.123456'}
+        for n in range(items)]
+    return batch, job, export
+
+
+def codecs():
+    """Get (name, encoder, decoder) of compared codecs"""
+    result = [('json (default)', lambda data: json.dumps(data).encode('utf-8'), json.loads)]
+    result.extend(
+        ('{} (csapi)'.format(name), dumps, loads)
+        for name, (dumps, loads) in sorted(csapi.JSON_CODECS.items()))
+    if csapi.msgpack is not None:
+        result.append((
+            'msgpack', lambda data: csapi.msgpack.packb(data, use_bin_type=True),
+            lambda data: csapi.msgpack.unpackb(data, raw=False)))
+    return result
+
+
+def measure(func, repeat):
+    """Get best time of func in milliseconds"""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description='Benchmark serialization of CS API bodies')
+    parser.add_argument('--items', type=int, default=10000, help='number of items in payloads')
+    parser.add_argument('--repeat', type=int, default=5, help='number of measurements')
+    args = parser.parse_args()
+
+    batch, job, export = payloads(args.items)
+    print('{:<16} {:>10} {:>14} {:>14} {:>14}'.format(
+        'codec', 'batch KiB', 'decode batch', 'encode job', 'encode export'))
+    for name, dumps, loads in codecs():
+        body = dumps(batch)
+        assert loads(body) == batch
+        print('{:<16} {:>10.1f} {:>11.2f} ms {:>11.2f} ms {:>11.2f} ms'.format(
+            name, len(body) / 1024,
+            measure(lambda: loads(body), args.repeat),  # pylint: disable=cell-var-from-loop
+            measure(lambda: dumps(job), args.repeat),  # pylint: disable=cell-var-from-loop
+            measure(lambda: b''.join(  # pylint: disable=cell-var-from-loop
+                dumps(line) + b'\n' for line in export), args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""Load test comparing Flask (sync) and asyncio deployments of CS API.
+
+Both applications must already be running against the same Central Server
+database, for example (in a directory with config.json allowing all clients):
+
+    gunicorn --workers 4 --bind 127.0.0.1:8000 server:app
+    uvicorn --workers 1 --port 8001 server_async:app
+
+Each concurrency level sends the given number of requests from that many
+client threads and reports throughput and latency percentiles. The "member"
+scenario adds new members with unique member codes, "status" only reads from
+the database.
+
+Usage: python benchmarks/bench_sync_async.py [--sync URL] [--async URL]
+    [--scenario status|member] [--concurrency 1,16,128] [--requests N]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+
+def percentile(values, fraction):
+    """Get percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Client(threading.Thread):
+    """Client thread sending requests over a persistent connection"""
+    def __init__(self, url, requests, make_request):
+        super().__init__(daemon=True)
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.requests = requests
+        self.make_request = make_request
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        for _ in range(self.requests):
+            method, path, body = self.make_request()
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers={
+                    'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    self.errors += 1
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+            self.latencies.append(time.perf_counter() - start)
+        conn.close()
+
+
+def request_factory(scenario, member_class, prefix):
+    """Create function returning (method, path, body) of next request"""
+    counter = iter(range(1 << 62))
+    lock = threading.Lock()
+
+    def make_request():
+        if scenario == 'status':
+            return 'GET', '/status', None
+        with lock:
+            number = next(counter)
+        return 'POST', '/member', json.dumps({
+            'member_class': member_class, 'member_code': '{}-{}'.format(prefix, number),
+            'member_name': 'Benchmark member {}'.format(number)})
+
+    return make_request
+
+
+def run_level(url, concurrency, total, make_request):
+    """Run single concurrency level against single deployment"""
+    per_client = max(1, total // concurrency)
+    clients = [Client(url, per_client, make_request) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': sum(client.errors for client in clients),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000}
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description='Compare sync and asyncio CS API deployments')
+    parser.add_argument('--sync', default='http://127.0.0.1:8000', help='URL of Flask app')
+    parser.add_argument('--async', dest='async_url', default='http://127.0.0.1:8001',
+                        help='URL of asyncio app')
+    parser.add_argument('--scenario', choices=('status', 'member'), default='status')
+    parser.add_argument('--concurrency', default='1,16,128',
+                        help='comma separated list of concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='number of requests per concurrency level')
+    parser.add_argument('--member-class', default='GOV', help='existing member class')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for mode, url in (('sync', args.sync), ('async', args.async_url)):
+        for concurrency in [int(value) for value in args.concurrency.split(',')]:
+            prefix = 'BENCH-{}-{}-{}-{}'.format(mode, concurrency, os.getpid(), int(time.time()))
+            result = run_level(
+                url, concurrency, args.requests,
+                request_factory(args.scenario, args.member_class, prefix))
+            result['mode'] = mode
+            results.append(result)
+            if not args.json:
+                print(
+                    '{mode:<6} {concurrency:>4} clients {requests:>6} requests '
+                    '{errors:>4} errors {rps:>9.1f} req/s  p50 {p50_ms:7.2f} ms  '
+                    'p95 {p95_ms:7.2f} ms  p99 {p99_ms:7.2f} ms'.format(**result))
+
+    if args.json:
+        print(json.dumps({'scenario': args.scenario, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+
+"""Query plan regression check of CS API statements.
+
+Runs EXPLAIN (ANALYZE, BUFFERS) of every statement in csapi.QUERIES and
+csapi.BATCH_QUERIES (with a batch of rows) against a large registry and
+reports execution time, buffer usage and plan shape (node types, relations and
+indexes) of each statement. Every statement runs in its own transaction that
+is rolled back, so the checked database is not modified. A statement is
+flagged when:
+* its plan contains sequential scan of a table that grows with the registry
+  (everything except member_classes, system_parameters and system
+  catalogs), unless the statement reads the whole registry anyway (export);
+* its plan shape differs from the plan in baseline report given with
+  --baseline.
+Exit code is 1 when any statement is flagged.
+
+The registry is generated with gen_dataset.py into a temporary database
+(created like in bench_http.py with --pg-bin or --admin-dsn), or an already
+populated database is given with --dsn. Statements using tables that CS API
+creates on first use (idempotency store, jobs) are skipped when the database
+does not contain them. Additional SQL (for example indexes of particular
+Central Server version) can be applied to the temporary database with --setup.
+
+Usage: python benchmarks/check_plans.py [--pg-bin DIR | --admin-dsn DSN | --dsn DSN]
+    [--members N] [--subsystems-mean N] [--setup FILE] [--output FILE]
+    [--baseline FILE]
+"""
+
+import argparse
+import datetime
+import json
+import re
+import sys
+import tempfile
+import psycopg2
+from bench_http import REPO_DIR, find_pg_bin, git_version, temporary_cluster, temporary_database
+from gen_dataset import DEFAULT_CLASSES, create_schema, generate, parse_classes
+
+sys.path.insert(0, REPO_DIR)
+from csapi import (  # noqa: E402 pylint: disable=wrong-import-position
+    BATCH_QUERIES, IDEMPOTENCY_TABLE, JOBS_TABLES, QUERIES)
+
+# Tables that do not grow with the registry, sequential scans of them are expected.
+# Finished jobs are removed after jobs.ttl.
+SMALL_TABLES = ('member_classes', 'system_parameters', 'csapi_jobs')
+
+# Tables created by CS API on first use, statements using them are skipped when missing
+OPTIONAL_TABLES = ('csapi_idempotency_keys', 'csapi_jobs', 'csapi_job_results')
+
+# Job used by statements of background jobs
+PLAN_CHECK_JOB = 'f' * 32
+
+# Statements that read the whole registry
+FULL_SCAN_QUERIES = ('export_clients',)
+
+# Number of members and subsystems looked up by batch statements
+BATCH_SAMPLE_SIZE = 100
+
+
+def get_sample(cur):
+    """Get parameters of existing rows used by checked statements
+
+    Member with the most subsystems is used, so that lookups of subsystems
+    are checked in their worst case.
+    """
+    cur.execute(
+        """
+            select m.id, m.member_class_id, mc.code, m.member_code, m.name,
+                max(s.subsystem_code)
+            from security_server_clients m
+            join member_classes mc on mc.id=m.member_class_id
+            join security_server_clients s
+                on s.xroad_member_id=m.id and s.type='Subsystem'
+            where m.type='XRoadMember'
+            group by m.id, mc.code
+            order by count(*) desc
+            limit 1
+        """)
+    row = cur.fetchone()
+    if row is None:
+        raise RuntimeError('Registry does not contain members with subsystems')
+    sample = dict(zip(
+        ('member_id', 'class_id', 'member_class', 'member_code', 'name', 'subsystem_code'),
+        row))
+    cur.execute(
+        """
+            select member_class_id, member_code from security_server_clients
+            where type='XRoadMember'
+            order by md5(member_code)
+            limit %(limit)s
+        """, {'limit': BATCH_SAMPLE_SIZE})
+    sample['members'] = cur.fetchall()
+    cur.execute(
+        """
+            select xroad_member_id, subsystem_code from security_server_clients
+            where type='Subsystem'
+            order by md5(xroad_member_id || subsystem_code)
+            limit %(limit)s
+        """, {'limit': BATCH_SAMPLE_SIZE})
+    sample['subsystems'] = cur.fetchall()
+    cur.execute("select value from system_parameters where key='instanceIdentifier'")
+    sample['instance'] = cur.fetchone()[0]
+    return sample
+
+
+def query_cases(sample):
+    """Get checked cases as (case name, query name, parameters) tuples"""
+    new = {
+        'instance': sample['instance'], 'class': sample['member_class'],
+        'class_id': sample['class_id'], 'code': 'PLAN-CHECK', 'name': 'Plan check',
+        'member_id': sample['member_id'], 'member_code': sample['member_code'],
+        'subsystem_code': 'PLAN-CHECK', 'identifier_id': 0,
+        'time': datetime.datetime.utcnow()}
+    return [
+        ('member_class_id', 'member_class_id', {'str': sample['member_class']}),
+        ('member_class_ids', 'member_class_ids', {'codes': [sample['member_class']]}),
+        ('member_data', 'member_data', {
+            'class_id': sample['class_id'], 'member_code': sample['member_code']}),
+        ('members_data', 'members_data', {
+            'class_ids': [member[0] for member in sample['members']],
+            'member_codes': [member[1] for member in sample['members']]}),
+        ('subsystem_exists', 'subsystem_exists', {
+            'member_id': sample['member_id'], 'subsystem_code': sample['subsystem_code']}),
+        ('existing_subsystems', 'existing_subsystems', {
+            'member_ids': [subsystem[0] for subsystem in sample['subsystems']],
+            'subsystem_codes': [subsystem[1] for subsystem in sample['subsystems']]}),
+        ('table_indexes', 'table_indexes', {'tables': ['security_server_clients']}),
+        ('idempotency_response', 'idempotency_response', {
+            'client_dn': 'CN=plan-check', 'key': 'PLAN-CHECK'}),
+        ('reserve_idempotency_key', 'reserve_idempotency_key', {
+            'client_dn': 'CN=plan-check', 'key': 'PLAN-CHECK', 'fingerprint': '', 'ttl': 60}),
+        ('add_idempotency_response', 'add_idempotency_response', {
+            'client_dn': 'CN=plan-check', 'key': 'PLAN-CHECK', 'fingerprint': '',
+            'response': '{}', 'ttl': 60}),
+        ('release_idempotency_key', 'release_idempotency_key', {
+            'client_dn': 'CN=plan-check', 'key': 'PLAN-CHECK'}),
+        ('purge_idempotency_responses', 'purge_idempotency_responses', {}),
+        ('add_job', 'add_job', {
+            'id': 'e' * 32, 'type': 'members', 'client_dn': 'CN=plan-check', 'items': '[]',
+            'results': '[]', 'total': 0}),
+        ('queued_jobs', 'queued_jobs', {}),
+        ('claim_job', 'claim_job', {'worker': 'PLAN-CHECK', 'stale_timeout': 60}),
+        ('update_job', 'update_job', {
+            'id': PLAN_CHECK_JOB, 'worker': 'PLAN-CHECK', 'status': 'COMPLETED',
+            'processed': 0, 'created': 0}),
+        ('add_job_results', 'add_job_results', {
+            'id': PLAN_CHECK_JOB, 'position': 0, 'results': '[]'}),
+        ('fail_job', 'fail_job', {
+            'id': PLAN_CHECK_JOB, 'worker': 'PLAN-CHECK', 'error': 'Plan check'}),
+        ('job', 'job', {'id': PLAN_CHECK_JOB, 'client_dn': 'CN=plan-check'}),
+        ('job_results', 'job_results', {'id': PLAN_CHECK_JOB}),
+        ('purge_jobs', 'purge_jobs', {'ttl': 604800}),
+        ('registration_lock', 'registration_lock', {'lock': 1}),
+        ('instance_identifier', 'instance_identifier', {}),
+        ('utc_time', 'utc_time', {}),
+        ('add_member_identifier', 'add_member_identifier', new),
+        ('add_subsystem_identifier', 'add_subsystem_identifier', new),
+        ('add_member_client', 'add_member_client', new),
+        ('add_subsystem_client', 'add_subsystem_client', new),
+        ('add_client_name', 'add_client_name', new),
+        ('register_member', 'register_member', new),
+        ('register_member:existing', 'register_member', dict(
+            new, code=sample['member_code'])),
+        ('register_subsystem', 'register_subsystem', new),
+        ('register_subsystem:existing', 'register_subsystem', dict(
+            new, subsystem_code=sample['subsystem_code'])),
+        ('list_members', 'list_members', {
+            'class_id': None, 'after_class_id': None, 'after_code': None, 'limit': 101}),
+        ('list_members:class_after', 'list_members', {
+            'class_id': sample['class_id'], 'after_class_id': sample['class_id'],
+            'after_code': sample['member_code'], 'limit': 101}),
+        ('list_subsystems', 'list_subsystems', {
+            'member_id': sample['member_id'], 'after': None, 'limit': 101}),
+        ('export_clients', 'export_clients', {})]
+
+
+def batch_cases(sample):
+    """Get checked batch insert cases as (case name, query name, rows) tuples"""
+    time = datetime.datetime.utcnow()
+    codes = ['PLAN-CHECK-{}'.format(n) for n in range(BATCH_SAMPLE_SIZE)]
+    # Identifiers of new rows are not used by other rows
+    identifier_ids = range(-1, -BATCH_SAMPLE_SIZE - 1, -1)
+    return [
+        ('add_member_identifiers', 'add_member_identifiers', [
+            {'instance': sample['instance'], 'class': sample['member_class'], 'code': code,
+             'time': time} for code in codes]),
+        ('add_member_clients', 'add_member_clients', [
+            {'code': code, 'name': 'Plan check', 'class_id': sample['class_id'],
+             'identifier_id': identifier_id, 'time': time}
+            for code, identifier_id in zip(codes, identifier_ids)]),
+        ('add_client_names', 'add_client_names', [
+            {'name': 'Plan check', 'identifier_id': identifier_id, 'time': time}
+            for identifier_id in identifier_ids]),
+        ('add_subsystem_identifiers', 'add_subsystem_identifiers', [
+            {'instance': sample['instance'], 'class': sample['member_class'],
+             'member_code': sample['member_code'], 'subsystem_code': code, 'time': time}
+            for code in codes]),
+        ('add_subsystem_clients', 'add_subsystem_clients', [
+            {'subsystem_code': code, 'member_id': sample['member_id'],
+             'identifier_id': identifier_id, 'time': time}
+            for code, identifier_id in zip(codes, identifier_ids)])]
+
+
+def batch_query(cur, query_name, rows):
+    """Get batch insert statement with rows formatted like execute_values does"""
+    statement, template = BATCH_QUERIES[query_name]
+    values = b','.join(cur.mogrify(template, row) for row in rows).decode('utf-8')
+    return statement.replace('%s', values)
+
+
+def missing_tables(cur):
+    """Get names of optional tables that do not exist in database"""
+    cur.execute(
+        'select name from unnest(%(names)s::text[]) name where to_regclass(name) is null',
+        {'names': list(OPTIONAL_TABLES)})
+    return {row[0] for row in cur.fetchall()}
+
+
+def plan_shape(node):
+    """Get plan nodes as list of strings describing node type, relation and index"""
+    description = node['Node Type']
+    if 'Relation Name' in node:
+        description += ' on {}'.format(node['Relation Name'])
+    if 'Index Name' in node:
+        description += ' using {}'.format(node['Index Name'])
+    shape = [description]
+    for child in node.get('Plans', []):
+        shape.extend('  ' + line for line in plan_shape(child))
+    return shape
+
+
+def seq_scans(node):
+    """Get names of relations read by sequential scans of plan"""
+    relations = []
+    if node['Node Type'] == 'Seq Scan':
+        relations.append(node['Relation Name'])
+    for child in node.get('Plans', []):
+        relations.extend(seq_scans(child))
+    return relations
+
+
+def explain(conn, query, params):
+    """Get EXPLAIN (ANALYZE, BUFFERS) output of statement
+
+    Statement runs in explicit transaction that is always rolled back.
+    """
+    conn.rollback()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('begin')
+            try:
+                cur.execute('explain (analyze, buffers, format json) ' + query, params)
+                output = cur.fetchone()[0]
+            finally:
+                cur.execute('rollback')
+    finally:
+        conn.autocommit = False
+    # Older servers return plan as text
+    if isinstance(output, str):
+        output = json.loads(output)
+    return output[0]
+
+
+def check(conn, baseline=None):
+    """Check plans of all statements
+
+    Returns list of results, one per checked case.
+    """
+    with conn.cursor() as cur:
+        sample = get_sample(cur)
+        missing = missing_tables(cur)
+    conn.rollback()
+    cases = query_cases(sample) + batch_cases(sample)
+    unchecked = (set(QUERIES) | set(BATCH_QUERIES)) - {query_name for _, query_name, _ in cases}
+    if unchecked:
+        raise RuntimeError('Statements without plan check: {}'.format(
+            ', '.join(sorted(unchecked))))
+
+    previous = {}
+    if baseline is not None:
+        previous = {result['case']: result for result in baseline['results']}
+
+    results = []
+    for case, query_name, params in cases:
+        if query_name in BATCH_QUERIES:
+            with conn.cursor() as cur:
+                query, params = batch_query(cur, query_name, params), None
+        else:
+            query = QUERIES[query_name]
+        skipped = sorted(
+            table for table in missing if re.search(r'\b{}\b'.format(table), query))
+        if skipped:
+            reason = 'Missing table {}'.format(', '.join(skipped))
+            print('Skipping {}: {}'.format(case, reason), flush=True)
+            results.append({'case': case, 'query': query_name, 'skipped': reason, 'flags': []})
+            continue
+        output = explain(conn, query, params)
+        plan = output['Plan']
+        result = {
+            'case': case, 'query': query_name,
+            'execution_ms': output['Execution Time'],
+            'planning_ms': output['Planning Time'],
+            'shared_hit_blocks': plan.get('Shared Hit Blocks', 0),
+            'shared_read_blocks': plan.get('Shared Read Blocks', 0),
+            'shape': plan_shape(plan), 'flags': []}
+        if query_name not in FULL_SCAN_QUERIES:
+            for relation in sorted(set(seq_scans(plan)) - set(SMALL_TABLES)):
+                # System catalogs do not grow with the registry
+                if relation.startswith('pg_'):
+                    continue
+                result['flags'].append('Sequential scan on {}'.format(relation))
+        if case in previous and previous[case].get('shape', result['shape']) != result['shape']:
+            result['flags'].append('Plan changed')
+        results.append(result)
+    return results
+
+
+def run(args, conn):
+    """Check plans and create report"""
+    with conn.cursor() as cur:
+        cur.execute('show server_version')
+        server_version = cur.fetchone()[0]
+        cur.execute(
+            """
+                select count(*) filter (where type='XRoadMember'),
+                    count(*) filter (where type='Subsystem')
+                from security_server_clients
+            """)
+        members, subsystems = cur.fetchone()
+    conn.rollback()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    return {
+        'version': git_version(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'postgres': server_version, 'members': members, 'subsystems': subsystems,
+        'results': check(conn, baseline)}
+
+
+def run_generated(args, db_params):
+    """Create schema and registry in temporary database and check plans"""
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn, conn.cursor() as cur:
+            create_schema(cur)
+            # Tables of database idempotency store and jobs are created by API on first use
+            cur.execute(IDEMPOTENCY_TABLE)
+            cur.execute(JOBS_TABLES)
+            cur.execute(
+                """
+                    insert into csapi_jobs (
+                        id, type, status, items, results, total, created_at, updated_at)
+                    values (%(id)s, 'members', 'COMPLETED', '[]', '[]', 0, now(), now())
+                """, {'id': PLAN_CHECK_JOB})
+        print('Generating registry...', flush=True)
+        generate(
+            conn, args.members, args.subsystems_mean, args.subsystems_max,
+            parse_classes(args.classes))
+        if args.setup:
+            with open(args.setup, 'r') as setup_file:
+                with conn, conn.cursor() as cur:
+                    cur.execute(setup_file.read())
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute('analyze')
+            conn.autocommit = False
+        return run(args, conn)
+    finally:
+        conn.close()
+
+
+def print_report(report):
+    """Print results of all cases"""
+    for result in report['results']:
+        if 'skipped' in result:
+            print('{case:<30} skipped: {skipped}'.format(**result))
+            continue
+        print('{case:<30} {execution_ms:>10.3f} ms {shared_hit_blocks:>8} hit '
+              '{shared_read_blocks:>8} read  {flags}'.format(
+                  **dict(result, flags='; '.join(result['flags']) or 'OK')))
+        if result['flags']:
+            for line in result['shape']:
+                print('    ' + line)
+
+
+def main():
+    """Run check"""
+    parser = argparse.ArgumentParser(description='Check query plans of CS API statements')
+    parser.add_argument('--pg-bin', help='directory of PostgreSQL binaries (initdb, pg_ctl)')
+    parser.add_argument('--admin-dsn', help='use existing PostgreSQL server instead of '
+                        'temporary cluster, e.g. "host=localhost user=postgres"')
+    parser.add_argument('--dsn', help='check already populated database instead of '
+                        'generating registry')
+    parser.add_argument('--members', type=int, default=1000000, help='number of members')
+    parser.add_argument('--subsystems-mean', type=float, default=1.5,
+                        help='mean number of subsystems per member')
+    parser.add_argument('--subsystems-max', type=int, default=100,
+                        help='maximum number of subsystems per member')
+    parser.add_argument('--classes', default=DEFAULT_CLASSES,
+                        help='comma separated member classes with weights (CODE:WEIGHT)')
+    parser.add_argument('--setup', help='SQL file applied after generating registry '
+                        '(e.g. indexes)')
+    parser.add_argument('--output', help='write results as JSON into file')
+    parser.add_argument('--baseline', help='JSON results of previous run to compare with')
+    args = parser.parse_args()
+
+    if args.dsn:
+        conn = psycopg2.connect(args.dsn)
+        try:
+            report = run(args, conn)
+        finally:
+            conn.close()
+    elif args.admin_dsn:
+        with temporary_database(args.admin_dsn, create_role=False) as db_params:
+            report = run_generated(args, db_params)
+    else:
+        pg_bin = find_pg_bin(args.pg_bin)
+        if pg_bin is None:
+            parser.error('PostgreSQL binaries not found, use --pg-bin, --admin-dsn or --dsn')
+        with tempfile.TemporaryDirectory(prefix='csapi-plans-') as work_dir:
+            with temporary_cluster(pg_bin, work_dir) as admin_dsn:
+                with temporary_database(admin_dsn, create_role=True) as db_params:
+                    report = run_generated(args, db_params)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if any(result['flags'] for result in report['results']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
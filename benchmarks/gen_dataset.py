@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""Generator of synthetic large Central Server client registry.
+
+Populates database containing the subset of Central Server schema used by
+CS API (benchmarks/schema.sql) with member classes, members and subsystems.
+Members are split between member classes by class weights (a few large
+classes and a long tail of small ones) and number of subsystems of each
+member is exponentially distributed, so most members have none or a few
+subsystems while some have dozens. Rows are generated inside PostgreSQL, so
+registries with millions of clients are created in minutes.
+
+Generation is repeatable: the same seed and parameters produce the same
+registry.
+
+Usage: python benchmarks/gen_dataset.py --dsn DSN [--create-schema]
+    [--members N] [--subsystems-mean N] [--subsystems-max N]
+    [--classes GOV:5,COM:70,NGO:15,NEE:10] [--seed N]
+"""
+
+import argparse
+import os
+import time
+import psycopg2
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+INSTANCE = 'BENCH'
+
+# Member class codes with relative share of members
+DEFAULT_CLASSES = 'GOV:5,COM:70,NGO:15,NEE:10'
+
+
+def parse_classes(value):
+    """Parse comma separated list of CODE:WEIGHT pairs
+
+    Returns list of (code, cumulative share) tuples, last share is 1.0.
+    """
+    classes = []
+    for pair in value.split(','):
+        code, _, weight = pair.partition(':')
+        classes.append((code.strip(), float(weight or 1)))
+    total = sum(weight for _, weight in classes)
+    cumulative = []
+    share = 0.0
+    for code, weight in classes:
+        share += weight / total
+        cumulative.append((code, share))
+    cumulative[-1] = (cumulative[-1][0], 1.0)
+    return cumulative
+
+
+def class_expression(classes):
+    """Create SQL expression choosing member class by random number r"""
+    whens = ' '.join(
+        "when r < {!r} then '{}'".format(share, code.replace("'", "''"))
+        for code, share in classes[:-1])
+    return "case {} else '{}' end".format(whens, classes[-1][0].replace("'", "''"))
+
+
+def create_schema(cur):
+    """Create tables of benchmarks/schema.sql"""
+    with open(os.path.join(BENCH_DIR, 'schema.sql'), 'r') as schema_file:
+        cur.execute(schema_file.read())
+
+
+def generate(conn, members, subsystems_mean, subsystems_max, classes, seed=0.5):
+    """Add instance identifier, member classes, members and subsystems
+
+    classes is returned by parse_classes, seed is between -1 and 1. Returns
+    dict with number of created rows.
+    """
+    with conn, conn.cursor() as cur:
+        cur.execute('select setseed(%(seed)s)', {'seed': seed})
+        cur.execute(
+            """
+                insert into system_parameters (key, value, created_at, updated_at)
+                values ('instanceIdentifier', %(instance)s, now(), now())
+            """, {'instance': INSTANCE})
+        cur.execute(
+            """
+                insert into member_classes (code, description, created_at, updated_at)
+                select code, 'Generated ' || code, now(), now()
+                from unnest(%(codes)s::varchar[]) as code
+            """, {'codes': [code for code, _ in classes]})
+
+        # Member codes look like registry codes, member age is spread over ten years
+        cur.execute(
+            """
+                create temporary table gen_members on commit drop as
+                select n, {class_expression} as member_class,
+                    (10000000 + n)::varchar as member_code,
+                    'Member ' || n as name,
+                    least(%(subsystems_max)s,
+                        floor(-ln(1 - random()) * %(subsystems_mean)s))::integer
+                        as subsystems,
+                    (current_timestamp at time zone 'UTC') - random() * interval '10 years'
+                        as created_at
+                from (select n, random() as r from generate_series(1, %(members)s) as n) s
+            """.format(class_expression=class_expression(classes)), {
+                'members': members, 'subsystems_mean': float(subsystems_mean),
+                'subsystems_max': subsystems_max})
+        cur.execute(
+            """
+                with identifier as (
+                    insert into identifiers (
+                        object_type, xroad_instance, member_class, member_code, type,
+                        created_at, updated_at)
+                    select 'MEMBER', %(instance)s, member_class, member_code, 'ClientId',
+                        created_at, created_at
+                    from gen_members
+                    order by created_at
+                    returning id, member_class, member_code, created_at
+                ), client as (
+                    insert into security_server_clients (
+                        member_code, name, member_class_id, server_client_id, type,
+                        created_at, updated_at)
+                    select i.member_code, m.name, mc.id, i.id, 'XRoadMember', i.created_at,
+                        i.created_at
+                    from identifier i
+                    join gen_members m on m.member_code=i.member_code
+                    join member_classes mc on mc.code=i.member_class
+                )
+                insert into security_server_client_names (
+                    name, client_identifier_id, created_at, updated_at)
+                select m.name, i.id, i.created_at, i.created_at
+                from identifier i
+                join gen_members m on m.member_code=i.member_code
+            """, {'instance': INSTANCE})
+
+        # Subsystems are created after their member
+        cur.execute(
+            """
+                create temporary table gen_subsystems on commit drop as
+                select c.id as member_id, c.name, m.member_class, m.member_code,
+                    'SUBSYSTEM-' || s as subsystem_code,
+                    m.created_at + random() * ((current_timestamp at time zone 'UTC')
+                        - m.created_at) as created_at
+                from gen_members m
+                join security_server_clients c
+                    on c.type='XRoadMember' and c.member_code=m.member_code
+                cross join lateral generate_series(1, m.subsystems) as s
+            """)
+        cur.execute(
+            """
+                with identifier as (
+                    insert into identifiers (
+                        object_type, xroad_instance, member_class, member_code,
+                        subsystem_code, type, created_at, updated_at)
+                    select 'SUBSYSTEM', %(instance)s, member_class, member_code,
+                        subsystem_code, 'ClientId', created_at, created_at
+                    from gen_subsystems
+                    order by created_at
+                    returning id, member_code, subsystem_code, created_at
+                ), client as (
+                    insert into security_server_clients (
+                        subsystem_code, xroad_member_id, server_client_id, type,
+                        created_at, updated_at)
+                    select i.subsystem_code, s.member_id, i.id, 'Subsystem', i.created_at,
+                        i.created_at
+                    from identifier i
+                    join gen_subsystems s
+                        on s.member_code=i.member_code and s.subsystem_code=i.subsystem_code
+                )
+                insert into security_server_client_names (
+                    name, client_identifier_id, created_at, updated_at)
+                select s.name, i.id, i.created_at, i.created_at
+                from identifier i
+                join gen_subsystems s
+                    on s.member_code=i.member_code and s.subsystem_code=i.subsystem_code
+            """, {'instance': INSTANCE})
+        cur.execute('select count(*) from gen_subsystems')
+        subsystems = cur.fetchone()[0]
+
+    # Planner statistics of generated tables
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('analyze')
+    finally:
+        conn.autocommit = autocommit
+
+    return {'member_classes': len(classes), 'members': members, 'subsystems': subsystems}
+
+
+def main():
+    """Generate registry"""
+    parser = argparse.ArgumentParser(description='Generate synthetic Central Server registry')
+    parser.add_argument('--dsn', required=True, help='connection string of target database')
+    parser.add_argument('--create-schema', action='store_true',
+                        help='create tables of benchmarks/schema.sql first')
+    parser.add_argument('--members', type=int, default=100000, help='number of members')
+    parser.add_argument('--subsystems-mean', type=float, default=1.5,
+                        help='mean number of subsystems per member')
+    parser.add_argument('--subsystems-max', type=int, default=100,
+                        help='maximum number of subsystems per member')
+    parser.add_argument('--classes', default=DEFAULT_CLASSES,
+                        help='comma separated member classes with weights (CODE:WEIGHT)')
+    parser.add_argument('--seed', type=float, default=0.5,
+                        help='random seed between -1 and 1')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.create_schema:
+            with conn, conn.cursor() as cur:
+                create_schema(cur)
+        start = time.monotonic()
+        counts = generate(
+            conn, args.members, args.subsystems_mean, args.subsystems_max,
+            parse_classes(args.classes), args.seed)
+    finally:
+        conn.close()
+    print('Created {member_classes} member classes, {members} members and {subsystems} '
+          'subsystems in {elapsed:.1f} s'.format(elapsed=time.monotonic() - start, **counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+-- Subset of X-Road Central Server database schema used by CS API.
+-- Indexes are not created, so that results do not depend on indexes of particular
+-- Central Server version.
+
+create table member_classes (
+    id serial primary key,
+    code varchar(255) not null,
+    description varchar(255),
+    created_at timestamp not null,
+    updated_at timestamp not null
+);
+
+create table identifiers (
+    id serial primary key,
+    object_type varchar(255),
+    xroad_instance varchar(255),
+    member_class varchar(255),
+    member_code varchar(255),
+    subsystem_code varchar(255),
+    service_version varchar(255),
+    server_code varchar(255),
+    service_code varchar(255),
+    type varchar(255),
+    created_at timestamp not null,
+    updated_at timestamp not null
+);
+
+create table security_server_clients (
+    id serial primary key,
+    member_code varchar(255),
+    subsystem_code varchar(255),
+    name varchar(255),
+    xroad_member_id integer,
+    member_class_id integer,
+    server_client_id integer,
+    type varchar(255),
+    administrative_contact varchar(255),
+    created_at timestamp not null,
+    updated_at timestamp not null
+);
+
+create table security_server_client_names (
+    id serial primary key,
+    name varchar(255),
+    client_identifier_id integer,
+    created_at timestamp not null,
+    updated_at timestamp not null
+);
+
+create table system_parameters (
+    id serial primary key,
+    key varchar(255),
+    value varchar(255),
+    ha_node_name varchar(255),
+    created_at timestamp not null,
+    updated_at timestamp not null
+);
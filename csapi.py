@@ -7,19 +7,732 @@ This module allows:
     * adding new subsystem to the X-Road Central Server.
 """
 
+import argparse
+import atexit
+import base64
+import binascii
+import bisect
+import copy
+import datetime
+import functools
+import hashlib
+import itertools
 import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
 import re
+import signal
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
 import psycopg2
-from flask import request, jsonify
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+from flask import g, has_request_context, request, Response, stream_with_context
 from flask_restful import Resource
+from werkzeug.exceptions import BadRequest
+
+# Optional faster serializers, stdlib json is used and MessagePack is disabled without them
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # pylint: disable=invalid-name
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None  # pylint: disable=invalid-name
 
 DB_CONF_FILE = '/etc/xroad/db.properties'
 LOGGER = logging.getLogger('csapi')
+# Statements exceeding slow_query_threshold and requests exceeding request_query_budget
+SLOW_QUERY_LOGGER = logging.getLogger('csapi_slow_query')
+DB_CONF_LINE_RE = re.compile('^(database|username|password|host|port)\\s*=\\s*(.+)$')
+
+# Default values for runtime settings that can be overridden in configuration file
+DEFAULT_SETTINGS = {
+    # Central Server database configuration file
+    'db_conf_file': DB_CONF_FILE,
+    # How often in seconds configuration file is checked for changes (None disables, then
+    # configuration is only reloaded on SIGHUP)
+    'config_check_interval': 5,
+    # Database connection pool of each worker process. Times are in seconds.
+    'db_pool': {
+        'min_size': 1,
+        'max_size': 4,
+        'max_lifetime': 3600,
+        'max_idle': 300,
+        'timeout': 10,
+        'health_check_idle': 5
+    },
+    # Database connection pool of asyncio application process. Times are in seconds.
+    'async_db_pool': {
+        'min_size': 1,
+        'max_size': 20,
+        'max_idle': 300,
+        'timeout': 10
+    },
+    # Register members and subsystems with a single statement (one database round trip)
+    'single_round_trip': False,
+    # Prepare statements of member and subsystem registration once per database connection
+    # and execute them by name (PostgreSQL must not be behind transaction pooling proxy).
+    # Disabled until the gain is measured against PostgreSQL.
+    'prepared_statements': False,
+    # Concurrent registrations of the same member or subsystem wait for the first one: in
+    # the same worker process they share its result, in other worker processes they wait
+    # on advisory lock in database until it is committed
+    'coalesce_registrations': True,
+    # Transactions creating members and subsystems that fail with serialization failure,
+    # deadlock or unique violation are run again, at most "attempts" times in total.
+    # Delay before each retry is random between 0 and base_delay doubled after each
+    # attempt (at most max_delay). Retry is not started when it would begin more than
+    # "budget" seconds after the first attempt. Times are in seconds.
+    'transaction_retry': {
+        'attempts': 3,
+        'base_delay': 0.05,
+        'max_delay': 1.0,
+        'budget': 2.0
+    },
+    # Maximum number of items in batch request
+    'batch_max_size': 10000,
+    # Number of items committed at once by streamed batch requests
+    'batch_chunk_size': 1000,
+    # Default and maximum number of items in a page of list requests
+    'page_size': 100,
+    'page_max_size': 1000,
+    # Number of rows fetched at once from server-side cursor of export request
+    'export_fetch_size': 1000,
+    # Directory shared by worker processes for metrics snapshots (None keeps metrics
+    # per process) and how often in seconds each worker writes its snapshot
+    'metrics_dir': None,
+    'metrics_flush_interval': 5,
+    # File shared by worker processes that is replaced when caches are flushed, workers
+    # flush their caches when the file changes (None flushes only the serving worker).
+    # Default is in /run/csapi created by systemd (RuntimeDirectory).
+    'cache_flush_file': '/run/csapi/cache-flush',
+    # Statements running longer than this many seconds are written to slow query log
+    # (None disables), requests executing more statements than request_query_budget are
+    # written to slow query log (None disables), per-request statement count and database
+    # time are reported in Server-Timing response header when server_timing is enabled
+    'slow_query_threshold': 1.0,
+    'request_query_budget': None,
+    'server_timing': False,
+    # Check indexes used by lookups when worker starts, missing indexes are created
+    # (concurrently, without blocking writes) only when create_missing_indexes is enabled
+    'verify_indexes': True,
+    'create_missing_indexes': False,
+    # How often in seconds each worker checks database status in background (None
+    # disables background checks) and maximum age of background check result served
+    # by /status and /status/ready, older results are replaced by checking in request
+    'status_probe_interval': 5,
+    'status_max_age': 15,
+    # Responses of member and subsystem creation requests with Idempotency-Key header are
+    # kept for ttl seconds and replayed to retries with the same key from the same client.
+    # Key is reserved for at most reservation_ttl seconds while the first request is
+    # processed. Store is "database" (csapi_idempotency_keys table shared by all workers),
+    # "memory" (at most max_size responses in each worker process, only reliable with a
+    # single worker) or None (header is ignored).
+    'idempotency': {
+        'store': 'database',
+        'ttl': 86400,
+        'reservation_ttl': 60,
+        'max_size': 10000
+    },
+    # Batch requests with "Prefer: respond-async" header are processed as background jobs
+    # by "workers" threads of each worker process (0 disables jobs, then requests are
+    # processed synchronously). Jobs can contain up to max_size items, new jobs are
+    # rejected while max_queued jobs are waiting. Running job that was not updated for
+    # stale_timeout seconds (its worker process was stopped) is continued by another
+    # worker, finished jobs are kept for ttl seconds. Times are in seconds.
+    'jobs': {
+        'workers': 0,
+        'max_size': 100000,
+        'max_queued': 100,
+        'poll_interval': 1,
+        'stale_timeout': 60,
+        'ttl': 604800
+    },
+    # Log records are written by background thread of each process, records are dropped
+    # when queue_size records are waiting. Format is "text" or "json" (JSON lines with
+    # request id and duration). Verbose lines of incoming requests are logged for
+    # sample_rate fraction of requests.
+    'log': {
+        'format': 'text',
+        'queue_size': 10000,
+        'sample_rate': 1.0
+    },
+    # JSON implementation of request and response bodies: "auto" (orjson when installed),
+    # "orjson" or "json" (stdlib). Requests with "application/msgpack" Content-Type are
+    # decoded and responses are encoded as MessagePack when requested by Accept header if
+    # msgpack is enabled (requires msgpack package).
+    'codec': {
+        'json': 'auto',
+        'msgpack': False
+    },
+    # Member class code to ID cache. Times are in seconds, 0 disables caching.
+    'member_class_cache': {
+        'ttl': 300,
+        'negative_ttl': 30
+    }
+}
 
+# Unsuccessful results of member and subsystem creation by result code
+CREATE_RESULTS = {
+    'INVALID_MEMBER_CLASS': {
+        'http_status': 400, 'code': 'INVALID_MEMBER_CLASS',
+        'msg': 'Provided Member Class does not exist'},
+    'INVALID_MEMBER': {
+        'http_status': 400, 'code': 'INVALID_MEMBER',
+        'msg': 'Provided Member does not exist'},
+    'MEMBER_EXISTS': {
+        'http_status': 409, 'code': 'MEMBER_EXISTS',
+        'msg': 'Provided Member already exists'},
+    'SUBSYSTEM_EXISTS': {
+        'http_status': 409, 'code': 'SUBSYSTEM_EXISTS',
+        'msg': 'Provided Subsystem already exists'}
+}
 
-def get_db_conf():
-    """Get Central Server database configuration parameters"""
+# Item parameters included in results of batch requests
+BATCH_KEYS = ('member_class', 'member_code', 'subsystem_code')
+
+# Number of rows sent to database in single multi-row statement
+BATCH_PAGE_SIZE = 1000
+
+# Upper bounds of latency histogram buckets in seconds
+METRICS_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Type and description of exported metrics by metric name
+METRICS_HELP = {
+    'csapi_requests_total': ('counter', 'Number of handled requests'),
+    'csapi_request_duration_seconds': ('histogram', 'Request handling time'),
+    'csapi_db_query_duration_seconds': ('histogram', 'Database query time by query helper'),
+    'csapi_db_errors_total': ('counter', 'Number of database errors by query helper'),
+    'csapi_db_connection_wait_seconds': (
+        'histogram', 'Time spent waiting for pooled database connection'),
+    'csapi_db_connection_errors_total': (
+        'counter', 'Number of failures to get pooled database connection'),
+    'csapi_coalesced_registrations_total': (
+        'counter', 'Number of registrations that shared result of concurrent registration'),
+    'csapi_jobs_total': ('counter', 'Number of finished background jobs by type and status'),
+    'csapi_log_records_dropped_total': (
+        'counter', 'Number of log records dropped because log writing was too slow'),
+    'csapi_db_statements_prepared_total': (
+        'counter', 'Number of statements prepared in database connections by query name'),
+    'csapi_db_transaction_retries_total': (
+        'counter', 'Number of retried database transactions by transaction and reason'),
+    'csapi_db_transaction_retries_exhausted_total': (
+        'counter', 'Number of database transactions that failed after all retries')
+}
+
+# Maximum length of statement text written to slow query log
+SLOW_QUERY_MAX_LENGTH = 1000
+
+# Accepted format of correlation id provided by client or proxy
+REQUEST_ID_RE = re.compile('^[A-Za-z0-9._-]{1,64}$')
+
+# Response fields with lists of items that are not logged
+UNLOGGED_KEYS = ('results', 'members', 'subsystems')
+
+# Verbose log lines of incoming requests that are sampled
+VERBOSE_LOG_PREFIXES = ('Incoming ', 'Client DN: ')
+
+# Database errors after which the whole transaction is run again, by retry reason
+RETRY_ERRORS = (
+    ('serialization_failure', psycopg2.errors.SerializationFailure),
+    ('deadlock', psycopg2.errors.DeadlockDetected),
+    ('unique_violation', psycopg2.errors.UniqueViolation))
+
+# Named parameter of SQL statement
+NAMED_PARAM_RE = re.compile(r'%\((\w+)\)s')
+
+# SQL statements with named parameters by query name
+QUERIES = {
+    'member_class_id': "select id from member_classes where code=%(str)s",
+    'subsystem_exists': """
+        select exists(
+            select * from security_server_clients
+            where type='Subsystem' and xroad_member_id=%(member_id)s
+                and subsystem_code=%(subsystem_code)s
+        )
+    """,
+    'member_data': """
+        select id, name
+        from security_server_clients
+        where type='XRoadMember' and member_class_id=%(class_id)s
+            and member_code=%(member_code)s
+    """,
+    'member_class_ids': 'select code, id from member_classes where code = any(%(codes)s)',
+    'members_data': """
+        select c.member_class_id, c.member_code, c.id, c.name
+        from security_server_clients c
+        join unnest(%(class_ids)s::integer[], %(member_codes)s::varchar[])
+            as m(class_id, member_code)
+            on c.member_class_id=m.class_id and c.member_code=m.member_code
+        where c.type='XRoadMember'
+    """,
+    'existing_subsystems': """
+        select c.xroad_member_id, c.subsystem_code
+        from security_server_clients c
+        join unnest(%(member_ids)s::integer[], %(subsystem_codes)s::varchar[])
+            as s(member_id, subsystem_code)
+            on c.xroad_member_id=s.member_id and c.subsystem_code=s.subsystem_code
+        where c.type='Subsystem'
+    """,
+    'idempotency_response': """
+        select fingerprint, response
+        from csapi_idempotency_keys
+        where client_dn=%(client_dn)s and key=%(key)s and expires_at > now()
+    """,
+    'reserve_idempotency_key': """
+        insert into csapi_idempotency_keys (client_dn, key, fingerprint, response, expires_at)
+        values (%(client_dn)s, %(key)s, %(fingerprint)s, null,
+            now() + %(ttl)s * interval '1 second')
+        on conflict (client_dn, key) do update
+        set fingerprint=excluded.fingerprint, response=null, expires_at=excluded.expires_at
+        where csapi_idempotency_keys.expires_at <= now()
+        returning key
+    """,
+    'add_idempotency_response': """
+        insert into csapi_idempotency_keys (client_dn, key, fingerprint, response, expires_at)
+        values (%(client_dn)s, %(key)s, %(fingerprint)s, %(response)s,
+            now() + %(ttl)s * interval '1 second')
+        on conflict (client_dn, key) do update
+        set fingerprint=excluded.fingerprint, response=excluded.response,
+            expires_at=excluded.expires_at
+        where csapi_idempotency_keys.response is null
+            or csapi_idempotency_keys.expires_at <= now()
+    """,
+    'release_idempotency_key': """
+        delete from csapi_idempotency_keys
+        where client_dn=%(client_dn)s and key=%(key)s and response is null
+    """,
+    'purge_idempotency_responses': """
+        delete from csapi_idempotency_keys where expires_at <= now()
+    """,
+    'add_job': """
+        insert into csapi_jobs (
+            id, type, client_dn, status, items, results, total, created_at, updated_at
+        ) values (
+            %(id)s, %(type)s, %(client_dn)s, 'QUEUED', %(items)s, %(results)s, %(total)s,
+            now(), now()
+        )
+    """,
+    'queued_jobs': "select count(*) from csapi_jobs where status='QUEUED'",
+    'claim_job': """
+        update csapi_jobs
+        set status='RUNNING', worker=%(worker)s, heartbeat=now(), updated_at=now()
+        where id=(
+            select id from csapi_jobs
+            where status='QUEUED' or (
+                status='RUNNING' and heartbeat < now() - %(stale_timeout)s * interval '1 second')
+            order by created_at
+            for update skip locked
+            limit 1
+        )
+        returning id, type, items, processed
+    """,
+    'update_job': """
+        update csapi_jobs
+        set status=%(status)s, processed=%(processed)s, created=created + %(created)s,
+            heartbeat=now(), updated_at=now()
+        where id=%(id)s and worker=%(worker)s
+    """,
+    'add_job_results': """
+        insert into csapi_job_results (job_id, position, results)
+        values (%(id)s, %(position)s, %(results)s)
+    """,
+    'fail_job': """
+        update csapi_jobs
+        set status='FAILED', error=%(error)s, updated_at=now()
+        where id=%(id)s and worker=%(worker)s
+    """,
+    'job': """
+        select type, status, total, processed, created, results, error, created_at, updated_at
+        from csapi_jobs
+        where id=%(id)s and client_dn is not distinct from %(client_dn)s
+    """,
+    'job_results': """
+        select results from csapi_job_results where job_id=%(id)s order by position
+    """,
+    'purge_jobs': """
+        delete from csapi_jobs
+        where status in ('COMPLETED', 'FAILED')
+            and updated_at < now() - %(ttl)s * interval '1 second'
+    """,
+    'table_indexes': """
+        select i.tablename, i.indexname, i.indexdef, x.indisvalid
+        from pg_indexes i
+        join pg_namespace n on n.nspname=i.schemaname
+        join pg_class c on c.relnamespace=n.oid and c.relname=i.indexname
+        join pg_index x on x.indexrelid=c.oid
+        where i.schemaname=current_schema() and i.tablename = any(%(tables)s)
+    """,
+    'registration_lock': 'select pg_advisory_xact_lock(%(lock)s)',
+    'instance_identifier': "select value from system_parameters where key='instanceIdentifier'",
+    'utc_time': "select current_timestamp at time zone 'UTC'",
+    'add_member_identifier': """
+        insert into identifiers (
+            object_type, xroad_instance, member_class, member_code, type, created_at,
+            updated_at
+        ) values (
+            'MEMBER', %(instance)s, %(class)s, %(code)s, 'ClientId', %(time)s, %(time)s
+        ) returning id
+    """,
+    'add_subsystem_identifier': """
+        insert into identifiers (
+            object_type, xroad_instance, member_class, member_code, subsystem_code, type,
+            created_at, updated_at
+        ) values (
+            'SUBSYSTEM', %(instance)s, %(class)s, %(member_code)s, %(subsystem_code)s,
+            'ClientId', %(time)s, %(time)s
+        ) returning id
+    """,
+    'add_member_client': """
+        insert into security_server_clients (
+            member_code, name, member_class_id, server_client_id, type, created_at, updated_at
+        ) values (
+            %(code)s, %(name)s, %(class_id)s, %(identifier_id)s, 'XRoadMember', %(time)s,
+            %(time)s
+        )
+    """,
+    'add_subsystem_client': """
+        insert into security_server_clients (
+            subsystem_code, xroad_member_id, server_client_id, type, created_at, updated_at
+        ) values (
+            %(subsystem_code)s, %(member_id)s, %(identifier_id)s, 'Subsystem', %(time)s,
+            %(time)s
+        )
+    """,
+    'add_client_name': """
+        insert into security_server_client_names (
+            name, client_identifier_id, created_at, updated_at
+        ) values (
+            %(name)s, %(identifier_id)s, %(time)s, %(time)s
+        )
+    """,
+    'register_member': """
+        with member_class as (
+            select id from member_classes where code=%(class)s
+        ), existing as (
+            select c.id from security_server_clients c
+            join member_class on c.member_class_id=member_class.id
+            where c.type='XRoadMember' and c.member_code=%(code)s
+        ), utc as (
+            select current_timestamp at time zone 'UTC' as time
+        ), identifier as (
+            insert into identifiers (
+                object_type, xroad_instance, member_class, member_code, type,
+                created_at, updated_at
+            )
+            select 'MEMBER', %(instance)s, %(class)s, %(code)s, 'ClientId',
+                utc.time, utc.time
+            from utc
+            where exists(select * from member_class)
+                and not exists(select * from existing)
+            returning id, created_at
+        ), client as (
+            insert into security_server_clients (
+                member_code, name, member_class_id, server_client_id, type,
+                created_at, updated_at
+            )
+            select %(code)s, %(name)s, member_class.id, identifier.id,
+                'XRoadMember', identifier.created_at, identifier.created_at
+            from identifier, member_class
+        ), client_name as (
+            insert into security_server_client_names (
+                name, client_identifier_id, created_at, updated_at
+            )
+            select %(name)s, identifier.id, identifier.created_at,
+                identifier.created_at
+            from identifier
+        )
+        select exists(select * from member_class), exists(select * from existing)
+    """,
+    'register_subsystem': """
+        with member_class as (
+            select id from member_classes where code=%(class)s
+        ), member as (
+            select c.id, c.name from security_server_clients c
+            join member_class on c.member_class_id=member_class.id
+            where c.type='XRoadMember' and c.member_code=%(member_code)s
+        ), existing as (
+            select c.id from security_server_clients c
+            join member on c.xroad_member_id=member.id
+            where c.type='Subsystem' and c.subsystem_code=%(subsystem_code)s
+        ), utc as (
+            select current_timestamp at time zone 'UTC' as time
+        ), identifier as (
+            insert into identifiers (
+                object_type, xroad_instance, member_class, member_code,
+                subsystem_code, type, created_at, updated_at
+            )
+            select 'SUBSYSTEM', %(instance)s, %(class)s, %(member_code)s,
+                %(subsystem_code)s, 'ClientId', utc.time, utc.time
+            from utc
+            where exists(select * from member)
+                and not exists(select * from existing)
+            returning id, created_at
+        ), client as (
+            insert into security_server_clients (
+                subsystem_code, xroad_member_id, server_client_id, type,
+                created_at, updated_at
+            )
+            select %(subsystem_code)s, member.id, identifier.id, 'Subsystem',
+                identifier.created_at, identifier.created_at
+            from identifier, member
+        ), client_name as (
+            insert into security_server_client_names (
+                name, client_identifier_id, created_at, updated_at
+            )
+            select member.name, identifier.id, identifier.created_at,
+                identifier.created_at
+            from identifier, member
+        )
+        select exists(select * from member_class), exists(select * from member),
+            exists(select * from existing)
+    """,
+    'list_members': """
+        select c.member_class_id, mc.code, c.member_code, c.name
+        from security_server_clients c
+        join member_classes mc on mc.id=c.member_class_id
+        where c.type='XRoadMember'
+            and (%(class_id)s::integer is null or c.member_class_id=%(class_id)s)
+            and (%(after_class_id)s::integer is null
+                or (c.member_class_id, c.member_code) > (%(after_class_id)s, %(after_code)s))
+        order by c.member_class_id, c.member_code
+        limit %(limit)s
+    """,
+    'list_subsystems': """
+        select subsystem_code
+        from security_server_clients
+        where type='Subsystem' and xroad_member_id=%(member_id)s
+            and (%(after)s::varchar is null or subsystem_code > %(after)s)
+        order by subsystem_code
+        limit %(limit)s
+    """,
+    'export_clients': """
+        select mc.code, coalesce(m.member_code, c.member_code), c.subsystem_code, n.name,
+            c.created_at
+        from security_server_clients c
+        left join security_server_clients m on m.id=c.xroad_member_id
+        join member_classes mc on mc.id=coalesce(m.member_class_id, c.member_class_id)
+        left join security_server_client_names n on n.client_identifier_id=c.server_client_id
+        where c.type in ('XRoadMember', 'Subsystem')
+        order by c.id
+    """
+}
+
+# Batch insert statements executed with psycopg2.extras.execute_values as (statement, row
+# template) tuples, "%s" of statement is replaced by rows formatted with template
+BATCH_QUERIES = {
+    'add_member_identifiers': (
+        """
+            insert into identifiers (
+                object_type, xroad_instance, member_class, member_code, type, created_at,
+                updated_at
+            ) values %s returning id, member_class, member_code
+        """,
+        "('MEMBER', %(instance)s, %(class)s, %(code)s, 'ClientId', %(time)s, %(time)s)"),
+    'add_member_clients': (
+        """
+            insert into security_server_clients (
+                member_code, name, member_class_id, server_client_id, type, created_at, updated_at
+            ) values %s
+        """,
+        "(%(code)s, %(name)s, %(class_id)s, %(identifier_id)s, 'XRoadMember', %(time)s, "
+        "%(time)s)"),
+    'add_client_names': (
+        """
+            insert into security_server_client_names (
+                name, client_identifier_id, created_at, updated_at
+            ) values %s
+        """,
+        "(%(name)s, %(identifier_id)s, %(time)s, %(time)s)"),
+    'add_subsystem_identifiers': (
+        """
+            insert into identifiers (
+                object_type, xroad_instance, member_class, member_code, subsystem_code, type,
+                created_at, updated_at
+            ) values %s returning id, member_class, member_code, subsystem_code
+        """,
+        "('SUBSYSTEM', %(instance)s, %(class)s, %(member_code)s, %(subsystem_code)s, "
+        "'ClientId', %(time)s, %(time)s)"),
+    'add_subsystem_clients': (
+        """
+            insert into security_server_clients (
+                subsystem_code, xroad_member_id, server_client_id, type, created_at, updated_at
+            ) values %s
+        """,
+        "(%(subsystem_code)s, %(member_id)s, %(identifier_id)s, 'Subsystem', %(time)s, "
+        "%(time)s)")
+}
+
+# Queries executed by every member and subsystem registration that are prepared once per
+# database connection when prepared_statements is enabled
+PREPARED_QUERY_NAMES = (
+    'member_class_id', 'subsystem_exists', 'member_data', 'registration_lock',
+    'instance_identifier', 'utc_time', 'add_member_identifier', 'add_subsystem_identifier',
+    'add_member_client', 'add_subsystem_client', 'add_client_name', 'register_member',
+    'register_subsystem')
+
+# Indexes of lookups as (index name, table, columns, query helpers using the index).
+# Existing btree index is sufficient when its leading columns are the same columns in
+# any order.
+INDEXES = (
+    ('csapi_member_classes_code_idx', 'member_classes', ('code',), (
+        'get_member_class_id', 'get_member_class_ids')),
+    ('csapi_clients_member_idx', 'security_server_clients', ('member_class_id', 'member_code'), (
+        'get_member_data', 'get_members_data', 'list_members')),
+    ('csapi_clients_subsystem_idx', 'security_server_clients', (
+        'xroad_member_id', 'subsystem_code'), (
+            'subsystem_exists', 'get_existing_subsystems', 'list_subsystems'))
+)
+
+# Method, columns and remaining part of index definition in pg_indexes
+INDEX_DEF_RE = re.compile(r' USING (\w+) \(([^)]*)\)(.*)$')
+
+# Settings that can be set to null in configuration file
+NULLABLE_SETTINGS = (
+    'config_check_interval', 'status_probe_interval', 'slow_query_threshold',
+    'db_pool.max_lifetime', 'db_pool.max_idle', 'member_class_cache.ttl',
+    'member_class_cache.negative_ttl', 'idempotency.store', 'cache_flush_file')
+
+# Request parameters of member and subsystem registration by job type
+JOB_PARAMS = {
+    'members': ('member_class', 'member_code', 'member_name'),
+    'subsystems': ('member_class', 'member_code', 'subsystem_code')
+}
+
+# Short names of DN attribute types by OID or alternative name
+DN_ATTRIBUTE_TYPES = {
+    '2.5.4.3': 'CN', '2.5.4.5': 'SERIALNUMBER', '2.5.4.6': 'C', '2.5.4.7': 'L', '2.5.4.8': 'ST',
+    '2.5.4.9': 'STREET', '2.5.4.10': 'O', '2.5.4.11': 'OU', '2.5.4.97': 'ORGANIZATIONIDENTIFIER',
+    '0.9.2342.19200300.100.1.1': 'UID', '0.9.2342.19200300.100.1.25': 'DC',
+    '1.2.840.113549.1.9.1': 'EMAILADDRESS', 'E': 'EMAILADDRESS', 'S': 'ST'
+}
+
+# Attribute type of DN (descriptor or OID, optionally with OID. prefix)
+DN_ATTRIBUTE_TYPE_RE = re.compile('^(?:OID\\.)?([A-Z][A-Z0-9-]*|[0-9]+(?:\\.[0-9]+)*)$')
+
+# Advisory lock held by the process creating missing indexes
+INDEX_LOCK_KEY = 0x63736170
+
+# Table of stored responses of database idempotency store, created on first use
+IDEMPOTENCY_TABLE = """
+    create table if not exists csapi_idempotency_keys (
+        client_dn text not null,
+        key varchar(255) not null,
+        fingerprint varchar(64) not null,
+        response text,
+        expires_at timestamp with time zone not null,
+        primary key (client_dn, key)
+    );
+    -- Response is null while the key is reserved (tables created by older versions)
+    alter table csapi_idempotency_keys alter column response drop not null;
+    create index if not exists csapi_idempotency_keys_expires_idx
+        on csapi_idempotency_keys (expires_at);
+"""
+
+# Advisory lock serializing creation of idempotency table by worker processes
+IDEMPOTENCY_LOCK_KEY = 0x63736171
+
+# Tables of background jobs, created on first use. Job has results of invalid items
+# (null for valid items), results of processed valid items are added in chunks.
+JOBS_TABLES = """
+    create table if not exists csapi_jobs (
+        id varchar(32) primary key,
+        type varchar(32) not null,
+        client_dn text,
+        status varchar(16) not null,
+        items text not null,
+        results text not null,
+        total integer not null,
+        processed integer not null default 0,
+        created integer not null default 0,
+        error text,
+        worker varchar(32),
+        heartbeat timestamp with time zone,
+        created_at timestamp with time zone not null,
+        updated_at timestamp with time zone not null
+    );
+    create index if not exists csapi_jobs_status_idx on csapi_jobs (status, created_at);
+    create table if not exists csapi_job_results (
+        job_id varchar(32) not null references csapi_jobs (id) on delete cascade,
+        position integer not null,
+        results text not null,
+        primary key (job_id, position)
+    );
+"""
+
+# Advisory lock serializing creation of job tables by worker processes
+JOBS_LOCK_KEY = 0x63736172
+
+# Format of job id
+JOB_ID_RE = re.compile('^[0-9a-f]{32}$')
+
+# How often in seconds finished jobs older than jobs.ttl are removed
+JOBS_PURGE_INTERVAL = 3600
+
+# Accepted format of Idempotency-Key header (printable ASCII characters)
+IDEMPOTENCY_KEY_RE = re.compile('^[\x21-\x7e]{1,255}$')
+
+# How often in seconds expired responses are removed from database idempotency store
+IDEMPOTENCY_PURGE_INTERVAL = 3600
+
+# Media types of MessagePack request bodies, the first one is used in responses
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def dumps_stdlib_json(data):
+    """Serialize data to compact UTF-8 encoded JSON with stdlib json module"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+# JSON encoder and decoder by codec name, all encoders produce the same compact UTF-8 output
+JSON_CODECS = {'json': (dumps_stdlib_json, json.loads)}
+if orjson is not None:
+    JSON_CODECS['orjson'] = (orjson.dumps, orjson.loads)
+
+# Current runtime settings
+SETTINGS = copy.deepcopy(DEFAULT_SETTINGS)
+
+# Parsed database configuration and stat() based key of parsed file
+_DB_CONF_CACHE = {'key': None, 'conf': None}
+_DB_CONF_LOCK = threading.Lock()
+
+# X-Road instance identifier, immutable for the life of Central Server
+_INSTANCE_IDENTIFIER = {'value': None}
+
+# Connection pool of current worker process
+_DB_POOL = {'pool': None}
+
+# Key of cache flush file when caches of current worker process were last flushed
+_CACHE_FLUSH = {'key': None, 'requested': False}
+
+# Metrics snapshot file name of current worker process and process ID it was created for
+_METRICS_SNAPSHOT = {'pid': None, 'file_name': None}
+
+# Job tables created by current worker process and time of last removal of old jobs
+_JOBS = {'table_ready': False, 'purged': None}
+
+# Idempotency store of current worker process and settings it was created with
+_IDEMPOTENCY_STORE = {'store': None, 'settings': None}
+
+# Configuration and client matcher compiled from it
+_CLIENT_MATCHER = {'entry': None}
+_DB_POOL_LOCK = threading.Lock()
+
+
+def read_db_conf(db_conf_file):
+    """Parse Central Server database configuration file"""
     conf = {
         'database': '',
         'username': '',
@@ -28,390 +741,3734 @@ def get_db_conf():
 
     # Getting database credentials from X-Road configuration
     try:
-        with open(DB_CONF_FILE, 'r') as db_conf:
+        with open(db_conf_file, 'r') as db_conf:
             for line in db_conf:
-                match_res = re.match('^database\\s*=\\s*(.+)$', line)
-                if match_res:
-                    conf['database'] = match_res.group(1)
-
-                match_res = re.match('^username\\s*=\\s*(.+)$', line)
-                if match_res:
-                    conf['username'] = match_res.group(1)
-
-                match_res = re.match('^password\\s*=\\s*(.+)$', line)
+                match_res = DB_CONF_LINE_RE.match(line)
                 if match_res:
-                    conf['password'] = match_res.group(1)
+                    conf[match_res.group(1)] = match_res.group(2)
     except IOError:
         pass
 
     return conf
 
 
+def file_key(path):
+    """Get key of file that changes when file is replaced or modified
+
+    Key consists of path, inode, modification time and size of file, None is
+    returned if file cannot be accessed.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return path, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def get_db_conf():
+    """Get Central Server database configuration parameters
+
+    Parsed configuration is cached in memory and file is parsed again only
+    when its inode, modification time or size changes.
+    """
+    db_conf_file = SETTINGS['db_conf_file']
+    # Configuration that cannot be checked for changes is not cached
+    key = file_key(db_conf_file)
+
+    with _DB_CONF_LOCK:
+        if key is not None and _DB_CONF_CACHE['key'] == key:
+            return dict(_DB_CONF_CACHE['conf'])
+
+    conf = read_db_conf(db_conf_file)
+    if key is not None:
+        with _DB_CONF_LOCK:
+            _DB_CONF_CACHE['key'] = key
+            _DB_CONF_CACHE['conf'] = dict(conf)
+    return conf
+
+
+def db_conf_error(conf):
+    """Get error response when database configuration is incomplete
+
+    Returns None when username, password and database are configured.
+    """
+    if conf['username'] and conf['password'] and conf['database']:
+        return None
+    LOGGER.error('DB_CONF_ERROR: Cannot access database configuration')
+    return {
+        'http_status': 500, 'code': 'DB_CONF_ERROR',
+        'msg': 'Cannot access database configuration'}
+
+
+def format_statement(query):
+    """Format statement text for slow query log
+
+    Parameters are not included, whitespace is collapsed and long statements
+    (multi-row inserts of batch requests) are truncated.
+    """
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    text = ' '.join(str(query).split())
+    if len(text) > SLOW_QUERY_MAX_LENGTH:
+        return text[:SLOW_QUERY_MAX_LENGTH] + '...'
+    return text
+
+
+def record_statement(query, duration, rows):
+    """Record executed statement in request totals and slow query log"""
+    request_id = None
+    if has_request_context():
+        g.csapi_db_queries = g.get('csapi_db_queries', 0) + 1
+        g.csapi_db_time = g.get('csapi_db_time', 0.0) + duration
+        request_id = g.get('csapi_request_id')
+
+    threshold = SETTINGS['slow_query_threshold']
+    if threshold is not None and duration >= threshold:
+        SLOW_QUERY_LOGGER.warning(
+            '%s: Slow query (%.3f s, %s rows): %s', request_id or '-', duration, rows,
+            format_statement(query))
+
+
+def positional_query(query):
+    """Convert query with named parameters into query with positional parameters
+
+    Returns query where %(name)s parameters are replaced with $1, $2, ...
+    and list of parameter names in position order.
+    """
+    names = []
+
+    def replace(match):
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return '${}'.format(names.index(match.group(1)) + 1)
+
+    return NAMED_PARAM_RE.sub(replace, query), names
+
+
+def prepared_statement(name):
+    """Create statements preparing and executing query of QUERIES
+
+    Returns PREPARE statement and EXECUTE statement with named parameters.
+    """
+    query, names = positional_query(QUERIES[name])
+    statement = 'csapi_{}'.format(name)
+    execute = 'execute {}'.format(statement)
+    if names:
+        execute += '({})'.format(', '.join('%({})s'.format(param) for param in names))
+    return 'prepare {} as {}'.format(statement, query.strip()), execute
+
+
+# PREPARE and EXECUTE statements of prepared queries by query name
+PREPARED_QUERIES = {name: prepared_statement(name) for name in PREPARED_QUERY_NAMES}
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection keeping track of statements prepared in its database session"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Names of prepared queries
+        self.prepared = set()
+        # Prepared statements of session must be deallocated before preparing again
+        self.stale_prepared = False
+
+    def invalidate_prepared(self):
+        """Prepare all statements again (after schema change or DISCARD)"""
+        self.prepared.clear()
+        self.stale_prepared = True
+
+
+def prepared_query(cur, name):
+    """Get statement executing query of QUERIES by name
+
+    Queries of PREPARED_QUERY_NAMES are prepared in connection of cursor
+    (PreparingConnection) on first use and executed by name, other queries
+    are returned as is.
+    """
+    if name not in PREPARED_QUERIES:
+        return QUERIES[name]
+    conn = cur.connection
+    if name not in conn.prepared:
+        if conn.stale_prepared:
+            cur.execute('deallocate all')
+            conn.stale_prepared = False
+        cur.execute(PREPARED_QUERIES[name][0])
+        conn.prepared.add(name)
+        METRICS.inc('csapi_db_statements_prepared_total', (('query', name),))
+    return PREPARED_QUERIES[name][1]
+
+
+def is_stale_prepared_error(err):
+    """Check if statement failed because prepared statement is not valid anymore
+
+    Prepared statement is missing after DISCARD ALL and can not be executed
+    when schema change modified its result columns.
+    """
+    return isinstance(err, psycopg2.errors.InvalidSqlStatementName) or (
+        isinstance(err, psycopg2.errors.FeatureNotSupported)
+        and 'cached plan must not change result type' in str(err))
+
+
+def execute_query(cur, name, params=None):
+    """Execute query of QUERIES by name, prepared queries are executed by name
+
+    name can also be a tuple of query names that are sent together as one
+    multi-statement query. Statements are prepared again when prepared
+    statement is not valid anymore. Failed statement is executed again when
+    it was the first statement of transaction, otherwise the error is raised
+    and statements are prepared again in the next transaction.
+    """
+    names = name if isinstance(name, tuple) else (name,)
+    conn = cur.connection
+    if not SETTINGS['prepared_statements'] or not isinstance(conn, PreparingConnection):
+        query = ';'.join(QUERIES[query_name] for query_name in names)
+        if params is None:
+            cur.execute(query)
+        else:
+            cur.execute(query, params)
+        return
+
+    first = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    for attempt in range(2):
+        try:
+            cur.execute(';'.join(prepared_query(cur, query_name) for query_name in names), params)
+            return
+        except psycopg2.Error as err:
+            if not is_stale_prepared_error(err):
+                raise
+            conn.invalidate_prepared()
+            if not first or attempt:
+                raise
+            LOGGER.warning('Preparing statements again: %s', str(err).strip())
+            conn.rollback()
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor recording duration and row count of each executed statement"""
+
+    def execute(self, query, query_vars=None):
+        """Execute statement and record its duration and row count"""
+        start = time.monotonic()
+        try:
+            return super().execute(query, query_vars)
+        finally:
+            record_statement(query, time.monotonic() - start, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        """Execute statement for each parameter set and record total duration and row count"""
+        start = time.monotonic()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_statement(query, time.monotonic() - start, self.rowcount)
+
+
 def get_db_connection(conf):
-    """Get connection object for Central Server database"""
+    """Get connection object for Central Server database
+
+    Database is on localhost unless host and port are set in database
+    configuration file.
+    """
     return psycopg2.connect(
         'host={} port={} dbname={} user={} password={}'.format(
-            'localhost', '5432', conf['database'], conf['username'], conf['password']))
+            conf.get('host', 'localhost'), conf.get('port', '5432'), conf['database'],
+            conf['username'], conf['password']),
+        connection_factory=PreparingConnection, cursor_factory=InstrumentedCursor)
 
 
-def get_member_class_id(cur, member_class):
-    """Get ID of member class from Central Server"""
-    cur.execute("""select id from member_classes where code=%(str)s""", {'str': member_class})
-    rec = cur.fetchone()
-    if rec:
-        return rec[0]
-    return None
+class PoolTimeout(psycopg2.pool.PoolError):
+    """Database connection was not available within pool timeout"""
 
 
-def subsystem_exists(cur, member_id, subsystem_code):
-    """Check if subsystem exists in Central Server"""
-    cur.execute(
+class DbPool:
+    """Pool of Central Server database connections
+
+    Pool is bound to the worker process that created it. Pool is filled to
+    min_size connections when it is created, further connections are
+    created lazily up to max_size. Connections are closed after max_lifetime
+    seconds or after staying unused for max_idle seconds (while keeping at
+    least min_size connections). Expired and idle connections are removed
+    when connections are checked out or returned (background status checks
+    use the pool regularly). Connections that were unused for more than
+    health_check_idle seconds are tested before checkout.
+    """
+
+    def __init__(self, db_conf, **kwargs):
+        self.db_conf = db_conf
+        self.min_size = kwargs.get('min_size', DEFAULT_SETTINGS['db_pool']['min_size'])
+        self.max_size = kwargs.get('max_size', DEFAULT_SETTINGS['db_pool']['max_size'])
+        self.max_lifetime = kwargs.get(
+            'max_lifetime', DEFAULT_SETTINGS['db_pool']['max_lifetime'])
+        self.max_idle = kwargs.get('max_idle', DEFAULT_SETTINGS['db_pool']['max_idle'])
+        self.timeout = kwargs.get('timeout', DEFAULT_SETTINGS['db_pool']['timeout'])
+        self.health_check_idle = kwargs.get(
+            'health_check_idle', DEFAULT_SETTINGS['db_pool']['health_check_idle'])
+        # Settings of pool for detecting configuration changes
+        self.settings = dict(kwargs)
+        self.pid = os.getpid()
+        self.closed = False
+        # Idle connections as [conn, created, last_used], most recently used last
+        self._idle = []
+        # Creation times of checked out connections by connection id
+        self._used = {}
+        self._connecting = 0
+        self._cond = threading.Condition()
+
+    def size(self):
+        """Total number of open connections"""
+        with self._cond:
+            return len(self._idle) + len(self._used)
+
+    def fill(self):
+        """Open connections until pool has min_size connections
+
+        Slots are reserved under the lock, so concurrent calls never open more
+        than min_size connections in total.
         """
-            select exists(
-                select * from security_server_clients
-                where type='Subsystem' and xroad_member_id=%(member_id)s
-                    and subsystem_code=%(subsystem_code)s
-            )
-        """, {'member_id': member_id, 'subsystem_code': subsystem_code})
-    return cur.fetchone()[0]
+        with self._cond:
+            missing = self.min_size - (len(self._idle) + len(self._used) + self._connecting)
+            if self.closed or missing <= 0:
+                return
+            self._connecting += missing
+        for opened in range(missing):
+            try:
+                conn = get_db_connection(self.db_conf)
+            except psycopg2.Error as err:
+                LOGGER.warning('Cannot open database connection for pool: %s', err)
+                with self._cond:
+                    self._connecting -= missing - opened
+                    self._cond.notify()
+                return
+            now = time.monotonic()
+            with self._cond:
+                self._connecting -= 1
+                if not self.closed:
+                    self._idle.append([conn, now, now])
+                    self._cond.notify()
+                    conn = None
+            if conn is not None:
+                conn.close()
 
+    def _expired(self, created, now):
+        return self.max_lifetime is not None and now - created > self.max_lifetime
 
-def get_member_data(cur, class_id, member_code):
-    """Get member data from Central Server"""
-    cur.execute(
+    def _reap(self, now):
+        """Remove expired and idle connections from pool, must be called with lock held
+
+        Returns list of removed connections that must be closed by caller.
         """
-            select id, name
-            from security_server_clients
-            where type='XRoadMember' and member_class_id=%(class_id)s
-                and member_code=%(member_code)s
-        """, {'class_id': class_id, 'member_code': member_code})
-    rec = cur.fetchone()
-    if rec:
-        return {'id': rec[0], 'name': rec[1]}
-    return None
+        reaped = []
+        keep = []
+        total = len(self._idle) + len(self._used) + self._connecting
+        # Least recently used connections are at the beginning of the list
+        for entry in self._idle:
+            if self._expired(entry[1], now) or (
+                    self.max_idle is not None and now - entry[2] > self.max_idle
+                    and total > self.min_size):
+                reaped.append(entry[0])
+                total -= 1
+            else:
+                keep.append(entry)
+        self._idle = keep
+        return reaped
 
+    @staticmethod
+    def _healthy(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute('select 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error as err:
+            LOGGER.warning('Discarding broken pooled database connection: %s', err)
+            return False
 
-def get_utc_time(cur):
-    """Get current time in UTC timezone from Central Server database"""
-    cur.execute("""select current_timestamp at time zone 'UTC'""")
-    return cur.fetchone()[0]
+    def getconn(self):
+        """Check out connection from pool"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self.closed:
+                        raise psycopg2.pool.PoolError('Connection pool is closed')
+                    now = time.monotonic()
+                    for conn in self._reap(now):
+                        conn.close()
+                    if self._idle:
+                        entry = self._idle.pop()
+                        self._used[id(entry[0])] = entry[1]
+                        break
+                    if len(self._used) + self._connecting < self.max_size:
+                        self._connecting += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolTimeout('Timed out waiting for database connection')
+                    self._cond.wait(remaining)
 
+            if entry is None:
+                return self._open()
 
-def add_member_identifier(cur, **kwargs):
-    """Add new X-Road member identifier to Central Server
+            conn, _, last_used = entry
+            if not conn.closed and (
+                    time.monotonic() - last_used <= self.health_check_idle
+                    or self._healthy(conn)):
+                return conn
+            self.putconn(conn, discard=True)
 
-    Required keyword arguments:
-    member_class, member_code, utc_time
+    def _open(self):
+        """Open new connection for a reserved pool slot"""
+        try:
+            conn = get_db_connection(self.db_conf)
+        except BaseException:
+            with self._cond:
+                self._connecting -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._connecting -= 1
+            self._used[id(conn)] = time.monotonic()
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Return connection to pool"""
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        now = time.monotonic()
+        with self._cond:
+            created = self._used.pop(id(conn), now)
+            if discard or conn.closed or self.closed or self._expired(created, now):
+                if not conn.closed:
+                    conn.close()
+            else:
+                self._idle.append([conn, created, now])
+            reaped = self._reap(now)
+            self._cond.notify()
+        for reaped_conn in reaped:
+            reaped_conn.close()
+
+    def close(self):
+        """Close idle connections, checked out connections are closed when returned"""
+        with self._cond:
+            self.closed = True
+            idle = self._idle
+            self._idle = []
+            self._cond.notify_all()
+        for entry in idle:
+            entry[0].close()
+
+
+def get_db_pool(conf):
+    """Get connection pool of current worker process
+
+    New pool is created (and filled to min_size connections) after fork or
+    when database configuration or pool settings change.
     """
-    cur.execute(
-        """
-            insert into identifiers (
-                object_type, xroad_instance, member_class, member_code, type, created_at,
-                updated_at
-            ) values (
-                'MEMBER', (select value from system_parameters where key='instanceIdentifier'),
-                %(class)s, %(code)s, 'ClientId', %(time)s, %(time)s
-            ) returning id
-        """, {
-            'class': kwargs['member_class'], 'code': kwargs['member_code'],
-            'time': kwargs['utc_time']}
-    )
-    return cur.fetchone()[0]
+    with _DB_POOL_LOCK:
+        pool = _DB_POOL['pool']
+        if pool is not None and pool.pid == os.getpid() and pool.db_conf == conf and (
+                pool.settings == SETTINGS['db_pool']):
+            return pool
+        if pool is not None and pool.pid == os.getpid():
+            pool.close()
+        # Connections inherited from parent process are left untouched
+        pool = DbPool(conf, **SETTINGS['db_pool'])
+        _DB_POOL['pool'] = pool
+    # Connections are opened without blocking other threads getting the pool
+    pool.fill()
+    return pool
 
 
-def add_subsystem_identifier(cur, **kwargs):
-    """Add new X-Road subsystem identifier to Central Server
+@contextmanager
+def db_connection(conf):
+    """Check out pooled connection for Central Server database
 
-    Required keyword arguments:
-    member_class, member_code, subsystem_code, utc_time
+    Uncommitted transaction is rolled back when connection is returned.
     """
-    cur.execute(
-        """
-            insert into identifiers (
-                object_type, xroad_instance, member_class, member_code, subsystem_code, type,
-                created_at, updated_at
-            ) values (
-                'SUBSYSTEM', (select value from system_parameters where key='instanceIdentifier'),
-                %(class)s, %(member_code)s, %(subsystem_code)s, 'ClientId', %(time)s, %(time)s
-            ) returning id
-        """, {
-            'class': kwargs['member_class'], 'member_code': kwargs['member_code'],
-            'subsystem_code': kwargs['subsystem_code'], 'time': kwargs['utc_time']}
-    )
-    return cur.fetchone()[0]
+    pool = get_db_pool(conf)
+    start = time.monotonic()
+    try:
+        conn = pool.getconn()
+    except psycopg2.Error:
+        METRICS.inc('csapi_db_connection_errors_total')
+        raise
+    finally:
+        METRICS.observe('csapi_db_connection_wait_seconds', time.monotonic() - start)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
 
 
-def add_member_client(cur, **kwargs):
-    """Add new X-Road member client to Central Server
+class LookupCache:
+    """Thread safe in-process cache of database lookups
 
-    Required keyword arguments:
-    member_code, member_name, class_id, identifier_id, utc_time
+    Lookup results of None (nothing found) are cached as negative entries
+    with their own TTL.
     """
-    cur.execute(
+
+    def __init__(self, ttl, negative_ttl):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        # Cached values as (value, expiry time) by key
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get cached value
+
+        Returns two items:
+        * True if value was found in cache, False otherwise
+        * cached value.
         """
-            insert into security_server_clients (
-                member_code, name, member_class_id, server_client_id, type, created_at, updated_at
-            ) values (
-                %(code)s, %(name)s, %(class_id)s, %(identifier_id)s, 'XRoadMember', %(time)s,
-                %(time)s
-            )
-        """, {
-            'code': kwargs['member_code'], 'name': kwargs['member_name'],
-            'class_id': kwargs['class_id'], 'identifier_id': kwargs['identifier_id'],
-            'time': kwargs['utc_time']
-        }
-    )
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self.hits += 1
+                    return True, entry[0]
+                del self._entries[key]
+            self.misses += 1
+            return False, None
 
+    def put(self, key, value):
+        """Store value in cache"""
+        ttl = self.ttl if value is not None else self.negative_ttl
+        if not ttl or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
 
-def add_subsystem_client(cur, **kwargs):
-    """Add new X-Road subsystem as a client to Central Server
+    def clear(self):
+        """Remove all cached values"""
+        with self._lock:
+            self._entries.clear()
 
-    Required keyword arguments:
-    subsystem_code, member_id, identifier_id, utc_time
+    def stats(self):
+        """Get cache statistics"""
+        with self._lock:
+            return {
+                'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'ttl': self.ttl, 'negative_ttl': self.negative_ttl}
+
+
+# Member class IDs by member class code
+MEMBER_CLASS_CACHE = LookupCache(
+    DEFAULT_SETTINGS['member_class_cache']['ttl'],
+    DEFAULT_SETTINGS['member_class_cache']['negative_ttl'])
+
+
+def flush_caches():
+    """Flush caches of current worker process"""
+    MEMBER_CLASS_CACHE.clear()
+    # Instance identifier is loaded again on next use
+    _INSTANCE_IDENTIFIER['value'] = None
+
+
+def request_cache_flush():
+    """Flush caches of current worker process on next cache access
+
+    Safe to call from signal handlers, caches are not locked here.
     """
-    cur.execute(
-        """
-            insert into security_server_clients (
-                subsystem_code, xroad_member_id, server_client_id, type, created_at, updated_at
-            ) values (
-                %(subsystem_code)s, %(member_id)s, %(identifier_id)s, 'Subsystem', %(time)s,
-                %(time)s
-            )
-        """, {
-            'subsystem_code': kwargs['subsystem_code'], 'member_id': kwargs['member_id'],
-            'identifier_id': kwargs['identifier_id'], 'time': kwargs['utc_time']
-        }
-    )
+    _CACHE_FLUSH['requested'] = True
 
 
-def add_client_name(cur, **kwargs):
-    """Add new X-Road client name to Central Server
+def check_cache_flush():
+    """Flush caches of current worker process if flush was requested
 
-    Required keyword arguments:
-    member_name, identifier_id, utc_time
+    Flush is requested by request_cache_flush() (SIGHUP) or by other workers
+    replacing cache_flush_file.
     """
-    cur.execute(
-        """
-            insert into security_server_client_names (
-                name, client_identifier_id, created_at, updated_at
-            ) values (
-                %(name)s, %(identifier_id)s, %(time)s, %(time)s
-            )
-        """, {
+    if _CACHE_FLUSH['requested']:
+        _CACHE_FLUSH['requested'] = False
+        flush_caches()
+    path = SETTINGS['cache_flush_file']
+    if path is None:
+        return
+    key = file_key(path)
+    if key != _CACHE_FLUSH['key']:
+        _CACHE_FLUSH['key'] = key
+        flush_caches()
+
+
+def reload_on_sighup(config):
+    """Reload configuration and flush caches of current process on next use after SIGHUP"""
+    def handle_sighup(signum, frame):  # pylint: disable=unused-argument
+        config.reload()
+        request_cache_flush()
+
+    signal.signal(signal.SIGHUP, handle_sighup)
+
+
+def flush_all_caches():
+    """Flush caches of current worker process and signal other workers to flush
+
+    Returns True if other workers were signalled (cache_flush_file is set and
+    could be replaced).
+    """
+    flush_caches()
+    path = SETTINGS['cache_flush_file']
+    if path is None:
+        return False
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        # New file (inode) changes file key even within mtime resolution
+        with open(tmp_path, 'w') as flush_file:
+            flush_file.write(uuid.uuid4().hex + '\n')
+        os.replace(tmp_path, path)
+    except OSError as err:
+        LOGGER.warning('Cannot signal cache flush to other worker processes: %s', err)
+        return False
+    _CACHE_FLUSH['key'] = file_key(path)
+    return True
+
+
+def get_cache_stats():
+    """Get response with cache statistics of current worker process"""
+    return {
+        'http_status': 200, 'code': 'OK', 'msg': 'Cache statistics',
+        'pid': os.getpid(), 'member_classes': MEMBER_CLASS_CACHE.stats(),
+        'instance_identifier': _INSTANCE_IDENTIFIER['value']}
+
+
+def flush_caches_response():
+    """Flush caches of all worker processes and get response of the flush"""
+    if flush_all_caches():
+        LOGGER.info('Caches flushed in all worker processes')
+        return {
+            'http_status': 200, 'code': 'OK',
+            'msg': 'Caches flushed in all worker processes', 'pid': os.getpid(),
+            'all_workers': True}
+
+    LOGGER.info('Caches flushed in worker process %s', os.getpid())
+    return {
+        'http_status': 200, 'code': 'OK',
+        'msg': 'Caches flushed only in worker process {}, other worker processes keep '
+               'cached values until they expire'.format(os.getpid()),
+        'pid': os.getpid(), 'all_workers': False}
+
+
+class SingleFlight:
+    """Coalescing of concurrent identical operations in current worker process
+
+    Operation started while identical operation (with the same key) is in
+    flight waits for it and gets its result instead of running again.
+    """
+
+    def __init__(self):
+        # Operations in flight as {'done': Event, 'result': result, 'failed': bool,
+        # 'waiting': number of waiting operations} by key
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, func):
+        """Run func unless identical operation is in flight
+
+        Returns two items:
+        * result of func or of identical operation in flight
+        * True if result is shared with identical operation.
+        If operation in flight fails then func is run.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {
+                    'done': threading.Event(), 'result': None, 'failed': True, 'waiting': 0}
+                self._calls[key] = call
+                leader = True
+            else:
+                call['waiting'] += 1
+                leader = False
+
+        if not leader:
+            call['done'].wait()
+            if not call['failed']:
+                return call['result'], True
+            return func(), False
+
+        try:
+            call['result'] = func()
+            call['failed'] = False
+            return call['result'], False
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+    def in_flight(self, key):
+        """Check if operation with the key is in flight"""
+        with self._lock:
+            return key in self._calls
+
+    def waiting(self, key):
+        """Get number of operations waiting for operation with the key"""
+        with self._lock:
+            call = self._calls.get(key)
+            return call['waiting'] if call is not None else 0
+
+
+# Registrations in flight in current worker process
+REGISTRATIONS = SingleFlight()
+
+
+class Metrics:
+    """Counters and latency histograms of current process
+
+    Metrics are identified by metric name and tuple of (label, value) pairs.
+    Histograms are stored as per bucket counts (last bucket is +Inf) and sum
+    of observed values.
+    """
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.flushed = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        """Increase counter"""
+        with self._lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name, value, labels=()):
+        """Add observed value to histogram"""
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = [[0] * (len(self.buckets) + 1), 0.0]
+                self.histograms[(name, labels)] = histogram
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+
+    def snapshot(self):
+        """Get JSON serializable copy of metrics"""
+        with self._lock:
+            return {
+                'counters': [
+                    [name, [list(label) for label in labels], value]
+                    for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, [list(label) for label in labels], list(counts), total]
+                    for (name, labels), (counts, total) in self.histograms.items()]}
+
+    def merge(self, snapshot):
+        """Add metrics from snapshot created by snapshot()"""
+        with self._lock:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, counts, total in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = [[0] * (len(self.buckets) + 1), 0.0]
+                    self.histograms[key] = histogram
+                for i, count in enumerate(counts):
+                    histogram[0][i] += count
+                histogram[1] += total
+
+    def clear(self):
+        """Remove all metrics"""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+# Metrics of current worker process
+METRICS = Metrics()
+
+
+class RequestLogFilter(logging.Filter):
+    """Add request context to log records and sample verbose request lines
+
+    Records get request_id and duration (seconds since request start, None
+    outside of requests). Verbose lines of incoming requests are logged for
+    log.sample_rate fraction of requests, decision is made once per request.
+    """
+
+    def filter(self, record):
+        request_id = None
+        duration = None
+        sampled = True
+        if has_request_context():
+            request_id = g.get('csapi_request_id')
+            if 'csapi_start' in g:
+                duration = round(time.monotonic() - g.csapi_start, 6)
+        if isinstance(record.msg, str) and record.msg.startswith(VERBOSE_LOG_PREFIXES):
+            rate = SETTINGS['log']['sample_rate']
+            if rate < 1:
+                if has_request_context():
+                    if 'csapi_log_sampled' not in g:
+                        g.csapi_log_sampled = random.random() < rate
+                    sampled = g.csapi_log_sampled
+                else:
+                    sampled = random.random() < rate
+        record.request_id = request_id
+        record.duration = duration
+        return sampled
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records when log.queue_size records are waiting
+
+    Records are never blocked on a full queue, dropped records are counted.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.addFilter(RequestLogFilter())
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= SETTINGS['log']['queue_size']:
+            self.dropped += 1
+            METRICS.inc('csapi_log_records_dropped_total')
+            return
+        self.queue.put_nowait(record)
+
+
+class LogListener(logging.handlers.QueueListener):
+    """Writer of queued log records, reports records dropped since last report"""
+
+    def __init__(self, queue_handler, *handlers):
+        super().__init__(queue_handler.queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.reported = 0
+
+    def handle(self, record):
+        dropped = self.queue_handler.dropped
+        if dropped != self.reported:
+            warning = logging.LogRecord(
+                record.name, logging.WARNING, __file__, 0,
+                'LOG_DROPPED: %s log records were dropped, log writing is too slow',
+                (dropped - self.reported,), None)
+            warning.request_id = None
+            warning.duration = None
+            self.reported = dropped
+            super().handle(warning)
+        super().handle(record)
+
+
+class LogFormatter(logging.Formatter):
+    """Formatter of text or JSON lines log (log.format setting)"""
+
+    def format(self, record):
+        if SETTINGS['log']['format'] != 'json':
+            return super().format(record)
+        line = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc).isoformat(),
+            'process': record.process, 'level': record.levelname, 'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'duration': getattr(record, 'duration', None)}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['exception'] = record.exc_text
+        return json.dumps(line, default=str)
+
+
+def start_log_queue(*handlers):
+    """Write log records of handlers in background thread
+
+    Returns queue handler that should be added to loggers instead of
+    handlers. Queued records are written when process exits.
+    """
+    queue_handler = BoundedQueueHandler(queue.Queue())
+    listener = LogListener(queue_handler, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
+
+
+def start_file_log(path, *names):
+    """Write log records of named loggers into file in background thread
+
+    Loggers are set to INFO level. Returns queue handler of the file.
+    """
+    handler = logging.FileHandler(path)
+    handler.setFormatter(LogFormatter('%(asctime)s - %(process)d - %(levelname)s: %(message)s'))
+    queue_handler = start_log_queue(handler)
+    for name in names:
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.INFO)
+        logger.addHandler(queue_handler)
+    return queue_handler
+
+
+def observe_query(func):
+    """Decorator recording duration and errors of database query helper"""
+    labels = (('query', func.__name__),)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        except psycopg2.Error:
+            METRICS.inc('csapi_db_errors_total', labels)
+            raise
+        finally:
+            METRICS.observe(
+                'csapi_db_query_duration_seconds', time.monotonic() - start, labels)
+
+    return wrapper
+
+
+@observe_query
+def get_member_class_id(cur, member_class):
+    """Get ID of member class from Central Server"""
+    execute_query(cur, 'member_class_id', {'str': member_class})
+    rec = cur.fetchone()
+    if rec:
+        return rec[0]
+    return None
+
+
+def get_cached_member_class_id(cur, member_class):
+    """Get ID of member class using in-process cache"""
+    check_cache_flush()
+    found, class_id = MEMBER_CLASS_CACHE.get(member_class)
+    if not found:
+        class_id = get_member_class_id(cur, member_class)
+        MEMBER_CLASS_CACHE.put(member_class, class_id)
+    return class_id
+
+
+@observe_query
+def subsystem_exists(cur, member_id, subsystem_code):
+    """Check if subsystem exists in Central Server"""
+    execute_query(
+        cur, 'subsystem_exists', {'member_id': member_id, 'subsystem_code': subsystem_code})
+    return cur.fetchone()[0]
+
+
+@observe_query
+def get_member_data(cur, class_id, member_code):
+    """Get member data from Central Server"""
+    execute_query(cur, 'member_data', {'class_id': class_id, 'member_code': member_code})
+    rec = cur.fetchone()
+    if rec:
+        return {'id': rec[0], 'name': rec[1]}
+    return None
+
+
+def registration_lock_key(*key):
+    """Get advisory lock key (signed 64-bit integer) of member or subsystem registration"""
+    digest = hashlib.blake2b(json.dumps(key).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+@observe_query
+def lock_registration(cur, *key):
+    """Wait until concurrent registration of the same member or subsystem is finished
+
+    Lock is held until the end of transaction. Following statements see
+    member or subsystem committed by concurrent registration.
+    """
+    execute_query(cur, 'registration_lock', {'lock': registration_lock_key(*key)})
+
+
+@observe_query
+def get_instance_identifier(cur):
+    """Get X-Road instance identifier from Central Server"""
+    execute_query(cur, 'instance_identifier')
+    rec = cur.fetchone()
+    if rec:
+        return rec[0]
+    return None
+
+
+def cached_instance_identifier():
+    """Get X-Road instance identifier cached by current worker process
+
+    Returns None when instance identifier is not cached (or cache was flushed).
+    """
+    check_cache_flush()
+    return _INSTANCE_IDENTIFIER['value']
+
+
+def cache_instance_identifier(instance_identifier):
+    """Cache X-Road instance identifier in current worker process"""
+    _INSTANCE_IDENTIFIER['value'] = instance_identifier
+
+
+def get_cached_instance_identifier(cur):
+    """Get X-Road instance identifier cached by current worker process"""
+    instance_identifier = cached_instance_identifier()
+    if instance_identifier is None:
+        instance_identifier = get_instance_identifier(cur)
+        cache_instance_identifier(instance_identifier)
+    return instance_identifier
+
+
+def load_instance_identifier():
+    """Load X-Road instance identifier into cache of current worker process
+
+    Returns loaded instance identifier or None if it cannot be loaded.
+    """
+    conf = get_db_conf()
+    if db_conf_error(conf) is not None:
+        return None
+
+    try:
+        with db_connection(conf) as conn:
+            with conn.cursor() as cur:
+                cache_instance_identifier(get_instance_identifier(cur))
+    except psycopg2.Error as err:
+        LOGGER.error('DB_ERROR: Cannot load instance identifier: %s', err)
+        return None
+
+    LOGGER.info('Instance identifier loaded: %s', _INSTANCE_IDENTIFIER['value'])
+    return _INSTANCE_IDENTIFIER['value']
+
+
+def index_columns(indexdef):
+    """Get column names of index from index definition of pg_indexes
+
+    Returns None for indexes that cannot serve equality lookups of plain
+    columns (partial and non-btree indexes). Expressions are returned as is.
+    """
+    match = INDEX_DEF_RE.search(indexdef)
+    if match is None or match.group(1) != 'btree' or ' WHERE ' in match.group(3):
+        return None
+    return [column.split()[0].strip('"') for column in match.group(2).split(', ')]
+
+
+def index_definition(name, table, columns):
+    """Get statement creating index without blocking writes to table"""
+    return 'create index concurrently if not exists {} on {} ({})'.format(
+        name, table, ', '.join(columns))
+
+
+@observe_query
+def get_missing_indexes(cur):
+    """Get indexes of lookups that have no equivalent index in Central Server database
+
+    Returns two items:
+    * list of missing indexes (items of INDEXES)
+    * set of names of invalid indexes (left by failed concurrent index creation).
+    """
+    cur.execute(QUERIES['table_indexes'], {'tables': sorted({index[1] for index in INDEXES})})
+    existing = {}
+    invalid = set()
+    for table, name, indexdef, valid in cur.fetchall():
+        if not valid:
+            invalid.add(name)
+            continue
+        columns = index_columns(indexdef)
+        if columns:
+            existing.setdefault(table, []).append(columns)
+
+    missing = []
+    for index in INDEXES:
+        _, table, columns, _ = index
+        if not any(
+                set(found[:len(columns)]) == set(columns) for found in existing.get(table, [])):
+            missing.append(index)
+    return missing, invalid
+
+
+def create_indexes(conn, indexes, invalid):
+    """Create indexes concurrently
+
+    Invalid indexes with the same name are dropped first. Only one process
+    creates indexes at a time, returns False if another process holds the
+    lock.
+    """
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('select pg_try_advisory_lock(%(key)s)', {'key': INDEX_LOCK_KEY})
+        if not cur.fetchone()[0]:
+            LOGGER.info('Missing indexes are being created by another process')
+            return False
+        try:
+            for name, table, columns, _ in indexes:
+                if name in invalid:
+                    cur.execute('drop index concurrently if exists {}'.format(name))
+                LOGGER.info('Creating index: %s', index_definition(name, table, columns))
+                start = time.monotonic()
+                cur.execute(index_definition(name, table, columns))
+                LOGGER.info('Index %s created in %.1f s', name, time.monotonic() - start)
+        finally:
+            cur.execute('select pg_advisory_unlock(%(key)s)', {'key': INDEX_LOCK_KEY})
+    return True
+
+
+def verify_indexes(create=False):
+    """Check indexes used by lookups and optionally create missing ones
+
+    Missing indexes are logged together with statements creating them.
+    Dedicated connection is used, so that long index creation does not hold
+    pooled connection. Returns list of indexes that are (still) missing or
+    None if indexes cannot be checked.
+    """
+    conf = get_db_conf()
+    if db_conf_error(conf) is not None:
+        return None
+
+    try:
+        conn = get_db_connection(conf)
+    except psycopg2.Error as err:
+        LOGGER.error('DB_ERROR: Cannot verify indexes: %s', err)
+        return None
+    try:
+        with conn.cursor() as cur:
+            missing, invalid = get_missing_indexes(cur)
+        conn.rollback()
+        for name, table, columns, helpers in missing:
+            LOGGER.warning(
+                'MISSING_INDEX: Lookups of %s have no index on %s (%s), recommended index: %s',
+                ', '.join(helpers), table, ', '.join(columns),
+                index_definition(name, table, columns))
+        if create and missing and create_indexes(conn, missing, invalid):
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                missing, _ = get_missing_indexes(cur)
+            conn.rollback()
+    except psycopg2.Error as err:
+        LOGGER.error('DB_ERROR: Cannot verify indexes: %s', err)
+        return None
+    finally:
+        conn.close()
+
+    if not missing:
+        LOGGER.info('Indexes of lookups verified')
+    return missing
+
+
+def start_index_verification():
+    """Verify indexes in background thread if enabled in settings
+
+    Worker start is not delayed by index checks and creation.
+    """
+    if not SETTINGS['verify_indexes']:
+        return None
+    thread = threading.Thread(
+        target=verify_indexes, kwargs={'create': SETTINGS['create_missing_indexes']},
+        name='csapi-verify-indexes', daemon=True)
+    thread.start()
+    return thread
+
+
+@observe_query
+def get_utc_time(cur):
+    """Get current time in UTC timezone from Central Server database"""
+    execute_query(cur, 'utc_time')
+    return cur.fetchone()[0]
+
+
+@observe_query
+def add_member_identifier(cur, **kwargs):
+    """Add new X-Road member identifier to Central Server
+
+    Required keyword arguments:
+    instance_identifier, member_class, member_code, utc_time
+    """
+    execute_query(
+        cur, 'add_member_identifier', {
+            'instance': kwargs['instance_identifier'], 'class': kwargs['member_class'],
+            'code': kwargs['member_code'], 'time': kwargs['utc_time']}
+    )
+    return cur.fetchone()[0]
+
+
+@observe_query
+def add_subsystem_identifier(cur, **kwargs):
+    """Add new X-Road subsystem identifier to Central Server
+
+    Required keyword arguments:
+    instance_identifier, member_class, member_code, subsystem_code, utc_time
+    """
+    execute_query(
+        cur, 'add_subsystem_identifier', {
+            'instance': kwargs['instance_identifier'], 'class': kwargs['member_class'],
+            'member_code': kwargs['member_code'], 'subsystem_code': kwargs['subsystem_code'],
+            'time': kwargs['utc_time']}
+    )
+    return cur.fetchone()[0]
+
+
+@observe_query
+def add_member_client(cur, **kwargs):
+    """Add new X-Road member client to Central Server
+
+    Required keyword arguments:
+    member_code, member_name, class_id, identifier_id, utc_time
+    """
+    execute_query(
+        cur, 'add_member_client', {
+            'code': kwargs['member_code'], 'name': kwargs['member_name'],
+            'class_id': kwargs['class_id'], 'identifier_id': kwargs['identifier_id'],
+            'time': kwargs['utc_time']
+        }
+    )
+
+
+@observe_query
+def add_subsystem_client(cur, **kwargs):
+    """Add new X-Road subsystem as a client to Central Server
+
+    Required keyword arguments:
+    subsystem_code, member_id, identifier_id, utc_time
+    """
+    execute_query(
+        cur, 'add_subsystem_client', {
+            'subsystem_code': kwargs['subsystem_code'], 'member_id': kwargs['member_id'],
+            'identifier_id': kwargs['identifier_id'], 'time': kwargs['utc_time']
+        }
+    )
+
+
+@observe_query
+def add_client_name(cur, **kwargs):
+    """Add new X-Road client name to Central Server
+
+    Required keyword arguments:
+    member_name, identifier_id, utc_time
+    """
+    execute_query(
+        cur, 'add_client_name', {
             'name': kwargs['member_name'], 'identifier_id': kwargs['identifier_id'],
             'time': kwargs['utc_time']}
     )
 
 
-def add_member(member_class, member_code, member_name, json_data):
-    """Add new X-Road member to Central Server"""
-    conf = get_db_conf()
-    if not conf['username'] or not conf['password'] or not conf['database']:
-        LOGGER.error('DB_CONF_ERROR: Cannot access database configuration')
-        return {
-            'http_status': 500, 'code': 'DB_CONF_ERROR',
-            'msg': 'Cannot access database configuration'}
+@observe_query
+def get_member_class_ids(cur, member_classes):
+    """Get IDs of multiple member classes from Central Server using in-process cache
+
+    Returns dict of member class IDs by member class code. Member classes
+    that do not exist are mapped to None.
+    """
+    check_cache_flush()
+    class_ids = {}
+    missing = []
+    for member_class in set(member_classes):
+        found, class_id = MEMBER_CLASS_CACHE.get(member_class)
+        if found:
+            class_ids[member_class] = class_id
+        else:
+            missing.append(member_class)
+
+    if missing:
+        cur.execute(QUERIES['member_class_ids'], {'codes': missing})
+        found_ids = dict(cur.fetchall())
+        for member_class in missing:
+            class_ids[member_class] = found_ids.get(member_class)
+            MEMBER_CLASS_CACHE.put(member_class, class_ids[member_class])
+
+    return class_ids
+
+
+@observe_query
+def get_members_data(cur, members):
+    """Get data of multiple members from Central Server
+
+    members is an iterable of (class_id, member_code) tuples. Returns dict of
+    member data by (class_id, member_code), members that do not exist are
+    not included.
+    """
+    members = list(set(members))
+    if not members:
+        return {}
+
+    cur.execute(
+        QUERIES['members_data'], {
+            'class_ids': [member[0] for member in members],
+            'member_codes': [member[1] for member in members]})
+    return {(rec[0], rec[1]): {'id': rec[2], 'name': rec[3]} for rec in cur.fetchall()}
+
+
+@observe_query
+def add_member_identifiers(cur, **kwargs):
+    """Add multiple X-Road member identifiers to Central Server
+
+    Required keyword arguments:
+    instance_identifier, members (list of (member_class, member_code) tuples), utc_time
+
+    Returns dict of identifier IDs by (member_class, member_code).
+    """
+    statement, template = BATCH_QUERIES['add_member_identifiers']
+    rows = psycopg2.extras.execute_values(
+        cur, statement, [
+            {
+                'instance': kwargs['instance_identifier'], 'class': member[0],
+                'code': member[1], 'time': kwargs['utc_time']}
+            for member in kwargs['members']],
+        template=template, page_size=BATCH_PAGE_SIZE, fetch=True)
+    return {(row[1], row[2]): row[0] for row in rows}
+
+
+@observe_query
+def add_member_clients(cur, **kwargs):
+    """Add multiple X-Road member clients to Central Server
+
+    Required keyword arguments:
+    members (list of (member_code, member_name, class_id, identifier_id) tuples), utc_time
+    """
+    statement, template = BATCH_QUERIES['add_member_clients']
+    psycopg2.extras.execute_values(
+        cur, statement, [
+            {
+                'code': member[0], 'name': member[1], 'class_id': member[2],
+                'identifier_id': member[3], 'time': kwargs['utc_time']}
+            for member in kwargs['members']],
+        template=template, page_size=BATCH_PAGE_SIZE)
+
+
+@observe_query
+def add_client_names(cur, **kwargs):
+    """Add multiple X-Road client names to Central Server
+
+    Required keyword arguments:
+    names (list of (member_name, identifier_id) tuples), utc_time
+    """
+    statement, template = BATCH_QUERIES['add_client_names']
+    psycopg2.extras.execute_values(
+        cur, statement, [
+            {'name': name[0], 'identifier_id': name[1], 'time': kwargs['utc_time']}
+            for name in kwargs['names']],
+        template=template, page_size=BATCH_PAGE_SIZE)
+
+
+@observe_query
+def get_existing_subsystems(cur, subsystems):
+    """Check which of multiple subsystems exist in Central Server
+
+    subsystems is an iterable of (member_id, subsystem_code) tuples. Returns
+    set of (member_id, subsystem_code) tuples of existing subsystems.
+    """
+    subsystems = list(set(subsystems))
+    if not subsystems:
+        return set()
+
+    cur.execute(
+        QUERIES['existing_subsystems'], {
+            'member_ids': [subsystem[0] for subsystem in subsystems],
+            'subsystem_codes': [subsystem[1] for subsystem in subsystems]})
+    return {(rec[0], rec[1]) for rec in cur.fetchall()}
+
+
+@observe_query
+def add_subsystem_identifiers(cur, **kwargs):
+    """Add multiple X-Road subsystem identifiers to Central Server
+
+    Required keyword arguments:
+    instance_identifier, subsystems (list of (member_class, member_code,
+    subsystem_code) tuples), utc_time
+
+    Returns dict of identifier IDs by (member_class, member_code, subsystem_code).
+    """
+    statement, template = BATCH_QUERIES['add_subsystem_identifiers']
+    rows = psycopg2.extras.execute_values(
+        cur, statement, [
+            {
+                'instance': kwargs['instance_identifier'], 'class': subsystem[0],
+                'member_code': subsystem[1], 'subsystem_code': subsystem[2],
+                'time': kwargs['utc_time']}
+            for subsystem in kwargs['subsystems']],
+        template=template, page_size=BATCH_PAGE_SIZE, fetch=True)
+    return {(row[1], row[2], row[3]): row[0] for row in rows}
+
+
+@observe_query
+def add_subsystem_clients(cur, **kwargs):
+    """Add multiple X-Road subsystems as clients to Central Server
+
+    Required keyword arguments:
+    subsystems (list of (subsystem_code, member_id, identifier_id) tuples), utc_time
+    """
+    statement, template = BATCH_QUERIES['add_subsystem_clients']
+    psycopg2.extras.execute_values(
+        cur, statement, [
+            {
+                'subsystem_code': subsystem[0], 'member_id': subsystem[1],
+                'identifier_id': subsystem[2], 'time': kwargs['utc_time']}
+            for subsystem in kwargs['subsystems']],
+        template=template, page_size=BATCH_PAGE_SIZE)
+
+
+@observe_query
+def list_members(cur, limit, after=None, class_id=None):
+    """List members of Central Server ordered by member class ID and member code
+
+    after is (class_id, member_code) of the last member of previous page.
+    Returns list of (class_id, member_class, member_code, member_name) tuples.
+    """
+    cur.execute(QUERIES['list_members'], {
+        'class_id': class_id, 'after_class_id': after[0] if after else None,
+        'after_code': after[1] if after else None, 'limit': limit})
+    return cur.fetchall()
+
+
+@observe_query
+def list_subsystems(cur, member_id, limit, after=None):
+    """List subsystem codes of member ordered by subsystem code
+
+    after is the last subsystem code of previous page.
+    """
+    cur.execute(QUERIES['list_subsystems'], {
+        'member_id': member_id, 'after': after, 'limit': limit})
+    return [rec[0] for rec in cur.fetchall()]
+
+
+def register_member(conn, member_class, member_code, member_name):
+    """Register new X-Road member using separate statements for each step
+
+    Returns result code (key of CREATE_RESULTS).
+    """
+    with conn.cursor() as cur:
+        class_id = get_cached_member_class_id(cur, member_class)
+        if class_id is None:
+            return 'INVALID_MEMBER_CLASS'
+
+        if SETTINGS['coalesce_registrations']:
+            lock_registration(cur, 'member', member_class, member_code)
+
+        if get_member_data(cur, class_id, member_code) is not None:
+            return 'MEMBER_EXISTS'
+
+        # Timestamps must be in UTC timezone
+        utc_time = get_utc_time(cur)
+
+        identifier_id = add_member_identifier(
+            cur, instance_identifier=get_cached_instance_identifier(cur),
+            member_class=member_class, member_code=member_code, utc_time=utc_time)
+
+        add_member_client(
+            cur, member_code=member_code, member_name=member_name, class_id=class_id,
+            identifier_id=identifier_id, utc_time=utc_time)
+
+        add_client_name(
+            cur, member_name=member_name, identifier_id=identifier_id, utc_time=utc_time)
+
+    conn.commit()
+    return 'CREATED'
+
+
+def register_subsystem(conn, member_class, member_code, subsystem_code):
+    """Register new X-Road subsystem using separate statements for each step
+
+    Returns result code (key of CREATE_RESULTS).
+    """
+    with conn.cursor() as cur:
+        class_id = get_cached_member_class_id(cur, member_class)
+        if class_id is None:
+            return 'INVALID_MEMBER_CLASS'
+
+        member_data = get_member_data(cur, class_id, member_code)
+        if member_data is None:
+            return 'INVALID_MEMBER'
+
+        if SETTINGS['coalesce_registrations']:
+            lock_registration(cur, 'subsystem', member_class, member_code, subsystem_code)
+
+        if subsystem_exists(cur, member_data['id'], subsystem_code):
+            return 'SUBSYSTEM_EXISTS'
+
+        # Timestamps must be in UTC timezone
+        utc_time = get_utc_time(cur)
+
+        identifier_id = add_subsystem_identifier(
+            cur, instance_identifier=get_cached_instance_identifier(cur),
+            member_class=member_class, member_code=member_code,
+            subsystem_code=subsystem_code, utc_time=utc_time)
+
+        add_subsystem_client(
+            cur, subsystem_code=subsystem_code, member_id=member_data['id'],
+            identifier_id=identifier_id, utc_time=utc_time)
+
+        add_client_name(
+            cur, member_name=member_data['name'], identifier_id=identifier_id,
+            utc_time=utc_time)
+
+    conn.commit()
+    return 'CREATED'
+
+
+def member_cte_code(class_exists, member_exists):
+    """Get result code (key of CREATE_RESULTS) of register_member statement"""
+    if not class_exists:
+        return 'INVALID_MEMBER_CLASS'
+    if member_exists:
+        return 'MEMBER_EXISTS'
+    return 'CREATED'
+
+
+def subsystem_cte_code(class_exists, member_exists, subsystem_found):
+    """Get result code (key of CREATE_RESULTS) of register_subsystem statement"""
+    if not class_exists:
+        return 'INVALID_MEMBER_CLASS'
+    if not member_exists:
+        return 'INVALID_MEMBER'
+    if subsystem_found:
+        return 'SUBSYSTEM_EXISTS'
+    return 'CREATED'
+
+
+@observe_query
+def register_member_cte(conn, member_class, member_code, member_name):
+    """Register new X-Road member with single data-modifying statement
+
+    Statement is executed in autocommit mode, so the whole registration takes
+    one round trip to the database. Returns result code (key of CREATE_RESULTS).
+    """
+    names = ('register_member',)
+    params = {'class': member_class, 'code': member_code, 'name': member_name}
+    if SETTINGS['coalesce_registrations']:
+        # Both statements are sent at once and run in one implicit transaction,
+        # registration statement sees member committed while waiting for the lock
+        names = ('registration_lock',) + names
+        params['lock'] = registration_lock_key('member', member_class, member_code)
+    # Autocommit is enabled before the first statement, loading instance identifier
+    # must not open a transaction
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            # Instance identifier is normally already cached
+            params['instance'] = get_cached_instance_identifier(cur)
+            execute_query(cur, names, params)
+            class_exists, member_exists = cur.fetchone()
+    finally:
+        conn.autocommit = False
+
+    return member_cte_code(class_exists, member_exists)
+
+
+@observe_query
+def register_subsystem_cte(conn, member_class, member_code, subsystem_code):
+    """Register new X-Road subsystem with single data-modifying statement
+
+    Statement is executed in autocommit mode, so the whole registration takes
+    one round trip to the database. Returns result code (key of CREATE_RESULTS).
+    """
+    names = ('register_subsystem',)
+    params = {
+        'class': member_class, 'member_code': member_code, 'subsystem_code': subsystem_code}
+    if SETTINGS['coalesce_registrations']:
+        # Both statements are sent at once and run in one implicit transaction,
+        # registration statement sees subsystem committed while waiting for the lock
+        names = ('registration_lock',) + names
+        params['lock'] = registration_lock_key(
+            'subsystem', member_class, member_code, subsystem_code)
+    # Autocommit is enabled before the first statement, loading instance identifier
+    # must not open a transaction
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            # Instance identifier is normally already cached
+            params['instance'] = get_cached_instance_identifier(cur)
+            execute_query(cur, names, params)
+            class_exists, member_exists, subsystem_found = cur.fetchone()
+    finally:
+        conn.autocommit = False
+
+    return subsystem_cte_code(class_exists, member_exists, subsystem_found)
+
+
+def register_members(conn, items, commit=True):
+    """Register multiple X-Road members in single transaction
+
+    items is a list of dicts with member_class, member_code and member_name.
+    Returns list of result codes (CREATED or key of CREATE_RESULTS) in the
+    same order as items. Transaction is left open for the caller when commit
+    is False.
+    """
+    codes = []
+    with conn.cursor() as cur:
+        class_ids = get_member_class_ids(cur, [item['member_class'] for item in items])
+        existing = get_members_data(cur, [
+            (class_ids[item['member_class']], item['member_code']) for item in items
+            if class_ids[item['member_class']] is not None])
+
+        new_items = []
+        for item in items:
+            class_id = class_ids[item['member_class']]
+            if class_id is None:
+                codes.append('INVALID_MEMBER_CLASS')
+            elif (class_id, item['member_code']) in existing:
+                codes.append('MEMBER_EXISTS')
+            else:
+                # Repeated items of the same batch are reported as existing members
+                existing[(class_id, item['member_code'])] = None
+                new_items.append(item)
+                codes.append('CREATED')
+
+        if new_items:
+            # Timestamps must be in UTC timezone
+            utc_time = get_utc_time(cur)
+
+            identifier_ids = add_member_identifiers(
+                cur, instance_identifier=get_cached_instance_identifier(cur),
+                members=[(item['member_class'], item['member_code']) for item in new_items],
+                utc_time=utc_time)
+
+            add_member_clients(
+                cur, members=[(
+                    item['member_code'], item['member_name'], class_ids[item['member_class']],
+                    identifier_ids[(item['member_class'], item['member_code'])])
+                              for item in new_items],
+                utc_time=utc_time)
+
+            add_client_names(
+                cur, names=[(
+                    item['member_name'],
+                    identifier_ids[(item['member_class'], item['member_code'])])
+                            for item in new_items],
+                utc_time=utc_time)
+
+    if commit:
+        conn.commit()
+    return codes
+
+
+def get_batch_members(cur, items):
+    """Resolve member classes and members of batch request items
+
+    Returns two items:
+    * dict of member class IDs by member class code (None if class does not exist)
+    * dict of member data by (class_id, member_code) of existing members.
+    """
+    class_ids = get_member_class_ids(cur, [item['member_class'] for item in items])
+    members = get_members_data(cur, [
+        (class_ids[item['member_class']], item['member_code']) for item in items
+        if class_ids[item['member_class']] is not None])
+    return class_ids, members
+
+
+def register_subsystems(conn, items, class_ids, members, commit=True):
+    """Register multiple X-Road subsystems in single transaction
+
+    items is a list of dicts with member_class, member_code and
+    subsystem_code. class_ids and members are returned by get_batch_members.
+    Returns list of result codes (CREATED or key of CREATE_RESULTS) in the
+    same order as items. Transaction is left open for the caller when commit
+    is False.
+    """
+    codes = []
+    with conn.cursor() as cur:
+        item_members = []
+        for item in items:
+            class_id = class_ids[item['member_class']]
+            item_members.append(
+                members.get((class_id, item['member_code'])) if class_id is not None else None)
+        existing = get_existing_subsystems(cur, [
+            (member['id'], item['subsystem_code'])
+            for item, member in zip(items, item_members) if member is not None])
+
+        new_items = []
+        for item, member in zip(items, item_members):
+            if class_ids[item['member_class']] is None:
+                codes.append('INVALID_MEMBER_CLASS')
+            elif member is None:
+                codes.append('INVALID_MEMBER')
+            elif (member['id'], item['subsystem_code']) in existing:
+                codes.append('SUBSYSTEM_EXISTS')
+            else:
+                # Repeated items of the same batch are reported as existing subsystems
+                existing.add((member['id'], item['subsystem_code']))
+                new_items.append((item, member))
+                codes.append('CREATED')
+
+        if new_items:
+            # Timestamps must be in UTC timezone
+            utc_time = get_utc_time(cur)
+
+            identifier_ids = add_subsystem_identifiers(
+                cur, instance_identifier=get_cached_instance_identifier(cur),
+                subsystems=[
+                    (item['member_class'], item['member_code'], item['subsystem_code'])
+                    for item, _ in new_items],
+                utc_time=utc_time)
+            identifier_ids = [
+                identifier_ids[(item['member_class'], item['member_code'], item['subsystem_code'])]
+                for item, _ in new_items]
+
+            add_subsystem_clients(
+                cur, subsystems=[
+                    (item['subsystem_code'], member['id'], identifier_id)
+                    for (item, member), identifier_id in zip(new_items, identifier_ids)],
+                utc_time=utc_time)
+
+            add_client_names(
+                cur, names=[
+                    (member['name'], identifier_id)
+                    for (_, member), identifier_id in zip(new_items, identifier_ids)],
+                utc_time=utc_time)
+
+    if commit:
+        conn.commit()
+    return codes
+
+
+def retry_reason(err):
+    """Get reason for running failed transaction again, None if error is not transient"""
+    for reason, error_class in RETRY_ERRORS:
+        if isinstance(err, error_class):
+            return reason
+    if is_stale_prepared_error(err):
+        return 'stale_prepared_statement'
+    return None
+
+
+def retry_delay(name, reason, attempt, start, err):
+    """Get delay before running failed transaction again
+
+    Delay is jittered exponential backoff according to transaction_retry
+    settings, start is monotonic time of the first attempt. Returns None
+    when attempts or time budget are exhausted. Retries are logged and
+    counted in metrics.
+    """
+    settings = SETTINGS['transaction_retry']
+    labels = (('transaction', name), ('reason', reason))
+    delay = random.uniform(0, min(
+        settings['max_delay'], settings['base_delay'] * 2 ** (attempt - 1)))
+    if attempt >= settings['attempts'] or (
+            time.monotonic() - start + delay > settings['budget']):
+        METRICS.inc('csapi_db_transaction_retries_exhausted_total', labels)
+        return None
+    METRICS.inc('csapi_db_transaction_retries_total', labels)
+    LOGGER.warning(
+        'Retrying %s transaction in %.3f s after %s (attempt %s): %s',
+        name, delay, reason, attempt, str(err).strip())
+    return delay
+
+
+def run_transaction(name, func):
+    """Run function executing database transaction, retrying transient failures
+
+    func must check out its own connection, so each attempt runs in a new
+    transaction. Transactions failing with error of RETRY_ERRORS (or stale
+    prepared statement) are run again with jittered exponential backoff
+    according to transaction_retry settings. Error of the last attempt is
+    raised. Returns result of func.
+    """
+    start = time.monotonic()
+    attempt = 1
+    while True:
+        try:
+            return func()
+        except psycopg2.Error as err:
+            reason = retry_reason(err)
+            if reason is None:
+                raise
+            delay = retry_delay(name, reason, attempt, start, err)
+            if delay is None:
+                raise
+        time.sleep(delay)
+        attempt += 1
+
+
+def run_registration(key, register, exists_code):
+    """Run registration, concurrent identical registrations are coalesced
+
+    key is (type, member_class, member_code[, subsystem_code]) and register
+    is a function returning result code. Registration is retried on transient
+    database errors (see run_transaction). Registration that shared result of
+    concurrent successful registration or failed with unique violation on the
+    last attempt (identical registration was committed concurrently) gets
+    exists_code. Returns result code.
+    """
+    def register_with_retry():
+        try:
+            return run_transaction(key[0], register)
+        except psycopg2.errors.UniqueViolation as err:
+            LOGGER.warning('Concurrent %s registration detected: %s', key[0], str(err).strip())
+            return exists_code
+
+    if not SETTINGS['coalesce_registrations']:
+        return register_with_retry()
+    code, shared = REGISTRATIONS.run(key, register_with_retry)
+    return coalesced_code(key, code, shared, exists_code)
+
+
+def coalesced_code(key, code, shared, exists_code):
+    """Get result code of registration that may share result of concurrent registration
+
+    Registration that shared successful result of identical registration did
+    not create anything itself and gets exists_code.
+    """
+    if not shared:
+        return code
+    METRICS.inc('csapi_coalesced_registrations_total', (('type', key[0]),))
+    if code == 'CREATED':
+        return exists_code
+    return code
+
+
+def registration_error(code, json_data):
+    """Get error response of registration with result code other than CREATED"""
+    LOGGER.warning('%s: %s (Request: %s)', code, CREATE_RESULTS[code]['msg'], json_data)
+    return dict(CREATE_RESULTS[code])
+
+
+def member_response(code, member_class, member_code, member_name, json_data):
+    """Get response of member registration with result code"""
+    if code != 'CREATED':
+        return registration_error(code, json_data)
+
+    LOGGER.info(
+        'Added new Member: member_code=%s, member_name=%s, member_class=%s',
+        member_code, member_name, member_class)
+
+    return {'http_status': 201, 'code': 'CREATED', 'msg': 'New Member added'}
+
+
+def subsystem_response(code, member_class, member_code, subsystem_code, json_data):
+    """Get response of subsystem registration with result code"""
+    if code != 'CREATED':
+        return registration_error(code, json_data)
+
+    LOGGER.info(
+        'Added new Subsystem: member_class=%s, member_code=%s, subsystem_code=%s',
+        member_class, member_code, subsystem_code)
+
+    return {'http_status': 201, 'code': 'CREATED', 'msg': 'New Subsystem added'}
+
+
+def add_member(member_class, member_code, member_name, json_data):
+    """Add new X-Road member to Central Server"""
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is not None:
+        return fault_response
+
+    register = register_member_cte if SETTINGS['single_round_trip'] else register_member
+
+    def register_once():
+        with db_connection(conf) as conn:
+            return register(conn, member_class, member_code, member_name)
+
+    code = run_registration(
+        ('member', member_class, member_code), register_once, 'MEMBER_EXISTS')
+
+    return member_response(code, member_class, member_code, member_name, json_data)
+
+
+def add_subsystem(member_class, member_code, subsystem_code, json_data):
+    """Add new X-Road subsystem to Central Server"""
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is not None:
+        return fault_response
+
+    register = register_subsystem_cte if SETTINGS['single_round_trip'] else register_subsystem
+
+    def register_once():
+        with db_connection(conf) as conn:
+            return register(conn, member_class, member_code, subsystem_code)
+
+    code = run_registration(
+        ('subsystem', member_class, member_code, subsystem_code), register_once,
+        'SUBSYSTEM_EXISTS')
+
+    return subsystem_response(code, member_class, member_code, subsystem_code, json_data)
+
+
+def get_member(member_class, member_code):
+    """Get X-Road member from Central Server"""
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is not None:
+        return fault_response
+
+    with db_connection(conf) as conn:
+        with conn.cursor() as cur:
+            class_id = get_cached_member_class_id(cur, member_class)
+            member_data = None
+            if class_id is not None:
+                member_data = get_member_data(cur, class_id, member_code)
+
+    if member_data is None:
+        LOGGER.warning(
+            'MEMBER_NOT_FOUND: Provided Member does not exist: member_class=%s, '
+            'member_code=%s', member_class, member_code)
+        return {
+            'http_status': 404, 'code': 'MEMBER_NOT_FOUND',
+            'msg': 'Provided Member does not exist'}
+
+    return {
+        'http_status': 200, 'code': 'OK', 'msg': 'Member found',
+        'member': {
+            'member_class': member_class, 'member_code': member_code,
+            'member_name': member_data['name']}}
+
+
+def get_members(member_class, limit, after):
+    """Get page of X-Road members from Central Server
+
+    member_class is optional member class filter, after is decoded cursor
+    of previous page.
+    """
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is not None:
+        return fault_response
+
+    with db_connection(conf) as conn:
+        with conn.cursor() as cur:
+            class_id = None
+            if member_class is not None:
+                class_id = get_cached_member_class_id(cur, member_class)
+                if class_id is None:
+                    LOGGER.warning(
+                        'INVALID_MEMBER_CLASS: Provided Member Class does not exist: %s',
+                        member_class)
+                    return dict(CREATE_RESULTS['INVALID_MEMBER_CLASS'])
+            # One extra row tells if there is a next page
+            rows = list_members(cur, limit + 1, after=after, class_id=class_id)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][0], rows[-1][2]])
+
+    return {
+        'http_status': 200, 'code': 'OK', 'msg': 'Members listed',
+        'members': [
+            {'member_class': row[1], 'member_code': row[2], 'member_name': row[3]}
+            for row in rows],
+        'next': next_cursor}
+
+
+def get_member_subsystems(member_class, member_code, limit, after):
+    """Get page of subsystems of X-Road member from Central Server
+
+    after is decoded cursor of previous page.
+    """
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is not None:
+        return fault_response
+
+    with db_connection(conf) as conn:
+        with conn.cursor() as cur:
+            class_id = get_cached_member_class_id(cur, member_class)
+            member_data = None
+            if class_id is not None:
+                member_data = get_member_data(cur, class_id, member_code)
+            if member_data is None:
+                LOGGER.warning(
+                    'MEMBER_NOT_FOUND: Provided Member does not exist: member_class=%s, '
+                    'member_code=%s', member_class, member_code)
+                return {
+                    'http_status': 404, 'code': 'MEMBER_NOT_FOUND',
+                    'msg': 'Provided Member does not exist'}
+            # One extra row tells if there is a next page
+            subsystem_codes = list_subsystems(
+                cur, member_data['id'], limit + 1, after=after[0] if after else None)
+
+    next_cursor = None
+    if len(subsystem_codes) > limit:
+        subsystem_codes = subsystem_codes[:limit]
+        next_cursor = encode_cursor([subsystem_codes[-1]])
+
+    return {
+        'http_status': 200, 'code': 'OK', 'msg': 'Subsystems listed',
+        'subsystems': [{'subsystem_code': code} for code in subsystem_codes],
+        'next': next_cursor}
+
+
+def export_clients(conf):
+    """Export all X-Road members and subsystems of Central Server
+
+    Generator of NDJSON lines with one line per member or subsystem followed
+    by a summary line. Rows are read through a server-side cursor in batches
+    of export_fetch_size rows, so memory use does not depend on registry size.
+    """
+    count = 0
+    try:
+        with db_connection(conf) as conn:
+            with conn.cursor(name='csapi_export') as cur:
+                cur.execute(QUERIES['export_clients'])
+                while True:
+                    rows = cur.fetchmany(SETTINGS['export_fetch_size'])
+                    if not rows:
+                        break
+                    count += len(rows)
+                    # Single write per fetched batch
+                    yield b''.join(dumps_json({
+                        'member_class': row[0], 'member_code': row[1],
+                        'subsystem_code': row[2], 'name': row[3],
+                        'created_at': row[4].isoformat() if row[4] else None}) + b'\n'
+                        for row in rows)
+    except psycopg2.Error as err:
+        # Already exported lines were sent to the client
+        LOGGER.error('DB_ERROR: Unclassified database error: %s', err)
+        yield dumps_json({'code': 'DB_ERROR', 'msg': 'Unclassified database error'}) + b'\n'
+        return
+
+    summary = {'code': 'OK', 'msg': 'Export completed', 'count': count}
+    LOGGER.info('Response: %s', summary)
+    yield dumps_json(summary) + b'\n'
+
+
+def batch_result(item, code, msg):
+    """Create result of single batch request item"""
+    result = {key: item[key] for key in BATCH_KEYS if isinstance(item, dict) and key in item}
+    result['code'] = code
+    result['msg'] = msg
+    return result
+
+
+def batch_response(results):
+    """Create response of processed batch request"""
+    created = sum(1 for result in results if result['code'] == 'CREATED')
+    return {
+        'http_status': 200, 'code': 'OK', 'msg': 'Batch processed',
+        'created': created, 'failed': len(results) - created, 'results': results}
+
+
+def add_members(items, results):
+    """Add multiple new X-Road members to Central Server
+
+    items is a list of valid batch request items and results is a list of
+    results of all batch request items where valid items have None value.
+    """
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is not None:
+        return fault_response
+
+    def register_once():
+        with db_connection(conf) as conn:
+            return register_members(conn, items)
+
+    codes = []
+    if items:
+        codes = run_transaction('members', register_once)
+
+    codes = iter(zip(items, codes))
+    for i, result in enumerate(results):
+        if result is not None:
+            continue
+        item, code = next(codes)
+        if code == 'CREATED':
+            LOGGER.info(
+                'Added new Member: member_code=%s, member_name=%s, member_class=%s',
+                item['member_code'], item['member_name'], item['member_class'])
+            results[i] = batch_result(item, code, 'New Member added')
+        else:
+            results[i] = batch_result(item, code, CREATE_RESULTS[code]['msg'])
+
+    return batch_response(results)
+
+
+def add_subsystems(conf, items, results):
+    """Add multiple new X-Road subsystems to Central Server
+
+    Generator of NDJSON lines with results of all batch request items in
+    request order, followed by a summary line. Valid items are committed in
+    chunks of batch_chunk_size items and results of each chunk are produced
+    after its commit. items and results are returned by get_batch_input.
+    """
+    try:
+        with db_connection(conf) as conn:
+            with conn.cursor() as cur:
+                class_ids, members = get_batch_members(cur, items)
+    except psycopg2.Error as err:
+        LOGGER.error('DB_ERROR: Unclassified database error: %s', err)
+        yield dumps_json({'code': 'DB_ERROR', 'msg': 'Unclassified database error'}) + b'\n'
+        return
+
+    def register_once(chunk):
+        with db_connection(conf) as conn:
+            return register_subsystems(conn, chunk, class_ids, members)
+
+    chunk_size = SETTINGS['batch_chunk_size']
+    valid_items = iter(items)
+    created = 0
+    start = 0
+    while start < len(results):
+        # Range of results containing next chunk of valid items
+        end = start
+        count = 0
+        while end < len(results) and (results[end] is not None or count < chunk_size):
+            if results[end] is None:
+                count += 1
+            end += 1
+        chunk = list(itertools.islice(valid_items, count))
+
+        codes = []
+        if chunk:
+            try:
+                codes = run_transaction('subsystems', functools.partial(register_once, chunk))
+            except psycopg2.Error as err:
+                # Chunk was rolled back, following chunks are still processed
+                LOGGER.error('DB_ERROR: Unclassified database error: %s', err)
+                codes = ['DB_ERROR'] * len(chunk)
+
+        positions = [i for i in range(start, end) if results[i] is None]
+        for i, item, code in zip(positions, chunk, codes):
+            if code == 'CREATED':
+                LOGGER.info(
+                    'Added new Subsystem: member_class=%s, member_code=%s, '
+                    'subsystem_code=%s',
+                    item['member_class'], item['member_code'], item['subsystem_code'])
+                created += 1
+                results[i] = batch_result(item, code, 'New Subsystem added')
+            elif code == 'DB_ERROR':
+                results[i] = batch_result(item, code, 'Unclassified database error')
+            else:
+                results[i] = batch_result(item, code, CREATE_RESULTS[code]['msg'])
+        for result in results[start:end]:
+            yield dumps_json(result) + b'\n'
+        start = end
+
+    summary = {
+        'code': 'OK', 'msg': 'Batch processed', 'created': created,
+        'failed': len(results) - created}
+    LOGGER.info('Response: %s', summary)
+    yield dumps_json(summary) + b'\n'
+
+
+def prefers_async():
+    """Check if client asked for asynchronous processing with Prefer header"""
+    preferences = request.headers.get('Prefer', '')
+    return any(
+        preference.split(';')[0].strip().lower() == 'respond-async'
+        for preference in preferences.split(','))
+
+
+def create_job_tables(conn):
+    """Create tables of background jobs unless already created by current process"""
+    if _JOBS['table_ready']:
+        return
+    with conn.cursor() as cur:
+        cur.execute('select pg_advisory_xact_lock(%(key)s)', {'key': JOBS_LOCK_KEY})
+        cur.execute(JOBS_TABLES)
+    conn.commit()
+    _JOBS['table_ready'] = True
+
+
+def add_job(job_type, client_dn, items, results):
+    """Add background job processing batch request items
+
+    items and results are returned by get_batch_input.
+    """
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is not None:
+        return fault_response
+
+    job_id = uuid.uuid4().hex
+    with db_connection(conf) as conn:
+        create_job_tables(conn)
+        with conn.cursor() as cur:
+            cur.execute(QUERIES['queued_jobs'])
+            queued = cur.fetchone()[0]
+            if queued >= SETTINGS['jobs']['max_queued']:
+                LOGGER.warning('TOO_MANY_JOBS: %s jobs are waiting', queued)
+                return {
+                    'http_status': 429, 'code': 'TOO_MANY_JOBS',
+                    'msg': 'Too many jobs are waiting, try again later'}
+            cur.execute(QUERIES['add_job'], {
+                'id': job_id, 'type': job_type, 'client_dn': client_dn,
+                'items': dumps_json(items).decode('utf-8'),
+                'results': dumps_json(results).decode('utf-8'),
+                'total': len(results)})
+        conn.commit()
+
+    LOGGER.info('Added new Job: job_id=%s, type=%s, items=%s', job_id, job_type, len(results))
+    JOB_RUNNER.wakeup()
+    return {
+        'http_status': 202, 'code': 'ACCEPTED', 'msg': 'Job accepted', 'job_id': job_id}
+
+
+def register_job_chunk(conn, job_type, chunk):
+    """Register chunk of job items without committing
+
+    Returns list of result codes in the same order as items.
+    """
+    if job_type == 'members':
+        return register_members(conn, chunk, commit=False)
+    with conn.cursor() as cur:
+        class_ids, members = get_batch_members(cur, chunk)
+    return register_subsystems(conn, chunk, class_ids, members, commit=False)
+
+
+def job_item_result(job_type, item, code):
+    """Create result of processed job item"""
+    if code != 'CREATED':
+        return batch_result(item, code, CREATE_RESULTS[code]['msg'])
+    if job_type == 'members':
+        LOGGER.info(
+            'Added new Member: member_code=%s, member_name=%s, member_class=%s',
+            item['member_code'], item['member_name'], item['member_class'])
+        return batch_result(item, code, 'New Member added')
+    LOGGER.info(
+        'Added new Subsystem: member_class=%s, member_code=%s, subsystem_code=%s',
+        item['member_class'], item['member_code'], item['subsystem_code'])
+    return batch_result(item, code, 'New Subsystem added')
+
+
+def run_job(conf, job, worker):
+    """Process remaining items of claimed job
+
+    Items are committed in chunks of batch_chunk_size items together with
+    job progress, so job continued by another worker never registers items
+    twice. Processing stops when job was taken over by another worker.
+    Returns final job status or None if job was taken over.
+    """
+    items = loads_json(job['items'])
+    position = job['processed']
+    chunk_size = SETTINGS['batch_chunk_size']
+    while True:
+        chunk = items[position:position + chunk_size]
+        status = 'COMPLETED' if position + len(chunk) >= len(items) else 'RUNNING'
+        with db_connection(conf) as conn:
+            codes = register_job_chunk(conn, job['type'], chunk) if chunk else []
+            with conn.cursor() as cur:
+                cur.execute(QUERIES['update_job'], {
+                    'id': job['id'], 'worker': worker, 'status': status,
+                    'processed': position + len(chunk),
+                    'created': sum(1 for code in codes if code == 'CREATED')})
+                if cur.rowcount != 1:
+                    conn.rollback()
+                    LOGGER.warning('Job %s was taken over by another worker', job['id'])
+                    return None
+                if chunk:
+                    cur.execute(QUERIES['add_job_results'], {
+                        'id': job['id'], 'position': position, 'results': dumps_json([
+                            job_item_result(job['type'], item, code)
+                            for item, code in zip(chunk, codes)]).decode('utf-8')})
+            conn.commit()
+        position += len(chunk)
+        if status == 'COMPLETED':
+            return status
+
+
+def process_job(worker):
+    """Claim and process next waiting or stale job
+
+    Returns True if job was processed, False if there were no jobs.
+    """
+    conf = get_db_conf()
+    if db_conf_error(conf) is not None:
+        return False
+
+    with db_connection(conf) as conn:
+        create_job_tables(conn)
+        with conn.cursor() as cur:
+            now = time.monotonic()
+            if _JOBS['purged'] is None or now - _JOBS['purged'] >= JOBS_PURGE_INTERVAL:
+                _JOBS['purged'] = now
+                cur.execute(QUERIES['purge_jobs'], {'ttl': SETTINGS['jobs']['ttl']})
+            cur.execute(QUERIES['claim_job'], {
+                'worker': worker, 'stale_timeout': SETTINGS['jobs']['stale_timeout']})
+            rec = cur.fetchone()
+        conn.commit()
+    if rec is None:
+        return False
+
+    job = {'id': rec[0], 'type': rec[1], 'items': rec[2], 'processed': rec[3]}
+    LOGGER.info('Processing Job: job_id=%s, type=%s', job['id'], job['type'])
+    try:
+        status = run_job(conf, job, worker)
+    except psycopg2.Error as err:
+        # Results of already committed chunks are kept
+        LOGGER.error('DB_ERROR: Job %s failed: %s', job['id'], err)
+        status = 'FAILED'
+        with db_connection(conf) as conn:
+            with conn.cursor() as cur:
+                cur.execute(QUERIES['fail_job'], {
+                    'id': job['id'], 'worker': worker, 'error': 'Unclassified database error'})
+            conn.commit()
+    if status is not None:
+        LOGGER.info('Job %s finished: %s', job['id'], status)
+        METRICS.inc('csapi_jobs_total', (('type', job['type']), ('status', status)))
+    return True
+
+
+class JobRunner:
+    """Background job workers of current worker process
+
+    After start() jobs.workers threads claim and process jobs, waiting for
+    new jobs up to jobs.poll_interval seconds between checks. Threads are
+    started again in a forked process and when jobs.workers is increased.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.pid = None
+        # Worker threads as (index, thread) tuples
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def _run(self, index):
+        # Unique id of worker thread, job updates of another worker are rejected
+        worker = uuid.uuid4().hex
+        while index < SETTINGS['jobs']['workers']:
+            try:
+                if process_job(worker):
+                    continue
+            except psycopg2.Error as err:
+                LOGGER.error('DB_ERROR: Cannot process jobs: %s', err)
+            self._wakeup.wait(SETTINGS['jobs']['poll_interval'])
+            self._wakeup.clear()
+
+    def running(self):
+        """Start missing worker threads, returns True if jobs are processed"""
+        with self._lock:
+            workers = SETTINGS['jobs']['workers']
+            if not self.started or not workers:
+                return False
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self._threads = []
+            self._threads = [
+                (index, thread) for index, thread in self._threads if thread.is_alive()]
+            running = {index for index, _ in self._threads}
+            for index in range(workers):
+                if index not in running:
+                    thread = threading.Thread(
+                        target=self._run, args=(index,), name='csapi-job-{}'.format(index),
+                        daemon=True)
+                    thread.start()
+                    self._threads.append((index, thread))
+            return True
+
+    def start(self):
+        """Start processing jobs"""
+        with self._lock:
+            self.started = True
+        self.running()
+
+    def wakeup(self):
+        """Check for new jobs without waiting for poll interval"""
+        if self.running():
+            self._wakeup.set()
+
+
+# Background job workers of current worker process
+JOB_RUNNER = JobRunner()
+
+
+def get_job(job_id, client_dn):
+    """Get status and results of background job
+
+    Only jobs added by the same client are found.
+    """
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is not None:
+        return fault_response
+
+    rec = None
+    if JOB_ID_RE.match(job_id):
+        with db_connection(conf) as conn:
+            with conn.cursor() as cur:
+                try:
+                    cur.execute(QUERIES['job'], {'id': job_id, 'client_dn': client_dn})
+                    rec = cur.fetchone()
+                except psycopg2.errors.UndefinedTable:
+                    # Job tables are created with the first job
+                    rec = None
+                if rec is not None:
+                    cur.execute(QUERIES['job_results'], {'id': job_id})
+                    processed = iter([
+                        result for row in cur.fetchall() for result in loads_json(row[0])])
+    if rec is None:
+        LOGGER.warning('JOB_NOT_FOUND: Job %s not found', job_id)
+        return {'http_status': 404, 'code': 'JOB_NOT_FOUND', 'msg': 'Job not found'}
+
+    job_type, status, total, _, created, results, error, created_at, updated_at = rec
+    # Results of valid items in request order, null for items waiting for processing
+    results = [
+        result if result is not None else next(processed, None)
+        for result in loads_json(results)]
+    done = sum(1 for result in results if result is not None)
+    return {
+        'http_status': 200, 'code': 'OK', 'msg': 'Job found', 'job_id': job_id,
+        'type': job_type, 'status': status, 'total': total, 'processed': done,
+        'created': created, 'failed': done - created, 'error': error,
+        'created_at': created_at.isoformat(), 'updated_at': updated_at.isoformat(),
+        'results': results}
+
+
+class MemoryIdempotencyStore:
+    """Idempotency store keeping responses in memory of current worker process
+
+    Least recently used responses are removed when there are more than
+    max_size responses.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # Stored (fingerprint, response, expiry time) by (client DN, key), response is
+        # None while the key is reserved
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _set(self, client_dn, key, fingerprint, response, ttl):
+        self._entries[(client_dn, key)] = (fingerprint, response, time.monotonic() + ttl)
+        self._entries.move_to_end((client_dn, key))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def reserve(self, client_dn, key, fingerprint, ttl):
+        """Reserve key for ttl seconds for request that is processed
+
+        Returns None if key was reserved, otherwise stored (fingerprint,
+        response) tuple where response is None while another request holds
+        the reservation.
+        """
+        with self._lock:
+            entry = self._entries.get((client_dn, key))
+            if entry is not None and entry[2] > time.monotonic():
+                self._entries.move_to_end((client_dn, key))
+                return entry[0], entry[1]
+            self._set(client_dn, key, fingerprint, None, ttl)
+            return None
+
+    def put(self, client_dn, key, fingerprint, response, ttl):
+        """Store response, response that is already stored is kept"""
+        with self._lock:
+            entry = self._entries.get((client_dn, key))
+            if entry is not None and entry[1] is not None and entry[2] > time.monotonic():
+                return
+            self._set(client_dn, key, fingerprint, response, ttl)
+
+    def release(self, client_dn, key):
+        """Remove reservation of key, stored response is kept"""
+        with self._lock:
+            entry = self._entries.get((client_dn, key))
+            if entry is not None and entry[1] is None:
+                del self._entries[(client_dn, key)]
+
+
+class DatabaseIdempotencyStore:
+    """Idempotency store keeping responses in Central Server database
+
+    Responses are shared by all worker processes. Table is created on first
+    use and expired responses are removed at most once per
+    IDEMPOTENCY_PURGE_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.table_ready = False
+        self.purged = None
+
+    def _create_table(self, conn):
+        with conn.cursor() as cur:
+            cur.execute('select pg_advisory_xact_lock(%(key)s)', {'key': IDEMPOTENCY_LOCK_KEY})
+            cur.execute(IDEMPOTENCY_TABLE)
+        conn.commit()
+        self.table_ready = True
+
+    def reserve(self, client_dn, key, fingerprint, ttl):
+        """Reserve key for ttl seconds for request that is processed
+
+        Returns None if key was reserved, otherwise stored (fingerprint,
+        response) tuple where response is None while another request holds
+        the reservation.
+        """
+        with db_connection(get_db_conf()) as conn:
+            if not self.table_ready:
+                self._create_table(conn)
+            with conn.cursor() as cur:
+                cur.execute(QUERIES['reserve_idempotency_key'], {
+                    'client_dn': client_dn, 'key': key, 'fingerprint': fingerprint,
+                    'ttl': ttl})
+                reserved = cur.fetchone() is not None
+                rec = None
+                if not reserved:
+                    cur.execute(QUERIES['idempotency_response'], {
+                        'client_dn': client_dn, 'key': key})
+                    rec = cur.fetchone()
+            conn.commit()
+        if reserved:
+            return None
+        if rec is None:
+            # Conflicting entry expired after the insert, handled as still reserved
+            return fingerprint, None
+        return rec[0], json.loads(rec[1]) if rec[1] is not None else None
+
+    def put(self, client_dn, key, fingerprint, response, ttl):
+        """Store response, response that is already stored is kept"""
+        with db_connection(get_db_conf()) as conn:
+            if not self.table_ready:
+                self._create_table(conn)
+            with conn.cursor() as cur:
+                cur.execute(QUERIES['add_idempotency_response'], {
+                    'client_dn': client_dn, 'key': key, 'fingerprint': fingerprint,
+                    'response': json.dumps(response), 'ttl': ttl})
+                now = time.monotonic()
+                if self.purged is None or now - self.purged >= IDEMPOTENCY_PURGE_INTERVAL:
+                    self.purged = now
+                    cur.execute(QUERIES['purge_idempotency_responses'])
+            conn.commit()
+
+    def release(self, client_dn, key):
+        """Remove reservation of key, stored response is kept"""
+        with db_connection(get_db_conf()) as conn:
+            with conn.cursor() as cur:
+                cur.execute(QUERIES['release_idempotency_key'], {
+                    'client_dn': client_dn, 'key': key})
+            conn.commit()
+
+
+# Idempotency store classes by store setting
+IDEMPOTENCY_STORES = {
+    'memory': lambda settings: MemoryIdempotencyStore(settings['max_size']),
+    'database': lambda settings: DatabaseIdempotencyStore()
+}
+
+
+def get_idempotency_store():
+    """Get idempotency store of current worker process or None if disabled
+
+    Store is created again when idempotency settings change.
+    """
+    settings = SETTINGS['idempotency']
+    if settings['store'] is None:
+        return None
+    cached = dict(_IDEMPOTENCY_STORE)
+    if cached['store'] is not None and cached['settings'] == settings:
+        return cached['store']
+    store = IDEMPOTENCY_STORES[settings['store']](settings)
+    _IDEMPOTENCY_STORE.update({'store': store, 'settings': dict(settings)})
+    return store
+
+
+def get_idempotency_key(client_dn):
+    """Get idempotency key of creation request from Idempotency-Key header
+
+    Returns two items:
+    * tuple of (client DN, key, request fingerprint) or None if request has
+      no key or idempotency store is disabled
+    * error response (if key is invalid).
+    """
+    key = request.headers.get('Idempotency-Key')
+    if key is None or get_idempotency_store() is None:
+        return None, None
+    if not IDEMPOTENCY_KEY_RE.match(key):
+        LOGGER.warning('INVALID_IDEMPOTENCY_KEY: Idempotency-Key header is invalid: %s', key)
+        return None, {
+            'http_status': 400, 'code': 'INVALID_IDEMPOTENCY_KEY',
+            'msg': 'Idempotency-Key header is invalid'}
+    # The same key must not be used for different requests. Raw body is hashed, decoded
+    # body may contain values that can not be serialized again (MessagePack bytes).
+    fingerprint = hashlib.sha256(
+        request.path.encode('utf-8') + b'\n' + request.get_data()).hexdigest()
+    return (client_dn or '', key, fingerprint), None
+
+
+def get_idempotent_response(idempotency):
+    """Get stored response of request with idempotency key or reserve the key
+
+    idempotency is returned by get_idempotency_key. Returns response data or
+    None if response is not stored and the key was reserved for this request,
+    the request must then be completed with run_idempotent.
+    """
+    if idempotency is None:
+        return None
+    client_dn, key, fingerprint = idempotency
+    stored = get_idempotency_store().reserve(
+        client_dn, key, fingerprint, SETTINGS['idempotency']['reservation_ttl'])
+    if stored is None:
+        return None
+    if stored[0] != fingerprint:
+        LOGGER.warning(
+            'IDEMPOTENCY_KEY_REUSED: Idempotency-Key was used for different request: %s', key)
+        return {
+            'http_status': 422, 'code': 'IDEMPOTENCY_KEY_REUSED',
+            'msg': 'Idempotency-Key was used for different request'}
+    if stored[1] is None:
+        LOGGER.warning(
+            'IDEMPOTENCY_KEY_IN_USE: Request with the same Idempotency-Key is being '
+            'processed: %s', key)
+        return {
+            'http_status': 409, 'code': 'IDEMPOTENCY_KEY_IN_USE',
+            'msg': 'Request with the same Idempotency-Key is being processed'}
+    LOGGER.info('Replaying stored response of Idempotency-Key: %s', key)
+    g.csapi_replayed = True
+    return stored[1]
+
+
+def run_idempotent(idempotency, func, *args):
+    """Process request with idempotency key reserved by get_idempotent_response
+
+    Response of func(*args) is stored, reservation is released if func fails.
+    """
+    try:
+        response = func(*args)
+    except Exception:
+        release_idempotency_key(idempotency)
+        raise
+    store_idempotent_response(idempotency, response)
+    return response
+
+
+def release_idempotency_key(idempotency):
+    """Release reserved idempotency key, so that retried request is processed
+
+    Failure to release key is logged and ignored (reservation expires).
+    """
+    if idempotency is None:
+        return
+    client_dn, key, _ = idempotency
+    try:
+        get_idempotency_store().release(client_dn, key)
+    except psycopg2.Error as err:
+        LOGGER.error('DB_ERROR: Cannot release Idempotency-Key %s: %s', key, err)
+
+
+def store_idempotent_response(idempotency, response):
+    """Store response of request with idempotency key
+
+    Server errors are not stored (key is released), so that retried request
+    is processed again. Failure to store response is logged and ignored.
+    """
+    if idempotency is None:
+        return
+    if response['http_status'] >= 500:
+        release_idempotency_key(idempotency)
+        return
+    client_dn, key, fingerprint = idempotency
+    try:
+        get_idempotency_store().put(
+            client_dn, key, fingerprint, response, SETTINGS['idempotency']['ttl'])
+    except psycopg2.Error as err:
+        LOGGER.error('DB_ERROR: Cannot store response of Idempotency-Key %s: %s', key, err)
+
+
+def metrics_snapshot_name():
+    """Get metrics snapshot file name of current worker process
+
+    Name contains a random part generated once per process, so that a new
+    worker reusing process ID of an exited worker does not overwrite its
+    snapshot.
+    """
+    pid = os.getpid()
+    if _METRICS_SNAPSHOT['pid'] != pid:
+        _METRICS_SNAPSHOT.update({
+            'pid': pid, 'file_name': '{}-{}.json'.format(pid, uuid.uuid4().hex)})
+    return _METRICS_SNAPSHOT['file_name']
+
+
+def flush_metrics(force=False):
+    """Write metrics snapshot of current worker process into metrics_dir
+
+    Snapshot is written at most once per metrics_flush_interval seconds
+    unless force is set.
+    """
+    metrics_dir = SETTINGS['metrics_dir']
+    now = time.monotonic()
+    if not metrics_dir or (
+            not force and now - METRICS.flushed < SETTINGS['metrics_flush_interval']):
+        return
+    METRICS.flushed = now
+
+    path = os.path.join(metrics_dir, metrics_snapshot_name())
+    try:
+        # Readers must never see partially written snapshot
+        with open(path + '.tmp', 'w') as snapshot_file:
+            json.dump(METRICS.snapshot(), snapshot_file)
+        os.replace(path + '.tmp', path)
+    except OSError as err:
+        LOGGER.error('Cannot write metrics snapshot "%s": %s', path, err)
+
+
+def remove_metrics_snapshot():
+    """Remove metrics snapshot of current worker process from metrics_dir
+
+    Called when worker exits, metrics of exited workers are not reported.
+    """
+    metrics_dir = SETTINGS['metrics_dir']
+    if not metrics_dir:
+        return
+    path = os.path.join(metrics_dir, metrics_snapshot_name())
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as err:
+        LOGGER.error('Cannot remove metrics snapshot "%s": %s', path, err)
+
+
+def snapshot_process_exited(file_name):
+    """Check if worker process that wrote metrics snapshot has exited
+
+    Process ID is the part of file name before the first "-".
+    """
+    try:
+        pid = int(file_name.split('-', 1)[0])
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        # Process exists but signals are not permitted
+        return False
+    return False
+
+
+def collect_metrics():
+    """Merge metrics of all worker processes
+
+    Snapshots of other worker processes are read from metrics_dir, metrics of
+    current process are used directly. Snapshots left by worker processes that
+    exited without removing them (killed workers) are removed.
+    """
+    merged = Metrics()
+    merged.merge(METRICS.snapshot())
+    metrics_dir = SETTINGS['metrics_dir']
+    if not metrics_dir:
+        return merged
+
+    own_file = metrics_snapshot_name()
+    try:
+        file_names = sorted(os.listdir(metrics_dir))
+    except OSError as err:
+        LOGGER.error('Cannot read metrics directory "%s": %s', metrics_dir, err)
+        return merged
+
+    for file_name in file_names:
+        if not file_name.endswith('.json') or file_name == own_file:
+            continue
+        if snapshot_process_exited(file_name):
+            LOGGER.info('Removing metrics snapshot of exited worker process "%s"', file_name)
+            try:
+                os.remove(os.path.join(metrics_dir, file_name))
+            except OSError:
+                # Removed concurrently by another worker, skipped anyway
+                pass
+            continue
+        try:
+            with open(os.path.join(metrics_dir, file_name), 'r') as snapshot_file:
+                merged.merge(json.load(snapshot_file))
+        except (OSError, ValueError) as err:
+            LOGGER.warning('Cannot read metrics snapshot "%s": %s', file_name, err)
+
+    return merged
+
+
+def format_labels(labels):
+    """Format metric labels in Prometheus text format"""
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in escaped) + '}'
+
+
+def render_metrics(metrics):
+    """Render metrics in Prometheus text exposition format"""
+    samples = {}
+    for (name, labels), value in sorted(metrics.counters.items()):
+        samples.setdefault(name, []).append('{}{} {}'.format(name, format_labels(labels), value))
+    for (name, labels), (counts, total) in sorted(metrics.histograms.items()):
+        cumulative = 0
+        for bound, count in zip(metrics.buckets + ('+Inf',), counts):
+            cumulative += count
+            samples.setdefault(name, []).append('{}_bucket{} {}'.format(
+                name, format_labels(labels + (('le', bound),)), cumulative))
+        samples[name].append('{}_sum{} {}'.format(name, format_labels(labels), total))
+        samples[name].append('{}_count{} {}'.format(name, format_labels(labels), cumulative))
+
+    lines = []
+    for name in sorted(samples):
+        metric_type, help_text = METRICS_HELP.get(name, ('untyped', name))
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        lines.extend(samples[name])
+    return '\n'.join(lines) + '\n'
+
+
+def start_request_timer():
+    """Remember start time of request"""
+    g.csapi_start = time.monotonic()
+
+
+def observe_request(response):
+    """Record metrics of finished request
+
+    Result code of JSON responses is used as code label, HTTP status is used
+    for other (streamed) responses.
+    """
+    route = request.url_rule.rule if request.url_rule is not None else 'unknown'
+    labels = (
+        ('route', route), ('method', request.method),
+        ('code', g.get('csapi_code', str(response.status_code))))
+    METRICS.inc('csapi_requests_total', labels)
+    if 'csapi_start' in g:
+        METRICS.observe(
+            'csapi_request_duration_seconds', time.monotonic() - g.csapi_start, labels)
+    flush_metrics()
+    return response
+
+
+def register_metrics(app):
+    """Register Flask request hooks that record request metrics"""
+    app.before_request(start_request_timer)
+    app.after_request(observe_request)
+
+
+def start_query_log():
+    """Assign correlation id to request
+
+    Correlation id provided by client or proxy in X-Request-Id header is used
+    when it is valid, otherwise new id is generated.
+    """
+    request_id = request.headers.get('X-Request-Id')
+    if request_id is None or not REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex
+    g.csapi_request_id = request_id
+
+
+def report_queries(response):
+    """Report statements executed by finished request
+
+    Statements of streamed responses that are executed after response headers
+    were sent are not included.
+    """
+    queries = g.get('csapi_db_queries', 0)
+    db_time = g.get('csapi_db_time', 0.0)
+    if 'csapi_request_id' in g:
+        response.headers['X-Request-Id'] = g.csapi_request_id
+
+    budget = SETTINGS['request_query_budget']
+    if budget is not None and queries > budget:
+        SLOW_QUERY_LOGGER.warning(
+            '%s: Query budget exceeded by %s %s (%s queries, %.3f s)',
+            g.get('csapi_request_id', '-'), request.method, request.path, queries, db_time)
+
+    if SETTINGS['server_timing']:
+        response.headers['Server-Timing'] = 'db;dur={:.3f};desc="{} queries"'.format(
+            db_time * 1000, queries)
+    return response
+
+
+def register_query_log(app):
+    """Register Flask request hooks that report statements executed by requests"""
+    app.before_request(start_query_log)
+    app.after_request(report_queries)
+
+
+def get_json_codec():
+    """Get (encoder, decoder) pair of configured JSON implementation"""
+    name = SETTINGS['codec']['json']
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in JSON_CODECS else 'json'
+    return JSON_CODECS[name]
+
+
+def dumps_json(data):
+    """Serialize data to compact UTF-8 encoded JSON"""
+    return get_json_codec()[0](data)
+
+
+def loads_json(data):
+    """Deserialize JSON document (str or UTF-8 encoded bytes)"""
+    return get_json_codec()[1](data)
+
+
+def msgpack_enabled():
+    """Check if MessagePack request and response bodies are accepted"""
+    return SETTINGS['codec']['msgpack'] and msgpack is not None
+
+
+def get_request_data():
+    """Decode request body
+
+    Body with MessagePack Content-Type is decoded as MessagePack when it is
+    enabled, any other body is decoded as JSON regardless of Content-Type.
+    Invalid body is rejected with 400 Bad Request.
+    """
+    body = request.get_data()
+    try:
+        if request.mimetype in MSGPACK_MIMETYPES and msgpack_enabled():
+            return msgpack.unpackb(body, raw=False)
+        return loads_json(body)
+    except ValueError as err:
+        raise BadRequest('Failed to decode request body: {}'.format(err)) from err
+
+
+def encode_response(body):
+    """Create response object with body encoded as requested by Accept header
+
+    Body is MessagePack only when it is enabled and preferred by client,
+    otherwise body is JSON.
+    """
+    if msgpack_enabled():
+        mimetype = request.accept_mimetypes.best_match(
+            ('application/json', MSGPACK_MIMETYPES[0]), default='application/json')
+        if mimetype == MSGPACK_MIMETYPES[0]:
+            response = Response(msgpack.packb(body, use_bin_type=True), mimetype=mimetype)
+        else:
+            response = Response(dumps_json(body) + b'\n', mimetype=mimetype)
+        response.vary.add('Accept')
+        return response
+    return Response(dumps_json(body) + b'\n', mimetype='application/json')
+
+
+def make_response(data):
+    """Create JSON (or MessagePack) response object"""
+    body = {'code': data['code'], 'msg': data['msg']}
+    # Additional response fields
+    body.update({key: value for key, value in data.items() if key not in (
+        'http_status', 'code', 'msg')})
+    response = encode_response(body)
+    response.status_code = data['http_status']
+    if g.get('csapi_replayed'):
+        response.headers['Idempotent-Replayed'] = 'true'
+    # Result code for request metrics
+    g.csapi_code = data['code']
+    # Per item results of batch and list requests are not logged
+    LOGGER.info('Response: %s', {
+        key: value for key, value in data.items() if key not in UNLOGGED_KEYS})
+    return response
+
+
+def job_response(job_type, client_dn, batch):
+    """Create response of batch request processed as background job
+
+    batch is returned by get_batch_input.
+    """
+    try:
+        data = add_job(job_type, client_dn, *batch)
+    except psycopg2.Error as err:
+        data = db_error_response(err)
+    response = make_response(data)
+    if data['http_status'] == 202:
+        response.headers['Location'] = '/jobs/{}'.format(data['job_id'])
+        response.headers['Preference-Applied'] = 'respond-async'
+    return response
+
+
+def get_input(json_data, param_name):
+    """Get parameter from request parameters
+
+    Returns two items:
+    * parameter value
+    * error response (if parameter not found).
+    If one parameter is set then other is always None.
+    """
+    try:
+        param = json_data[param_name]
+    except KeyError:
+        LOGGER.warning(
+            'MISSING_PARAMETER: Request parameter %s is missing '
+            '(Request: %s)', param_name, json_data)
+        return None, {
+            'http_status': 400, 'code': 'MISSING_PARAMETER',
+            'msg': 'Request parameter {} is missing'.format(param_name)}
+
+    return param, None
+
+
+def get_inputs(json_data, param_names):
+    """Get multiple parameters from request parameters
+
+    Returns two items:
+    * list of parameter values in the order of param_names
+    * error response of the first missing parameter.
+    If one item is set then other is always None.
+    """
+    params = []
+    for param_name in param_names:
+        (param, fault_response) = get_input(json_data, param_name)
+        if param is None:
+            return None, fault_response
+        params.append(param)
+
+    return params, None
+
+
+def db_error_response(err):
+    """Get error response of unclassified database error"""
+    LOGGER.error('DB_ERROR: Unclassified database error: %s', err)
+    return {
+        'http_status': 500, 'code': 'DB_ERROR',
+        'msg': 'Unclassified database error'}
+
+
+def get_batch_input(json_data, param_names, max_size=None):
+    """Get parameters of batch request items
+
+    Request can contain up to max_size items (batch_max_size by default).
+
+    Returns two items:
+    * tuple of valid items and list of results of all items (where valid
+      items have None value)
+    * error response (if request is not a list of items or is too large).
+    If one of items is set then other is always None.
+    """
+    if not isinstance(json_data, list):
+        LOGGER.warning('INVALID_REQUEST: Request must be a list of items')
+        return None, {
+            'http_status': 400, 'code': 'INVALID_REQUEST',
+            'msg': 'Request must be a list of items'}
+
+    if max_size is None:
+        max_size = SETTINGS['batch_max_size']
+    if len(json_data) > max_size:
+        LOGGER.warning(
+            'BATCH_TOO_LARGE: Request contains %s items, maximum is %s',
+            len(json_data), max_size)
+        return None, {
+            'http_status': 413, 'code': 'BATCH_TOO_LARGE',
+            'msg': 'Request can contain up to {} items'.format(max_size)}
+
+    items = []
+    results = []
+    for item in json_data:
+        result = None
+        for param_name in param_names:
+            if not isinstance(item, dict) or param_name not in item:
+                result = batch_result(
+                    item, 'MISSING_PARAMETER',
+                    'Request parameter {} is missing'.format(param_name))
+                break
+            if not isinstance(item[param_name], str):
+                result = batch_result(
+                    item, 'INVALID_PARAMETER',
+                    'Request parameter {} must be a string'.format(param_name))
+                break
+        if result is None:
+            items.append({param_name: item[param_name] for param_name in param_names})
+        results.append(result)
+
+    return (items, results), None
+
+
+def encode_cursor(values):
+    """Encode keyset pagination position as opaque cursor string"""
+    return base64.urlsafe_b64encode(
+        json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, types):
+    """Decode cursor string created by encode_cursor
+
+    types is a tuple of expected types of cursor values. Returns list of
+    values or None if cursor is invalid.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != len(types):
+        return None
+    for value, value_type in zip(values, types):
+        # bool is a subclass of int
+        if not isinstance(value, value_type) or isinstance(value, bool):
+            return None
+    return values
+
+
+def get_page_input(args, cursor_types):
+    """Get pagination parameters of list request
+
+    Returns two items:
+    * tuple of page size and decoded cursor (None for the first page)
+    * error response (if parameters are invalid).
+    If one item is set then other is always None.
+    """
+    try:
+        limit = int(args.get('limit', SETTINGS['page_size']))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= SETTINGS['page_max_size']:
+        LOGGER.warning(
+            'INVALID_PARAMETER: Request parameter limit must be between 1 and %s (Request: %s)',
+            SETTINGS['page_max_size'], args.get('limit'))
+        return None, {
+            'http_status': 400, 'code': 'INVALID_PARAMETER',
+            'msg': 'Request parameter limit must be between 1 and {}'.format(
+                SETTINGS['page_max_size'])}
+
+    after = args.get('after')
+    if after is not None:
+        after = decode_cursor(after, cursor_types)
+        if after is None:
+            LOGGER.warning(
+                'INVALID_PARAMETER: Request parameter after is invalid (Request: %s)',
+                args.get('after'))
+            return None, {
+                'http_status': 400, 'code': 'INVALID_PARAMETER',
+                'msg': 'Request parameter after is invalid'}
+
+    return (limit, after), None
+
+
+def load_config(config_file):
+    """Load configuration from JSON file"""
+    try:
+        with open(config_file, 'r') as conf:
+            LOGGER.info('Configuration loaded from file "%s"', config_file)
+            return json.load(conf)
+    except IOError as err:
+        LOGGER.error('Cannot load configuration file "%s": %s', config_file, str(err))
+        return None
+    except json.JSONDecodeError as err:
+        LOGGER.error('Invalid JSON configuration file "%s": %s', config_file, str(err))
+        return None
+
+
+def configure(config):
+    """Apply runtime settings from configuration
+
+    All settings are replaced at once, so that concurrent requests never see
+    a mix of old and new settings.
+    """
+    if not isinstance(config, dict):
+        config = {}
+    settings = {}
+    for key, default in DEFAULT_SETTINGS.items():
+        if isinstance(default, dict):
+            value = dict(default)
+            if isinstance(config.get(key), dict):
+                value.update(config[key])
+        else:
+            value = config.get(key, default)
+        settings[key] = value
+    SETTINGS.update(settings)
+
+    MEMBER_CLASS_CACHE.ttl = SETTINGS['member_class_cache']['ttl']
+    MEMBER_CLASS_CACHE.negative_ttl = SETTINGS['member_class_cache']['negative_ttl']
+
+    # Allowed clients are compiled when configuration is loaded
+    get_client_matcher(config)
+
+
+def parse_dn_value(dn, pos):
+    """Parse attribute value of RFC 4514 DN string starting at position pos
+
+    Returns unescaped value and position of the separator following the
+    value (or length of dn).
+    """
+    value = bytearray()
+    while pos < len(dn) and dn[pos] == ' ':
+        pos += 1
+    quoted = pos < len(dn) and dn[pos] == '"'
+    if quoted:
+        pos += 1
+    while pos < len(dn):
+        char = dn[pos]
+        if quoted and char == '"':
+            pos += 1
+            while pos < len(dn) and dn[pos] == ' ':
+                pos += 1
+            if pos < len(dn) and dn[pos] not in ',;+':
+                raise ValueError('Unexpected characters after quoted value')
+            return value.decode('utf-8'), pos
+        if not quoted and char in ',;+':
+            break
+        if char == '\\':
+            if re.match('[0-9A-Fa-f]{2}', dn[pos + 1:pos + 3]):
+                value.append(int(dn[pos + 1:pos + 3], 16))
+                pos += 3
+                continue
+            if pos + 1 >= len(dn):
+                raise ValueError('Incomplete escape sequence')
+            char = dn[pos + 1]
+            pos += 1
+        value.extend(char.encode('utf-8'))
+        pos += 1
+    if quoted:
+        raise ValueError('Unterminated quoted value')
+    return value.decode('utf-8'), pos
+
+
+def parse_dn(dn):
+    """Parse distinguished name into list of RDNs of (attribute type, value) pairs
+
+    Accepts RFC 4514 (RFC 2253) strings like "CN=client,O=RIA,C=EE" and
+    legacy OpenSSL strings like "/C=EE/O=RIA/CN=client" (converted to RFC
+    4514 order, most specific RDN first). Raises ValueError if dn is invalid.
+    """
+    if dn.startswith('/'):
+        rdns = []
+        for rdn in reversed(dn[1:].split('/')):
+            avas = []
+            for ava in rdn.split('+'):
+                attr_type, separator, value = ava.partition('=')
+                if not separator:
+                    raise ValueError('Missing attribute value')
+                avas.append((attr_type, value))
+            rdns.append(avas)
+        return rdns
+
+    rdns = []
+    avas = []
+    pos = 0
+    while True:
+        separator = dn.find('=', pos)
+        if separator < 0:
+            raise ValueError('Missing attribute value')
+        attr_type = dn[pos:separator]
+        value, pos = parse_dn_value(dn, separator + 1)
+        avas.append((attr_type, value))
+        if pos >= len(dn):
+            break
+        if dn[pos] != '+':
+            rdns.append(avas)
+            avas = []
+        pos += 1
+    rdns.append(avas)
+    return rdns
+
+
+@functools.lru_cache(maxsize=4096)
+def canonical_dn(dn):
+    """Get canonical form of distinguished name or None if dn is invalid
+
+    Canonical form is a tuple of RDNs (most specific first), each RDN is a
+    sorted tuple of (attribute type, value) pairs. Attribute types are upper
+    case short names, values are case folded with whitespace collapsed, so
+    that spacing, letter case, escaping and order of multi-valued RDN
+    attributes do not matter. Order of RDNs is significant.
+    """
+    try:
+        rdns = parse_dn(dn)
+    except ValueError:
+        return None
+
+    canonical = []
+    for avas in rdns:
+        canonical_avas = []
+        for attr_type, value in avas:
+            match = DN_ATTRIBUTE_TYPE_RE.match(attr_type.strip().upper())
+            if match is None:
+                return None
+            attr_type = DN_ATTRIBUTE_TYPES.get(match.group(1), match.group(1))
+            canonical_avas.append((attr_type, ' '.join(value.split()).casefold()))
+        canonical.append(tuple(sorted(canonical_avas)))
+    return tuple(canonical)
+
+
+class ClientMatcher:
+    """Allowed client certificates compiled from configuration
+
+    "allowed" DNs are kept in hash sets of exact and canonical DNs.
+    "allowed_subtrees" DNs are compiled into a trie of canonical RDNs
+    starting from the least specific RDN, so a client DN is allowed when
+    the trie contains a subtree DN it ends with.
+    """
+
+    def __init__(self, config):
+        self.allow_all = config.get('allow_all', False) is True
+        self.exact = set()
+        self.canonical = set()
+        # Nested dicts by canonical RDN, None key marks allowed subtree
+        self.subtrees = {}
+
+        allowed = config.get('allowed')
+        for dn in allowed if isinstance(allowed, list) else []:
+            if not isinstance(dn, str):
+                continue
+            self.exact.add(dn)
+            canonical = canonical_dn(dn)
+            if canonical is not None:
+                self.canonical.add(canonical)
+
+        subtrees = config.get('allowed_subtrees')
+        for dn in subtrees if isinstance(subtrees, list) else []:
+            canonical = canonical_dn(dn) if isinstance(dn, str) else None
+            if not canonical:
+                LOGGER.warning('Invalid DN in allowed_subtrees: %s', dn)
+                continue
+            node = self.subtrees
+            for rdn in reversed(canonical):
+                node = node.setdefault(rdn, {})
+            node[None] = True
+
+    def match(self, client_dn):
+        """Check if client DN is allowed"""
+        if self.allow_all:
+            return True
+        if client_dn is None:
+            return False
+        if client_dn in self.exact:
+            return True
+
+        canonical = canonical_dn(client_dn)
+        if canonical is None:
+            return False
+        if canonical in self.canonical:
+            return True
+
+        node = self.subtrees
+        for rdn in reversed(canonical):
+            node = node.get(rdn)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+
+def get_client_matcher(config):
+    """Get client matcher compiled from configuration
+
+    Matcher of the last used configuration is kept, so that configuration
+    is compiled only once. Configuration must not be modified after use.
+    """
+    cached = _CLIENT_MATCHER['entry']
+    if cached is not None and cached[0] is config:
+        return cached[1]
+    matcher = ClientMatcher(config)
+    # Entry is replaced atomically
+    _CLIENT_MATCHER['entry'] = (config, matcher)
+    return matcher
+
+
+def setting_error(name, value, default):
+    """Check type of setting value against its default value
+
+    Returns error message or None if value is valid.
+    """
+    if value is None:
+        if default is None or name in NULLABLE_SETTINGS:
+            return None
+        return '{} must not be null'.format(name)
+    if isinstance(default, bool):
+        valid = isinstance(value, bool)
+    elif isinstance(default, (int, float)):
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif isinstance(default, str):
+        valid = isinstance(value, str)
+    else:
+        # Settings without default value
+        valid = isinstance(value, (str, int, float)) and not isinstance(value, bool)
+    if not valid:
+        return '{} has invalid value: {}'.format(name, json.dumps(value))
+    return None
+
+
+def validate_config(config):
+    """Check configuration before it is applied
+
+    Returns list of errors, empty list if configuration is valid.
+    """
+    if not isinstance(config, dict):
+        return ['Configuration must be a JSON object']
+
+    errors = []
+    if not isinstance(config.get('allow_all', False), bool):
+        errors.append('allow_all must be true or false')
+    for key in ('allowed', 'allowed_subtrees'):
+        value = config.get(key, [])
+        if not isinstance(value, list) or not all(isinstance(dn, str) for dn in value):
+            errors.append('{} must be a list of strings'.format(key))
+        elif key == 'allowed_subtrees':
+            errors.extend(
+                'Invalid DN in allowed_subtrees: {}'.format(dn) for dn in value
+                if not canonical_dn(dn))
+
+    for key, default in DEFAULT_SETTINGS.items():
+        if key not in config:
+            continue
+        if not isinstance(default, dict):
+            errors.append(setting_error(key, config[key], default))
+        elif not isinstance(config[key], dict):
+            errors.append('{} must be a JSON object'.format(key))
+        else:
+            for name, value in config[key].items():
+                if name not in default:
+                    errors.append('Unknown setting {}.{}'.format(key, name))
+                else:
+                    errors.append(setting_error(
+                        '{}.{}'.format(key, name), value, default[name]))
+
+    store = config.get('idempotency', {}).get('store') if isinstance(
+        config.get('idempotency'), dict) else None
+    if isinstance(store, str) and store not in IDEMPOTENCY_STORES:
+        errors.append('idempotency.store must be one of: {}'.format(
+            ', '.join(sorted(IDEMPOTENCY_STORES))))
+    log_format = config.get('log', {}).get('format') if isinstance(
+        config.get('log'), dict) else None
+    if isinstance(log_format, str) and log_format not in ('text', 'json'):
+        errors.append('log.format must be one of: json, text')
+    codec = config.get('codec') if isinstance(config.get('codec'), dict) else {}
+    if isinstance(codec.get('json'), str) and codec['json'] not in JSON_CODECS and (
+            codec['json'] != 'auto'):
+        errors.append('codec.json must be one of: {}'.format(
+            ', '.join(['auto'] + sorted(JSON_CODECS))))
+    if codec.get('msgpack') is True and msgpack is None:
+        errors.append('codec.msgpack requires msgpack package')
+    return [error for error in errors if error is not None]
+
+
+class ConfigFile:
+    """Configuration file that is reloaded when it changes
+
+    File is checked for changes at most once per config_check_interval
+    seconds and on first use after reload() (called on SIGHUP). Changed file
+    is validated before it replaces current configuration together with
+    runtime settings and compiled client matcher, invalid file is logged
+    and current configuration is kept.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.config = None
+        self.key = None
+        self.checked = 0.0
+        self.reload_requested = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load configuration file, invalid configuration allows no clients"""
+        with self._lock:
+            self.checked = time.monotonic()
+            self.key = file_key(self.path)
+            config = load_config(self.path)
+            errors = validate_config(config) if config is not None else []
+            if errors:
+                LOGGER.error(
+                    'Invalid configuration file "%s": %s', self.path, '; '.join(errors))
+                config = None
+            configure(config)
+            self.config = config
+        return config
+
+    def reload(self):
+        """Check configuration file for changes on next use"""
+        self.reload_requested = True
+
+    def check(self):
+        """Apply configuration file if it has changed and is valid
+
+        Returns True if new configuration was applied. Check is skipped if
+        another thread is already checking.
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self.checked = time.monotonic()
+            self.reload_requested = False
+            key = file_key(self.path)
+            if key == self.key:
+                return False
+            # Broken file is reported once, not on every check
+            self.key = key
+            config = load_config(self.path)
+            if config is None:
+                LOGGER.error('Keeping current configuration')
+                return False
+            errors = validate_config(config)
+            if errors:
+                LOGGER.error(
+                    'Invalid configuration file "%s", keeping current configuration: %s',
+                    self.path, '; '.join(errors))
+                return False
+            configure(config)
+            self.config = config
+            return True
+        finally:
+            self._lock.release()
+
+    def get(self):
+        """Get current configuration"""
+        interval = SETTINGS['config_check_interval']
+        if self.reload_requested or (
+                interval is not None and time.monotonic() - self.checked >= interval):
+            self.check()
+        return self.config
+
+
+def check_client(config, client_dn):
+    """Check if client dn is in whitelist
+
+    config is configuration dict or ConfigFile.
+    """
+    if isinstance(config, ConfigFile):
+        config = config.get()
+    # If config is None then all clients are not allowed
+    if config is None:
+        return False
+    return get_client_matcher(config).match(client_dn)
+
+
+def incorrect_client(client_dn):
+    """Return error response when client is not allowed"""
+    LOGGER.error('FORBIDDEN: Client certificate is not allowed: %s', client_dn)
+    return make_response({
+        'http_status': 403, 'code': 'FORBIDDEN',
+        'msg': 'Client certificate is not allowed: {}'.format(client_dn)})
+
+
+def test_db():
+    """Add new X-Road subsystem to Central Server"""
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is not None:
+        return fault_response
+
+    with db_connection(conf) as conn:
+        with conn.cursor() as cur:
+            return db_status(get_instance_identifier(cur))
+
+
+def db_status(instance_identifier):
+    """Get response of database check that read instance identifier
+
+    Status check also refreshes cached instance identifier.
+    """
+    if instance_identifier is None:
+        return {'http_status': 500, 'code': 'DB_ERROR', 'msg': 'Unexpected DB state'}
+
+    cache_instance_identifier(instance_identifier)
+    return {'http_status': 200, 'code': 'OK', 'msg': 'API is ready'}
+
+
+def probe_db():
+    """Check database status, database errors are reported as DB_ERROR status"""
+    try:
+        return test_db()
+    except psycopg2.Error as err:
+        return db_error_response(err)
+
+
+class StatusProber:
+    """Background database status check of current worker process
+
+    After start() database status is checked every status_probe_interval
+    seconds in a daemon thread. Thread is started again in a forked process
+    on next use.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.pid = None
+        # Last status and its monotonic time
+        self.result = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def probe(self):
+        """Check database status and remember result"""
+        status = probe_db()
+        self.result = (status, time.monotonic())
+        return status
+
+    def _run(self):
+        while True:
+            interval = SETTINGS['status_probe_interval']
+            if interval is None:
+                break
+            self.probe()
+            time.sleep(interval)
+
+    def running(self):
+        """Check if status is checked in background in current process"""
+        with self._lock:
+            if not self.started or SETTINGS['status_probe_interval'] is None:
+                return False
+            if self.pid != os.getpid() or not self._thread.is_alive():
+                # Forked process or background checks were disabled and enabled again
+                self.pid = os.getpid()
+                self.result = None
+                self._thread = threading.Thread(
+                    target=self._run, name='csapi-status-probe', daemon=True)
+                self._thread.start()
+            return True
+
+    def start(self):
+        """Start background checks"""
+        with self._lock:
+            self.started = True
+        self.running()
+
+    def cached(self, max_age):
+        """Get background check result that is at most max_age seconds old or None"""
+        result = self.result
+        if not self.running() or result is None or time.monotonic() - result[1] > max_age:
+            return None
+        return result[0]
+
+
+# Database status of current worker process
+STATUS_PROBER = StatusProber()
 
-    with get_db_connection(conf) as conn:
-        with conn.cursor() as cur:
-            class_id = get_member_class_id(cur, member_class)
-            if class_id is None:
-                LOGGER.warning(
-                    'INVALID_MEMBER_CLASS: Provided Member Class does not exist '
-                    '(Request: %s)', json_data)
-                return {
-                    'http_status': 400, 'code': 'INVALID_MEMBER_CLASS',
-                    'msg': 'Provided Member Class does not exist'}
 
-            if get_member_data(cur, class_id, member_code) is not None:
-                LOGGER.warning(
-                    'MEMBER_EXISTS: Provided Member already exists '
-                    '(Request: %s)', json_data)
-                return {
-                    'http_status': 409, 'code': 'MEMBER_EXISTS',
-                    'msg': 'Provided Member already exists'}
+def get_db_status():
+    """Get database status
 
-            # Timestamps must be in UTC timezone
-            utc_time = get_utc_time(cur)
+    Result of background check is used when it is recent enough, otherwise
+    database is checked in request.
+    """
+    status = STATUS_PROBER.cached(SETTINGS['status_max_age'])
+    if status is None:
+        status = STATUS_PROBER.probe()
+    return status
 
-            identifier_id = add_member_identifier(
-                cur, member_class=member_class, member_code=member_code, utc_time=utc_time)
 
-            add_member_client(
-                cur, member_code=member_code, member_name=member_name, class_id=class_id,
-                identifier_id=identifier_id, utc_time=utc_time)
+class MemberApi(Resource):
+    """Member API class for Flask"""
+    def __init__(self, config):
+        self.config = config
 
-            add_client_name(
-                cur, member_name=member_name, identifier_id=identifier_id, utc_time=utc_time)
+    def post(self):
+        """POST method"""
+        json_data = get_request_data()
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-        conn.commit()
+        LOGGER.info('Incoming request: %s', json_data)
+        LOGGER.info('Client DN: %s', client_dn)
 
-    LOGGER.info(
-        'Added new Member: member_code=%s, member_name=%s, member_class=%s',
-        member_code, member_name, member_class)
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
 
-    return {'http_status': 201, 'code': 'CREATED', 'msg': 'New Member added'}
+        (params, fault_response) = get_inputs(json_data, JOB_PARAMS['members'])
+        if params is None:
+            return make_response(fault_response)
+        (member_class, member_code, member_name) = params
 
+        (idempotency, fault_response) = get_idempotency_key(client_dn)
+        if fault_response is not None:
+            return make_response(fault_response)
 
-def add_subsystem(member_class, member_code, subsystem_code, json_data):
-    """Add new X-Road subsystem to Central Server"""
-    conf = get_db_conf()
-    if not conf['username'] or not conf['password'] or not conf['database']:
-        LOGGER.error('DB_CONF_ERROR: Cannot access database configuration')
-        return {
-            'http_status': 500, 'code': 'DB_CONF_ERROR',
-            'msg': 'Cannot access database configuration'}
+        try:
+            # Retried request gets stored response without registering again
+            response = get_idempotent_response(idempotency)
+            if response is None:
+                response = run_idempotent(
+                    idempotency, add_member, member_class, member_code, member_name, json_data)
+        except psycopg2.Error as err:
+            response = db_error_response(err)
 
-    with get_db_connection(conf) as conn:
-        with conn.cursor() as cur:
-            class_id = get_member_class_id(cur, member_class)
-            if class_id is None:
-                LOGGER.warning(
-                    'INVALID_MEMBER_CLASS: Provided Member Class does not exist '
-                    '(Request: %s)', json_data)
-                return {
-                    'http_status': 400, 'code': 'INVALID_MEMBER_CLASS',
-                    'msg': 'Provided Member Class does not exist'}
+        return make_response(response)
 
-            member_data = get_member_data(cur, class_id, member_code)
-            if member_data is None:
-                LOGGER.warning(
-                    'INVALID_MEMBER: Provided Member does not exist '
-                    '(Request: %s)', json_data)
-                return {
-                    'http_status': 400, 'code': 'INVALID_MEMBER',
-                    'msg': 'Provided Member does not exist'}
 
-            if subsystem_exists(cur, member_data['id'], subsystem_code):
-                LOGGER.warning(
-                    'SUBSYSTEM_EXISTS: Provided Subsystem already exists '
-                    '(Request: %s)', json_data)
-                return {
-                    'http_status': 409, 'code': 'SUBSYSTEM_EXISTS',
-                    'msg': 'Provided Subsystem already exists'}
+class MembersApi(Resource):
+    """Batch Member and Member list API class for Flask"""
+    def __init__(self, config):
+        self.config = config
 
-            # Timestamps must be in UTC timezone
-            utc_time = get_utc_time(cur)
+    def post(self):
+        """POST method"""
+        json_data = get_request_data()
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-            identifier_id = add_subsystem_identifier(
-                cur, member_class=member_class, member_code=member_code,
-                subsystem_code=subsystem_code, utc_time=utc_time)
+        LOGGER.info(
+            'Incoming batch request: %s items',
+            len(json_data) if isinstance(json_data, list) else None)
+        LOGGER.info('Client DN: %s', client_dn)
 
-            add_subsystem_client(
-                cur, subsystem_code=subsystem_code, member_id=member_data['id'],
-                identifier_id=identifier_id, utc_time=utc_time)
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
 
-            add_client_name(
-                cur, member_name=member_data['name'], identifier_id=identifier_id,
-                utc_time=utc_time)
+        # Large batches can be processed as background jobs
+        run_async = SETTINGS['jobs']['workers'] > 0 and prefers_async()
+        (batch, fault_response) = get_batch_input(
+            json_data, JOB_PARAMS['members'],
+            SETTINGS['jobs']['max_size'] if run_async else None)
+        if batch is None:
+            return make_response(fault_response)
 
-        conn.commit()
+        if run_async:
+            return job_response('members', client_dn, batch)
 
-    LOGGER.info(
-        'Added new Subsystem: member_class=%s, member_code=%s, subsystem_code=%s',
-        member_class, member_code, subsystem_code)
+        try:
+            response = add_members(*batch)
+        except psycopg2.Error as err:
+            response = db_error_response(err)
 
-    return {'http_status': 201, 'code': 'CREATED', 'msg': 'New Subsystem added'}
+        return make_response(response)
 
+    def get(self):
+        """GET method"""
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-def make_response(data):
-    """Create JSON response object"""
-    response = jsonify({'code': data['code'], 'msg': data['msg']})
-    response.status_code = data['http_status']
-    LOGGER.info('Response: %s', data)
-    return response
+        LOGGER.info('Incoming members list request: %s', request.args.to_dict())
+        LOGGER.info('Client DN: %s', client_dn)
 
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
 
-def get_input(json_data, param_name):
-    """Get parameter from request parameters
+        (page, fault_response) = get_page_input(request.args, (int, str))
+        if page is None:
+            return make_response(fault_response)
 
-    Returns two items:
-    * parameter value
-    * error response (if parameter not found).
-    If one parameter is set then other is always None.
-    """
-    try:
-        param = json_data[param_name]
-    except KeyError:
-        LOGGER.warning(
-            'MISSING_PARAMETER: Request parameter %s is missing '
-            '(Request: %s)', param_name, json_data)
-        return None, {
-            'http_status': 400, 'code': 'MISSING_PARAMETER',
-            'msg': 'Request parameter {} is missing'.format(param_name)}
+        try:
+            response = get_members(request.args.get('member_class'), *page)
+        except psycopg2.Error as err:
+            response = db_error_response(err)
 
-    return param, None
+        return make_response(response)
 
 
-def load_config(config_file):
-    """Load configuration from JSON file"""
-    try:
-        with open(config_file, 'r') as conf:
-            LOGGER.info('Configuration loaded from file "%s"', config_file)
-            return json.load(conf)
-    except IOError as err:
-        LOGGER.error('Cannot load configuration file "%s": %s', config_file, str(err))
-        return None
-    except json.JSONDecodeError as err:
-        LOGGER.error('Invalid JSON configuration file "%s": %s', config_file, str(err))
-        return None
+class MemberInfoApi(Resource):
+    """Member information API class for Flask"""
+    def __init__(self, config):
+        self.config = config
 
+    def get(self, member_class, member_code):
+        """GET method"""
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-def check_client(config, client_dn):
-    """Check if client dn is in whitelist"""
-    # If config is None then all clients are not allowed
-    if config is None:
-        return False
-    if config.get('allow_all', False) is True:
-        return True
+        LOGGER.info('Incoming member request: %s/%s', member_class, member_code)
+        LOGGER.info('Client DN: %s', client_dn)
 
-    allowed = config.get('allowed')
-    if client_dn is None or not isinstance(allowed, list):
-        return False
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
 
-    if client_dn in allowed:
-        return True
+        try:
+            response = get_member(member_class, member_code)
+        except psycopg2.Error as err:
+            response = db_error_response(err)
 
-    return False
+        return make_response(response)
 
 
-def incorrect_client(client_dn):
-    """Return error response when client is not allowed"""
-    LOGGER.error('FORBIDDEN: Client certificate is not allowed: %s', client_dn)
-    return make_response({
-        'http_status': 403, 'code': 'FORBIDDEN',
-        'msg': 'Client certificate is not allowed: {}'.format(client_dn)})
+class MemberSubsystemsApi(Resource):
+    """Member subsystems list API class for Flask"""
+    def __init__(self, config):
+        self.config = config
 
+    def get(self, member_class, member_code):
+        """GET method"""
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-def test_db():
-    """Add new X-Road subsystem to Central Server"""
-    conf = get_db_conf()
-    if not conf['username'] or not conf['password'] or not conf['database']:
-        LOGGER.error('DB_CONF_ERROR: Cannot access database configuration')
-        return {
-            'http_status': 500, 'code': 'DB_CONF_ERROR',
-            'msg': 'Cannot access database configuration'}
+        LOGGER.info(
+            'Incoming subsystems list request: %s/%s %s', member_class, member_code,
+            request.args.to_dict())
+        LOGGER.info('Client DN: %s', client_dn)
 
-    with get_db_connection(conf) as conn:
-        with conn.cursor() as cur:
-            cur.execute("""select 1 from system_parameters where key='instanceIdentifier'""")
-            rec = cur.fetchone()
-            if rec:
-                return {
-                    'http_status': 200, 'code': 'OK',
-                    'msg': 'API is ready'}
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
 
-    return {'http_status': 500, 'code': 'DB_ERROR', 'msg': 'Unexpected DB state'}
+        (page, fault_response) = get_page_input(request.args, (str,))
+        if page is None:
+            return make_response(fault_response)
 
+        try:
+            response = get_member_subsystems(member_class, member_code, *page)
+        except psycopg2.Error as err:
+            response = db_error_response(err)
 
-class MemberApi(Resource):
-    """Member API class for Flask"""
+        return make_response(response)
+
+
+class SubsystemApi(Resource):
+    """Subsystem API class for Flask"""
     def __init__(self, config):
         self.config = config
 
     def post(self):
         """POST method"""
-        json_data = request.get_json(force=True)
+        json_data = get_request_data()
         client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
         LOGGER.info('Incoming request: %s', json_data)
@@ -420,68 +4477,177 @@ class MemberApi(Resource):
         if not check_client(self.config, client_dn):
             return incorrect_client(client_dn)
 
-        (member_class, fault_response) = get_input(json_data, 'member_class')
-        if member_class is None:
-            return make_response(fault_response)
-
-        (member_code, fault_response) = get_input(json_data, 'member_code')
-        if member_code is None:
+        (params, fault_response) = get_inputs(json_data, JOB_PARAMS['subsystems'])
+        if params is None:
             return make_response(fault_response)
+        (member_class, member_code, subsystem_code) = params
 
-        (member_name, fault_response) = get_input(json_data, 'member_name')
-        if member_name is None:
+        (idempotency, fault_response) = get_idempotency_key(client_dn)
+        if fault_response is not None:
             return make_response(fault_response)
 
         try:
-            response = add_member(member_class, member_code, member_name, json_data)
+            # Retried request gets stored response without registering again
+            response = get_idempotent_response(idempotency)
+            if response is None:
+                response = run_idempotent(
+                    idempotency, add_subsystem, member_class, member_code, subsystem_code,
+                    json_data)
         except psycopg2.Error as err:
-            LOGGER.error('DB_ERROR: Unclassified database error: %s', err)
-            response = {
-                'http_status': 500, 'code': 'DB_ERROR',
-                'msg': 'Unclassified database error'}
+            response = db_error_response(err)
 
         return make_response(response)
 
 
-class SubsystemApi(Resource):
-    """Subsystem API class for Flask"""
+class CacheApi(Resource):
+    """Cache administration API class for Flask
+
+    Caches are kept separately in each worker process. Statistics are of the
+    worker process that serves the request, flush affects all worker processes
+    when cache_flush_file is configured.
+    """
+    def __init__(self, config):
+        self.config = config
+
+    def get(self):
+        """GET method"""
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
+
+        LOGGER.info('Incoming cache statistics request')
+        LOGGER.info('Client DN: %s', client_dn)
+
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
+
+        return make_response(get_cache_stats())
+
+    def delete(self):
+        """DELETE method"""
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
+
+        LOGGER.info('Incoming cache flush request')
+        LOGGER.info('Client DN: %s', client_dn)
+
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
+
+        return make_response(flush_caches_response())
+
+
+class SubsystemsApi(Resource):
+    """Batch Subsystem API class for Flask"""
     def __init__(self, config):
         self.config = config
 
     def post(self):
         """POST method"""
-        json_data = request.get_json(force=True)
+        json_data = get_request_data()
         client_dn = request.headers.get('X-Ssl-Client-S-Dn')
 
-        LOGGER.info('Incoming request: %s', json_data)
+        LOGGER.info(
+            'Incoming batch request: %s items',
+            len(json_data) if isinstance(json_data, list) else None)
         LOGGER.info('Client DN: %s', client_dn)
 
         if not check_client(self.config, client_dn):
             return incorrect_client(client_dn)
 
-        (member_class, fault_response) = get_input(json_data, 'member_class')
-        if member_class is None:
+        # Large batches can be processed as background jobs
+        run_async = SETTINGS['jobs']['workers'] > 0 and prefers_async()
+        (batch, fault_response) = get_batch_input(
+            json_data, JOB_PARAMS['subsystems'],
+            SETTINGS['jobs']['max_size'] if run_async else None)
+        if batch is None:
             return make_response(fault_response)
 
-        (member_code, fault_response) = get_input(json_data, 'member_code')
-        if member_code is None:
-            return make_response(fault_response)
+        if run_async:
+            return job_response('subsystems', client_dn, batch)
 
-        (subsystem_code, fault_response) = get_input(json_data, 'subsystem_code')
-        if subsystem_code is None:
+        conf = get_db_conf()
+        fault_response = db_conf_error(conf)
+        if fault_response is not None:
             return make_response(fault_response)
 
+        # Results are streamed as NDJSON while chunks are committed, Nginx must not
+        # buffer the response. Request context is kept for correlation id of slow query log.
+        return Response(
+            stream_with_context(add_subsystems(conf, *batch)), mimetype='application/x-ndjson',
+            headers={'X-Accel-Buffering': 'no'})
+
+
+class JobApi(Resource):
+    """Background job status API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def get(self, job_id):
+        """GET method"""
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
+
+        LOGGER.info('Incoming job request: %s', job_id)
+        LOGGER.info('Client DN: %s', client_dn)
+
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
+
         try:
-            response = add_subsystem(member_class, member_code, subsystem_code, json_data)
+            response = get_job(job_id, client_dn)
         except psycopg2.Error as err:
-            LOGGER.error('DB_ERROR: Unclassified database error: %s', err)
-            response = {
-                'http_status': 500, 'code': 'DB_ERROR',
-                'msg': 'Unclassified database error'}
+            response = db_error_response(err)
 
         return make_response(response)
 
 
+class ExportApi(Resource):
+    """Client registry export API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def get(self):
+        """GET method"""
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
+
+        LOGGER.info('Incoming export request')
+        LOGGER.info('Client DN: %s', client_dn)
+
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
+
+        conf = get_db_conf()
+        fault_response = db_conf_error(conf)
+        if fault_response is not None:
+            return make_response(fault_response)
+
+        # Rows are streamed as NDJSON while they are read, Nginx must not buffer the response.
+        # Request context is kept for correlation id of slow query log.
+        return Response(
+            stream_with_context(export_clients(conf)), mimetype='application/x-ndjson',
+            headers={'X-Accel-Buffering': 'no'})
+
+
+class MetricsApi(Resource):
+    """Metrics API class for Flask"""
+    def __init__(self, config):
+        self.config = config
+
+    def get(self):
+        """GET method"""
+        client_dn = request.headers.get('X-Ssl-Client-S-Dn')
+
+        LOGGER.info('Incoming metrics request')
+        LOGGER.info('Client DN: %s', client_dn)
+
+        if not check_client(self.config, client_dn):
+            return incorrect_client(client_dn)
+
+        body = render_metrics(collect_metrics())
+        if not SETTINGS['metrics_dir']:
+            body = (
+                '# Metrics of worker process {} only, aggregation of all worker processes '
+                'is disabled (metrics_dir is not configured)\n'.format(os.getpid()) + body)
+        return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class StatusApi(Resource):
     """Status API class for Flask"""
     def __init__(self, config):
@@ -492,12 +4658,67 @@ class StatusApi(Resource):
         """GET method"""
         LOGGER.info('Incoming status request')
 
-        try:
-            response = test_db()
-        except psycopg2.Error as err:
-            LOGGER.error('DB_ERROR: Unclassified database error: %s', err)
-            response = {
-                'http_status': 500, 'code': 'DB_ERROR',
-                'msg': 'Unclassified database error'}
+        return make_response(get_db_status())
+
+
+class StatusLiveApi(Resource):
+    """Liveness status API class for Flask
+
+    Process is alive when it serves requests, database is not checked.
+    """
+    def __init__(self, config):
+        self.config = config
+
+    @staticmethod
+    def get():
+        """GET method"""
+        LOGGER.info('Incoming liveness status request')
+
+        return make_response({'http_status': 200, 'code': 'OK', 'msg': 'API is alive'})
 
+
+class StatusReadyApi(Resource):
+    """Readiness status API class for Flask
+
+    API is ready when database check within status_max_age seconds
+    succeeded, otherwise 503 is returned with the result code of the check.
+    """
+    def __init__(self, config):
+        self.config = config
+
+    @staticmethod
+    def get():
+        """GET method"""
+        LOGGER.info('Incoming readiness status request')
+
+        response = get_db_status()
+        if response['http_status'] != 200:
+            response = dict(response, http_status=503)
         return make_response(response)
+
+
+def main():
+    """Run database checks from command line"""
+    parser = argparse.ArgumentParser(description='X-Road Central Server API database checks')
+    parser.add_argument('command', choices=('check-indexes',))
+    parser.add_argument(
+        '--config', default='config.json', help='configuration file (default: config.json)')
+    parser.add_argument(
+        '--create', action='store_true', help='create missing indexes concurrently')
+    args = parser.parse_args()
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.INFO)
+
+    configure(load_config(args.config))
+    missing = verify_indexes(create=args.create)
+    if missing is None:
+        sys.exit(2)
+    if missing:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,618 @@
+#!/usr/bin/env python3
+
+"""This is an asyncio variant of X-Road Central Server API.
+
+ASGI application with the same routes, responses and client checks as Flask
+resources of csapi module. Database is accessed with asyncpg connection pool,
+so a single process can serve many requests waiting for database at once.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import itertools
+import time
+import asyncpg
+from csapi import (
+    JOB_PARAMS, LOGGER, MEMBER_CLASS_CACHE, QUERIES, SETTINGS, cache_instance_identifier,
+    cached_instance_identifier, check_cache_flush, check_client, coalesced_code, db_conf_error,
+    db_error_response, db_status, dumps_json, flush_caches_response, get_cache_stats,
+    get_db_conf, get_inputs, loads_json, member_cte_code, member_response, positional_query,
+    registration_lock_key, retry_delay, subsystem_cte_code, subsystem_response)
+
+# Errors of database access that are reported as DB_ERROR
+DB_ERRORS = (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError)
+
+# Database errors after which the whole transaction is run again, by retry reason
+# (the same reasons as csapi.RETRY_ERRORS)
+RETRY_ERRORS = (
+    ('serialization_failure', asyncpg.SerializationError),
+    ('deadlock', asyncpg.DeadlockDetectedError),
+    ('unique_violation', asyncpg.UniqueViolationError),
+    ('stale_prepared_statement', asyncpg.InvalidCachedStatementError))
+
+# Routes with allowed methods by path
+ROUTES = {
+    '/member': ('POST',),
+    '/subsystem': ('POST',),
+    '/status': ('GET',),
+    '/cache': ('GET', 'DELETE')
+}
+
+# Connection pool of current process, database configuration used by it and
+# lock serializing pool creation
+_DB_POOL = {'pool': None, 'key': None, 'lock': asyncio.Lock()}
+
+# Queries of csapi module in asyncpg format by query name
+ASYNC_QUERIES = {name: positional_query(query) for name, query in QUERIES.items()}
+
+
+class SingleFlight:
+    """Coalescing of concurrent identical operations in current process
+
+    asyncio variant of csapi.SingleFlight: operation started while identical
+    operation (with the same key) is in flight awaits it and gets its result
+    instead of running again.
+    """
+
+    def __init__(self):
+        # Operations in flight as {'done': Event, 'result': result, 'failed': bool} by key
+        self._calls = {}
+
+    async def run(self, key, func):
+        """Run coroutine function func unless identical operation is in flight
+
+        Returns two items:
+        * result of func or of identical operation in flight
+        * True if result is shared with identical operation.
+        If operation in flight fails (or is cancelled) then func is run.
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            await call['done'].wait()
+            if call['failed']:
+                return await func(), False
+            return call['result'], True
+
+        call = {'done': asyncio.Event(), 'result': None, 'failed': True}
+        self._calls[key] = call
+        try:
+            call['result'] = await func()
+            call['failed'] = False
+        finally:
+            del self._calls[key]
+            call['done'].set()
+        return call['result'], False
+
+    def in_flight(self, key):
+        """Check if operation with the key is in flight"""
+        return key in self._calls
+
+
+# Registrations in flight in current process
+REGISTRATIONS = SingleFlight()
+
+
+async def fetchrow(conn, name, params=None):
+    """Execute named query and return first row of results"""
+    query, names = ASYNC_QUERIES[name]
+    return await conn.fetchrow(query, *[params[param] for param in names])
+
+
+async def execute(conn, name, params):
+    """Execute named query"""
+    query, names = ASYNC_QUERIES[name]
+    await conn.execute(query, *[params[param] for param in names])
+
+
+async def get_db_pool(conf):
+    """Get connection pool of current process
+
+    Pool is created on first use and recreated when database configuration
+    changes.
+    """
+    key = (
+        conf.get('host', 'localhost'), conf.get('port', '5432'), conf['database'],
+        conf['username'], conf['password'])
+    async with _DB_POOL['lock']:
+        if _DB_POOL['pool'] is None or _DB_POOL['key'] != key:
+            old_pool = _DB_POOL['pool']
+            settings = SETTINGS['async_db_pool']
+            _DB_POOL['pool'] = await asyncpg.create_pool(
+                host=key[0], port=int(key[1]), database=conf['database'], user=conf['username'],
+                password=conf['password'], min_size=settings['min_size'],
+                max_size=settings['max_size'],
+                max_inactive_connection_lifetime=settings['max_idle'],
+                timeout=settings['timeout'])
+            _DB_POOL['key'] = key
+            if old_pool is not None:
+                # Connections still in use are closed when they are released
+                asyncio.ensure_future(old_pool.close())
+    return _DB_POOL['pool']
+
+
+async def close_db_pool():
+    """Close connection pool of current process"""
+    if _DB_POOL['pool'] is not None:
+        await _DB_POOL['pool'].close()
+        _DB_POOL['pool'] = None
+        _DB_POOL['key'] = None
+
+
+def get_checked_db_conf():
+    """Get Central Server database configuration parameters
+
+    Returns two items:
+    * database configuration
+    * error response (if configuration is incomplete).
+    If one item is set then other is always None.
+    """
+    conf = get_db_conf()
+    fault_response = db_conf_error(conf)
+    if fault_response is None:
+        return conf, None
+    return None, fault_response
+
+
+@asynccontextmanager
+async def db_connection(conf):
+    """Get database connection from the pool of current process"""
+    pool = await get_db_pool(conf)
+    async with pool.acquire(timeout=SETTINGS['async_db_pool']['timeout']) as conn:
+        yield conn
+
+
+async def get_member_class_id(conn, member_class):
+    """Get ID of member class from Central Server"""
+    rec = await fetchrow(conn, 'member_class_id', {'str': member_class})
+    return rec[0] if rec else None
+
+
+async def get_cached_member_class_id(conn, member_class):
+    """Get ID of member class using in-process cache of csapi module"""
+    check_cache_flush()
+    found, class_id = MEMBER_CLASS_CACHE.get(member_class)
+    if not found:
+        class_id = await get_member_class_id(conn, member_class)
+        MEMBER_CLASS_CACHE.put(member_class, class_id)
+    return class_id
+
+
+async def subsystem_exists(conn, member_id, subsystem_code):
+    """Check if subsystem exists in Central Server"""
+    rec = await fetchrow(
+        conn, 'subsystem_exists', {'member_id': member_id, 'subsystem_code': subsystem_code})
+    return rec[0]
+
+
+async def get_member_data(conn, class_id, member_code):
+    """Get member data from Central Server"""
+    rec = await fetchrow(conn, 'member_data', {'class_id': class_id, 'member_code': member_code})
+    if rec:
+        return {'id': rec[0], 'name': rec[1]}
+    return None
+
+
+async def lock_registration(conn, *key):
+    """Wait until concurrent registration of the same member or subsystem is finished
+
+    Lock is held until the end of transaction (see csapi.lock_registration).
+    """
+    await execute(conn, 'registration_lock', {'lock': registration_lock_key(*key)})
+
+
+async def get_instance_identifier(conn):
+    """Get X-Road instance identifier from Central Server"""
+    rec = await fetchrow(conn, 'instance_identifier')
+    return rec[0] if rec else None
+
+
+async def get_cached_instance_identifier(conn):
+    """Get X-Road instance identifier cached by csapi module in current process"""
+    instance_identifier = cached_instance_identifier()
+    if instance_identifier is None:
+        instance_identifier = await get_instance_identifier(conn)
+        cache_instance_identifier(instance_identifier)
+    return instance_identifier
+
+
+async def load_instance_identifier():
+    """Load X-Road instance identifier into cache of current process
+
+    Returns loaded instance identifier or None if it cannot be loaded.
+    """
+    (conf, _) = get_checked_db_conf()
+    if conf is None:
+        return None
+
+    try:
+        async with db_connection(conf) as conn:
+            instance_identifier = await get_instance_identifier(conn)
+    except DB_ERRORS as err:
+        LOGGER.error('DB_ERROR: Cannot load instance identifier: %s', err)
+        return None
+
+    cache_instance_identifier(instance_identifier)
+    LOGGER.info('Instance identifier loaded: %s', instance_identifier)
+    return instance_identifier
+
+
+async def register_member(conn, member_class, member_code, member_name):
+    """Register new X-Road member using separate statements for each step
+
+    Returns result code (key of CREATE_RESULTS).
+    """
+    async with conn.transaction():
+        class_id = await get_cached_member_class_id(conn, member_class)
+        if class_id is None:
+            return 'INVALID_MEMBER_CLASS'
+
+        if SETTINGS['coalesce_registrations']:
+            await lock_registration(conn, 'member', member_class, member_code)
+
+        if await get_member_data(conn, class_id, member_code) is not None:
+            return 'MEMBER_EXISTS'
+
+        # Timestamps must be in UTC timezone
+        utc_time = (await fetchrow(conn, 'utc_time'))[0]
+
+        identifier_id = (await fetchrow(conn, 'add_member_identifier', {
+            'instance': await get_cached_instance_identifier(conn), 'class': member_class,
+            'code': member_code, 'time': utc_time}))[0]
+
+        await execute(conn, 'add_member_client', {
+            'code': member_code, 'name': member_name, 'class_id': class_id,
+            'identifier_id': identifier_id, 'time': utc_time})
+
+        await execute(conn, 'add_client_name', {
+            'name': member_name, 'identifier_id': identifier_id, 'time': utc_time})
+
+    return 'CREATED'
+
+
+async def register_subsystem(conn, member_class, member_code, subsystem_code):
+    """Register new X-Road subsystem using separate statements for each step
+
+    Returns result code (key of CREATE_RESULTS).
+    """
+    async with conn.transaction():
+        class_id = await get_cached_member_class_id(conn, member_class)
+        if class_id is None:
+            return 'INVALID_MEMBER_CLASS'
+
+        member_data = await get_member_data(conn, class_id, member_code)
+        if member_data is None:
+            return 'INVALID_MEMBER'
+
+        if SETTINGS['coalesce_registrations']:
+            await lock_registration(conn, 'subsystem', member_class, member_code, subsystem_code)
+
+        if await subsystem_exists(conn, member_data['id'], subsystem_code):
+            return 'SUBSYSTEM_EXISTS'
+
+        # Timestamps must be in UTC timezone
+        utc_time = (await fetchrow(conn, 'utc_time'))[0]
+
+        identifier_id = (await fetchrow(conn, 'add_subsystem_identifier', {
+            'instance': await get_cached_instance_identifier(conn), 'class': member_class,
+            'member_code': member_code, 'subsystem_code': subsystem_code,
+            'time': utc_time}))[0]
+
+        await execute(conn, 'add_subsystem_client', {
+            'subsystem_code': subsystem_code, 'member_id': member_data['id'],
+            'identifier_id': identifier_id, 'time': utc_time})
+
+        await execute(conn, 'add_client_name', {
+            'name': member_data['name'], 'identifier_id': identifier_id, 'time': utc_time})
+
+    return 'CREATED'
+
+
+async def fetch_registration(conn, name, params, key):
+    """Execute registration statement and return its result row
+
+    Statement is executed outside of explicit transaction, so the whole
+    registration takes one round trip to the database. asyncpg sends one
+    statement per query, so coalesced registration takes the registration
+    lock and executes the statement in explicit transaction instead, the
+    statement sees registration committed while waiting for the lock.
+    """
+    if not SETTINGS['coalesce_registrations']:
+        return await fetchrow(conn, name, params)
+    async with conn.transaction():
+        await lock_registration(conn, *key)
+        return await fetchrow(conn, name, params)
+
+
+async def register_member_cte(conn, member_class, member_code, member_name):
+    """Register new X-Road member with single data-modifying statement
+
+    Returns result code (key of CREATE_RESULTS).
+    """
+    rec = await fetch_registration(conn, 'register_member', {
+        'instance': await get_cached_instance_identifier(conn), 'class': member_class,
+        'code': member_code, 'name': member_name}, ('member', member_class, member_code))
+    return member_cte_code(rec[0], rec[1])
+
+
+async def register_subsystem_cte(conn, member_class, member_code, subsystem_code):
+    """Register new X-Road subsystem with single data-modifying statement
+
+    Returns result code (key of CREATE_RESULTS).
+    """
+    rec = await fetch_registration(conn, 'register_subsystem', {
+        'instance': await get_cached_instance_identifier(conn), 'class': member_class,
+        'member_code': member_code, 'subsystem_code': subsystem_code},
+        ('subsystem', member_class, member_code, subsystem_code))
+    return subsystem_cte_code(rec[0], rec[1], rec[2])
+
+
+def retry_reason(err):
+    """Get reason for running failed transaction again, None if error is not transient"""
+    return next((
+        reason for reason, error_class in RETRY_ERRORS if isinstance(err, error_class)), None)
+
+
+async def run_transaction(name, func):
+    """Run coroutine function executing database transaction, retrying transient failures
+
+    Retries are the same as in csapi.run_transaction: func must acquire its
+    own connection, failed attempts are run again with jittered exponential
+    backoff according to transaction_retry settings and error of the last
+    attempt is raised. Returns result of func.
+    """
+    start = time.monotonic()
+    for attempt in itertools.count(1):
+        try:
+            return await func()
+        except asyncpg.PostgresError as err:
+            reason = retry_reason(err)
+            delay = None if reason is None else retry_delay(name, reason, attempt, start, err)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
+
+
+async def run_registration(key, register, exists_code):
+    """Run registration, concurrent identical registrations are coalesced
+
+    Same as csapi.run_registration for coroutine function register.
+    Returns result code.
+    """
+    async def register_with_retry():
+        try:
+            return await run_transaction(key[0], register)
+        except asyncpg.UniqueViolationError as err:
+            LOGGER.warning('Concurrent %s registration detected: %s', key[0], err)
+            return exists_code
+
+    if not SETTINGS['coalesce_registrations']:
+        return await register_with_retry()
+    code, shared = await REGISTRATIONS.run(key, register_with_retry)
+    return coalesced_code(key, code, shared, exists_code)
+
+
+async def add_member(member_class, member_code, member_name, json_data):
+    """Add new X-Road member to Central Server"""
+    (conf, fault_response) = get_checked_db_conf()
+    if conf is None:
+        return fault_response
+
+    async def register_once():
+        register = register_member_cte if SETTINGS['single_round_trip'] else register_member
+        async with db_connection(conf) as conn:
+            return await register(conn, member_class, member_code, member_name)
+
+    code = await run_registration(
+        ('member', member_class, member_code), register_once, 'MEMBER_EXISTS')
+    return member_response(code, member_class, member_code, member_name, json_data)
+
+
+async def add_subsystem(member_class, member_code, subsystem_code, json_data):
+    """Add new X-Road subsystem to Central Server"""
+    (conf, fault_response) = get_checked_db_conf()
+    if conf is None:
+        return fault_response
+
+    async def register_once():
+        register = (
+            register_subsystem_cte if SETTINGS['single_round_trip'] else register_subsystem)
+        async with db_connection(conf) as conn:
+            return await register(conn, member_class, member_code, subsystem_code)
+
+    code = await run_registration(
+        ('subsystem', member_class, member_code, subsystem_code), register_once,
+        'SUBSYSTEM_EXISTS')
+    return subsystem_response(code, member_class, member_code, subsystem_code, json_data)
+
+
+async def test_db():
+    """Test database connection and refresh cached instance identifier"""
+    (conf, fault_response) = get_checked_db_conf()
+    if conf is None:
+        return fault_response
+
+    async with db_connection(conf) as conn:
+        return db_status(await get_instance_identifier(conn))
+
+
+async def send_json(send, http_status, body):
+    """Send JSON response"""
+    content = dumps_json(body) + b'\n'
+    await send({
+        'type': 'http.response.start', 'status': http_status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(content)).encode('ascii'))]})
+    await send({'type': 'http.response.body', 'body': content})
+
+
+async def make_response(send, data):
+    """Send JSON response with the same contents as csapi.make_response"""
+    body = {'code': data['code'], 'msg': data['msg']}
+    # Additional response fields
+    body.update({key: value for key, value in data.items() if key not in (
+        'http_status', 'code', 'msg')})
+    LOGGER.info('Response: %s', data)
+    await send_json(send, data['http_status'], body)
+
+
+def incorrect_client(client_dn):
+    """Return error response when client is not allowed"""
+    LOGGER.error('FORBIDDEN: Client certificate is not allowed: %s', client_dn)
+    return {
+        'http_status': 403, 'code': 'FORBIDDEN',
+        'msg': 'Client certificate is not allowed: {}'.format(client_dn)}
+
+
+async def read_body(receive):
+    """Read complete request body"""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+
+def get_header(scope, name):
+    """Get request header value or None if header is missing"""
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+class App:
+    """ASGI application of Central Server API"""
+    def __init__(self, config):
+        self.config = config
+        self.handlers = {
+            ('/member', 'POST'): self.member,
+            ('/subsystem', 'POST'): self.subsystem,
+            ('/status', 'GET'): self.status,
+            ('/cache', 'GET'): self.cache_stats,
+            ('/cache', 'DELETE'): self.cache_flush
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if scope['path'] not in ROUTES:
+            await send_json(send, 404, {
+                'message': 'The requested URL was not found on the server.'})
+            return
+        if scope['method'] not in ROUTES[scope['path']]:
+            await send_json(send, 405, {
+                'message': 'The method is not allowed for the requested URL.'})
+            return
+
+        if scope['method'] == 'POST':
+            body = await read_body(receive)
+            if body is None:
+                return
+            try:
+                json_data = loads_json(body)
+            except ValueError:
+                await send_json(send, 400, {
+                    'message': 'Failed to decode JSON object'})
+                return
+        else:
+            json_data = None
+
+        response = await self.handlers[(scope['path'], scope['method'])](
+            json_data, get_header(scope, b'x-ssl-client-s-dn'))
+        await make_response(send, response)
+
+    @staticmethod
+    async def lifespan(receive, send):
+        """Handle ASGI lifespan events"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Lock of the running event loop, Python < 3.10 binds locks to the
+                # event loop that was current when the lock was created
+                _DB_POOL['lock'] = asyncio.Lock()
+                # Each worker process loads its own copy
+                await load_instance_identifier()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_db_pool()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def forbidden(self, client_dn):
+        """Get error response when client is not allowed, None if client is allowed"""
+        LOGGER.info('Client DN: %s', client_dn)
+        if check_client(self.config, client_dn):
+            return None
+        return incorrect_client(client_dn)
+
+    async def member(self, json_data, client_dn):
+        """POST /member"""
+        LOGGER.info('Incoming request: %s', json_data)
+        fault_response = self.forbidden(client_dn)
+        if fault_response is not None:
+            return fault_response
+
+        (params, fault_response) = get_inputs(json_data, JOB_PARAMS['members'])
+        if params is None:
+            return fault_response
+
+        try:
+            return await add_member(*params, json_data)
+        except DB_ERRORS as err:
+            return db_error_response(err)
+
+    async def subsystem(self, json_data, client_dn):
+        """POST /subsystem"""
+        LOGGER.info('Incoming request: %s', json_data)
+        fault_response = self.forbidden(client_dn)
+        if fault_response is not None:
+            return fault_response
+
+        (params, fault_response) = get_inputs(json_data, JOB_PARAMS['subsystems'])
+        if params is None:
+            return fault_response
+
+        try:
+            return await add_subsystem(*params, json_data)
+        except DB_ERRORS as err:
+            return db_error_response(err)
+
+    @staticmethod
+    async def status(json_data, client_dn):  # pylint: disable=unused-argument
+        """GET /status"""
+        LOGGER.info('Incoming status request')
+
+        try:
+            return await test_db()
+        except DB_ERRORS as err:
+            return db_error_response(err)
+
+    async def cache_stats(self, json_data, client_dn):  # pylint: disable=unused-argument
+        """GET /cache"""
+        LOGGER.info('Incoming cache statistics request')
+        fault_response = self.forbidden(client_dn)
+        if fault_response is not None:
+            return fault_response
+
+        return get_cache_stats()
+
+    async def cache_flush(self, json_data, client_dn):  # pylint: disable=unused-argument
+        """DELETE /cache
+
+        With a single process (or cache_flush_file configured) the flush
+        affects all processes of the application.
+        """
+        LOGGER.info('Incoming cache flush request')
+        fault_response = self.forbidden(client_dn)
+        if fault_response is not None:
+            return fault_response
+
+        return flush_caches_response()
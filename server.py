@@ -1,29 +1,65 @@
 #!/usr/bin/env python3
 
+import atexit
 import logging
+import os
 from flask import Flask
 from flask_restful import Api
-from csapi import MemberApi, SubsystemApi, StatusApi, load_config
+from csapi import (
+    MemberApi, MembersApi, MemberInfoApi, MemberSubsystemsApi, SubsystemApi, SubsystemsApi,
+    JobApi, ExportApi, MetricsApi, StatusApi, StatusLiveApi, StatusReadyApi, CacheApi,
+    ConfigFile, JOB_RUNNER, STATUS_PROBER, load_instance_identifier, register_metrics,
+    register_query_log, remove_metrics_snapshot, start_index_verification, start_file_log,
+    reload_on_sighup)
 
-handler = logging.FileHandler('/var/log/xroad/csapi.log')
-handler.setFormatter(logging.Formatter('%(asctime)s - %(process)d - %(levelname)s: %(message)s'))
+# Log directory can be overridden for running outside of Central Server (benchmarks)
+LOG_DIR = os.environ.get('CSAPI_LOG_DIR', '/var/log/xroad')
 
-# CS API module logger
-logger_m = logging.getLogger('csapi')
-logger_m.setLevel(logging.INFO)
-logger_m.addHandler(handler)
-
-# Application logger
+# Log files are written by background threads of each worker, requests do not wait for disk.
+# CS API module and application log into csapi.log, slow queries into csapi-slow.log.
+start_file_log(os.path.join(LOG_DIR, 'csapi.log'), 'csapi', __name__)
+start_file_log(os.path.join(LOG_DIR, 'csapi-slow.log'), 'csapi_slow_query')
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logger.addHandler(handler)
 
-config = load_config('config.json')
+# Configuration is reloaded when config.json changes or worker receives SIGHUP,
+# SIGHUP also flushes caches of the worker
+config = ConfigFile('config.json')
+config.load()
+reload_on_sighup(config)
 
 app = Flask(__name__)
+register_metrics(app)
+register_query_log(app)
 api = Api(app)
 api.add_resource(MemberApi, '/member', resource_class_kwargs={'config': config})
+api.add_resource(MembersApi, '/members', resource_class_kwargs={'config': config})
+api.add_resource(
+    MemberInfoApi, '/member/<string:member_class>/<string:member_code>',
+    resource_class_kwargs={'config': config})
+api.add_resource(
+    MemberSubsystemsApi, '/member/<string:member_class>/<string:member_code>/subsystems',
+    resource_class_kwargs={'config': config})
 api.add_resource(SubsystemApi, '/subsystem', resource_class_kwargs={'config': config})
+api.add_resource(SubsystemsApi, '/subsystems', resource_class_kwargs={'config': config})
+api.add_resource(JobApi, '/jobs/<string:job_id>', resource_class_kwargs={'config': config})
+api.add_resource(ExportApi, '/export', resource_class_kwargs={'config': config})
+api.add_resource(MetricsApi, '/metrics', resource_class_kwargs={'config': config})
 api.add_resource(StatusApi, '/status', resource_class_kwargs={'config': config})
+api.add_resource(StatusLiveApi, '/status/live', resource_class_kwargs={'config': config})
+api.add_resource(StatusReadyApi, '/status/ready', resource_class_kwargs={'config': config})
+api.add_resource(CacheApi, '/cache', resource_class_kwargs={'config': config})
+
+# Each gunicorn worker imports this module and loads its own copy
+load_instance_identifier()
+start_index_verification()
+
+# Status requests are served from result of background database check
+STATUS_PROBER.start()
+
+# Background jobs are processed by threads of each worker (when enabled)
+JOB_RUNNER.start()
+
+# Metrics of exited worker are not reported
+atexit.register(remove_metrics_snapshot)
 
 logger.info('Starting Central Server API')
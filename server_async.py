@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+from csapi import ConfigFile, reload_on_sighup, start_file_log
+from csapi_async import App
+
+# Log directory can be overridden for running outside of Central Server (benchmarks)
+LOG_DIR = os.environ.get('CSAPI_LOG_DIR', '/var/log/xroad')
+
+# Log file is written by background thread, event loop does not wait for disk
+start_file_log(os.path.join(LOG_DIR, 'csapi.log'), 'csapi', __name__)
+logger = logging.getLogger(__name__)
+
+# Configuration is reloaded when config.json changes or process receives SIGHUP,
+# SIGHUP also flushes caches of the process
+config = ConfigFile('config.json')
+config.load()
+reload_on_sighup(config)
+
+# Instance identifier is loaded by each worker process on ASGI lifespan startup
+app = App(config)
+
+logger.info('Starting Central Server API (asyncio)')
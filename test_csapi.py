@@ -1,11 +1,19 @@
+import datetime
 import io
 import json
+import logging
+import os
+import queue
+import signal
+import tempfile
+import threading
+import time
 import unittest
 import csapi
 import psycopg2
 from flask import Flask, jsonify
 from flask_restful import Api
-from unittest.mock import patch, MagicMock, mock_open
+from unittest.mock import call, patch, MagicMock, mock_open
 
 
 class MainTestCase(unittest.TestCase):
@@ -19,6 +27,39 @@ class MainTestCase(unittest.TestCase):
             'config': {'allow_all': True}})
         self.api.add_resource(csapi.StatusApi, '/status', resource_class_kwargs={
             'config': {'allow_all': True}})
+        self.api.add_resource(csapi.StatusLiveApi, '/status/live', resource_class_kwargs={
+            'config': {'allow_all': True}})
+        self.api.add_resource(csapi.StatusReadyApi, '/status/ready', resource_class_kwargs={
+            'config': {'allow_all': True}})
+        self.api.add_resource(csapi.CacheApi, '/cache', resource_class_kwargs={
+            'config': {'allow_all': True}})
+        self.api.add_resource(csapi.MembersApi, '/members', resource_class_kwargs={
+            'config': {'allow_all': True}})
+        self.api.add_resource(csapi.SubsystemsApi, '/subsystems', resource_class_kwargs={
+            'config': {'allow_all': True}})
+        self.api.add_resource(
+            csapi.MemberInfoApi, '/member/<string:member_class>/<string:member_code>',
+            resource_class_kwargs={'config': {'allow_all': True}})
+        self.api.add_resource(
+            csapi.MemberSubsystemsApi,
+            '/member/<string:member_class>/<string:member_code>/subsystems',
+            resource_class_kwargs={'config': {'allow_all': True}})
+        self.api.add_resource(csapi.ExportApi, '/export', resource_class_kwargs={
+            'config': {'allow_all': True}})
+        self.api.add_resource(csapi.JobApi, '/jobs/<string:job_id>', resource_class_kwargs={
+            'config': {'allow_all': True}})
+        self.api.add_resource(csapi.MetricsApi, '/metrics', resource_class_kwargs={
+            'config': {'allow_all': True}})
+        csapi.register_metrics(self.app)
+        csapi.register_query_log(self.app)
+        # Tests must not replace cache flush file of a service running on the same host
+        csapi.configure({'cache_flush_file': None})
+        csapi.MEMBER_CLASS_CACHE.clear()
+        csapi.METRICS.clear()
+        csapi.STATUS_PROBER = csapi.StatusProber()
+        csapi._IDEMPOTENCY_STORE.update({'store': None, 'settings': None})
+        csapi._JOBS.update({'table_ready': False, 'purged': None})
+        csapi._CACHE_FLUSH.update({'key': None, 'requested': False})
 
     @patch('builtins.open', return_value=io.StringIO('''adapter=postgresql
 encoding=utf8
@@ -41,6 +82,23 @@ reconnect=true
         self.assertEqual({'database': '', 'password': '', 'username': ''}, response)
         mock_open.assert_called_with('/etc/xroad/db.properties', 'r')
 
+    @patch('os.stat')
+    def test_get_db_conf_cached(self, mock_stat):
+        csapi._DB_CONF_CACHE.update({'key': None, 'conf': None})
+        mock_stat.return_value = MagicMock(st_ino=1, st_mtime_ns=100, st_size=10)
+        with patch('builtins.open', mock_open(read_data='password=pass1\n')) as m:
+            self.assertEqual('pass1', csapi.get_db_conf()['password'])
+            self.assertEqual('pass1', csapi.get_db_conf()['password'])
+            m.assert_called_once_with('/etc/xroad/db.properties', 'r')
+        # Password rotation changes modification time
+        mock_stat.return_value = MagicMock(st_ino=1, st_mtime_ns=200, st_size=10)
+        with patch('builtins.open', mock_open(read_data='password=pass2\n')) as m:
+            self.assertEqual('pass2', csapi.get_db_conf()['password'])
+            m.assert_called_once_with('/etc/xroad/db.properties', 'r')
+        # Returned configuration can not modify cached one
+        csapi.get_db_conf()['password'] = 'CHANGED'
+        self.assertEqual('pass2', csapi.get_db_conf()['password'])
+
     @patch('psycopg2.connect')
     def test_get_db_connection(self, mock_pg_connect):
         csapi.get_db_connection({
@@ -49,7 +107,118 @@ reconnect=true
             'username': 'centerui_user'})
         mock_pg_connect.assert_called_with(
             'host=localhost port=5432 dbname=centerui_production user=centerui_user '
-            'password=centerui_pass')
+            'password=centerui_pass', connection_factory=csapi.PreparingConnection,
+            cursor_factory=csapi.InstrumentedCursor)
+
+    @patch('psycopg2.connect')
+    def test_get_db_connection_host(self, mock_pg_connect):
+        csapi.configure({'db_conf_file': '/tmp/db.properties'})
+        with patch('builtins.open', mock_open(read_data=(
+                'database=db\nusername=user\npassword=pass\nhost=127.0.0.1\n'
+                'port=15432\n'))) as m:
+            csapi.get_db_connection(csapi.get_db_conf())
+            m.assert_called_once_with('/tmp/db.properties', 'r')
+        mock_pg_connect.assert_called_with(
+            'host=127.0.0.1 port=15432 dbname=db user=user password=pass',
+            connection_factory=csapi.PreparingConnection, cursor_factory=csapi.InstrumentedCursor)
+
+    def test_prepared_statement(self):
+        self.assertEqual((
+            "prepare csapi_member_class_id as select id from member_classes where code=$1",
+            'execute csapi_member_class_id(%(str)s)'),
+            csapi.prepared_statement('member_class_id'))
+        prepare, execute = csapi.prepared_statement('add_member_client')
+        self.assertTrue(prepare.startswith(
+            'prepare csapi_add_member_client as insert into security_server_clients'))
+        self.assertIn("$1, $2, $3, $4, 'XRoadMember', $5,\n            $5\n", prepare)
+        self.assertEqual(
+            'execute csapi_add_member_client(%(code)s, %(name)s, %(class_id)s, '
+            '%(identifier_id)s, %(time)s)', execute)
+        self.assertEqual(
+            'execute csapi_utc_time', csapi.prepared_statement('utc_time')[1])
+
+    @staticmethod
+    def prepared_cursor(status=psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+        cur = MagicMock()
+        cur.connection = MagicMock(spec=csapi.PreparingConnection)
+        cur.connection.prepared = set()
+        cur.connection.stale_prepared = False
+        cur.connection.get_transaction_status.return_value = status
+        cur.connection.invalidate_prepared.side_effect = lambda: (
+            cur.connection.prepared.clear(), setattr(cur.connection, 'stale_prepared', True))
+        return cur
+
+    def test_execute_query_prepared(self):
+        csapi.configure({'prepared_statements': True})
+        cur = self.prepared_cursor()
+        csapi.execute_query(cur, 'member_class_id', {'str': 'GOV'})
+        csapi.execute_query(cur, 'member_class_id', {'str': 'COM'})
+        csapi.execute_query(cur, 'utc_time')
+        self.assertEqual([
+            call(csapi.PREPARED_QUERIES['member_class_id'][0]),
+            call('execute csapi_member_class_id(%(str)s)', {'str': 'GOV'}),
+            call('execute csapi_member_class_id(%(str)s)', {'str': 'COM'}),
+            call(csapi.PREPARED_QUERIES['utc_time'][0]),
+            call('execute csapi_utc_time', None)], cur.execute.call_args_list)
+        self.assertEqual(1, csapi.METRICS.counters[(
+            'csapi_db_statements_prepared_total', (('query', 'member_class_id'),))])
+
+        # Prepared and other queries sent together
+        cur = self.prepared_cursor()
+        csapi.execute_query(cur, ('registration_lock', 'member_class_ids'), {'lock': 1})
+        cur.execute.assert_called_with(
+            'execute csapi_registration_lock(%(lock)s);' + csapi.QUERIES['member_class_ids'],
+            {'lock': 1})
+
+        # Disabled prepared statements
+        csapi.configure({'prepared_statements': False})
+        cur = self.prepared_cursor()
+        csapi.execute_query(cur, 'member_class_id', {'str': 'GOV'})
+        csapi.execute_query(cur, 'utc_time')
+        self.assertEqual([
+            call(csapi.QUERIES['member_class_id'], {'str': 'GOV'}),
+            call(csapi.QUERIES['utc_time'])], cur.execute.call_args_list)
+
+    def test_execute_query_prepare_again(self):
+        csapi.configure({'prepared_statements': True})
+        cur = self.prepared_cursor()
+        cur.execute.side_effect = [
+            None, psycopg2.errors.InvalidSqlStatementName('prepared statement does not exist'),
+            None, None, None]
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            csapi.execute_query(cur, 'member_class_id', {'str': 'GOV'})
+            self.assertEqual([
+                'WARNING:csapi:Preparing statements again: prepared statement does not exist'],
+                cm.output)
+        # Failed first statement of transaction is executed again
+        cur.connection.rollback.assert_called_once_with()
+        self.assertEqual([
+            call(csapi.PREPARED_QUERIES['member_class_id'][0]),
+            call('execute csapi_member_class_id(%(str)s)', {'str': 'GOV'}),
+            call('deallocate all'),
+            call(csapi.PREPARED_QUERIES['member_class_id'][0]),
+            call('execute csapi_member_class_id(%(str)s)', {'str': 'GOV'})],
+            cur.execute.call_args_list)
+        self.assertEqual({'member_class_id'}, cur.connection.prepared)
+
+    def test_execute_query_prepare_again_in_transaction(self):
+        csapi.configure({'prepared_statements': True})
+        cur = self.prepared_cursor(psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+        cur.execute.side_effect = [None, psycopg2.errors.FeatureNotSupported(
+            'cached plan must not change result type')]
+        with self.assertRaises(psycopg2.errors.FeatureNotSupported):
+            csapi.execute_query(cur, 'member_data', {'class_id': 1, 'member_code': 'CODE'})
+        cur.connection.rollback.assert_not_called()
+        # Statements are prepared again in next transaction
+        self.assertEqual(set(), cur.connection.prepared)
+        self.assertEqual(True, cur.connection.stale_prepared)
+
+        cur = self.prepared_cursor()
+        cur.execute.side_effect = [None, psycopg2.errors.UniqueViolation('duplicate key')]
+        with self.assertRaises(psycopg2.errors.UniqueViolation):
+            csapi.execute_query(cur, 'add_client_name', {
+                'name': 'NAME', 'identifier_id': 1, 'time': 'TIME'})
+        self.assertEqual({'add_client_name'}, cur.connection.prepared)
 
     def test_get_member_class_id(self):
         cur = MagicMock()
@@ -57,7 +226,7 @@ reconnect=true
         cur.fetchone = MagicMock(return_value=[12345])
         self.assertEqual(12345, csapi.get_member_class_id(cur, 'MEMBER_CLASS'))
         cur.execute.assert_called_with(
-            'select id from member_classes where code=%(str)s', {'str': 'MEMBER_CLASS'})
+            csapi.QUERIES['member_class_id'], {'str': 'MEMBER_CLASS'})
         cur.fetchone.assert_called_once()
 
     def test_get_member_class_id_empty(self):
@@ -72,16 +241,139 @@ reconnect=true
         cur.fetchone = MagicMock(return_value=None)
         self.assertEqual(None, csapi.get_member_class_id(cur, 'MEMBER_CLASS'))
 
+    @patch('csapi.get_member_class_id', side_effect=[12345, None])
+    def test_get_cached_member_class_id(self, mock_get_member_class_id):
+        cache = csapi.MEMBER_CLASS_CACHE
+        hits, misses = cache.hits, cache.misses
+        self.assertEqual(12345, csapi.get_cached_member_class_id('CUR', 'MEMBER_CLASS'))
+        self.assertEqual(12345, csapi.get_cached_member_class_id('CUR', 'MEMBER_CLASS'))
+        # Negative result is cached as well
+        self.assertEqual(None, csapi.get_cached_member_class_id('CUR', 'NO_CLASS'))
+        self.assertEqual(None, csapi.get_cached_member_class_id('CUR', 'NO_CLASS'))
+        self.assertEqual(2, mock_get_member_class_id.call_count)
+        mock_get_member_class_id.assert_called_with('CUR', 'NO_CLASS')
+        self.assertEqual(hits + 2, cache.hits)
+        self.assertEqual(misses + 2, cache.misses)
+
+    def test_lookup_cache(self):
+        cache = csapi.LookupCache(300, 0)
+        self.assertEqual((False, None), cache.get('KEY'))
+        cache.put('KEY', 'VALUE')
+        # Negative caching is disabled
+        cache.put('NONE', None)
+        self.assertEqual((True, 'VALUE'), cache.get('KEY'))
+        self.assertEqual((False, None), cache.get('NONE'))
+        self.assertEqual(
+            {'size': 1, 'hits': 1, 'misses': 2, 'ttl': 300, 'negative_ttl': 0}, cache.stats())
+        cache.clear()
+        self.assertEqual((False, None), cache.get('KEY'))
+        self.assertEqual(0, cache.stats()['size'])
+
+    def test_lookup_cache_expired(self):
+        cache = csapi.LookupCache(-1, 300)
+        cache.put('KEY', 'VALUE')
+        self.assertEqual((False, None), cache.get('KEY'))
+        cache.ttl = 300
+        with patch('time.monotonic', return_value=1000):
+            cache.put('KEY', 'VALUE')
+        with patch('time.monotonic', return_value=1301):
+            self.assertEqual((False, None), cache.get('KEY'))
+
+    def test_configure_member_class_cache(self):
+        csapi.configure({'member_class_cache': {'ttl': 60}})
+        self.assertEqual(60, csapi.MEMBER_CLASS_CACHE.ttl)
+        self.assertEqual(30, csapi.MEMBER_CLASS_CACHE.negative_ttl)
+
+    def test_cache_stats(self):
+        csapi.MEMBER_CLASS_CACHE.put('MEMBER_CLASS', 12345)
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.get('/cache')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('OK', response.json['code'])
+        self.assertEqual(1, response.json['member_classes']['size'])
+
+    def test_cache_flush(self):
+        csapi.MEMBER_CLASS_CACHE.put('MEMBER_CLASS', 12345)
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.delete('/cache')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(
+                'Caches flushed only in worker process {}, other worker processes keep '
+                'cached values until they expire'.format(os.getpid()), response.json['msg'])
+            self.assertEqual(False, response.json['all_workers'])
+            self.assertEqual(os.getpid(), response.json['pid'])
+            self.assertIn(
+                'INFO:csapi:Caches flushed in worker process {}'.format(os.getpid()), cm.output)
+        self.assertEqual((False, None), csapi.MEMBER_CLASS_CACHE.get('MEMBER_CLASS'))
+        self.assertEqual(None, csapi._INSTANCE_IDENTIFIER['value'])
+
+    def test_cache_flush_all_workers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'cache-flush')
+            csapi.configure({'cache_flush_file': path})
+            csapi.MEMBER_CLASS_CACHE.put('MEMBER_CLASS', 12345)
+            with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+                response = self.client.delete('/cache')
+                self.assertIn('INFO:csapi:Caches flushed in all worker processes', cm.output)
+            self.assertEqual('Caches flushed in all worker processes', response.json['msg'])
+            self.assertEqual(True, response.json['all_workers'])
+            self.assertEqual((False, None), csapi.MEMBER_CLASS_CACHE.get('MEMBER_CLASS'))
+            self.assertEqual(['cache-flush'], os.listdir(tmp_dir))
+
+            # Serving worker does not flush again
+            csapi.MEMBER_CLASS_CACHE.put('MEMBER_CLASS', 12345)
+            cur = MagicMock()
+            self.assertEqual(12345, csapi.get_cached_member_class_id(cur, 'MEMBER_CLASS'))
+
+            # Other worker flushes its caches when the file is replaced
+            csapi._INSTANCE_IDENTIFIER['value'] = 'INSTANCE'
+            csapi._CACHE_FLUSH['key'] = ('OTHER',)
+            cur.fetchone.return_value = (54321,)
+            self.assertEqual(54321, csapi.get_cached_member_class_id(cur, 'MEMBER_CLASS'))
+            self.assertEqual(None, csapi._INSTANCE_IDENTIFIER['value'])
+            self.assertEqual(csapi.file_key(path), csapi._CACHE_FLUSH['key'])
+
+    @patch('signal.signal')
+    def test_reload_on_sighup(self, mock_signal):
+        config = MagicMock()
+        csapi.reload_on_sighup(config)
+        self.assertEqual(signal.SIGHUP, mock_signal.call_args[0][0])
+        mock_signal.call_args[0][1](signal.SIGHUP, None)
+        config.reload.assert_called_once_with()
+        self.assertEqual(True, csapi._CACHE_FLUSH['requested'])
+
+    def test_request_cache_flush(self):
+        csapi.MEMBER_CLASS_CACHE.put('MEMBER_CLASS', 12345)
+        csapi._INSTANCE_IDENTIFIER['value'] = 'INSTANCE'
+        csapi.request_cache_flush()
+        # Caches are flushed on next use, not in signal handler
+        self.assertEqual('INSTANCE', csapi._INSTANCE_IDENTIFIER['value'])
+        cur = MagicMock()
+        cur.fetchone.return_value = (54321,)
+        self.assertEqual(54321, csapi.get_cached_member_class_id(cur, 'MEMBER_CLASS'))
+        self.assertEqual(None, csapi._INSTANCE_IDENTIFIER['value'])
+        self.assertEqual(False, csapi._CACHE_FLUSH['requested'])
+        # Flush is done once
+        self.assertEqual(54321, csapi.get_cached_member_class_id(cur, 'MEMBER_CLASS'))
+        self.assertEqual(1, cur.execute.call_count)
+
+    def test_cache_flush_file_error(self):
+        csapi.configure({'cache_flush_file': '/nonexistent/cache-flush'})
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.delete('/cache')
+            self.assertTrue(any(
+                line.startswith('WARNING:csapi:Cannot signal cache flush to other worker '
+                                'processes') for line in cm.output))
+        self.assertEqual(False, response.json['all_workers'])
+
     def test_subsystem_exists(self):
         cur = MagicMock()
         cur.execute = MagicMock()
         cur.fetchone = MagicMock(return_value=[True])
         self.assertEqual(True, csapi.subsystem_exists(cur, 123, 'SUBSYSTEM_CODE'))
         cur.execute.assert_called_with(
-            "\n            select exists(\n                select * from security_server_clients\n"
-            "                where type='Subsystem' and xroad_member_id=%(member_id)s\n"
-            "                    and subsystem_code=%(subsystem_code)s\n"
-            "            )\n        ", {'member_id': 123, 'subsystem_code': 'SUBSYSTEM_CODE'})
+            csapi.QUERIES['subsystem_exists'],
+            {'member_id': 123, 'subsystem_code': 'SUBSYSTEM_CODE'})
         cur.fetchone.assert_called_once()
 
     def test_get_member_data(self):
@@ -91,10 +383,7 @@ reconnect=true
         self.assertEqual(
             {'id': 1234, 'name': 'M_NAME'}, csapi.get_member_data(cur, 123, 'MEMBER_CODE'))
         cur.execute.assert_called_with(
-            "\n            select id, name\n            from security_server_clients\n"
-            "            where type='XRoadMember' and member_class_id=%(class_id)s\n"
-            "                and member_code=%(member_code)s\n"
-            "        ", {'class_id': 123, 'member_code': 'MEMBER_CODE'})
+            csapi.QUERIES['member_data'], {'class_id': 123, 'member_code': 'MEMBER_CODE'})
         cur.fetchone.assert_called_once()
 
     def test_get_member_data_no_member(self):
@@ -103,18 +392,171 @@ reconnect=true
         cur.fetchone = MagicMock(return_value=None)
         self.assertEqual(None, csapi.get_member_data(cur, 123, 'MEMBER_CODE'))
         cur.execute.assert_called_with(
-            "\n            select id, name\n            from security_server_clients\n"
-            "            where type='XRoadMember' and member_class_id=%(class_id)s\n"
-            "                and member_code=%(member_code)s\n"
-            "        ", {'class_id': 123, 'member_code': 'MEMBER_CODE'})
+            csapi.QUERIES['member_data'], {'class_id': 123, 'member_code': 'MEMBER_CODE'})
         cur.fetchone.assert_called_once()
 
+    def test_get_instance_identifier(self):
+        cur = MagicMock()
+        cur.fetchone = MagicMock(return_value=['INSTANCE'])
+        self.assertEqual('INSTANCE', csapi.get_instance_identifier(cur))
+        cur.execute.assert_called_with(csapi.QUERIES['instance_identifier'])
+        cur.fetchone = MagicMock(return_value=None)
+        self.assertEqual(None, csapi.get_instance_identifier(cur))
+
+    @patch('csapi.get_instance_identifier', return_value='INSTANCE')
+    def test_get_cached_instance_identifier(self, mock_get_instance_identifier):
+        csapi._INSTANCE_IDENTIFIER['value'] = None
+        self.assertEqual('INSTANCE', csapi.get_cached_instance_identifier('CUR'))
+        self.assertEqual('INSTANCE', csapi.get_cached_instance_identifier('CUR'))
+        mock_get_instance_identifier.assert_called_once_with('CUR')
+
+    @patch('csapi.get_instance_identifier', return_value='INSTANCE')
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_load_instance_identifier(
+            self, mock_get_db_conf, mock_db_connection, mock_get_instance_identifier):
+        csapi._INSTANCE_IDENTIFIER['value'] = None
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual('INSTANCE', csapi.load_instance_identifier())
+            self.assertEqual(['INFO:csapi:Instance identifier loaded: INSTANCE'], cm.output)
+        mock_get_instance_identifier.assert_called_once_with(
+            mock_db_connection().__enter__().cursor().__enter__())
+        self.assertEqual('INSTANCE', csapi._INSTANCE_IDENTIFIER['value'])
+
+    @patch('csapi.db_connection', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_load_instance_identifier_db_error(self, mock_get_db_conf, mock_db_connection):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(None, csapi.load_instance_identifier())
+            self.assertEqual([
+                'ERROR:csapi:DB_ERROR: Cannot load instance identifier: DB_ERROR_MSG'],
+                cm.output)
+
+    def test_index_columns(self):
+        self.assertEqual(['member_class_id', 'member_code'], csapi.index_columns(
+            'CREATE INDEX idx ON public.security_server_clients USING btree '
+            '(member_class_id, member_code)'))
+        self.assertEqual(['code'], csapi.index_columns(
+            'CREATE UNIQUE INDEX idx ON public.member_classes USING btree ("code" DESC)'))
+        self.assertEqual(None, csapi.index_columns(
+            'CREATE INDEX idx ON public.member_classes USING hash (code)'))
+        self.assertEqual(None, csapi.index_columns(
+            'CREATE INDEX idx ON public.security_server_clients USING btree (member_code) '
+            "WHERE ((type)::text = 'XRoadMember'::text)"))
+
+    def test_get_missing_indexes(self):
+        cur = MagicMock()
+        cur.fetchall.return_value = [
+            ('member_classes', 'pk', 'CREATE UNIQUE INDEX pk ON public.member_classes '
+                                     'USING btree (id)', True),
+            ('member_classes', 'code', 'CREATE INDEX code ON public.member_classes '
+                                       'USING btree (code, id)', True),
+            ('security_server_clients', 'member', 'CREATE INDEX member ON '
+             'public.security_server_clients USING btree (member_code, member_class_id)', True),
+            ('security_server_clients', 'csapi_clients_subsystem_idx', 'CREATE INDEX '
+             'csapi_clients_subsystem_idx ON public.security_server_clients USING btree '
+             '(xroad_member_id, subsystem_code)', False)]
+        missing, invalid = csapi.get_missing_indexes(cur)
+        self.assertEqual([csapi.INDEXES[2]], missing)
+        self.assertEqual({'csapi_clients_subsystem_idx'}, invalid)
+        cur.execute.assert_called_once_with(
+            csapi.QUERIES['table_indexes'],
+            {'tables': ['member_classes', 'security_server_clients']})
+
+    def test_create_indexes(self):
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        cur.fetchone.return_value = (True,)
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual(True, csapi.create_indexes(
+                conn, [csapi.INDEXES[2]], {'csapi_clients_subsystem_idx'}))
+        self.assertEqual(True, conn.autocommit)
+        self.assertEqual([
+            'drop index concurrently if exists csapi_clients_subsystem_idx',
+            'create index concurrently if not exists csapi_clients_subsystem_idx on '
+            'security_server_clients (xroad_member_id, subsystem_code)'],
+            [call[0][0] for call in cur.execute.call_args_list[1:-1]])
+        self.assertEqual(
+            'select pg_advisory_unlock(%(key)s)', cur.execute.call_args_list[-1][0][0])
+
+    def test_create_indexes_locked(self):
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        cur.fetchone.return_value = (False,)
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(False, csapi.create_indexes(conn, [csapi.INDEXES[2]], set()))
+            self.assertEqual(
+                ['INFO:csapi:Missing indexes are being created by another process'], cm.output)
+        cur.execute.assert_called_once()
+
+    @patch('csapi.create_indexes')
+    @patch('csapi.get_missing_indexes', return_value=([csapi.INDEXES[0]], set()))
+    @patch('csapi.get_db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_verify_indexes(
+            self, mock_get_db_conf, mock_get_db_connection, mock_get_missing_indexes,
+            mock_create_indexes):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual([csapi.INDEXES[0]], csapi.verify_indexes())
+            self.assertEqual([
+                'WARNING:csapi:MISSING_INDEX: Lookups of get_member_class_id, '
+                'get_member_class_ids have no index on member_classes (code), recommended '
+                'index: create index concurrently if not exists csapi_member_classes_code_idx '
+                'on member_classes (code)'], cm.output)
+        mock_create_indexes.assert_not_called()
+        mock_get_db_connection.return_value.close.assert_called_once()
+
+    @patch('csapi.create_indexes', return_value=True)
+    @patch('csapi.get_missing_indexes', side_effect=[
+        ([csapi.INDEXES[0]], {'INVALID'}), ([], set())])
+    @patch('csapi.get_db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_verify_indexes_create(
+            self, mock_get_db_conf, mock_get_db_connection, mock_get_missing_indexes,
+            mock_create_indexes):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual([], csapi.verify_indexes(create=True))
+            self.assertEqual('INFO:csapi:Indexes of lookups verified', cm.output[-1])
+        mock_create_indexes.assert_called_once_with(
+            mock_get_db_connection.return_value, [csapi.INDEXES[0]], {'INVALID'})
+
+    @patch('csapi.get_db_connection', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_verify_indexes_db_error(self, mock_get_db_conf, mock_get_db_connection):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(None, csapi.verify_indexes())
+            self.assertEqual(
+                ['ERROR:csapi:DB_ERROR: Cannot verify indexes: DB_ERROR_MSG'], cm.output)
+
+    @patch('csapi.verify_indexes')
+    def test_start_index_verification(self, mock_verify_indexes):
+        csapi.configure({'verify_indexes': False})
+        self.assertEqual(None, csapi.start_index_verification())
+        csapi.configure({'create_missing_indexes': True})
+        csapi.start_index_verification().join()
+        mock_verify_indexes.assert_called_once_with(create=True)
+
     def test_get_utc_time(self):
         cur = MagicMock()
         cur.execute = MagicMock()
         cur.fetchone = MagicMock(return_value=['TIME'])
         self.assertEqual('TIME', csapi.get_utc_time(cur))
-        cur.execute.assert_called_with("select current_timestamp at time zone 'UTC'")
+        cur.execute.assert_called_with(csapi.QUERIES['utc_time'])
         cur.fetchone.assert_called_once()
 
     def test_add_member_identifier(self):
@@ -122,15 +564,12 @@ reconnect=true
         cur.execute = MagicMock()
         cur.fetchone = MagicMock(return_value=[12345])
         self.assertEqual(12345, csapi.add_member_identifier(
-            cur, member_class='MEMBER_CLASS', member_code='MEMBER_CODE', utc_time='TIME'))
+            cur, instance_identifier='INSTANCE', member_class='MEMBER_CLASS',
+            member_code='MEMBER_CODE', utc_time='TIME'))
         cur.execute.assert_called_with(
-            "\n            insert into identifiers (\n                object_type, "
-            "xroad_instance, member_class, member_code, type, created_at,\n                "
-            "updated_at\n            ) values (\n                'MEMBER', "
-            "(select value from system_parameters where key='instanceIdentifier'),\n"
-            "                %(class)s, %(code)s, 'ClientId', %(time)s, %(time)s\n            ) "
-            "returning id\n        ", {
-                'class': 'MEMBER_CLASS', 'code': 'MEMBER_CODE', 'time': 'TIME'})
+            csapi.QUERIES['add_member_identifier'], {
+                'instance': 'INSTANCE', 'class': 'MEMBER_CLASS', 'code': 'MEMBER_CODE',
+                'time': 'TIME'})
         cur.fetchone.assert_called_once()
 
     def test_add_subsystem_identifier(self):
@@ -138,17 +577,11 @@ reconnect=true
         cur.execute = MagicMock()
         cur.fetchone = MagicMock(return_value=[12345])
         self.assertEqual(12345, csapi.add_subsystem_identifier(
-            cur, member_class='MEMBER_CLASS', member_code='MEMBER_CODE',
-            subsystem_code='SUBSYSTEM_CODE', utc_time='TIME'))
+            cur, instance_identifier='INSTANCE', member_class='MEMBER_CLASS',
+            member_code='MEMBER_CODE', subsystem_code='SUBSYSTEM_CODE', utc_time='TIME'))
         cur.execute.assert_called_with(
-            "\n            insert into identifiers (\n                object_type, "
-            "xroad_instance, member_class, member_code, subsystem_code, type,\n"
-            "                created_at, updated_at\n            ) values (\n"
-            "                'SUBSYSTEM', "
-            "(select value from system_parameters where key='instanceIdentifier'),\n"
-            "                %(class)s, %(member_code)s, %(subsystem_code)s, 'ClientId', %(time)s,"
-            " %(time)s\n            ) returning id\n        ", {
-                'class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
+            csapi.QUERIES['add_subsystem_identifier'], {
+                'instance': 'INSTANCE', 'class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
                 'subsystem_code': 'SUBSYSTEM_CODE', 'time': 'TIME'})
         cur.fetchone.assert_called_once()
 
@@ -159,10 +592,7 @@ reconnect=true
             cur, member_code='MEMBER_CODE', member_name='MEMBER_NAME', class_id='CLASS_ID',
             identifier_id='IDENT_ID', utc_time='TIME'))
         cur.execute.assert_called_with(
-            "\n            insert into security_server_clients (\n                member_code, "
-            "name, member_class_id, server_client_id, type, created_at, updated_at\n            ) "
-            "values (\n                %(code)s, %(name)s, %(class_id)s, %(identifier_id)s, "
-            "'XRoadMember', %(time)s,\n                %(time)s\n            )\n        ", {
+            csapi.QUERIES['add_member_client'], {
                 'code': 'MEMBER_CODE', 'name': 'MEMBER_NAME', 'class_id': 'CLASS_ID',
                 'identifier_id': 'IDENT_ID', 'time': 'TIME'})
 
@@ -173,10 +603,7 @@ reconnect=true
             cur, subsystem_code='SUBSYSTEM_CODE', member_id='MEMBER_ID', identifier_id='IDENT_ID',
             utc_time='TIME'))
         cur.execute.assert_called_with(
-            "\n            insert into security_server_clients (\n                subsystem_code, "
-            "xroad_member_id, server_client_id, type, created_at, updated_at\n            ) "
-            "values (\n                %(subsystem_code)s, %(member_id)s, %(identifier_id)s, "
-            "'Subsystem', %(time)s,\n                %(time)s\n            )\n        ", {
+            csapi.QUERIES['add_subsystem_client'], {
                 'subsystem_code': 'SUBSYSTEM_CODE', 'member_id': 'MEMBER_ID',
                 'identifier_id': 'IDENT_ID', 'time': 'TIME'})
 
@@ -186,17 +613,15 @@ reconnect=true
         self.assertEqual(None, csapi.add_client_name(
             cur, member_name='MEMBER_NAME', identifier_id='IDENT_ID', utc_time='TIME'))
         cur.execute.assert_called_with(
-            '\n            insert into security_server_client_names (\n                name, '
-            'client_identifier_id, created_at, updated_at\n            ) values (\n'
-            '                %(name)s, %(identifier_id)s, %(time)s, %(time)s\n            )\n'
-            '        ', {'name': 'MEMBER_NAME', 'identifier_id': 'IDENT_ID', 'time': 'TIME'})
+            csapi.QUERIES['add_client_name'],
+            {'name': 'MEMBER_NAME', 'identifier_id': 'IDENT_ID', 'time': 'TIME'})
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': '',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
-    def test_add_member_no_database(self, mock_get_db_conf, mock_get_db_connection):
+    def test_add_member_no_database(self, mock_get_db_conf, mock_db_connection):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -206,14 +631,14 @@ reconnect=true
             self.assertEqual(
                 ['ERROR:csapi:DB_CONF_ERROR: Cannot access database configuration'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_not_called()
+            mock_db_connection.assert_not_called()
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': '',
             'username': 'centerui_user'})
-    def test_add_member_no_password(self, mock_get_db_conf, mock_get_db_connection):
+    def test_add_member_no_password(self, mock_get_db_conf, mock_db_connection):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -223,14 +648,14 @@ reconnect=true
             self.assertEqual(
                 ['ERROR:csapi:DB_CONF_ERROR: Cannot access database configuration'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_not_called()
+            mock_db_connection.assert_not_called()
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': ''})
-    def test_add_member_no_username(self, mock_get_db_conf, mock_get_db_connection):
+    def test_add_member_no_username(self, mock_get_db_conf, mock_db_connection):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -240,16 +665,16 @@ reconnect=true
             self.assertEqual(
                 ['ERROR:csapi:DB_CONF_ERROR: Cannot access database configuration'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_not_called()
+            mock_db_connection.assert_not_called()
 
-    @patch('csapi.get_member_class_id', return_value=None)
-    @patch('csapi.get_db_connection')
+    @patch('csapi.get_cached_member_class_id', return_value=None)
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
     def test_add_member_no_class(
-            self, mock_get_db_conf, mock_get_db_connection, mock_get_member_class_id):
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -260,21 +685,21 @@ reconnect=true
                 'WARNING:csapi:INVALID_MEMBER_CLASS: Provided Member Class does not exist '
                 '(Request: JSON_DATA)'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_called_with({
+            mock_db_connection.assert_called_with({
                 'database': 'centerui_production', 'password': 'centerui_pass',
                 'username': 'centerui_user'})
-            mock_get_member_class_id.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
+            mock_get_cached_member_class_id.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
 
     @patch('csapi.get_member_data', return_value={'id': 111, 'name': 'M_NAME'})
-    @patch('csapi.get_member_class_id', return_value=12345)
-    @patch('csapi.get_db_connection')
+    @patch('csapi.get_cached_member_class_id', return_value=12345)
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
     def test_add_member_member_exists(
-            self, mock_get_db_conf, mock_get_db_connection, mock_get_member_class_id,
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id,
             mock_get_member_data):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
@@ -286,29 +711,34 @@ reconnect=true
                 'WARNING:csapi:MEMBER_EXISTS: Provided Member already exists (Request: '
                 'JSON_DATA)'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_called_with({
+            mock_db_connection.assert_called_with({
                 'database': 'centerui_production', 'password': 'centerui_pass',
                 'username': 'centerui_user'})
-            mock_get_member_class_id.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
+            mock_get_cached_member_class_id.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
             mock_get_member_data.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
+                mock_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
+            # Concurrent registrations in other worker processes are waited for
+            mock_db_connection().__enter__().cursor().__enter__().execute.assert_called_with(
+                csapi.QUERIES['registration_lock'], {
+                    'lock': csapi.registration_lock_key('member', 'MEMBER_CLASS', 'MEMBER_CODE')})
 
     @patch('csapi.add_client_name')
     @patch('csapi.add_member_client')
     @patch('csapi.add_member_identifier', return_value=123456)
+    @patch('csapi.get_cached_instance_identifier', return_value='INSTANCE')
     @patch('csapi.get_utc_time', return_value='TIME')
     @patch('csapi.get_member_data', return_value=None)
-    @patch('csapi.get_member_class_id', return_value=12345)
-    @patch('csapi.get_db_connection')
+    @patch('csapi.get_cached_member_class_id', return_value=12345)
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
     def test_add_member_ok(
-            self, mock_get_db_conf, mock_get_db_connection, mock_get_member_class_id,
-            mock_get_member_data, mock_get_utc_time, mock_add_member_identifier,
-            mock_add_member_client, mock_add_client_name):
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id,
+            mock_get_member_data, mock_get_utc_time, mock_get_cached_instance_identifier,
+            mock_add_member_identifier, mock_add_member_client, mock_add_client_name):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -319,32 +749,33 @@ reconnect=true
                 'INFO:csapi:Added new Member: member_code=MEMBER_CODE, '
                 'member_name=MEMBER_NAME, member_class=MEMBER_CLASS'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_called_with({
+            mock_db_connection.assert_called_with({
                 'database': 'centerui_production', 'password': 'centerui_pass',
                 'username': 'centerui_user'})
-            mock_get_member_class_id.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
+            mock_get_cached_member_class_id.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
             mock_get_member_data.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
+                mock_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
             mock_get_utc_time.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__())
+                mock_db_connection().__enter__().cursor().__enter__())
             mock_add_member_identifier.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(),
-                member_class='MEMBER_CLASS', member_code='MEMBER_CODE', utc_time='TIME')
+                mock_db_connection().__enter__().cursor().__enter__(),
+                instance_identifier='INSTANCE', member_class='MEMBER_CLASS',
+                member_code='MEMBER_CODE', utc_time='TIME')
             mock_add_member_client.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(),
+                mock_db_connection().__enter__().cursor().__enter__(),
                 member_code='MEMBER_CODE', member_name='MEMBER_NAME', class_id=12345,
                 identifier_id=123456, utc_time='TIME')
             mock_add_client_name.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(),
+                mock_db_connection().__enter__().cursor().__enter__(),
                 member_name='MEMBER_NAME', identifier_id=123456, utc_time='TIME')
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': '',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
-    def test_add_subsystem_no_database(self, mock_get_db_conf, mock_get_db_connection):
+    def test_add_subsystem_no_database(self, mock_get_db_conf, mock_db_connection):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -354,14 +785,14 @@ reconnect=true
             self.assertEqual(
                 ['ERROR:csapi:DB_CONF_ERROR: Cannot access database configuration'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_not_called()
+            mock_db_connection.assert_not_called()
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': '',
             'username': 'centerui_user'})
-    def test_add_subsystem_no_password(self, mock_get_db_conf, mock_get_db_connection):
+    def test_add_subsystem_no_password(self, mock_get_db_conf, mock_db_connection):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -371,14 +802,14 @@ reconnect=true
             self.assertEqual(
                 ['ERROR:csapi:DB_CONF_ERROR: Cannot access database configuration'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_not_called()
+            mock_db_connection.assert_not_called()
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': ''})
-    def test_add_subsystem_no_username(self, mock_get_db_conf, mock_get_db_connection):
+    def test_add_subsystem_no_username(self, mock_get_db_conf, mock_db_connection):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -388,16 +819,16 @@ reconnect=true
             self.assertEqual(
                 ['ERROR:csapi:DB_CONF_ERROR: Cannot access database configuration'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_not_called()
+            mock_db_connection.assert_not_called()
 
-    @patch('csapi.get_member_class_id', return_value=None)
-    @patch('csapi.get_db_connection')
+    @patch('csapi.get_cached_member_class_id', return_value=None)
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
     def test_add_subsystem_no_class(
-            self, mock_get_db_conf, mock_get_db_connection, mock_get_member_class_id):
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -408,21 +839,21 @@ reconnect=true
                 'WARNING:csapi:INVALID_MEMBER_CLASS: Provided Member Class does not exist '
                 '(Request: JSON_DATA)'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_called_with({
+            mock_db_connection.assert_called_with({
                 'database': 'centerui_production', 'password': 'centerui_pass',
                 'username': 'centerui_user'})
-            mock_get_member_class_id.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
+            mock_get_cached_member_class_id.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
 
     @patch('csapi.get_member_data', return_value=None)
-    @patch('csapi.get_member_class_id', return_value=12345)
-    @patch('csapi.get_db_connection')
+    @patch('csapi.get_cached_member_class_id', return_value=12345)
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
     def test_add_subsystem_member_does_not_exist(
-            self, mock_get_db_conf, mock_get_db_connection, mock_get_member_class_id,
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id,
             mock_get_member_data):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
@@ -434,24 +865,24 @@ reconnect=true
                 'WARNING:csapi:INVALID_MEMBER: Provided Member does not exist (Request: '
                 'JSON_DATA)'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_called_with({
+            mock_db_connection.assert_called_with({
                 'database': 'centerui_production', 'password': 'centerui_pass',
                 'username': 'centerui_user'})
-            mock_get_member_class_id.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
+            mock_get_cached_member_class_id.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
             mock_get_member_data.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
+                mock_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
 
     @patch('csapi.subsystem_exists', return_value=True)
     @patch('csapi.get_member_data', return_value={'id': 111, 'name': 'M_NAME'})
-    @patch('csapi.get_member_class_id', return_value=12345)
-    @patch('csapi.get_db_connection')
+    @patch('csapi.get_cached_member_class_id', return_value=12345)
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
     def test_add_member_subsystem_exists(
-            self, mock_get_db_conf, mock_get_db_connection, mock_get_member_class_id,
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id,
             mock_get_member_data, mock_subsystem_exists):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
@@ -463,64 +894,1265 @@ reconnect=true
                 'WARNING:csapi:SUBSYSTEM_EXISTS: Provided Subsystem already exists (Request: '
                 'JSON_DATA)'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_called_with({
+            mock_db_connection.assert_called_with({
                 'database': 'centerui_production', 'password': 'centerui_pass',
                 'username': 'centerui_user'})
-            mock_get_member_class_id.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
+            mock_get_cached_member_class_id.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
             mock_get_member_data.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
+                mock_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
             mock_subsystem_exists.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 111, 'SUBSYSTEM_CODE')
+                mock_db_connection().__enter__().cursor().__enter__(), 111, 'SUBSYSTEM_CODE')
+
+    @patch('csapi.add_client_name')
+    @patch('csapi.add_subsystem_client')
+    @patch('csapi.add_subsystem_identifier', return_value=123456)
+    @patch('csapi.get_cached_instance_identifier', return_value='INSTANCE')
+    @patch('csapi.get_utc_time', return_value='TIME')
+    @patch('csapi.subsystem_exists', return_value=False)
+    @patch('csapi.get_member_data', return_value={'id': 111, 'name': 'M_NAME'})
+    @patch('csapi.get_cached_member_class_id', return_value=12345)
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_add_subsystem_ok(
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id,
+            mock_get_member_data, mock_subsystem_exists, mock_get_utc_time,
+            mock_get_cached_instance_identifier, mock_add_subsystem_identifier,
+            mock_add_subsystem_client, mock_add_client_name):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                {
+                    'code': 'CREATED', 'http_status': 201,
+                    'msg': 'New Subsystem added'},
+                csapi.add_subsystem('MEMBER_CLASS', 'MEMBER_CODE', 'SUBSYSTEM_CODE', 'JSON_DATA'))
+            self.assertEqual([
+                'INFO:csapi:Added new Subsystem: member_class=MEMBER_CLASS, '
+                'member_code=MEMBER_CODE, subsystem_code=SUBSYSTEM_CODE'], cm.output)
+            mock_get_db_conf.assert_called_with()
+            mock_db_connection.assert_called_with({
+                'database': 'centerui_production', 'password': 'centerui_pass',
+                'username': 'centerui_user'})
+            mock_get_cached_member_class_id.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
+            mock_get_member_data.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
+            mock_subsystem_exists.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(), 111, 'SUBSYSTEM_CODE')
+            mock_get_utc_time.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__())
+            mock_add_subsystem_identifier.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(),
+                instance_identifier='INSTANCE', member_class='MEMBER_CLASS',
+                member_code='MEMBER_CODE', subsystem_code='SUBSYSTEM_CODE', utc_time='TIME')
+            mock_add_subsystem_client.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(),
+                identifier_id=123456, member_id=111, subsystem_code='SUBSYSTEM_CODE',
+                utc_time='TIME')
+            mock_add_client_name.assert_called_with(
+                mock_db_connection().__enter__().cursor().__enter__(),
+                member_name='M_NAME', identifier_id=123456, utc_time='TIME')
+
+    @patch('csapi.get_cached_instance_identifier', return_value='INSTANCE')
+    def test_register_member_cte(self, mock_get_cached_instance_identifier):
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        for row, code in (
+                ((False, False), 'INVALID_MEMBER_CLASS'), ((True, True), 'MEMBER_EXISTS'),
+                ((True, False), 'CREATED')):
+            cur.fetchone.return_value = row
+            self.assertEqual(
+                code, csapi.register_member_cte(conn, 'MEMBER_CLASS', 'MEMBER_CODE', 'NAME'))
+        # Single statement is executed in autocommit mode
+        self.assertEqual(3, cur.execute.call_count)
+        self.assertEqual({
+            'instance': 'INSTANCE', 'class': 'MEMBER_CLASS', 'code': 'MEMBER_CODE',
+            'name': 'NAME',
+            'lock': csapi.registration_lock_key('member', 'MEMBER_CLASS', 'MEMBER_CODE')},
+            cur.execute.call_args[0][1])
+        # Advisory lock is taken in the same round trip
+        self.assertEqual(
+            csapi.QUERIES['registration_lock'] + ';' + csapi.QUERIES['register_member'],
+            cur.execute.call_args[0][0])
+        conn.commit.assert_not_called()
+        self.assertEqual(False, conn.autocommit)
+
+    def test_register_cte_uncached_instance_identifier(self):
+        csapi._INSTANCE_IDENTIFIER['value'] = None
+        conn = MagicMock()
+        conn.autocommit = False
+        cur = conn.cursor.return_value.__enter__.return_value
+        autocommit = []
+        cur.execute.side_effect = lambda *args: autocommit.append(conn.autocommit)
+        cur.fetchone.side_effect = [('INSTANCE',), (True, False)]
+        self.assertEqual(
+            'CREATED', csapi.register_member_cte(conn, 'MEMBER_CLASS', 'MEMBER_CODE', 'NAME'))
+        # Loading instance identifier does not open transaction before autocommit is set
+        self.assertEqual([True, True], autocommit)
+        self.assertEqual('INSTANCE', cur.execute.call_args[0][1]['instance'])
+        self.assertEqual(False, conn.autocommit)
+
+        csapi._INSTANCE_IDENTIFIER['value'] = None
+        autocommit.clear()
+        cur.fetchone.side_effect = [('INSTANCE',), (True, True, False)]
+        self.assertEqual('CREATED', csapi.register_subsystem_cte(
+            conn, 'MEMBER_CLASS', 'MEMBER_CODE', 'SUBSYSTEM_CODE'))
+        self.assertEqual([True, True], autocommit)
+        self.assertEqual(False, conn.autocommit)
+
+    @patch('csapi.get_cached_instance_identifier', return_value='INSTANCE')
+    def test_register_subsystem_cte(self, mock_get_cached_instance_identifier):
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        for row, code in (
+                ((False, False, False), 'INVALID_MEMBER_CLASS'),
+                ((True, False, False), 'INVALID_MEMBER'),
+                ((True, True, True), 'SUBSYSTEM_EXISTS'),
+                ((True, True, False), 'CREATED')):
+            cur.fetchone.return_value = row
+            self.assertEqual(code, csapi.register_subsystem_cte(
+                conn, 'MEMBER_CLASS', 'MEMBER_CODE', 'SUBSYSTEM_CODE'))
+        self.assertEqual({
+            'instance': 'INSTANCE', 'class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
+            'subsystem_code': 'SUBSYSTEM_CODE', 'lock': csapi.registration_lock_key(
+                'subsystem', 'MEMBER_CLASS', 'MEMBER_CODE', 'SUBSYSTEM_CODE')},
+            cur.execute.call_args[0][1])
+
+        # Without coalescing only registration statement is executed
+        csapi.configure({'coalesce_registrations': False})
+        csapi.register_subsystem_cte(conn, 'MEMBER_CLASS', 'MEMBER_CODE', 'SUBSYSTEM_CODE')
+        self.assertEqual(csapi.QUERIES['register_subsystem'], cur.execute.call_args[0][0])
+        self.assertEqual(False, conn.autocommit)
+
+    @patch('csapi.get_cached_instance_identifier', return_value='INSTANCE')
+    def test_register_member_cte_db_error(self, mock_get_cached_instance_identifier):
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        cur.execute.side_effect = psycopg2.Error('DB_ERROR_MSG')
+        with self.assertRaises(psycopg2.Error):
+            csapi.register_member_cte(conn, 'MEMBER_CLASS', 'MEMBER_CODE', 'NAME')
+        self.assertEqual(False, conn.autocommit)
+
+    @patch('csapi.register_member_cte', return_value='MEMBER_EXISTS')
+    @patch('csapi.register_member')
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_add_member_single_round_trip(
+            self, mock_get_db_conf, mock_db_connection, mock_register_member,
+            mock_register_member_cte):
+        csapi.configure({'single_round_trip': True})
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                {
+                    'code': 'MEMBER_EXISTS', 'http_status': 409,
+                    'msg': 'Provided Member already exists'},
+                csapi.add_member('MEMBER_CLASS', 'MEMBER_CODE', 'MEMBER_NAME', 'JSON_DATA'))
+            self.assertEqual([
+                'WARNING:csapi:MEMBER_EXISTS: Provided Member already exists (Request: '
+                'JSON_DATA)'], cm.output)
+        mock_register_member.assert_not_called()
+        mock_register_member_cte.assert_called_once_with(
+            mock_db_connection().__enter__(), 'MEMBER_CLASS', 'MEMBER_CODE', 'MEMBER_NAME')
+
+    @patch('csapi.register_subsystem_cte', return_value='CREATED')
+    @patch('csapi.register_subsystem')
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_add_subsystem_single_round_trip(
+            self, mock_get_db_conf, mock_db_connection, mock_register_subsystem,
+            mock_register_subsystem_cte):
+        csapi.configure({'single_round_trip': True})
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual(
+                {'code': 'CREATED', 'http_status': 201, 'msg': 'New Subsystem added'},
+                csapi.add_subsystem(
+                    'MEMBER_CLASS', 'MEMBER_CODE', 'SUBSYSTEM_CODE', 'JSON_DATA'))
+        mock_register_subsystem.assert_not_called()
+        mock_register_subsystem_cte.assert_called_once_with(
+            mock_db_connection().__enter__(), 'MEMBER_CLASS', 'MEMBER_CODE', 'SUBSYSTEM_CODE')
+
+    def test_get_member_class_ids(self):
+        csapi.MEMBER_CLASS_CACHE.put('CACHED', 1)
+        cur = MagicMock()
+        cur.fetchall.return_value = [('GOV', 2)]
+        self.assertEqual(
+            {'CACHED': 1, 'GOV': 2, 'NO_CLASS': None},
+            csapi.get_member_class_ids(cur, ['CACHED', 'GOV', 'NO_CLASS', 'GOV']))
+        self.assertEqual(
+            'select code, id from member_classes where code = any(%(codes)s)',
+            cur.execute.call_args[0][0])
+        self.assertEqual(['GOV', 'NO_CLASS'], sorted(cur.execute.call_args[0][1]['codes']))
+        # Results are cached
+        cur.reset_mock()
+        self.assertEqual({'GOV': 2, 'NO_CLASS': None}, csapi.get_member_class_ids(
+            cur, ['GOV', 'NO_CLASS']))
+        cur.execute.assert_not_called()
+        # Requested cache flush applies to batch lookups too
+        csapi.request_cache_flush()
+        self.assertEqual({'GOV': 2}, csapi.get_member_class_ids(cur, ['GOV']))
+        self.assertEqual(['GOV'], cur.execute.call_args[0][1]['codes'])
+
+    def test_get_members_data(self):
+        cur = MagicMock()
+        self.assertEqual({}, csapi.get_members_data(cur, []))
+        cur.execute.assert_not_called()
+        cur.fetchall.return_value = [(1, 'CODE1', 11, 'NAME1')]
+        self.assertEqual(
+            {(1, 'CODE1'): {'id': 11, 'name': 'NAME1'}},
+            csapi.get_members_data(cur, [(1, 'CODE1'), (1, 'CODE2')]))
+        params = cur.execute.call_args[0][1]
+        self.assertEqual(
+            [(1, 'CODE1'), (1, 'CODE2')],
+            sorted(zip(params['class_ids'], params['member_codes'])))
+
+    @patch('psycopg2.extras.execute_values', return_value=[(11, 'GOV', 'CODE1')])
+    def test_add_member_identifiers(self, mock_execute_values):
+        self.assertEqual({('GOV', 'CODE1'): 11}, csapi.add_member_identifiers(
+            'CUR', instance_identifier='INSTANCE', members=[('GOV', 'CODE1')],
+            utc_time='TIME'))
+        args, kwargs = mock_execute_values.call_args
+        self.assertEqual('CUR', args[0])
+        self.assertEqual(csapi.BATCH_QUERIES['add_member_identifiers'][0], args[1])
+        self.assertEqual(
+            [{'instance': 'INSTANCE', 'class': 'GOV', 'code': 'CODE1', 'time': 'TIME'}],
+            args[2])
+        self.assertEqual(csapi.BATCH_QUERIES['add_member_identifiers'][1], kwargs['template'])
+        self.assertEqual(True, kwargs['fetch'])
+
+    @patch('psycopg2.extras.execute_values')
+    def test_add_member_clients(self, mock_execute_values):
+        csapi.add_member_clients(
+            'CUR', members=[('CODE1', 'NAME1', 1, 11)], utc_time='TIME')
+        self.assertEqual([{
+            'code': 'CODE1', 'name': 'NAME1', 'class_id': 1, 'identifier_id': 11,
+            'time': 'TIME'}], mock_execute_values.call_args[0][2])
+
+    @patch('psycopg2.extras.execute_values')
+    def test_add_client_names(self, mock_execute_values):
+        csapi.add_client_names('CUR', names=[('NAME1', 11)], utc_time='TIME')
+        self.assertEqual(
+            [{'name': 'NAME1', 'identifier_id': 11, 'time': 'TIME'}],
+            mock_execute_values.call_args[0][2])
+
+    @patch('csapi.add_client_names')
+    @patch('csapi.add_member_clients')
+    @patch('csapi.add_member_identifiers', return_value={('GOV', 'NEW'): 21})
+    @patch('csapi.get_cached_instance_identifier', return_value='INSTANCE')
+    @patch('csapi.get_utc_time', return_value='TIME')
+    @patch('csapi.get_members_data', return_value={(1, 'OLD'): {'id': 11, 'name': 'NAME'}})
+    @patch('csapi.get_member_class_ids', return_value={'GOV': 1, 'NO_CLASS': None})
+    def test_register_members(
+            self, mock_get_member_class_ids, mock_get_members_data, mock_get_utc_time,
+            mock_get_cached_instance_identifier, mock_add_member_identifiers,
+            mock_add_member_clients, mock_add_client_names):
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        self.assertEqual(
+            ['CREATED', 'MEMBER_EXISTS', 'INVALID_MEMBER_CLASS', 'MEMBER_EXISTS'],
+            csapi.register_members(conn, [
+                {'member_class': 'GOV', 'member_code': 'NEW', 'member_name': 'NEW_NAME'},
+                {'member_class': 'GOV', 'member_code': 'OLD', 'member_name': 'NAME'},
+                {'member_class': 'NO_CLASS', 'member_code': 'NEW', 'member_name': 'NAME'},
+                {'member_class': 'GOV', 'member_code': 'NEW', 'member_name': 'DUPLICATE'}]))
+        mock_get_members_data.assert_called_once_with(
+            cur, [(1, 'NEW'), (1, 'OLD'), (1, 'NEW')])
+        mock_add_member_identifiers.assert_called_once_with(
+            cur, instance_identifier='INSTANCE', members=[('GOV', 'NEW')], utc_time='TIME')
+        mock_add_member_clients.assert_called_once_with(
+            cur, members=[('NEW', 'NEW_NAME', 1, 21)], utc_time='TIME')
+        mock_add_client_names.assert_called_once_with(
+            cur, names=[('NEW_NAME', 21)], utc_time='TIME')
+        conn.commit.assert_called_once_with()
+
+    @patch('csapi.get_utc_time')
+    @patch('csapi.get_members_data', return_value={})
+    @patch('csapi.get_member_class_ids', return_value={'NO_CLASS': None})
+    def test_register_members_nothing_to_add(
+            self, mock_get_member_class_ids, mock_get_members_data, mock_get_utc_time):
+        conn = MagicMock()
+        self.assertEqual(['INVALID_MEMBER_CLASS'], csapi.register_members(conn, [
+            {'member_class': 'NO_CLASS', 'member_code': 'NEW', 'member_name': 'NAME'}]))
+        mock_get_utc_time.assert_not_called()
+
+    def test_get_batch_input(self):
+        (items, results), err = csapi.get_batch_input([
+            {'member_class': 'GOV', 'member_code': 'CODE', 'extra': 'VALUE'},
+            {'member_class': 'GOV'},
+            {'member_class': 'GOV', 'member_code': 1},
+            'NOT_DICT'], ('member_class', 'member_code'))
+        self.assertEqual(None, err)
+        self.assertEqual([{'member_class': 'GOV', 'member_code': 'CODE'}], items)
+        self.assertEqual([
+            None,
+            {
+                'member_class': 'GOV', 'code': 'MISSING_PARAMETER',
+                'msg': 'Request parameter member_code is missing'},
+            {
+                'member_class': 'GOV', 'member_code': 1, 'code': 'INVALID_PARAMETER',
+                'msg': 'Request parameter member_code must be a string'},
+            {'code': 'MISSING_PARAMETER', 'msg': 'Request parameter member_class is missing'}],
+            results)
+
+    def test_get_batch_input_err(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual((None, {
+                'http_status': 400, 'code': 'INVALID_REQUEST',
+                'msg': 'Request must be a list of items'}), csapi.get_batch_input({}, ()))
+            csapi.configure({'batch_max_size': 1})
+            self.assertEqual((None, {
+                'http_status': 413, 'code': 'BATCH_TOO_LARGE',
+                'msg': 'Request can contain up to 1 items'}), csapi.get_batch_input([{}, {}], ()))
+            self.assertEqual([
+                'WARNING:csapi:INVALID_REQUEST: Request must be a list of items',
+                'WARNING:csapi:BATCH_TOO_LARGE: Request contains 2 items, maximum is 1'],
+                cm.output)
+
+    @patch('csapi.register_members', return_value=['CREATED', 'MEMBER_EXISTS'])
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_add_members(self, mock_get_db_conf, mock_db_connection, mock_register_members):
+        items = [
+            {'member_class': 'GOV', 'member_code': 'NEW', 'member_name': 'NAME'},
+            {'member_class': 'GOV', 'member_code': 'OLD', 'member_name': 'NAME'}]
+        missing = {'code': 'MISSING_PARAMETER', 'msg': 'Request parameter member_class is missing'}
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual({
+                'http_status': 200, 'code': 'OK', 'msg': 'Batch processed', 'created': 1,
+                'failed': 2, 'results': [
+                    {
+                        'member_class': 'GOV', 'member_code': 'NEW', 'code': 'CREATED',
+                        'msg': 'New Member added'},
+                    missing,
+                    {
+                        'member_class': 'GOV', 'member_code': 'OLD', 'code': 'MEMBER_EXISTS',
+                        'msg': 'Provided Member already exists'}]},
+                csapi.add_members(items, [None, missing, None]))
+            self.assertEqual([
+                'INFO:csapi:Added new Member: member_code=NEW, member_name=NAME, '
+                'member_class=GOV'], cm.output)
+        mock_register_members.assert_called_once_with(mock_db_connection().__enter__(), items)
+
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': '',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_add_members_no_database(self, mock_get_db_conf, mock_db_connection):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual('DB_CONF_ERROR', csapi.add_members([], [])['code'])
+        mock_db_connection.assert_not_called()
+
+    @patch('csapi.add_members', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Batch processed', 'results': ['RESULT']})
+    def test_members_query(self, mock_add_members):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.post('/members', data=json.dumps([
+                {'member_class': 'GOV', 'member_code': 'CODE', 'member_name': 'NAME'}]))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(['RESULT'], response.json['results'])
+            self.assertEqual([
+                'INFO:csapi:Incoming batch request: 1 items',
+                'INFO:csapi:Client DN: None',
+                "INFO:csapi:Response: {'http_status': 200, 'code': 'OK', 'msg': "
+                "'Batch processed'}"], cm.output)
+        mock_add_members.assert_called_once_with(
+            [{'member_class': 'GOV', 'member_code': 'CODE', 'member_name': 'NAME'}], [None])
+
+    def test_members_invalid_query(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/members', data=json.dumps({}))
+            self.assertEqual(400, response.status_code)
+            self.assertEqual('INVALID_REQUEST', response.json['code'])
+
+    @patch('csapi.add_members', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    def test_members_db_error_handled(self, mock_add_members):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.post('/members', data=json.dumps([]))
+            self.assertEqual(500, response.status_code)
+            self.assertIn(
+                'ERROR:csapi:DB_ERROR: Unclassified database error: DB_ERROR_MSG', cm.output)
+
+    @patch('csapi.add_members')
+    @patch('csapi.add_job', return_value={
+        'http_status': 202, 'code': 'ACCEPTED', 'msg': 'Job accepted', 'job_id': 'JOB_ID'})
+    def test_members_async_query(self, mock_add_job, mock_add_members):
+        items = [
+            {'member_class': 'GOV', 'member_code': 'CODE', 'member_name': 'NAME'},
+            {'member_class': 'GOV'}]
+        csapi.configure({'jobs': {'workers': 1}, 'batch_max_size': 1})
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/members', data=json.dumps(items), headers={
+                'Prefer': 'wait=10, respond-async', 'X-Ssl-Client-S-Dn': 'CN=client'})
+            self.assertEqual(202, response.status_code)
+            self.assertEqual(
+                {'code': 'ACCEPTED', 'msg': 'Job accepted', 'job_id': 'JOB_ID'}, response.json)
+            self.assertTrue(response.headers['Location'].endswith('/jobs/JOB_ID'))
+            self.assertEqual('respond-async', response.headers['Preference-Applied'])
+            # Jobs are not limited by batch_max_size
+            mock_add_job.assert_called_once_with('members', 'CN=client', [items[0]], [
+                None, {'member_class': 'GOV', 'code': 'MISSING_PARAMETER',
+                       'msg': 'Request parameter member_code is missing'}])
+
+            # Without header request is processed synchronously
+            response = self.client.post('/members', data=json.dumps(items))
+            self.assertEqual('BATCH_TOO_LARGE', response.json['code'])
+            csapi.configure({'jobs': {'workers': 0}})
+            response = self.client.post('/members', data=json.dumps(items[:1]), headers={
+                'Prefer': 'respond-async'})
+            mock_add_members.assert_called_once()
+            mock_add_job.assert_called_once()
+
+    @patch('csapi.add_job', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    def test_subsystems_async_query(self, mock_add_job):
+        csapi.configure({'jobs': {'workers': 1}})
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.post('/subsystems', data=json.dumps([{
+                'member_class': 'GOV', 'member_code': 'CODE', 'subsystem_code': 'SUB'}]),
+                headers={'Prefer': 'respond-async'})
+            self.assertEqual(500, response.status_code)
+            self.assertEqual('DB_ERROR', response.json['code'])
+            self.assertNotIn('Location', response.headers)
+            self.assertIn(
+                'ERROR:csapi:DB_ERROR: Unclassified database error: DB_ERROR_MSG', cm.output)
+        self.assertEqual('subsystems', mock_add_job.call_args[0][0])
+
+    @patch('csapi.JOB_RUNNER')
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+        'username': 'u', 'password': 'p', 'database': 'd'})
+    def test_add_job(self, mock_get_db_conf, mock_db_connection, mock_job_runner):
+        conn = mock_db_connection().__enter__()
+        cur = conn.cursor().__enter__()
+        cur.fetchone.return_value = (0,)
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = csapi.add_job('members', 'CN=client', [{'ITEM': 1}], [None, 'RESULT'])
+        self.assertEqual(202, response['http_status'])
+        params = cur.execute.call_args[0][1]
+        self.assertEqual(csapi.QUERIES['add_job'], cur.execute.call_args[0][0])
+        self.assertEqual(response['job_id'], params['id'])
+        self.assertEqual({
+            'id': params['id'], 'type': 'members', 'client_dn': 'CN=client',
+            'items': '[{"ITEM":1}]', 'results': '[null,"RESULT"]', 'total': 2}, params)
+        cur.execute.assert_any_call(csapi.JOBS_TABLES)
+        mock_job_runner.wakeup.assert_called_once_with()
+
+        cur.fetchone.return_value = (100,)
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = csapi.add_job('members', 'CN=client', [], [])
+        self.assertEqual('TOO_MANY_JOBS', response['code'])
+        self.assertEqual(429, response['http_status'])
+
+    @patch('csapi.register_job_chunk', side_effect=[['CREATED', 'MEMBER_EXISTS'], ['CREATED']])
+    @patch('csapi.db_connection')
+    def test_run_job(self, mock_db_connection, mock_register_job_chunk):
+        csapi.configure({'batch_chunk_size': 2})
+        conn = mock_db_connection().__enter__()
+        cur = conn.cursor().__enter__()
+        cur.rowcount = 1
+        items = [
+            {'member_class': 'GOV', 'member_code': str(i), 'member_name': 'NAME'}
+            for i in range(4)]
+        job = {'id': 'JOB_ID', 'type': 'members', 'items': json.dumps(items), 'processed': 1}
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual('COMPLETED', csapi.run_job({}, job, 'WORKER'))
+        # Processing continues after already committed items
+        self.assertEqual([items[1:3], items[3:]], [
+            call[0][2] for call in mock_register_job_chunk.call_args_list])
+        self.assertEqual(2, conn.commit.call_count)
+        updates = [
+            call[0][1] for call in cur.execute.call_args_list
+            if call[0][0] == csapi.QUERIES['update_job']]
+        self.assertEqual([
+            {'id': 'JOB_ID', 'worker': 'WORKER', 'status': 'RUNNING', 'processed': 3,
+             'created': 1},
+            {'id': 'JOB_ID', 'worker': 'WORKER', 'status': 'COMPLETED', 'processed': 4,
+             'created': 1}], updates)
+        cur.execute.assert_called_with(csapi.QUERIES['add_job_results'], {
+            'id': 'JOB_ID', 'position': 3, 'results': (
+                '[{"member_class":"GOV","member_code":"3","code":"CREATED",'
+                '"msg":"New Member added"}]')})
+        self.assertEqual(2, len(cm.output))
+
+        # Job taken over by another worker is not updated
+        cur.rowcount = 0
+        mock_register_job_chunk.side_effect = [['CREATED']]
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(None, csapi.run_job({}, dict(job, processed=3), 'WORKER'))
+        self.assertEqual(
+            ['WARNING:csapi:Job JOB_ID was taken over by another worker'], cm.output)
+        conn.rollback.assert_called_once_with()
+        self.assertEqual(2, conn.commit.call_count)
+
+    @patch('csapi.run_job', return_value='COMPLETED')
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+        'username': 'u', 'password': 'p', 'database': 'd'})
+    def test_process_job(self, mock_get_db_conf, mock_db_connection, mock_run_job):
+        cur = mock_db_connection().__enter__().cursor().__enter__()
+        cur.fetchone.return_value = None
+        self.assertEqual(False, csapi.process_job('WORKER'))
+        cur.execute.assert_any_call(csapi.QUERIES['purge_jobs'], {'ttl': 604800})
+        cur.execute.assert_called_with(csapi.QUERIES['claim_job'], {
+            'worker': 'WORKER', 'stale_timeout': 60})
+        mock_run_job.assert_not_called()
+
+        cur.fetchone.return_value = ('JOB_ID', 'subsystems', '[]', 0)
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(True, csapi.process_job('WORKER'))
+        mock_run_job.assert_called_once_with(
+            mock_get_db_conf.return_value,
+            {'id': 'JOB_ID', 'type': 'subsystems', 'items': '[]', 'processed': 0}, 'WORKER')
+        self.assertEqual([
+            'INFO:csapi:Processing Job: job_id=JOB_ID, type=subsystems',
+            'INFO:csapi:Job JOB_ID finished: COMPLETED'], cm.output)
+        self.assertEqual(1, csapi.METRICS.counters[('csapi_jobs_total', (
+            ('type', 'subsystems'), ('status', 'COMPLETED')))])
+
+        mock_run_job.side_effect = psycopg2.Error('DB_ERROR_MSG')
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(True, csapi.process_job('WORKER'))
+        self.assertIn('ERROR:csapi:DB_ERROR: Job JOB_ID failed: DB_ERROR_MSG', cm.output)
+        cur.execute.assert_called_with(csapi.QUERIES['fail_job'], {
+            'id': 'JOB_ID', 'worker': 'WORKER', 'error': 'Unclassified database error'})
+
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+        'username': 'u', 'password': 'p', 'database': 'd'})
+    def test_job_query(self, mock_get_db_conf, mock_db_connection):
+        cur = mock_db_connection().__enter__().cursor().__enter__()
+        job_id = 'a' * 32
+        cur.fetchone.return_value = (
+            'members', 'RUNNING', 4, 1, 1, json.dumps([None, 'MISSING', None, None]), None,
+            datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2026, 1, 2, tzinfo=datetime.timezone.utc))
+        cur.fetchall.return_value = [(json.dumps(['CREATED']),)]
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.get('/jobs/' + job_id)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual({
+                'code': 'OK', 'msg': 'Job found', 'job_id': job_id, 'type': 'members',
+                'status': 'RUNNING', 'total': 4, 'processed': 2, 'created': 1, 'failed': 1,
+                'error': None, 'created_at': '2026-01-01T00:00:00+00:00',
+                'updated_at': '2026-01-02T00:00:00+00:00',
+                'results': ['CREATED', 'MISSING', None, None]}, response.json)
+            self.assertEqual('INFO:csapi:Incoming job request: ' + job_id, cm.output[0])
+            cur.execute.assert_any_call(
+                csapi.QUERIES['job'], {'id': job_id, 'client_dn': None})
+
+            cur.fetchone.return_value = None
+            response = self.client.get('/jobs/' + job_id)
+            self.assertEqual(404, response.status_code)
+            self.assertEqual('JOB_NOT_FOUND', response.json['code'])
+
+            # Job tables are not created yet
+            cur.execute.side_effect = psycopg2.errors.UndefinedTable('NO_TABLE')
+            response = self.client.get('/jobs/' + job_id)
+            self.assertEqual(404, response.status_code)
+
+            mock_db_connection.reset_mock()
+            response = self.client.get('/jobs/INVALID')
+            self.assertEqual(404, response.status_code)
+            mock_db_connection.assert_not_called()
+
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+        'username': 'u', 'password': 'p', 'database': 'd'})
+    def test_job_query_other_client(self, mock_get_db_conf, mock_db_connection):
+        cur = mock_db_connection().__enter__().cursor().__enter__()
+        job_id = 'a' * 32
+        # Job of another client is not matched by the query
+        cur.fetchone.return_value = None
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.get(
+                '/jobs/' + job_id, headers={'X-Ssl-Client-S-Dn': 'CN=other'})
+            self.assertIn('WARNING:csapi:JOB_NOT_FOUND: Job {} not found'.format(job_id), cm.output)
+        self.assertEqual(404, response.status_code)
+        self.assertEqual('JOB_NOT_FOUND', response.json['code'])
+        cur.execute.assert_called_once_with(
+            csapi.QUERIES['job'], {'id': job_id, 'client_dn': 'CN=other'})
+        self.assertIn('client_dn is not distinct from %(client_dn)s', csapi.QUERIES['job'])
+
+    def test_job_runner(self):
+        runner = csapi.JobRunner()
+        with patch('csapi.process_job', return_value=False) as mock_process_job:
+            runner.start()
+            self.assertEqual(False, runner.running())
+            csapi.configure({'jobs': {'workers': 2, 'poll_interval': 60}})
+            runner.wakeup()
+            for _ in range(500):
+                if mock_process_job.call_count >= 2:
+                    break
+                time.sleep(0.01)
+            # Each worker thread checks for jobs when it starts
+            self.assertEqual(
+                {'csapi-job-0', 'csapi-job-1'},
+                {thread.name for _, thread in runner._threads})
+            self.assertLessEqual(2, mock_process_job.call_count)
+            csapi.configure({'jobs': {'workers': 0}})
+            runner.wakeup()
+            self.assertEqual(False, runner.running())
+
+    def test_get_existing_subsystems(self):
+        cur = MagicMock()
+        self.assertEqual(set(), csapi.get_existing_subsystems(cur, []))
+        cur.execute.assert_not_called()
+        cur.fetchall.return_value = [(11, 'SUB1')]
+        self.assertEqual(
+            {(11, 'SUB1')}, csapi.get_existing_subsystems(cur, [(11, 'SUB1'), (11, 'SUB2')]))
+        params = cur.execute.call_args[0][1]
+        self.assertEqual(
+            [(11, 'SUB1'), (11, 'SUB2')],
+            sorted(zip(params['member_ids'], params['subsystem_codes'])))
+
+    @patch('psycopg2.extras.execute_values', return_value=[(21, 'GOV', 'CODE1', 'SUB1')])
+    def test_add_subsystem_identifiers(self, mock_execute_values):
+        self.assertEqual({('GOV', 'CODE1', 'SUB1'): 21}, csapi.add_subsystem_identifiers(
+            'CUR', instance_identifier='INSTANCE', subsystems=[('GOV', 'CODE1', 'SUB1')],
+            utc_time='TIME'))
+        args, kwargs = mock_execute_values.call_args
+        self.assertEqual([{
+            'instance': 'INSTANCE', 'class': 'GOV', 'member_code': 'CODE1',
+            'subsystem_code': 'SUB1', 'time': 'TIME'}], args[2])
+        self.assertEqual(True, kwargs['fetch'])
+
+    @patch('psycopg2.extras.execute_values')
+    def test_add_subsystem_clients(self, mock_execute_values):
+        csapi.add_subsystem_clients('CUR', subsystems=[('SUB1', 11, 21)], utc_time='TIME')
+        self.assertEqual([{
+            'subsystem_code': 'SUB1', 'member_id': 11, 'identifier_id': 21, 'time': 'TIME'}],
+            mock_execute_values.call_args[0][2])
+
+    @patch('csapi.get_members_data', return_value={(1, 'CODE1'): {'id': 11, 'name': 'NAME'}})
+    @patch('csapi.get_member_class_ids', return_value={'GOV': 1, 'NO_CLASS': None})
+    def test_get_batch_members(self, mock_get_member_class_ids, mock_get_members_data):
+        items = [
+            {'member_class': 'GOV', 'member_code': 'CODE1'},
+            {'member_class': 'NO_CLASS', 'member_code': 'CODE1'}]
+        self.assertEqual((
+            {'GOV': 1, 'NO_CLASS': None}, {(1, 'CODE1'): {'id': 11, 'name': 'NAME'}}),
+            csapi.get_batch_members('CUR', items))
+        mock_get_member_class_ids.assert_called_once_with('CUR', ['GOV', 'NO_CLASS'])
+        mock_get_members_data.assert_called_once_with('CUR', [(1, 'CODE1')])
+
+    @patch('csapi.add_client_names')
+    @patch('csapi.add_subsystem_clients')
+    @patch('csapi.add_subsystem_identifiers', return_value={('GOV', 'CODE1', 'NEW'): 21})
+    @patch('csapi.get_cached_instance_identifier', return_value='INSTANCE')
+    @patch('csapi.get_utc_time', return_value='TIME')
+    @patch('csapi.get_existing_subsystems', return_value={(11, 'OLD')})
+    def test_register_subsystems(
+            self, mock_get_existing_subsystems, mock_get_utc_time,
+            mock_get_cached_instance_identifier, mock_add_subsystem_identifiers,
+            mock_add_subsystem_clients, mock_add_client_names):
+        conn = MagicMock()
+        cur = conn.cursor.return_value.__enter__.return_value
+        self.assertEqual(
+            [
+                'CREATED', 'SUBSYSTEM_EXISTS', 'INVALID_MEMBER_CLASS', 'INVALID_MEMBER',
+                'SUBSYSTEM_EXISTS'],
+            csapi.register_subsystems(conn, [
+                {'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'NEW'},
+                {'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'OLD'},
+                {'member_class': 'NO_CLASS', 'member_code': 'CODE1', 'subsystem_code': 'NEW'},
+                {'member_class': 'GOV', 'member_code': 'CODE2', 'subsystem_code': 'NEW'},
+                {'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'NEW'}],
+                {'GOV': 1, 'NO_CLASS': None}, {(1, 'CODE1'): {'id': 11, 'name': 'NAME'}}))
+        mock_get_existing_subsystems.assert_called_once_with(
+            cur, [(11, 'NEW'), (11, 'OLD'), (11, 'NEW')])
+        mock_add_subsystem_identifiers.assert_called_once_with(
+            cur, instance_identifier='INSTANCE', subsystems=[('GOV', 'CODE1', 'NEW')],
+            utc_time='TIME')
+        mock_add_subsystem_clients.assert_called_once_with(
+            cur, subsystems=[('NEW', 11, 21)], utc_time='TIME')
+        mock_add_client_names.assert_called_once_with(
+            cur, names=[('NAME', 21)], utc_time='TIME')
+        conn.commit.assert_called_once_with()
+
+    @patch('csapi.register_subsystems', side_effect=[['CREATED', 'SUBSYSTEM_EXISTS'], ['CREATED']])
+    @patch('csapi.get_batch_members', return_value=('CLASS_IDS', 'MEMBERS'))
+    @patch('csapi.db_connection')
+    def test_add_subsystems(
+            self, mock_db_connection, mock_get_batch_members, mock_register_subsystems):
+        csapi.configure({'batch_chunk_size': 2})
+        items = [
+            {'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB1'},
+            {'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB2'},
+            {'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB3'}]
+        missing = {'code': 'MISSING_PARAMETER', 'msg': 'Request parameter member_class is missing'}
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            lines = list(csapi.add_subsystems('CONF', items, [None, missing, None, None]))
+            self.assertEqual([
+                'INFO:csapi:Added new Subsystem: member_class=GOV, member_code=CODE1, '
+                'subsystem_code=SUB1',
+                'INFO:csapi:Added new Subsystem: member_class=GOV, member_code=CODE1, '
+                'subsystem_code=SUB3',
+                "INFO:csapi:Response: {'code': 'OK', 'msg': 'Batch processed', 'created': 2, "
+                "'failed': 2}"], cm.output)
+        self.assertEqual([
+            {
+                'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB1',
+                'code': 'CREATED', 'msg': 'New Subsystem added'},
+            missing,
+            {
+                'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB2',
+                'code': 'SUBSYSTEM_EXISTS', 'msg': 'Provided Subsystem already exists'},
+            {
+                'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB3',
+                'code': 'CREATED', 'msg': 'New Subsystem added'},
+            {'code': 'OK', 'msg': 'Batch processed', 'created': 2, 'failed': 2}],
+            [json.loads(line) for line in lines])
+        mock_db_connection.assert_called_with('CONF')
+        # Items are committed in chunks
+        self.assertEqual(
+            [items[:2], items[2:]],
+            [call[0][1] for call in mock_register_subsystems.call_args_list])
+        mock_register_subsystems.assert_called_with(
+            mock_db_connection().__enter__(), items[2:], 'CLASS_IDS', 'MEMBERS')
+
+    @patch('csapi.register_subsystems', side_effect=[
+        ['CREATED'], psycopg2.errors.UniqueViolation('DB_ERROR_MSG'), ['CREATED']])
+    @patch('csapi.get_batch_members', return_value=({}, {}))
+    @patch('csapi.db_connection')
+    def test_add_subsystems_db_error(
+            self, mock_db_connection, mock_get_batch_members, mock_register_subsystems):
+        csapi.configure({'batch_chunk_size': 1, 'transaction_retry': {'attempts': 1}})
+        items = [
+            {'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB1'},
+            {'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB2'},
+            {'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB3'}]
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            lines = list(csapi.add_subsystems('CONF', items, [None, None, None]))
+            self.assertIn(
+                'ERROR:csapi:DB_ERROR: Unclassified database error: DB_ERROR_MSG', cm.output)
+        # Items of failed chunk get DB_ERROR, following chunks are still processed
+        self.assertEqual([
+            {
+                'member_class': 'GOV', 'member_code': 'CODE1', 'subsystem_code': 'SUB2',
+                'code': 'DB_ERROR', 'msg': 'Unclassified database error'},
+            {'code': 'OK', 'msg': 'Batch processed', 'created': 2, 'failed': 1}],
+            [json.loads(line) for line in lines[1::2]])
+        self.assertEqual(
+            ['CREATED', 'DB_ERROR', 'CREATED', 'OK'],
+            [json.loads(line)['code'] for line in lines])
+
+    @patch('csapi.get_batch_members', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    @patch('csapi.db_connection')
+    def test_add_subsystems_resolve_db_error(self, mock_db_connection, mock_get_batch_members):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual(
+                [b'{"code":"DB_ERROR","msg":"Unclassified database error"}\n'],
+                list(csapi.add_subsystems('CONF', [], [])))
+
+    @patch('csapi.add_subsystems', return_value=iter(['LINE1\n', 'LINE2\n']))
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_subsystems_query(self, mock_get_db_conf, mock_add_subsystems):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.post('/subsystems', data=json.dumps([
+                {'member_class': 'GOV', 'member_code': 'CODE', 'subsystem_code': 'SUB'}]))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('application/x-ndjson', response.mimetype)
+            self.assertEqual(b'LINE1\nLINE2\n', response.data)
+            self.assertEqual('no', response.headers['X-Accel-Buffering'])
+            self.assertEqual([
+                'INFO:csapi:Incoming batch request: 1 items',
+                'INFO:csapi:Client DN: None'], cm.output)
+        mock_add_subsystems.assert_called_once_with(
+            mock_get_db_conf.return_value,
+            [{'member_class': 'GOV', 'member_code': 'CODE', 'subsystem_code': 'SUB'}], [None])
+
+    @patch('csapi.add_subsystems')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_subsystems_query_request_context(self, mock_get_db_conf, mock_add_subsystems):
+        def add_subsystems(*args):
+            # Results are produced after the view returned
+            yield '{}\n'.format(csapi.request.headers.get('X-Request-Id')).encode('utf-8')
+        mock_add_subsystems.side_effect = add_subsystems
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/subsystems', data=json.dumps([
+                {'member_class': 'GOV', 'member_code': 'CODE', 'subsystem_code': 'SUB'}]),
+                headers={'X-Request-Id': 'REQ_ID'})
+            self.assertEqual(b'REQ_ID\n', response.data)
+
+    @patch('csapi.get_db_conf', return_value={
+            'database': '',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_subsystems_no_database(self, mock_get_db_conf):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/subsystems', data=json.dumps([]))
+            self.assertEqual(500, response.status_code)
+            self.assertEqual('DB_CONF_ERROR', response.json['code'])
+
+    def test_subsystems_invalid_query(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/subsystems', data=json.dumps('NOT_LIST'))
+            self.assertEqual(400, response.status_code)
+            self.assertEqual('INVALID_REQUEST', response.json['code'])
+
+    @patch('csapi.db_connection')
+    def test_export_clients(self, mock_db_connection):
+        csapi.configure({'export_fetch_size': 2})
+        cur = mock_db_connection().__enter__().cursor().__enter__()
+        cur.fetchmany = MagicMock(side_effect=[
+            [('GOV', 'CODE', None, 'NAME', datetime.datetime(2020, 1, 2, 3, 4, 5)),
+             ('GOV', 'CODE', 'SUB', 'NAME', None)], []])
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual([
+                b'{"member_class":"GOV","member_code":"CODE","subsystem_code":null,'
+                b'"name":"NAME","created_at":"2020-01-02T03:04:05"}\n'
+                b'{"member_class":"GOV","member_code":"CODE","subsystem_code":"SUB",'
+                b'"name":"NAME","created_at":null}\n',
+                b'{"code":"OK","msg":"Export completed","count":2}\n'],
+                list(csapi.export_clients('CONF')))
+            self.assertEqual([
+                "INFO:csapi:Response: {'code': 'OK', 'msg': 'Export completed', 'count': 2}"],
+                cm.output)
+        mock_db_connection().__enter__().cursor.assert_called_with(name='csapi_export')
+        cur.execute.assert_called_once_with(csapi.QUERIES['export_clients'])
+        cur.fetchmany.assert_called_with(2)
+
+    @patch('csapi.db_connection')
+    def test_export_clients_db_error(self, mock_db_connection):
+        cur = mock_db_connection().__enter__().cursor().__enter__()
+        cur.fetchmany = MagicMock(side_effect=[
+            [('GOV', 'CODE', None, 'NAME', None)], psycopg2.Error('DB_ERROR_MSG')])
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            lines = list(csapi.export_clients('CONF'))
+            self.assertEqual(
+                b'{"code":"DB_ERROR","msg":"Unclassified database error"}\n', lines[-1])
+            self.assertEqual(2, len(lines))
+            self.assertEqual([
+                'ERROR:csapi:DB_ERROR: Unclassified database error: DB_ERROR_MSG'], cm.output)
+
+    @patch('csapi.export_clients', return_value=iter(['LINE1\n', 'LINE2\n']))
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_export_query(self, mock_get_db_conf, mock_export_clients):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.get('/export')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('application/x-ndjson', response.mimetype)
+            self.assertEqual(b'LINE1\nLINE2\n', response.data)
+            self.assertEqual('no', response.headers['X-Accel-Buffering'])
+            self.assertEqual([
+                'INFO:csapi:Incoming export request',
+                'INFO:csapi:Client DN: None'], cm.output)
+        mock_export_clients.assert_called_once_with(mock_get_db_conf.return_value)
+
+    @patch('csapi.get_db_conf', return_value={
+            'database': '',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_export_no_database(self, mock_get_db_conf):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.get('/export')
+            self.assertEqual(500, response.status_code)
+            self.assertEqual('DB_CONF_ERROR', response.json['code'])
+
+    def test_cursor(self):
+        cursor = csapi.encode_cursor([12, 'CODE'])
+        self.assertEqual([12, 'CODE'], csapi.decode_cursor(cursor, (int, str)))
+        self.assertEqual(None, csapi.decode_cursor(cursor, (str,)))
+        self.assertEqual(None, csapi.decode_cursor(cursor, (str, str)))
+        self.assertEqual(None, csapi.decode_cursor(
+            csapi.encode_cursor([True, 'CODE']), (int, str)))
+        self.assertEqual(None, csapi.decode_cursor('!', (int, str)))
+        self.assertEqual(None, csapi.decode_cursor('e30=', (int, str)))
+
+    def test_get_page_input(self):
+        self.assertEqual(((100, None), None), csapi.get_page_input({}, (str,)))
+        self.assertEqual(((5, ['SUB']), None), csapi.get_page_input({
+            'limit': '5', 'after': csapi.encode_cursor(['SUB'])}, (str,)))
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual((None, {
+                'http_status': 400, 'code': 'INVALID_PARAMETER',
+                'msg': 'Request parameter limit must be between 1 and 1000'}),
+                csapi.get_page_input({'limit': '1001'}, (str,)))
+            self.assertEqual('INVALID_PARAMETER', csapi.get_page_input(
+                {'limit': 'x'}, (str,))[1]['code'])
+            self.assertEqual((None, {
+                'http_status': 400, 'code': 'INVALID_PARAMETER',
+                'msg': 'Request parameter after is invalid'}),
+                csapi.get_page_input({'after': 'x'}, (str,)))
+            self.assertEqual(
+                'WARNING:csapi:INVALID_PARAMETER: Request parameter limit must be between 1 '
+                'and 1000 (Request: 1001)', cm.output[0])
+
+    def test_list_members(self):
+        cur = MagicMock()
+        cur.fetchall = MagicMock(return_value=['ROW'])
+        self.assertEqual(['ROW'], csapi.list_members(cur, 11))
+        cur.execute.assert_called_with(csapi.QUERIES['list_members'], {
+            'class_id': None, 'after_class_id': None, 'after_code': None, 'limit': 11})
+        csapi.list_members(cur, 11, after=[12, 'CODE'], class_id=12)
+        cur.execute.assert_called_with(csapi.QUERIES['list_members'], {
+            'class_id': 12, 'after_class_id': 12, 'after_code': 'CODE', 'limit': 11})
+
+    def test_list_subsystems(self):
+        cur = MagicMock()
+        cur.fetchall = MagicMock(return_value=[('SUB1',), ('SUB2',)])
+        self.assertEqual(['SUB1', 'SUB2'], csapi.list_subsystems(cur, 123, 2, after='SUB0'))
+        cur.execute.assert_called_with(csapi.QUERIES['list_subsystems'], {
+            'member_id': 123, 'after': 'SUB0', 'limit': 2})
+
+    @patch('csapi.get_member_data', return_value={'id': 123, 'name': 'NAME'})
+    @patch('csapi.get_cached_member_class_id', side_effect=[12, None])
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_get_member(
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id,
+            mock_get_member_data):
+        self.assertEqual({
+            'http_status': 200, 'code': 'OK', 'msg': 'Member found',
+            'member': {'member_class': 'GOV', 'member_code': 'CODE', 'member_name': 'NAME'}},
+            csapi.get_member('GOV', 'CODE'))
+        mock_get_member_data.assert_called_once_with(
+            mock_db_connection().__enter__().cursor().__enter__(), 12, 'CODE')
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual({
+                'http_status': 404, 'code': 'MEMBER_NOT_FOUND',
+                'msg': 'Provided Member does not exist'}, csapi.get_member('BAD', 'CODE'))
+            self.assertEqual([
+                'WARNING:csapi:MEMBER_NOT_FOUND: Provided Member does not exist: '
+                'member_class=BAD, member_code=CODE'], cm.output)
+
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': '',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_get_member_no_database(self, mock_get_db_conf, mock_db_connection):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual('DB_CONF_ERROR', csapi.get_member('GOV', 'CODE')['code'])
+            self.assertEqual('DB_CONF_ERROR', csapi.get_members(None, 10, None)['code'])
+            self.assertEqual('DB_CONF_ERROR', csapi.get_member_subsystems(
+                'GOV', 'CODE', 10, None)['code'])
+        mock_db_connection.assert_not_called()
+
+    @patch('csapi.list_members', return_value=[
+        (12, 'GOV', 'CODE1', 'NAME1'), (12, 'GOV', 'CODE2', 'NAME2'),
+        (13, 'COM', 'CODE3', 'NAME3')])
+    @patch('csapi.get_cached_member_class_id', side_effect=[12, None])
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_get_members(
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id,
+            mock_list_members):
+        self.assertEqual({
+            'http_status': 200, 'code': 'OK', 'msg': 'Members listed',
+            'members': [
+                {'member_class': 'GOV', 'member_code': 'CODE1', 'member_name': 'NAME1'},
+                {'member_class': 'GOV', 'member_code': 'CODE2', 'member_name': 'NAME2'}],
+            'next': csapi.encode_cursor([12, 'CODE2'])}, csapi.get_members('GOV', 2, None))
+        mock_list_members.assert_called_once_with(
+            mock_db_connection().__enter__().cursor().__enter__(), 3, after=None, class_id=12)
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual('INVALID_MEMBER_CLASS', csapi.get_members('BAD', 2, None)['code'])
+        self.assertEqual(None, csapi.get_members(None, 3, [1, 'A'])['next'])
+        mock_list_members.assert_called_with(
+            mock_db_connection().__enter__().cursor().__enter__(), 4, after=[1, 'A'],
+            class_id=None)
 
-    @patch('csapi.add_client_name')
-    @patch('csapi.add_subsystem_client')
-    @patch('csapi.add_subsystem_identifier', return_value=123456)
-    @patch('csapi.get_utc_time', return_value='TIME')
-    @patch('csapi.subsystem_exists', return_value=False)
-    @patch('csapi.get_member_data', return_value={'id': 111, 'name': 'M_NAME'})
-    @patch('csapi.get_member_class_id', return_value=12345)
-    @patch('csapi.get_db_connection')
+    @patch('csapi.list_subsystems', return_value=['SUB1', 'SUB2'])
+    @patch('csapi.get_member_data', side_effect=[{'id': 123, 'name': 'NAME'}, None])
+    @patch('csapi.get_cached_member_class_id', return_value=12)
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
-    def test_add_subsystem_ok(
-            self, mock_get_db_conf, mock_get_db_connection, mock_get_member_class_id,
-            mock_get_member_data, mock_subsystem_exists, mock_get_utc_time,
-            mock_add_subsystem_identifier, mock_add_subsystem_client, mock_add_client_name):
+    def test_get_member_subsystems(
+            self, mock_get_db_conf, mock_db_connection, mock_get_cached_member_class_id,
+            mock_get_member_data, mock_list_subsystems):
+        self.assertEqual({
+            'http_status': 200, 'code': 'OK', 'msg': 'Subsystems listed',
+            'subsystems': [{'subsystem_code': 'SUB1'}],
+            'next': csapi.encode_cursor(['SUB1'])},
+            csapi.get_member_subsystems('GOV', 'CODE', 1, ['SUB0']))
+        mock_list_subsystems.assert_called_once_with(
+            mock_db_connection().__enter__().cursor().__enter__(), 123, 2, after='SUB0')
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual('MEMBER_NOT_FOUND', csapi.get_member_subsystems(
+                'GOV', 'CODE', 1, None)['code'])
+
+    @patch('csapi.get_member', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Member found', 'member': 'MEMBER'})
+    def test_member_info_query(self, mock_get_member):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
-            self.assertEqual(
-                {
-                    'code': 'CREATED', 'http_status': 201,
-                    'msg': 'New Subsystem added'},
-                csapi.add_subsystem('MEMBER_CLASS', 'MEMBER_CODE', 'SUBSYSTEM_CODE', 'JSON_DATA'))
+            response = self.client.get('/member/GOV/CODE')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('MEMBER', response.json['member'])
             self.assertEqual([
-                'INFO:csapi:Added new Subsystem: member_class=MEMBER_CLASS, '
-                'member_code=MEMBER_CODE, subsystem_code=SUBSYSTEM_CODE'], cm.output)
-            mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_called_with({
-                'database': 'centerui_production', 'password': 'centerui_pass',
-                'username': 'centerui_user'})
-            mock_get_member_class_id.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 'MEMBER_CLASS')
-            mock_get_member_data.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 12345, 'MEMBER_CODE')
-            mock_subsystem_exists.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(), 111, 'SUBSYSTEM_CODE')
-            mock_get_utc_time.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__())
-            mock_add_subsystem_identifier.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(),
-                member_class='MEMBER_CLASS', member_code='MEMBER_CODE',
-                subsystem_code='SUBSYSTEM_CODE', utc_time='TIME')
-            mock_add_subsystem_client.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(),
-                identifier_id=123456, member_id=111, subsystem_code='SUBSYSTEM_CODE',
-                utc_time='TIME')
-            mock_add_client_name.assert_called_with(
-                mock_get_db_connection().__enter__().cursor().__enter__(),
-                member_name='M_NAME', identifier_id=123456, utc_time='TIME')
+                'INFO:csapi:Incoming member request: GOV/CODE',
+                'INFO:csapi:Client DN: None',
+                "INFO:csapi:Response: {'http_status': 200, 'code': 'OK', 'msg': "
+                "'Member found', 'member': 'MEMBER'}"], cm.output)
+        mock_get_member.assert_called_once_with('GOV', 'CODE')
+
+    @patch('csapi.get_member', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    def test_member_info_db_error_handled(self, mock_get_member):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(500, self.client.get('/member/GOV/CODE').status_code)
+            self.assertIn(
+                'ERROR:csapi:DB_ERROR: Unclassified database error: DB_ERROR_MSG', cm.output)
+
+    @patch('csapi.get_members', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Members listed', 'members': ['MEMBER'],
+        'next': None})
+    def test_members_list_query(self, mock_get_members):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.get('/members?member_class=GOV&limit=5')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(['MEMBER'], response.json['members'])
+            self.assertEqual([
+                "INFO:csapi:Incoming members list request: {'member_class': 'GOV', "
+                "'limit': '5'}",
+                'INFO:csapi:Client DN: None',
+                "INFO:csapi:Response: {'http_status': 200, 'code': 'OK', 'msg': "
+                "'Members listed', 'next': None}"], cm.output)
+        mock_get_members.assert_called_once_with('GOV', 5, None)
+
+    @patch('csapi.get_members')
+    def test_members_list_invalid_query(self, mock_get_members):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.get('/members?after=x')
+            self.assertEqual(400, response.status_code)
+            self.assertEqual('INVALID_PARAMETER', response.json['code'])
+        mock_get_members.assert_not_called()
+
+    @patch('csapi.get_member_subsystems', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'Subsystems listed', 'subsystems': [],
+        'next': None})
+    def test_member_subsystems_query(self, mock_get_member_subsystems):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.get('/member/GOV/CODE/subsystems?after={}'.format(
+                csapi.encode_cursor(['SUB'])))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual([], response.json['subsystems'])
+        mock_get_member_subsystems.assert_called_once_with('GOV', 'CODE', 100, ['SUB'])
+
+    @patch('csapi.get_member_subsystems', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    def test_member_subsystems_db_error_handled(self, mock_get_member_subsystems):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.get('/member/GOV/CODE/subsystems')
+            self.assertEqual(500, response.status_code)
+
+    def test_metrics(self):
+        metrics = csapi.Metrics(buckets=(0.1, 1.0))
+        metrics.inc('COUNTER')
+        metrics.inc('COUNTER', value=2)
+        metrics.inc('COUNTER', (('code', 'OK'),))
+        metrics.observe('HISTOGRAM', 0.05)
+        metrics.observe('HISTOGRAM', 0.1)
+        metrics.observe('HISTOGRAM', 5)
+        self.assertEqual({
+            'counters': [['COUNTER', [], 3], ['COUNTER', [['code', 'OK']], 1]],
+            'histograms': [['HISTOGRAM', [], [2, 0, 1], 5.15]]}, metrics.snapshot())
+        metrics.merge(metrics.snapshot())
+        self.assertEqual(6, metrics.counters[('COUNTER', ())])
+        self.assertEqual(2, metrics.counters[('COUNTER', (('code', 'OK'),))])
+        self.assertEqual([[4, 0, 2], 10.3], metrics.histograms[('HISTOGRAM', ())])
+        metrics.clear()
+        self.assertEqual({'counters': [], 'histograms': []}, metrics.snapshot())
+
+    def test_render_metrics(self):
+        metrics = csapi.Metrics(buckets=(0.1, 1.0))
+        metrics.inc('csapi_requests_total', (('route', '/a"b'), ('code', 'OK')))
+        metrics.observe('csapi_db_connection_wait_seconds', 0.5)
+        self.assertEqual(
+            '# HELP csapi_db_connection_wait_seconds Time spent waiting for pooled database '
+            'connection\n'
+            '# TYPE csapi_db_connection_wait_seconds histogram\n'
+            'csapi_db_connection_wait_seconds_bucket{le="0.1"} 0\n'
+            'csapi_db_connection_wait_seconds_bucket{le="1.0"} 1\n'
+            'csapi_db_connection_wait_seconds_bucket{le="+Inf"} 1\n'
+            'csapi_db_connection_wait_seconds_sum 0.5\n'
+            'csapi_db_connection_wait_seconds_count 1\n'
+            '# HELP csapi_requests_total Number of handled requests\n'
+            '# TYPE csapi_requests_total counter\n'
+            'csapi_requests_total{route="/a\\"b",code="OK"} 1\n', csapi.render_metrics(metrics))
+
+    def test_observe_query(self):
+        cur = MagicMock()
+        cur.fetchone = MagicMock(return_value=['TIME'])
+        csapi.get_utc_time(cur)
+        cur.execute = MagicMock(side_effect=psycopg2.Error('DB_ERROR_MSG'))
+        with self.assertRaises(psycopg2.Error):
+            csapi.get_utc_time(cur)
+        labels = (('query', 'get_utc_time'),)
+        self.assertEqual(
+            2, sum(csapi.METRICS.histograms[('csapi_db_query_duration_seconds', labels)][0]))
+        self.assertEqual(1, csapi.METRICS.counters[('csapi_db_errors_total', labels)])
+
+    @patch('os.kill')
+    @patch('os.getpid', return_value=1000)
+    def test_flush_and_collect_metrics(self, mock_getpid, mock_kill):
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            csapi.configure({'metrics_dir': metrics_dir, 'metrics_flush_interval': 60})
+            csapi.METRICS.flushed = 0.0
+            csapi.METRICS.inc('COUNTER')
+            csapi.flush_metrics()
+            own_file = csapi.metrics_snapshot_name()
+            self.assertRegex(own_file, r'^1000-[0-9a-f]{32}\.json$')
+            self.assertEqual([own_file], os.listdir(metrics_dir))
+            # Not written again before flush interval
+            csapi.METRICS.inc('COUNTER')
+            csapi.flush_metrics()
+            with open(os.path.join(metrics_dir, own_file)) as snapshot_file:
+                self.assertEqual([['COUNTER', [], 1]], json.load(snapshot_file)['counters'])
+
+            # Snapshots of other workers, also with the same process ID
+            with open(os.path.join(metrics_dir, '999-a.json'), 'w') as snapshot_file:
+                json.dump({'counters': [['COUNTER', [], 3]], 'histograms': []}, snapshot_file)
+            with open(os.path.join(metrics_dir, '1000-b.json'), 'w') as snapshot_file:
+                json.dump({'counters': [['COUNTER', [], 2]], 'histograms': []}, snapshot_file)
+            with open(os.path.join(metrics_dir, '998.json'), 'w') as snapshot_file:
+                snapshot_file.write('{')
+            with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+                self.assertEqual(7, csapi.collect_metrics().counters[('COUNTER', ())])
+                self.assertEqual(1, len(cm.output))
+
+            # Snapshot of worker that exited without removing it is removed
+            def kill(pid, signum):
+                if pid == 999:
+                    raise ProcessLookupError()
+            mock_kill.side_effect = kill
+            with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+                self.assertEqual(4, csapi.collect_metrics().counters[('COUNTER', ())])
+                self.assertIn(
+                    'INFO:csapi:Removing metrics snapshot of exited worker process '
+                    '"999-a.json"', cm.output)
+            self.assertNotIn('999-a.json', os.listdir(metrics_dir))
+            mock_kill.assert_any_call(1000, 0)
+
+            csapi.flush_metrics(force=True)
+            with open(os.path.join(metrics_dir, own_file)) as snapshot_file:
+                self.assertEqual([['COUNTER', [], 2]], json.load(snapshot_file)['counters'])
+            with open(os.path.join(metrics_dir, '1000-b.json')) as snapshot_file:
+                self.assertEqual([['COUNTER', [], 2]], json.load(snapshot_file)['counters'])
+
+            # Worker removes its own snapshot when it exits
+            csapi.remove_metrics_snapshot()
+            self.assertNotIn(own_file, os.listdir(metrics_dir))
+            csapi.remove_metrics_snapshot()
+
+            # New worker process reusing process ID gets a new snapshot file
+            csapi._METRICS_SNAPSHOT['pid'] = None
+            self.assertNotEqual(own_file, csapi.metrics_snapshot_name())
+
+    def test_collect_metrics_no_dir(self):
+        csapi.METRICS.inc('COUNTER')
+        self.assertEqual(1, csapi.collect_metrics().counters[('COUNTER', ())])
+
+    @patch('csapi.test_db', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'API is ready'})
+    def test_request_metrics(self, mock_test_db):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.client.get('/status')
+            self.client.get('/status')
+            self.client.post('/member', data=json.dumps({}))
+            self.client.get('/unknown')
+        labels = (('route', '/status'), ('method', 'GET'), ('code', 'OK'))
+        self.assertEqual(2, csapi.METRICS.counters[('csapi_requests_total', labels)])
+        self.assertEqual(
+            2, sum(csapi.METRICS.histograms[('csapi_request_duration_seconds', labels)][0]))
+        self.assertEqual(1, csapi.METRICS.counters[('csapi_requests_total', (
+            ('route', '/member'), ('method', 'POST'), ('code', 'MISSING_PARAMETER')))])
+        self.assertEqual(1, csapi.METRICS.counters[('csapi_requests_total', (
+            ('route', 'unknown'), ('method', 'GET'), ('code', '404')))])
+
+    def test_format_statement(self):
+        self.assertEqual(
+            'select id from member_classes where code=%(str)s',
+            csapi.format_statement(csapi.QUERIES['member_class_id']))
+        self.assertEqual('insert into t values (1)', csapi.format_statement(
+            b'insert into t\n    values (1)'))
+        self.assertEqual(
+            'x' * csapi.SLOW_QUERY_MAX_LENGTH + '...',
+            csapi.format_statement('x' * (csapi.SLOW_QUERY_MAX_LENGTH + 1)))
+
+    def test_record_statement(self):
+        with self.assertLogs(csapi.SLOW_QUERY_LOGGER, level='INFO') as cm:
+            csapi.record_statement('select 1', 0.5, 1)
+            csapi.record_statement('select\n  2', 1.5, 1)
+            with self.app.test_request_context('/status'):
+                csapi.g.csapi_request_id = 'REQ_ID'
+                csapi.record_statement('select 3', 0.1, 1)
+                csapi.record_statement('select 4', 1.0, 2)
+                self.assertEqual(2, csapi.g.csapi_db_queries)
+                self.assertAlmostEqual(1.1, csapi.g.csapi_db_time)
+            self.assertEqual([
+                'WARNING:csapi_slow_query:-: Slow query (1.500 s, 1 rows): select 2',
+                'WARNING:csapi_slow_query:REQ_ID: Slow query (1.000 s, 2 rows): select 4'],
+                cm.output)
+
+        csapi.configure({'slow_query_threshold': None})
+        with self.assertNoLogs(csapi.SLOW_QUERY_LOGGER):
+            csapi.record_statement('select 5', 100.0, 1)
+
+    @patch('csapi.test_db')
+    def test_query_log_headers(self, mock_test_db):
+        def run_queries():
+            csapi.record_statement('select 1', 0.002, 1)
+            csapi.record_statement('select 2', 0.0005, 1)
+            return {'http_status': 200, 'code': 'OK', 'msg': 'API is ready'}
+
+        mock_test_db.side_effect = run_queries
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.get('/status', headers={'X-Request-Id': 'REQ-1.a_b'})
+            self.assertEqual('REQ-1.a_b', response.headers['X-Request-Id'])
+            self.assertNotIn('Server-Timing', response.headers)
+
+            # Invalid correlation id is replaced
+            response = self.client.get('/status', headers={'X-Request-Id': 'a b'})
+            self.assertRegex(response.headers['X-Request-Id'], '^[0-9a-f]{32}$')
+
+            csapi.configure({'server_timing': True, 'request_query_budget': 1})
+            with self.assertLogs(csapi.SLOW_QUERY_LOGGER, level='INFO') as cm:
+                response = self.client.get('/status', headers={'X-Request-Id': 'REQ_ID'})
+                self.assertEqual([
+                    'WARNING:csapi_slow_query:REQ_ID: Query budget exceeded by GET /status '
+                    '(2 queries, 0.003 s)'], cm.output)
+            self.assertEqual('db;dur=2.500;desc="2 queries"', response.headers['Server-Timing'])
+
+    def test_metrics_api(self):
+        csapi.METRICS.inc('csapi_requests_total', (('code', 'OK'),))
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.get('/metrics')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('text/plain; version=0.0.4; charset=utf-8', response.content_type)
+            self.assertIn(b'csapi_requests_total{code="OK"} 1\n', response.data)
+            self.assertTrue(response.data.startswith(
+                '# Metrics of worker process {} only, aggregation of all worker processes is '
+                'disabled (metrics_dir is not configured)\n'.format(os.getpid()).encode()))
+            self.assertEqual([
+                'INFO:csapi:Incoming metrics request',
+                'INFO:csapi:Client DN: None'], cm.output)
 
     def test_make_response(self):
         with self.app.app_context():
@@ -536,6 +2168,14 @@ reconnect=true
                     "INFO:csapi:Response: {'http_status': 200, 'code': 'OK', "
                     "'msg': 'All Correct'}"], cm.output)
 
+    def test_make_response_extra_fields(self):
+        with self.app.app_context():
+            with self.assertLogs(csapi.LOGGER, level='INFO'):
+                response = csapi.make_response(
+                    {'http_status': 200, 'code': 'OK', 'msg': 'All Correct', 'extra': [1]})
+                self.assertEqual(
+                    {'code': 'OK', 'msg': 'All Correct', 'extra': [1]}, response.json)
+
     def test_get_input(self):
         (value, err) = csapi.get_input(
             {'member_name': 'MEMBER_NAME', 'member_class': 'MEMBER_CLASS'},
@@ -543,6 +2183,16 @@ reconnect=true
         self.assertEqual('MEMBER_NAME', value)
         self.assertEqual(None, err)
 
+    def test_get_inputs(self):
+        self.assertEqual((['MEMBER_CLASS', 'MEMBER_NAME'], None), csapi.get_inputs(
+            {'member_name': 'MEMBER_NAME', 'member_class': 'MEMBER_CLASS'},
+            ('member_class', 'member_name')))
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            (values, err) = csapi.get_inputs(
+                {'member_name': 'MEMBER_NAME'}, ('member_class', 'member_code'))
+        self.assertEqual(None, values)
+        self.assertEqual('Request parameter member_class is missing', err['msg'])
+
     def test_get_input_err(self):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             (value, err) = csapi.get_input(
@@ -588,6 +2238,125 @@ reconnect=true
         self.assertEqual(True, csapi.check_client({'allowed': ['DN1', 'DN2']}, 'DN1'))
         self.assertEqual(False, csapi.check_client({'allowed': ['DN1', 'DN2']}, 'DN3'))
 
+    def test_check_client_canonical(self):
+        config = {'allowed': ['CN=client, OU=xtss+O=RIA,C=EE', 'CN=Name\\, With Comma,C=EE']}
+        self.assertEqual(True, csapi.check_client(config, 'cn=CLIENT,O=ria+OU=xtss,C=EE'))
+        self.assertEqual(True, csapi.check_client(config, '/C=EE/OU=xtss+O=RIA/CN=client'))
+        self.assertEqual(True, csapi.check_client(config, '2.5.4.3=client,OU=xtss+O=RIA,C=EE'))
+        self.assertEqual(True, csapi.check_client(config, 'CN=name\\2c  with comma,C=EE'))
+        self.assertEqual(True, csapi.check_client(config, 'CN="Name, With Comma",C=EE'))
+        self.assertEqual(False, csapi.check_client(config, 'CN=client,OU=xtss,C=EE'))
+        self.assertEqual(False, csapi.check_client(config, 'C=EE,OU=xtss+O=RIA,CN=client'))
+        self.assertEqual(False, csapi.check_client(config, 'CN=client,OU=xtss+O=RIA,C=EE,'))
+
+    def test_check_client_subtrees(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            config = {'allowed_subtrees': ['O=RIA,C=EE', 'NOT_DN', 'OU=a,O=other,C=EE']}
+            self.assertEqual(True, csapi.check_client(config, 'CN=client,OU=xtss,O=RIA,C=EE'))
+            self.assertEqual(['WARNING:csapi:Invalid DN in allowed_subtrees: NOT_DN'], cm.output)
+        self.assertEqual(True, csapi.check_client(config, 'CN=client, O=ria, C=ee'))
+        self.assertEqual(True, csapi.check_client(config, 'O=RIA,C=EE'))
+        self.assertEqual(True, csapi.check_client(config, 'CN=client,OU=a,O=other,C=EE'))
+        self.assertEqual(False, csapi.check_client(config, 'CN=client,O=other,C=EE'))
+        self.assertEqual(False, csapi.check_client(config, 'CN=client,O=RIA,C=FI'))
+        self.assertEqual(False, csapi.check_client(config, 'C=EE'))
+        self.assertEqual(False, csapi.check_client(config, 'NOT_DN'))
+
+    def test_get_client_matcher(self):
+        config = {'allowed': ['CN=client']}
+        matcher = csapi.get_client_matcher(config)
+        self.assertIs(matcher, csapi.get_client_matcher(config))
+        self.assertIsNot(matcher, csapi.get_client_matcher({'allowed': ['CN=client']}))
+        csapi.configure(config)
+        self.assertIs(config, csapi._CLIENT_MATCHER['entry'][0])
+
+    def test_validate_config(self):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'example-config.json'), 'r') as config_file:
+            self.assertEqual([], csapi.validate_config(json.load(config_file)))
+        self.assertEqual([], csapi.validate_config({'cache_flush_file': None}))
+        self.assertEqual(['Configuration must be a JSON object'], csapi.validate_config([]))
+        self.assertEqual([
+            'allow_all must be true or false', 'allowed must be a list of strings',
+            'Invalid DN in allowed_subtrees: NOT_DN', 'db_pool must be a JSON object',
+            'single_round_trip has invalid value: 1', 'batch_max_size must not be null',
+            'page_size has invalid value: "10"', 'Unknown setting member_class_cache.size',
+            'member_class_cache.negative_ttl has invalid value: true',
+            'idempotency.store must be one of: database, memory',
+            'log.format must be one of: json, text'],
+            csapi.validate_config({
+                'allow_all': 'yes', 'allowed': ['DN', 1], 'allowed_subtrees': ['NOT_DN'],
+                'page_size': '10', 'single_round_trip': 1, 'batch_max_size': None,
+                'db_pool': [], 'member_class_cache': {
+                    'ttl': None, 'size': 10, 'negative_ttl': True},
+                'metrics_dir': '/run/csapi', 'slow_query_threshold': None,
+                'idempotency': {'store': 'redis'}, 'log': {'format': 'xml'}}))
+
+    def test_config_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'config.json')
+            with open(path, 'w') as config_file:
+                json.dump({'allowed': ['CN=old'], 'page_size': 10}, config_file)
+            config = csapi.ConfigFile(path)
+            with self.assertLogs(csapi.LOGGER, level='INFO'):
+                self.assertEqual({'allowed': ['CN=old'], 'page_size': 10}, config.load())
+            self.assertEqual(10, csapi.SETTINGS['page_size'])
+            self.assertEqual(True, csapi.check_client(config, 'CN=old'))
+
+            # Changes are not checked before config_check_interval
+            with open(path, 'w') as config_file:
+                json.dump({'allowed': ['CN=new'], 'page_size': 200}, config_file)
+            self.assertEqual(False, csapi.check_client(config, 'CN=new'))
+            config.reload()
+            with self.assertLogs(csapi.LOGGER, level='INFO'):
+                self.assertEqual(True, csapi.check_client(config, 'CN=new'))
+            self.assertEqual(False, csapi.check_client(config, 'CN=old'))
+            self.assertEqual(200, csapi.SETTINGS['page_size'])
+
+            # Invalid configuration is not applied
+            config.checked = 0.0
+            with open(path, 'w') as config_file:
+                json.dump({'allowed': ['CN=other'], 'page_size': 'many'}, config_file)
+            with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+                self.assertEqual(True, csapi.check_client(config, 'CN=new'))
+                self.assertEqual(
+                    'ERROR:csapi:Invalid configuration file "{}", keeping current '
+                    'configuration: page_size has invalid value: "many"'.format(path),
+                    cm.output[-1])
+            self.assertEqual(200, csapi.SETTINGS['page_size'])
+            config.checked = 0.0
+            with open(path, 'w') as config_file:
+                config_file.write('{"allowed": ')
+            with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+                self.assertEqual({'allowed': ['CN=new'], 'page_size': 200}, config.get())
+                self.assertEqual('ERROR:csapi:Keeping current configuration', cm.output[-1])
+            # Unchanged file is not loaded again
+            config.reload()
+            self.assertFalse(config.check())
+
+    def test_config_file_invalid(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'config.json')
+            with open(path, 'w') as config_file:
+                json.dump({'allow_all': True, 'page_size': 'many'}, config_file)
+            config = csapi.ConfigFile(path)
+            with self.assertLogs(csapi.LOGGER, level='INFO'):
+                self.assertEqual(None, config.load())
+            self.assertEqual(False, csapi.check_client(config, 'CN=client'))
+            self.assertEqual(100, csapi.SETTINGS['page_size'])
+
+    def test_canonical_dn(self):
+        self.assertEqual(
+            ((('CN', 'client ä'),), (('O', 'ria'), ('OU', 'xtss')), (('C', 'ee'),)),
+            csapi.canonical_dn('cn = Client \\C3\\84, OU=xtss + O=RIA; C=EE'))
+        self.assertEqual(None, csapi.canonical_dn('CN'))
+        self.assertEqual(None, csapi.canonical_dn('CN="unterminated'))
+        self.assertEqual(None, csapi.canonical_dn('CN="quoted" text'))
+        self.assertEqual(None, csapi.canonical_dn('CN=escape\\'))
+        self.assertEqual(None, csapi.canonical_dn('1CN=client'))
+        self.assertEqual(None, csapi.canonical_dn('CN=\\FF'))
+        self.assertEqual(None, csapi.canonical_dn('/C=EE/CN'))
+
     def test_incorrect_client(self):
         with self.app.app_context():
             with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
@@ -860,44 +2629,46 @@ reconnect=true
                         'member_class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
                         'subsystem_code': 'SUBSYSTEM_CODE'})
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
-    def test_test_db_ok(self, mock_get_db_conf, mock_get_db_connection):
-        mock_get_db_connection.execute = MagicMock()
-        mock_get_db_connection.fetchone = MagicMock(return_value=1)
+    def test_test_db_ok(self, mock_get_db_conf, mock_db_connection):
+        csapi._INSTANCE_IDENTIFIER['value'] = None
+        mock_cur = mock_db_connection.return_value.__enter__.return_value.cursor.return_value
+        mock_cur.__enter__.return_value.fetchone.return_value = ['INSTANCE']
         self.assertEqual(
             {'code': 'OK', 'http_status': 200, 'msg': 'API is ready'},
             csapi.test_db())
+        self.assertEqual('INSTANCE', csapi._INSTANCE_IDENTIFIER['value'])
         mock_get_db_conf.assert_called_with()
-        mock_get_db_connection.assert_called_with({
+        mock_db_connection.assert_called_with({
             'database': 'centerui_production', 'password': 'centerui_pass',
             'username': 'centerui_user'})
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
-    def test_test_db_not_ok(self, mock_get_db_conf, mock_get_db_connection):
-        mock_cur = mock_get_db_connection.return_value.__enter__.return_value.cursor.return_value
+    def test_test_db_not_ok(self, mock_get_db_conf, mock_db_connection):
+        mock_cur = mock_db_connection.return_value.__enter__.return_value.cursor.return_value
         mock_cur.__enter__.return_value.fetchone.return_value = None
         self.assertEqual(
             {'code': 'DB_ERROR', 'http_status': 500, 'msg': 'Unexpected DB state'},
             csapi.test_db())
         mock_get_db_conf.assert_called_with()
-        mock_get_db_connection.assert_called_with({
+        mock_db_connection.assert_called_with({
             'database': 'centerui_production', 'password': 'centerui_pass',
             'username': 'centerui_user'})
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': '',
             'password': 'centerui_pass',
             'username': 'centerui_user'})
-    def test_test_db_no_database(self, mock_get_db_conf, mock_get_db_connection):
+    def test_test_db_no_database(self, mock_get_db_conf, mock_db_connection):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -907,14 +2678,14 @@ reconnect=true
             self.assertEqual(
                 ['ERROR:csapi:DB_CONF_ERROR: Cannot access database configuration'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_not_called()
+            mock_db_connection.assert_not_called()
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': '',
             'username': 'centerui_user'})
-    def test_test_db_no_password(self, mock_get_db_conf, mock_get_db_connection):
+    def test_test_db_no_password(self, mock_get_db_conf, mock_db_connection):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -924,14 +2695,14 @@ reconnect=true
             self.assertEqual(
                 ['ERROR:csapi:DB_CONF_ERROR: Cannot access database configuration'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_not_called()
+            mock_db_connection.assert_not_called()
 
-    @patch('csapi.get_db_connection')
+    @patch('csapi.db_connection')
     @patch('csapi.get_db_conf', return_value={
             'database': 'centerui_production',
             'password': 'centerui_pass',
             'username': ''})
-    def test_test_db_no_username(self, mock_get_db_conf, mock_get_db_connection):
+    def test_test_db_no_username(self, mock_get_db_conf, mock_db_connection):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
             self.assertEqual(
                 {
@@ -941,7 +2712,7 @@ reconnect=true
             self.assertEqual(
                 ['ERROR:csapi:DB_CONF_ERROR: Cannot access database configuration'], cm.output)
             mock_get_db_conf.assert_called_with()
-            mock_get_db_connection.assert_not_called()
+            mock_db_connection.assert_not_called()
 
     @patch('csapi.test_db', side_effect=psycopg2.Error('DB_ERROR_MSG'))
     def test_status_db_error_handled(self, mock_test_db):
@@ -980,6 +2751,798 @@ reconnect=true
                 mock_test_db.assert_called_with()
 
 
+    def test_status_live(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.get('/status/live')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual({'code': 'OK', 'msg': 'API is alive'}, response.json)
+            self.assertEqual('INFO:csapi:Incoming liveness status request', cm.output[0])
+
+    @patch('csapi.test_db', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    def test_status_ready(self, mock_test_db):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.get('/status/ready')
+            self.assertEqual(503, response.status_code)
+            self.assertEqual(
+                {'code': 'DB_ERROR', 'msg': 'Unclassified database error'}, response.json)
+            mock_test_db.side_effect = None
+            mock_test_db.return_value = {
+                'http_status': 200, 'code': 'OK', 'msg': 'API is ready'}
+            response = self.client.get('/status/ready')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual({'code': 'OK', 'msg': 'API is ready'}, response.json)
+
+    @patch('csapi.test_db', return_value={
+        'http_status': 200, 'code': 'OK', 'msg': 'API is ready'})
+    def test_status_prober(self, mock_test_db):
+        csapi.configure({'status_probe_interval': 60})
+        # Without background checks database is checked in every request
+        self.assertEqual('OK', csapi.get_db_status()['code'])
+        self.assertEqual('OK', csapi.get_db_status()['code'])
+        self.assertEqual(2, mock_test_db.call_count)
+
+        csapi.STATUS_PROBER.start()
+        for _ in range(100):
+            if csapi.STATUS_PROBER.result is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(3, mock_test_db.call_count)
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual(200, self.client.get('/status').status_code)
+            self.assertEqual(200, self.client.get('/status/ready').status_code)
+        self.assertEqual(3, mock_test_db.call_count)
+
+        # Stale result is not used
+        csapi.configure({'status_probe_interval': 60, 'status_max_age': -1})
+        self.assertEqual('OK', csapi.get_db_status()['code'])
+        self.assertEqual(4, mock_test_db.call_count)
+
+        # Disabled background checks
+        csapi.configure({'status_probe_interval': None})
+        self.assertEqual(None, csapi.STATUS_PROBER.cached(15))
+
+    @patch('csapi.add_member', return_value={
+        'http_status': 201, 'code': 'CREATED', 'msg': 'New Member added'})
+    def test_member_idempotency_key(self, mock_add_member):
+        csapi.configure({'idempotency': {'store': 'memory'}})
+        data = {
+            'member_class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
+            'member_name': 'MEMBER_NAME'}
+        headers = {'Idempotency-Key': 'KEY-1', 'X-Ssl-Client-S-Dn': 'CN=client'}
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.post('/member', data=json.dumps(data), headers=headers)
+            self.assertEqual(201, response.status_code)
+            self.assertNotIn('Idempotent-Replayed', response.headers)
+
+            # Retry gets stored response
+            response = self.client.post('/member', data=json.dumps(data), headers=headers)
+            self.assertEqual(201, response.status_code)
+            self.assertEqual({'code': 'CREATED', 'msg': 'New Member added'}, response.json)
+            self.assertEqual('true', response.headers['Idempotent-Replayed'])
+            self.assertIn(
+                'INFO:csapi:Replaying stored response of Idempotency-Key: KEY-1', cm.output)
+            mock_add_member.assert_called_once()
+
+            # Keys of different clients are separate
+            response = self.client.post('/member', data=json.dumps(data), headers={
+                'Idempotency-Key': 'KEY-1', 'X-Ssl-Client-S-Dn': 'CN=other'})
+            self.assertNotIn('Idempotent-Replayed', response.headers)
+            self.assertEqual(2, mock_add_member.call_count)
+
+            # Key must not be used for different request
+            response = self.client.post('/member', data=json.dumps(
+                dict(data, member_code='OTHER_CODE')), headers=headers)
+            self.assertEqual(422, response.status_code)
+            self.assertEqual({
+                'code': 'IDEMPOTENCY_KEY_REUSED',
+                'msg': 'Idempotency-Key was used for different request'}, response.json)
+            self.assertEqual(2, mock_add_member.call_count)
+
+            response = self.client.post('/member', data=json.dumps(data), headers={
+                'Idempotency-Key': 'INVALID KEY'})
+            self.assertEqual(400, response.status_code)
+            self.assertEqual('INVALID_IDEMPOTENCY_KEY', response.json['code'])
+            self.assertEqual(2, mock_add_member.call_count)
+
+    @patch('csapi.add_subsystem')
+    def test_subsystem_idempotency_key(self, mock_add_subsystem):
+        csapi.configure({'idempotency': {'store': 'memory'}})
+        data = {
+            'member_class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
+            'subsystem_code': 'SUBSYSTEM_CODE'}
+        headers = {'Idempotency-Key': 'KEY-1'}
+        mock_add_subsystem.side_effect = psycopg2.Error('DB_ERROR_MSG')
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/subsystem', data=json.dumps(data), headers=headers)
+            self.assertEqual(500, response.status_code)
+
+            # Server errors are not stored
+            mock_add_subsystem.side_effect = None
+            mock_add_subsystem.return_value = {
+                'http_status': 409, 'code': 'SUBSYSTEM_EXISTS',
+                'msg': 'Provided Subsystem already exists'}
+            response = self.client.post('/subsystem', data=json.dumps(data), headers=headers)
+            self.assertEqual(409, response.status_code)
+            self.assertNotIn('Idempotent-Replayed', response.headers)
+
+            response = self.client.post('/subsystem', data=json.dumps(data), headers=headers)
+            self.assertEqual(409, response.status_code)
+            self.assertEqual('SUBSYSTEM_EXISTS', response.json['code'])
+            self.assertEqual('true', response.headers['Idempotent-Replayed'])
+            self.assertEqual(2, mock_add_subsystem.call_count)
+
+            # Key of /subsystem request can not be reused for /member request
+            response = self.client.post('/member', data=json.dumps(dict(
+                data, member_name='MEMBER_NAME')), headers=headers)
+            self.assertEqual(422, response.status_code)
+
+    @patch('csapi.add_member', return_value={
+        'http_status': 201, 'code': 'CREATED', 'msg': 'New Member added'})
+    def test_idempotency_key_in_use(self, mock_add_member):
+        csapi.configure({'idempotency': {'store': 'memory'}})
+        data = {
+            'member_class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
+            'member_name': 'MEMBER_NAME'}
+        headers = {'Idempotency-Key': 'KEY-1', 'X-Ssl-Client-S-Dn': 'CN=client'}
+        with self.app.test_request_context(
+                '/member', method='POST', data=json.dumps(data), headers=headers):
+            idempotency, _ = csapi.get_idempotency_key('CN=client')
+        # Concurrent request is being processed
+        self.assertEqual(None, csapi.get_idempotent_response(idempotency))
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            response = self.client.post('/member', data=json.dumps(data), headers=headers)
+            self.assertEqual(409, response.status_code)
+            self.assertEqual({
+                'code': 'IDEMPOTENCY_KEY_IN_USE',
+                'msg': 'Request with the same Idempotency-Key is being processed'},
+                response.json)
+            self.assertIn(
+                'WARNING:csapi:IDEMPOTENCY_KEY_IN_USE: Request with the same Idempotency-Key '
+                'is being processed: KEY-1', cm.output)
+        mock_add_member.assert_not_called()
+
+        # Response of concurrent request is replayed
+        csapi.store_idempotent_response(idempotency, mock_add_member.return_value)
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/member', data=json.dumps(data), headers=headers)
+        self.assertEqual(201, response.status_code)
+        self.assertEqual('true', response.headers['Idempotent-Replayed'])
+        mock_add_member.assert_not_called()
+
+    @patch('csapi.add_member', side_effect=psycopg2.Error('DB_ERROR_MSG'))
+    def test_idempotency_key_released(self, mock_add_member):
+        csapi.configure({'idempotency': {'store': 'memory'}})
+        data = {
+            'member_class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
+            'member_name': 'MEMBER_NAME'}
+        headers = {'Idempotency-Key': 'KEY-1'}
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/member', data=json.dumps(data), headers=headers)
+            self.assertEqual(500, response.status_code)
+            # Failed request does not keep the key reserved
+            mock_add_member.side_effect = None
+            mock_add_member.return_value = {
+                'http_status': 201, 'code': 'CREATED', 'msg': 'New Member added'}
+            response = self.client.post('/member', data=json.dumps(data), headers=headers)
+            self.assertEqual(201, response.status_code)
+        self.assertEqual(2, mock_add_member.call_count)
+
+    @patch('csapi.add_member', return_value={
+        'http_status': 201, 'code': 'CREATED', 'msg': 'New Member added'})
+    @patch('csapi.get_request_data', return_value={
+        'member_class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
+        'member_name': 'MEMBER_NAME', 'extra': b'\x00'})
+    def test_idempotency_key_binary_body(self, mock_get_request_data, mock_add_member):
+        csapi.configure({'idempotency': {'store': 'memory'}})
+        # MessagePack body may contain bytes that can not be serialized as JSON
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/member', data=b'\x85', headers={
+                'Idempotency-Key': 'KEY-1'})
+        self.assertEqual(201, response.status_code)
+
+    @patch('csapi.add_member', return_value={
+        'http_status': 201, 'code': 'CREATED', 'msg': 'New Member added'})
+    def test_idempotency_disabled(self, mock_add_member):
+        csapi.configure({'idempotency': {'store': None}})
+        data = {
+            'member_class': 'MEMBER_CLASS', 'member_code': 'MEMBER_CODE',
+            'member_name': 'MEMBER_NAME'}
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            for _ in range(2):
+                response = self.client.post('/member', data=json.dumps(data), headers={
+                    'Idempotency-Key': 'INVALID KEY'})
+                self.assertEqual(201, response.status_code)
+        self.assertEqual(2, mock_add_member.call_count)
+
+    def test_memory_idempotency_store(self):
+        store = csapi.MemoryIdempotencyStore(2)
+        self.assertEqual(None, store.reserve('DN', 'KEY-1', 'FP1', 60))
+        # Concurrent request with the same key sees the reservation
+        self.assertEqual(('FP1', None), store.reserve('DN', 'KEY-1', 'FP1', 60))
+        store.put('DN', 'KEY-1', 'FP1', {'code': 'CREATED'}, 60)
+        store.put('DN', 'KEY-2', 'FP2', {'code': 'CREATED'}, 60)
+        # Stored response is not replaced
+        store.put('DN', 'KEY-1', 'FP3', {'code': 'MEMBER_EXISTS'}, 60)
+        self.assertEqual(('FP1', {'code': 'CREATED'}), store.reserve('DN', 'KEY-1', 'FP1', 60))
+        self.assertEqual(None, store.reserve('OTHER_DN', 'KEY-1', 'FP1', 60))
+        # Least recently used response is removed
+        self.assertEqual(None, store.reserve('DN', 'KEY-3', 'FP3', 60))
+        self.assertEqual(None, store.reserve('DN', 'KEY-2', 'FP2', 60))
+        # Released reservation can be taken again, stored response is not released
+        store.release('DN', 'KEY-2')
+        self.assertEqual(None, store.reserve('DN', 'KEY-2', 'FP2', 60))
+        store.put('DN', 'KEY-2', 'FP2', {'code': 'CREATED'}, 60)
+        store.release('DN', 'KEY-2')
+        self.assertEqual(('FP2', {'code': 'CREATED'}), store.reserve('DN', 'KEY-2', 'FP2', 60))
+        # Expired reservations and responses are not returned
+        self.assertEqual(None, store.reserve('DN', 'KEY-4', 'FP4', 0))
+        self.assertEqual(None, store.reserve('DN', 'KEY-4', 'FP4', 0))
+        store.put('DN', 'KEY-4', 'FP4', {'code': 'CREATED'}, 0)
+        self.assertEqual(None, store.reserve('DN', 'KEY-4', 'FP4', 60))
+
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+        'username': 'u', 'password': 'p', 'database': 'd'})
+    def test_database_idempotency_store(self, mock_get_db_conf, mock_db_connection):
+        conn = mock_db_connection().__enter__()
+        cur = conn.cursor().__enter__()
+        # Key is already used
+        cur.fetchone.side_effect = [None, ('FP1', '{"code": "CREATED"}')]
+        store = csapi.DatabaseIdempotencyStore()
+        self.assertEqual(('FP1', {'code': 'CREATED'}), store.reserve('DN', 'KEY-1', 'FP1', 60))
+        cur.execute.assert_any_call(csapi.IDEMPOTENCY_TABLE)
+        cur.execute.assert_any_call(csapi.QUERIES['reserve_idempotency_key'], {
+            'client_dn': 'DN', 'key': 'KEY-1', 'fingerprint': 'FP1', 'ttl': 60})
+        cur.execute.assert_called_with(
+            csapi.QUERIES['idempotency_response'], {'client_dn': 'DN', 'key': 'KEY-1'})
+
+        # Key is reserved by another request
+        cur.fetchone.side_effect = [None, ('FP1', None)]
+        self.assertEqual(('FP1', None), store.reserve('DN', 'KEY-1', 'FP1', 60))
+
+        # Key is reserved for this request
+        cur.execute.reset_mock()
+        cur.fetchone.side_effect = [('KEY-1',)]
+        self.assertEqual(None, store.reserve('DN', 'KEY-1', 'FP1', 60))
+        cur.execute.assert_called_once_with(csapi.QUERIES['reserve_idempotency_key'], {
+            'client_dn': 'DN', 'key': 'KEY-1', 'fingerprint': 'FP1', 'ttl': 60})
+        store.release('DN', 'KEY-1')
+        cur.execute.assert_called_with(csapi.QUERIES['release_idempotency_key'], {
+            'client_dn': 'DN', 'key': 'KEY-1'})
+        cur.fetchone.side_effect = None
+
+        cur.execute.reset_mock()
+        store.put('DN', 'KEY-2', 'FP2', {'code': 'CREATED'}, 60)
+        store.put('DN', 'KEY-3', 'FP3', {'code': 'CREATED'}, 60)
+        # Table is created once and expired responses are purged once per interval
+        self.assertEqual([
+            csapi.QUERIES['add_idempotency_response'],
+            csapi.QUERIES['purge_idempotency_responses'],
+            csapi.QUERIES['add_idempotency_response']],
+            [call[0][0] for call in cur.execute.call_args_list])
+        cur.execute.assert_called_with(csapi.QUERIES['add_idempotency_response'], {
+            'client_dn': 'DN', 'key': 'KEY-3', 'fingerprint': 'FP3',
+            'response': '{"code": "CREATED"}', 'ttl': 60})
+
+    def test_get_idempotency_store(self):
+        # Responses are shared by all worker processes by default
+        self.assertIsInstance(csapi.get_idempotency_store(), csapi.DatabaseIdempotencyStore)
+        csapi.configure({'idempotency': {'store': 'memory'}})
+        store = csapi.get_idempotency_store()
+        self.assertIsInstance(store, csapi.MemoryIdempotencyStore)
+        self.assertIs(store, csapi.get_idempotency_store())
+        csapi.configure({'idempotency': {'store': None}})
+        self.assertEqual(None, csapi.get_idempotency_store())
+
+    def test_single_flight(self):
+        single_flight = csapi.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def leader():
+            started.set()
+            release.wait(5)
+            return 'LEADER'
+
+        thread = threading.Thread(target=lambda: results.append(
+            single_flight.run('KEY', leader)))
+        thread.start()
+        started.wait(5)
+        self.assertEqual(True, single_flight.in_flight('KEY'))
+        follower = threading.Thread(target=lambda: results.append(
+            single_flight.run('KEY', lambda: 'FOLLOWER')))
+        follower.start()
+        for _ in range(500):
+            if single_flight.waiting('KEY'):
+                break
+            time.sleep(0.01)
+        # Other keys are not coalesced
+        self.assertEqual(('OTHER', False), single_flight.run('OTHER_KEY', lambda: 'OTHER'))
+        release.set()
+        thread.join(5)
+        follower.join(5)
+        self.assertEqual([('LEADER', False), ('LEADER', True)], results)
+        self.assertEqual(False, single_flight.in_flight('KEY'))
+
+    def test_single_flight_failed(self):
+        single_flight = csapi.SingleFlight()
+        with self.assertRaises(ValueError):
+            single_flight.run('KEY', MagicMock(side_effect=ValueError))
+        # Failed operation is not remembered
+        self.assertEqual(('OK', False), single_flight.run('KEY', lambda: 'OK'))
+
+    @patch('csapi.register_member')
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_add_member_coalesced(
+            self, mock_get_db_conf, mock_db_connection, mock_register_member):
+        key = ('member', 'MEMBER_CLASS', 'MEMBER_CODE')
+        release = threading.Event()
+        results = []
+
+        def register(*args):
+            release.wait(5)
+            return 'CREATED'
+
+        mock_register_member.side_effect = register
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            thread = threading.Thread(target=lambda: results.append(csapi.add_member(
+                'MEMBER_CLASS', 'MEMBER_CODE', 'MEMBER_NAME', 'JSON_DATA')))
+            thread.start()
+            for _ in range(500):
+                if csapi.REGISTRATIONS.in_flight(key):
+                    break
+                time.sleep(0.01)
+            follower = threading.Thread(target=lambda: results.append(csapi.add_member(
+                'MEMBER_CLASS', 'MEMBER_CODE', 'MEMBER_NAME', 'JSON_DATA')))
+            follower.start()
+            for _ in range(500):
+                if csapi.REGISTRATIONS.waiting(key):
+                    break
+                time.sleep(0.01)
+            release.set()
+            thread.join(5)
+            follower.join(5)
+
+        # Second request shares result of the first one and gets correct error
+        mock_register_member.assert_called_once()
+        self.assertEqual(['CREATED', 'MEMBER_EXISTS'], [result['code'] for result in results])
+        self.assertEqual(409, results[1]['http_status'])
+        self.assertIn(
+            'WARNING:csapi:MEMBER_EXISTS: Provided Member already exists (Request: JSON_DATA)',
+            cm.output)
+        self.assertEqual(1, csapi.METRICS.counters[(
+            'csapi_coalesced_registrations_total', (('type', 'member'),))])
+
+    def test_log_formatter(self):
+        formatter = csapi.LogFormatter('%(levelname)s: %(message)s')
+        record = logging.LogRecord('csapi', logging.INFO, __file__, 1, 'Msg %s', ('A',), None)
+        record.created = 0.0
+        record.request_id = 'REQUEST_ID'
+        record.duration = 0.5
+        self.assertEqual('INFO: Msg A', formatter.format(record))
+        csapi.configure({'log': {'format': 'json'}})
+        self.assertEqual({
+            'time': '1970-01-01T00:00:00+00:00', 'process': record.process, 'level': 'INFO',
+            'logger': 'csapi', 'message': 'Msg A', 'request_id': 'REQUEST_ID',
+            'duration': 0.5}, json.loads(formatter.format(record)))
+
+    def test_log_queue(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(csapi.LogFormatter('%(levelname)s: %(message)s'))
+        queue_handler = csapi.BoundedQueueHandler(queue.Queue())
+        listener = csapi.LogListener(queue_handler, handler)
+        logger = logging.getLogger('csapi_test_log_queue')
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+        try:
+            csapi.configure({'log': {'queue_size': 2}})
+            for i in range(4):
+                logger.warning('Message %s', i)
+            self.assertEqual(2, queue_handler.dropped)
+            self.assertEqual(2, csapi.METRICS.counters[('csapi_log_records_dropped_total', ())])
+            # Records are written by background thread
+            self.assertEqual('', stream.getvalue())
+            listener.start()
+            listener.stop()
+            self.assertEqual([
+                'WARNING: LOG_DROPPED: 2 log records were dropped, log writing is too slow',
+                'WARNING: Message 0', 'WARNING: Message 1'], stream.getvalue().splitlines())
+        finally:
+            logger.removeHandler(queue_handler)
+
+    def test_request_log_filter(self):
+        log_filter = csapi.RequestLogFilter()
+        record = logging.LogRecord(
+            'csapi', logging.INFO, __file__, 1, 'Incoming request: %s', ({},), None)
+        self.assertEqual(True, log_filter.filter(record))
+        self.assertEqual(None, record.request_id)
+        self.assertEqual(None, record.duration)
+
+        csapi.configure({'log': {'sample_rate': 0.5}})
+        with patch('random.random', side_effect=[0.7, 0.1]):
+            with self.app.test_request_context('/member'):
+                csapi.start_request_timer()
+                csapi.start_query_log()
+                # The same decision for all verbose lines of request
+                self.assertEqual(False, log_filter.filter(record))
+                self.assertEqual(False, log_filter.filter(logging.LogRecord(
+                    'csapi', logging.INFO, __file__, 1, 'Client DN: %s', (None,), None)))
+                response = logging.LogRecord(
+                    'csapi', logging.INFO, __file__, 1, 'Response: %s', ({},), None)
+                self.assertEqual(True, log_filter.filter(response))
+                self.assertEqual(csapi.g.csapi_request_id, response.request_id)
+                self.assertLessEqual(0, response.duration)
+            with self.app.test_request_context('/member'):
+                self.assertEqual(True, log_filter.filter(record))
+
+    def test_json_codecs(self):
+        data = {'member_name': 'Õun', 'items': [1, 2.5, None, True]}
+        expected = '{"member_name":"Õun","items":[1,2.5,null,true]}'.encode('utf-8')
+        for name in csapi.JSON_CODECS:
+            csapi.configure({'codec': {'json': name}})
+            self.assertEqual(expected, csapi.dumps_json(data))
+            self.assertEqual(data, csapi.loads_json(expected))
+            self.assertEqual(data, csapi.loads_json(expected.decode('utf-8')))
+        csapi.configure({'codec': {'json': 'auto'}})
+        self.assertEqual(
+            csapi.JSON_CODECS.get('orjson', csapi.JSON_CODECS['json']), csapi.get_json_codec())
+
+    def test_validate_codec_config(self):
+        with patch('csapi.msgpack', None), patch.dict(csapi.JSON_CODECS, {
+                'json': csapi.JSON_CODECS['json']}, clear=True):
+            self.assertEqual([], csapi.validate_config({'codec': {'json': 'auto'}}))
+            self.assertEqual([
+                'codec.json must be one of: auto, json',
+                'codec.msgpack requires msgpack package'],
+                csapi.validate_config({'codec': {'json': 'orjson', 'msgpack': True}}))
+
+    def test_member_invalid_body(self):
+        response = self.client.post('/member', data=b'{"member_class": ')
+        self.assertEqual(400, response.status_code)
+        response = self.client.post('/member', data=b'')
+        self.assertEqual(400, response.status_code)
+
+    @patch('csapi.add_member', return_value={
+        'http_status': 201, 'code': 'CREATED', 'msg': 'New Member added'})
+    def test_member_msgpack(self, mock_add_member):
+        data = {'member_class': 'GOV', 'member_code': 'CODE', 'member_name': 'NAME'}
+        with patch('csapi.msgpack') as mock_msgpack:
+            mock_msgpack.unpackb.return_value = data
+            mock_msgpack.packb.return_value = b'PACKED'
+            with self.assertLogs(csapi.LOGGER, level='INFO'):
+                # MessagePack is disabled by default
+                response = self.client.post('/member', data=b'MSGPACK', headers={
+                    'Content-Type': 'application/msgpack'})
+                self.assertEqual(400, response.status_code)
+
+                csapi.configure({'codec': {'msgpack': True}})
+                response = self.client.post('/member', data=b'MSGPACK', headers={
+                    'Content-Type': 'application/msgpack', 'Accept': 'application/msgpack'})
+                self.assertEqual(201, response.status_code)
+                self.assertEqual('application/msgpack', response.mimetype)
+                self.assertEqual(b'PACKED', response.data)
+                self.assertEqual('Accept', response.headers['Vary'])
+                mock_msgpack.unpackb.assert_called_once_with(b'MSGPACK', raw=False)
+                mock_msgpack.packb.assert_called_once_with(
+                    {'code': 'CREATED', 'msg': 'New Member added'}, use_bin_type=True)
+
+                # JSON is used when client does not prefer MessagePack
+                response = self.client.post('/member', data=json.dumps(data), headers={
+                    'Accept': 'application/json;q=0.9, application/msgpack;q=0.5'})
+                self.assertEqual('application/json', response.mimetype)
+                self.assertEqual({'code': 'CREATED', 'msg': 'New Member added'}, response.json)
+                response = self.client.post('/member', data=json.dumps(data))
+                self.assertEqual('application/json', response.mimetype)
+
+                mock_msgpack.unpackb.side_effect = ValueError('Unpack failed')
+                response = self.client.post('/member', data=b'MSGPACK', headers={
+                    'Content-Type': 'application/x-msgpack'})
+                self.assertEqual(400, response.status_code)
+        mock_add_member.assert_called_with('GOV', 'CODE', 'NAME', data)
+
+    @patch('time.sleep')
+    @patch('random.uniform', side_effect=lambda low, high: high / 2)
+    def test_run_transaction(self, mock_uniform, mock_sleep):
+        func = MagicMock(side_effect=[
+            psycopg2.errors.SerializationFailure('could not serialize access'),
+            psycopg2.errors.DeadlockDetected('deadlock detected'), 'RESULT'])
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual('RESULT', csapi.run_transaction('member', func))
+            self.assertEqual([
+                'WARNING:csapi:Retrying member transaction in 0.025 s after '
+                'serialization_failure (attempt 1): could not serialize access',
+                'WARNING:csapi:Retrying member transaction in 0.050 s after deadlock '
+                '(attempt 2): deadlock detected'], cm.output)
+        self.assertEqual(3, func.call_count)
+        # Backoff is doubled after each attempt
+        self.assertEqual([call(0, 0.05), call(0, 0.1)], mock_uniform.call_args_list)
+        self.assertEqual([call(0.025), call(0.05)], mock_sleep.call_args_list)
+        self.assertEqual(1, csapi.METRICS.counters[('csapi_db_transaction_retries_total', (
+            ('transaction', 'member'), ('reason', 'serialization_failure')))])
+        self.assertEqual(1, csapi.METRICS.counters[('csapi_db_transaction_retries_total', (
+            ('transaction', 'member'), ('reason', 'deadlock')))])
+
+    @patch('time.sleep')
+    def test_run_transaction_exhausted(self, mock_sleep):
+        csapi.configure({'transaction_retry': {'attempts': 2}})
+        func = MagicMock(side_effect=psycopg2.errors.DeadlockDetected('deadlock detected'))
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            with self.assertRaises(psycopg2.errors.DeadlockDetected):
+                csapi.run_transaction('members', func)
+        self.assertEqual(2, func.call_count)
+        self.assertEqual(1, mock_sleep.call_count)
+        self.assertEqual(1, csapi.METRICS.counters[(
+            'csapi_db_transaction_retries_exhausted_total',
+            (('transaction', 'members'), ('reason', 'deadlock')))])
+
+        # Retry is not started after budget
+        csapi.configure({'transaction_retry': {'budget': 0}})
+        func.reset_mock()
+        with self.assertRaises(psycopg2.errors.DeadlockDetected):
+            csapi.run_transaction('members', func)
+        self.assertEqual(1, func.call_count)
+
+        # Other errors are not retried
+        func = MagicMock(side_effect=psycopg2.Error('DB_ERROR_MSG'))
+        with self.assertRaises(psycopg2.Error):
+            csapi.run_transaction('members', func)
+        self.assertEqual(1, func.call_count)
+        self.assertEqual(1, mock_sleep.call_count)
+
+    def test_retry_reason(self):
+        self.assertEqual('unique_violation', csapi.retry_reason(
+            psycopg2.errors.UniqueViolation('duplicate key')))
+        self.assertEqual('stale_prepared_statement', csapi.retry_reason(
+            psycopg2.errors.InvalidSqlStatementName('prepared statement does not exist')))
+        self.assertEqual(None, csapi.retry_reason(
+            psycopg2.errors.FeatureNotSupported('not supported')))
+        self.assertEqual(None, csapi.retry_reason(psycopg2.Error('DB_ERROR_MSG')))
+
+    @patch('time.sleep')
+    @patch('csapi.register_member', side_effect=psycopg2.errors.UniqueViolation(
+        'duplicate key value violates unique constraint'))
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_add_member_unique_violation(
+            self, mock_get_db_conf, mock_db_connection, mock_register_member, mock_sleep):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(
+                {
+                    'code': 'MEMBER_EXISTS', 'http_status': 409,
+                    'msg': 'Provided Member already exists'},
+                csapi.add_member('MEMBER_CLASS', 'MEMBER_CODE', 'MEMBER_NAME', 'JSON_DATA'))
+            self.assertEqual([
+                'WARNING:csapi:Concurrent member registration detected: duplicate key value '
+                'violates unique constraint',
+                'WARNING:csapi:MEMBER_EXISTS: Provided Member already exists (Request: '
+                'JSON_DATA)'], cm.output[-2:])
+        # Whole transaction is run again with new connection
+        self.assertEqual(3, mock_register_member.call_count)
+        self.assertEqual(2, mock_sleep.call_count)
+
+    @patch('time.sleep')
+    @patch('csapi.register_members', side_effect=[
+        psycopg2.errors.SerializationFailure('could not serialize access'), ['CREATED']])
+    @patch('csapi.db_connection')
+    @patch('csapi.get_db_conf', return_value={
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'})
+    def test_add_members_retry(
+            self, mock_get_db_conf, mock_db_connection, mock_register_members, mock_sleep):
+        items = [{'member_class': 'GOV', 'member_code': 'CODE', 'member_name': 'NAME'}]
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = csapi.add_members(items, [None])
+        self.assertEqual(1, response['created'])
+        self.assertEqual(2, mock_register_members.call_count)
+        self.assertEqual(2, mock_db_connection.call_count)
+
+class DbPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        csapi.configure(None)
+        csapi._DB_POOL['pool'] = None
+        self.conf = {
+            'database': 'centerui_production',
+            'password': 'centerui_pass',
+            'username': 'centerui_user'}
+
+    @staticmethod
+    def new_conn(*args):
+        conn = MagicMock()
+        conn.closed = 0
+        conn.get_transaction_status.return_value = \
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        return conn
+
+    @patch('csapi.get_db_connection')
+    def test_getconn_reuse(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_conn
+        pool = csapi.DbPool(self.conf, min_size=0, max_size=2)
+        conn = pool.getconn()
+        mock_get_db_connection.assert_called_once_with(self.conf)
+        pool.putconn(conn)
+        self.assertIs(conn, pool.getconn())
+        mock_get_db_connection.assert_called_once()
+        self.assertEqual(1, pool.size())
+
+    @patch('csapi.get_db_connection')
+    def test_getconn_timeout(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_conn
+        pool = csapi.DbPool(self.conf, min_size=0, max_size=1, timeout=0.01)
+        pool.getconn()
+        with self.assertRaises(csapi.PoolTimeout):
+            pool.getconn()
+
+    @patch('csapi.get_db_connection', side_effect=psycopg2.OperationalError('CONN_ERR'))
+    def test_getconn_connect_error(self, mock_get_db_connection):
+        pool = csapi.DbPool(self.conf, min_size=0, max_size=1, timeout=0.01)
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.getconn()
+        # Failed connection attempt must release its slot
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.getconn()
+        self.assertEqual(2, mock_get_db_connection.call_count)
+
+    @patch('csapi.get_db_connection')
+    def test_getconn_health_check(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_conn
+        pool = csapi.DbPool(self.conf, min_size=0, max_size=1, health_check_idle=-1)
+        broken = pool.getconn()
+        broken.cursor.return_value.__enter__.return_value.execute.side_effect = \
+            psycopg2.OperationalError('BROKEN')
+        pool.putconn(broken)
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            conn = pool.getconn()
+            self.assertEqual([
+                'WARNING:csapi:Discarding broken pooled database connection: BROKEN'],
+                cm.output)
+        self.assertIsNot(broken, conn)
+        broken.close.assert_called_once_with()
+        self.assertEqual(1, pool.size())
+
+    @patch('csapi.get_db_connection')
+    def test_putconn_rollback(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_conn
+        pool = csapi.DbPool(self.conf, min_size=0)
+        conn = pool.getconn()
+        conn.get_transaction_status.return_value = \
+            psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        pool.putconn(conn)
+        conn.rollback.assert_called_once_with()
+        conn.close.assert_not_called()
+
+    @patch('csapi.get_db_connection')
+    def test_putconn_expired(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_conn
+        pool = csapi.DbPool(self.conf, min_size=0, max_lifetime=-1)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.close.assert_called_once_with()
+        self.assertEqual(0, pool.size())
+
+    @patch('csapi.get_db_connection')
+    def test_reap_idle(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_conn
+        pool = csapi.DbPool(self.conf, min_size=1, max_size=3, max_idle=-1)
+        conn1 = pool.getconn()
+        conn2 = pool.getconn()
+        pool.putconn(conn1)
+        pool.putconn(conn2)
+        # One idle connection is reaped when connections are returned, other one is kept
+        # because of min_size
+        conn1.close.assert_called_once_with()
+        self.assertIs(conn2, pool.getconn())
+        self.assertEqual(1, pool.size())
+
+    @patch('csapi.get_db_connection')
+    def test_fill(self, mock_get_db_connection):
+        def new_conn(*args):
+            # Other thread fills the pool while connection is opened
+            time.sleep(0.05)
+            return self.new_conn()
+
+        mock_get_db_connection.side_effect = new_conn
+        pool = csapi.DbPool(self.conf, min_size=2, max_size=4)
+        conn = pool.getconn()
+        threads = [threading.Thread(target=pool.fill) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Connection opened by getconn counts towards min_size
+        self.assertEqual(2, mock_get_db_connection.call_count)
+        self.assertEqual(2, pool.size())
+        pool.putconn(conn)
+        pool.fill()
+        self.assertEqual(2, mock_get_db_connection.call_count)
+
+    @patch('csapi.get_db_connection')
+    def test_fill_error(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = [
+            self.new_conn(), psycopg2.OperationalError('CONN_ERR')]
+        pool = csapi.DbPool(self.conf, min_size=3, max_size=3, timeout=0.01)
+        with self.assertLogs(csapi.LOGGER, level='WARNING') as cm:
+            pool.fill()
+        self.assertEqual([
+            'WARNING:csapi:Cannot open database connection for pool: CONN_ERR'], cm.output)
+        self.assertEqual(1, pool.size())
+        # Slots reserved by failed fill are released
+        mock_get_db_connection.side_effect = self.new_conn
+        pool.getconn()
+        pool.getconn()
+        pool.getconn()
+        self.assertEqual(3, pool.size())
+
+    @patch('csapi.get_db_connection')
+    def test_fill_closed(self, mock_get_db_connection):
+        conn = self.new_conn()
+        pool = csapi.DbPool(self.conf, min_size=1)
+
+        def close_pool(*args):
+            pool.close()
+            return conn
+
+        mock_get_db_connection.side_effect = close_pool
+        pool.fill()
+        conn.close.assert_called_once_with()
+        self.assertEqual(0, pool.size())
+
+    @patch('csapi.get_db_connection')
+    def test_get_db_pool(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_conn
+        csapi.configure({'db_pool': {'min_size': 2, 'max_size': 5}})
+        pool = csapi.get_db_pool(self.conf)
+        self.assertEqual(5, pool.max_size)
+        self.assertEqual(300, pool.max_idle)
+        self.assertEqual(2, pool.size())
+        # Existing pool is not filled again
+        self.assertIs(pool, csapi.get_db_pool(dict(self.conf)))
+        self.assertEqual(2, mock_get_db_connection.call_count)
+        # Changed password requires new pool
+        new_pool = csapi.get_db_pool(dict(self.conf, password='new_pass'))
+        self.assertIsNot(pool, new_pool)
+        self.assertTrue(pool.closed)
+        self.assertEqual(0, pool.size())
+        # Changed pool settings require new pool
+        csapi.configure({'db_pool': {'min_size': 2, 'max_size': 6}})
+        self.assertIsNot(new_pool, csapi.get_db_pool(dict(self.conf, password='new_pass')))
+
+    @patch('csapi.get_db_connection')
+    def test_db_connection_metrics(self, mock_get_db_connection):
+        csapi.METRICS.clear()
+        mock_get_db_connection.side_effect = self.new_conn
+        with csapi.db_connection(self.conf):
+            pass
+        mock_get_db_connection.side_effect = psycopg2.Error('DB_ERROR_MSG')
+        csapi.get_db_pool(self.conf).close()
+        with self.assertRaises(psycopg2.Error):
+            with csapi.db_connection(self.conf):
+                pass
+        self.assertEqual(
+            2, sum(csapi.METRICS.histograms[('csapi_db_connection_wait_seconds', ())][0]))
+        self.assertEqual(1, csapi.METRICS.counters[('csapi_db_connection_errors_total', ())])
+
+    @patch('csapi.get_db_connection')
+    def test_db_connection(self, mock_get_db_connection):
+        mock_get_db_connection.side_effect = self.new_conn
+        with self.assertRaises(ValueError):
+            with csapi.db_connection(self.conf) as conn:
+                raise ValueError()
+        pool = csapi.get_db_pool(self.conf)
+        self.assertEqual(1, pool.size())
+        with csapi.db_connection(self.conf) as conn2:
+            self.assertIs(conn, conn2)
+
+
 class NoConfTestCase(unittest.TestCase):
     def setUp(self):
         self.app = Flask(__name__)
@@ -989,6 +3552,23 @@ class NoConfTestCase(unittest.TestCase):
             'config': None})
         self.api.add_resource(csapi.SubsystemApi, '/subsystem', resource_class_kwargs={
             'config': None})
+        self.api.add_resource(csapi.CacheApi, '/cache', resource_class_kwargs={
+            'config': None})
+        self.api.add_resource(csapi.MembersApi, '/members', resource_class_kwargs={
+            'config': None})
+        self.api.add_resource(csapi.SubsystemsApi, '/subsystems', resource_class_kwargs={
+            'config': None})
+        self.api.add_resource(
+            csapi.MemberInfoApi, '/member/<string:member_class>/<string:member_code>',
+            resource_class_kwargs={'config': None})
+        self.api.add_resource(
+            csapi.MemberSubsystemsApi,
+            '/member/<string:member_class>/<string:member_code>/subsystems',
+            resource_class_kwargs={'config': None})
+        self.api.add_resource(csapi.ExportApi, '/export', resource_class_kwargs={
+            'config': None})
+        self.api.add_resource(csapi.MetricsApi, '/metrics', resource_class_kwargs={
+            'config': None})
 
     def test_member_no_conf(self):
         with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
@@ -1013,5 +3593,37 @@ class NoConfTestCase(unittest.TestCase):
                 "'Client certificate is not allowed: None'}"], cm.output)
 
 
+    def test_cache_no_conf(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual(403, self.client.get('/cache').status_code)
+            self.assertEqual(403, self.client.delete('/cache').status_code)
+
+
+    def test_members_no_conf(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/members', data=json.dumps([]))
+            self.assertEqual(403, response.status_code)
+
+
+    def test_subsystems_no_conf(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            response = self.client.post('/subsystems', data=json.dumps([]))
+            self.assertEqual(403, response.status_code)
+
+    def test_read_no_conf(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual(403, self.client.get('/members').status_code)
+            self.assertEqual(403, self.client.get('/member/GOV/CODE').status_code)
+            self.assertEqual(403, self.client.get('/member/GOV/CODE/subsystems').status_code)
+
+    def test_export_no_conf(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual(403, self.client.get('/export').status_code)
+
+    def test_metrics_no_conf(self):
+        with self.assertLogs(csapi.LOGGER, level='INFO'):
+            self.assertEqual(403, self.client.get('/metrics').status_code)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,383 @@
+import asyncio
+import json
+import unittest
+import csapi
+import csapi_async
+import asyncpg
+from unittest.mock import patch, call, AsyncMock, MagicMock
+
+DB_CONF = {
+    'database': 'centerui_production',
+    'password': 'centerui_pass',
+    'username': 'centerui_user'}
+
+
+async def call_app(app, method, path, body=b'', headers=None):
+    """Call ASGI application and return response status and decoded JSON body"""
+    scope = {
+        'type': 'http', 'method': method, 'path': path,
+        'headers': [(key.lower().encode(), value.encode()) for key, value in (
+            headers or {}).items()]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]['status'], json.loads(messages[1]['body'])
+
+
+class AsyncTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.app = csapi_async.App({'allow_all': True})
+        csapi.configure({'cache_flush_file': None})
+        csapi.MEMBER_CLASS_CACHE.clear()
+        csapi.METRICS.clear()
+        csapi._INSTANCE_IDENTIFIER['value'] = None
+        csapi._CACHE_FLUSH.update({'key': None, 'requested': False})
+
+    def test_positional_query(self):
+        self.assertEqual(
+            ('select $1, $2, $1', ['time', 'name']),
+            csapi_async.positional_query('select %(time)s, %(name)s, %(time)s'))
+        self.assertEqual(
+            ("select value from system_parameters where key='instanceIdentifier'", []),
+            csapi_async.ASYNC_QUERIES['instance_identifier'])
+
+    async def test_fetchrow(self):
+        conn = MagicMock()
+        conn.fetchrow = AsyncMock(return_value=[12345])
+        self.assertEqual([12345], await csapi_async.fetchrow(
+            conn, 'member_class_id', {'str': 'MEMBER_CLASS'}))
+        conn.fetchrow.assert_called_with(
+            'select id from member_classes where code=$1', 'MEMBER_CLASS')
+
+    async def test_execute(self):
+        conn = MagicMock()
+        conn.execute = AsyncMock()
+        await csapi_async.execute(conn, 'add_client_name', {
+            'name': 'MEMBER_NAME', 'identifier_id': 'IDENT_ID', 'time': 'TIME'})
+        self.assertEqual(
+            ('MEMBER_NAME', 'IDENT_ID', 'TIME'), conn.execute.call_args[0][1:])
+
+    @patch('csapi_async.fetchrow', new_callable=AsyncMock, return_value=[123])
+    async def test_get_cached_member_class_id(self, mock_fetchrow):
+        self.assertEqual(123, await csapi_async.get_cached_member_class_id('CONN', 'GOV'))
+        self.assertEqual(123, await csapi_async.get_cached_member_class_id('CONN', 'GOV'))
+        mock_fetchrow.assert_called_once_with('CONN', 'member_class_id', {'str': 'GOV'})
+
+        # Cache flush requested by SIGHUP applies to asyncio variant too
+        csapi.request_cache_flush()
+        self.assertEqual(123, await csapi_async.get_cached_member_class_id('CONN', 'GOV'))
+        self.assertEqual(2, mock_fetchrow.call_count)
+
+    @patch('csapi_async.fetchrow', new_callable=AsyncMock, return_value=None)
+    async def test_get_member_data_no_member(self, mock_fetchrow):
+        self.assertEqual(None, await csapi_async.get_member_data('CONN', 123, 'CODE'))
+        mock_fetchrow.assert_called_once_with(
+            'CONN', 'member_data', {'class_id': 123, 'member_code': 'CODE'})
+
+    @patch('csapi_async.db_connection')
+    @patch('csapi_async.get_db_conf', return_value=DB_CONF)
+    @patch('csapi_async.get_instance_identifier', new_callable=AsyncMock, return_value='EE')
+    async def test_load_instance_identifier(
+            self, mock_get_instance_identifier, mock_get_db_conf, mock_db_connection):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual('EE', await csapi_async.load_instance_identifier())
+            self.assertEqual(['INFO:csapi:Instance identifier loaded: EE'], cm.output)
+        self.assertEqual('EE', csapi._INSTANCE_IDENTIFIER['value'])
+
+    @patch('csapi_async.db_connection', side_effect=OSError('DB_ERROR_MSG'))
+    @patch('csapi_async.get_db_conf', return_value=DB_CONF)
+    async def test_load_instance_identifier_db_error(self, mock_get_db_conf, mock_db_connection):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual(None, await csapi_async.load_instance_identifier())
+            self.assertEqual([
+                'ERROR:csapi:DB_ERROR: Cannot load instance identifier: DB_ERROR_MSG'],
+                cm.output)
+
+    @patch('csapi_async.execute', new_callable=AsyncMock)
+    @patch('csapi_async.get_cached_instance_identifier', new_callable=AsyncMock,
+           return_value='EE')
+    @patch('csapi_async.fetchrow', new_callable=AsyncMock, side_effect=[['TIME'], [321]])
+    @patch('csapi_async.get_member_data', new_callable=AsyncMock, return_value=None)
+    @patch('csapi_async.get_cached_member_class_id', new_callable=AsyncMock, return_value=12)
+    async def test_register_member(
+            self, mock_class_id, mock_member_data, mock_fetchrow, mock_instance,
+            mock_execute):
+        conn = MagicMock()
+        self.assertEqual('CREATED', await csapi_async.register_member(
+            conn, 'GOV', 'CODE', 'NAME'))
+        conn.transaction.assert_called_once_with()
+        mock_fetchrow.assert_called_with(conn, 'add_member_identifier', {
+            'instance': 'EE', 'class': 'GOV', 'code': 'CODE', 'time': 'TIME'})
+        mock_execute.assert_any_call(conn, 'add_member_client', {
+            'code': 'CODE', 'name': 'NAME', 'class_id': 12, 'identifier_id': 321,
+            'time': 'TIME'})
+        mock_execute.assert_called_with(conn, 'add_client_name', {
+            'name': 'NAME', 'identifier_id': 321, 'time': 'TIME'})
+
+    @patch('csapi_async.lock_registration', new_callable=AsyncMock)
+    @patch('csapi_async.get_member_data', new_callable=AsyncMock, return_value={'id': 1})
+    @patch('csapi_async.get_cached_member_class_id', new_callable=AsyncMock, return_value=12)
+    async def test_register_member_exists(
+            self, mock_class_id, mock_member_data, mock_lock_registration):
+        conn = MagicMock()
+        self.assertEqual('MEMBER_EXISTS', await csapi_async.register_member(
+            conn, 'GOV', 'CODE', 'NAME'))
+        mock_lock_registration.assert_called_once_with(conn, 'member', 'GOV', 'CODE')
+
+        csapi.configure({'coalesce_registrations': False})
+        mock_lock_registration.reset_mock()
+        self.assertEqual('MEMBER_EXISTS', await csapi_async.register_member(
+            conn, 'GOV', 'CODE', 'NAME'))
+        mock_lock_registration.assert_not_called()
+
+    @patch('csapi_async.lock_registration', new_callable=AsyncMock)
+    @patch('csapi_async.subsystem_exists', new_callable=AsyncMock, return_value=True)
+    @patch('csapi_async.get_member_data', new_callable=AsyncMock, return_value={'id': 1})
+    @patch('csapi_async.get_cached_member_class_id', new_callable=AsyncMock, return_value=12)
+    async def test_register_subsystem_exists(
+            self, mock_class_id, mock_member_data, mock_subsystem_exists,
+            mock_lock_registration):
+        conn = MagicMock()
+        self.assertEqual('SUBSYSTEM_EXISTS', await csapi_async.register_subsystem(
+            conn, 'GOV', 'CODE', 'SUB'))
+        mock_subsystem_exists.assert_called_once()
+        mock_lock_registration.assert_called_once_with(conn, 'subsystem', 'GOV', 'CODE', 'SUB')
+
+    @patch('csapi_async.lock_registration', new_callable=AsyncMock)
+    @patch('csapi_async.get_cached_instance_identifier', new_callable=AsyncMock,
+           return_value='EE')
+    @patch('csapi_async.fetchrow', new_callable=AsyncMock, return_value=(True, False))
+    async def test_register_member_cte_coalesced(
+            self, mock_fetchrow, mock_instance, mock_lock_registration):
+        conn = MagicMock()
+        self.assertEqual('CREATED', await csapi_async.register_member_cte(
+            conn, 'GOV', 'CODE', 'NAME'))
+        # Lock and registration statement run in the same transaction
+        conn.transaction.assert_called_once_with()
+        mock_lock_registration.assert_called_once_with(conn, 'member', 'GOV', 'CODE')
+        mock_fetchrow.assert_called_once_with(conn, 'register_member', {
+            'instance': 'EE', 'class': 'GOV', 'code': 'CODE', 'name': 'NAME'})
+
+    @patch('csapi_async.get_cached_instance_identifier', new_callable=AsyncMock,
+           return_value='EE')
+    @patch('csapi_async.fetchrow', new_callable=AsyncMock)
+    async def test_register_subsystem_cte(self, mock_fetchrow, mock_instance):
+        csapi.configure({'coalesce_registrations': False})
+        for rec, code in (
+                ((False, False, False), 'INVALID_MEMBER_CLASS'),
+                ((True, False, False), 'INVALID_MEMBER'),
+                ((True, True, True), 'SUBSYSTEM_EXISTS'),
+                ((True, True, False), 'CREATED')):
+            mock_fetchrow.return_value = rec
+            self.assertEqual(code, await csapi_async.register_subsystem_cte(
+                'CONN', 'GOV', 'CODE', 'SUB'))
+        mock_fetchrow.assert_called_with('CONN', 'register_subsystem', {
+            'instance': 'EE', 'class': 'GOV', 'member_code': 'CODE',
+            'subsystem_code': 'SUB'})
+
+    @patch('csapi_async.register_member_cte', new_callable=AsyncMock, return_value='CREATED')
+    @patch('csapi_async.register_member', new_callable=AsyncMock, return_value='MEMBER_EXISTS')
+    @patch('csapi_async.db_connection')
+    @patch('csapi_async.get_db_conf', return_value=DB_CONF)
+    async def test_member_api(
+            self, mock_get_db_conf, mock_db_connection, mock_register_member,
+            mock_register_member_cte):
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual((409, {
+                'code': 'MEMBER_EXISTS', 'msg': 'Provided Member already exists'}),
+                await call_app(self.app, 'POST', '/member', json.dumps({
+                    'member_class': 'GOV', 'member_code': 'CODE',
+                    'member_name': 'NAME'}).encode()))
+            self.assertEqual([
+                "INFO:csapi:Incoming request: {'member_class': 'GOV', 'member_code': 'CODE', "
+                "'member_name': 'NAME'}",
+                'INFO:csapi:Client DN: None',
+                "WARNING:csapi:MEMBER_EXISTS: Provided Member already exists (Request: "
+                "{'member_class': 'GOV', 'member_code': 'CODE', 'member_name': 'NAME'})",
+                "INFO:csapi:Response: {'http_status': 409, 'code': 'MEMBER_EXISTS', "
+                "'msg': 'Provided Member already exists'}"], cm.output)
+        mock_register_member.assert_called_once_with(
+            mock_db_connection().__aenter__.return_value, 'GOV', 'CODE', 'NAME')
+
+        csapi.configure({'single_round_trip': True})
+        self.assertEqual((201, {'code': 'CREATED', 'msg': 'New Member added'}), await call_app(
+            self.app, 'POST', '/member', json.dumps({
+                'member_class': 'GOV', 'member_code': 'CODE',
+                'member_name': 'NAME'}).encode()))
+        mock_register_member_cte.assert_called_once()
+
+    async def test_member_api_missing_parameter(self):
+        self.assertEqual((400, {
+            'code': 'MISSING_PARAMETER', 'msg': 'Request parameter member_name is missing'}),
+            await call_app(self.app, 'POST', '/member', json.dumps({
+                'member_class': 'GOV', 'member_code': 'CODE'}).encode()))
+
+    async def test_member_api_forbidden(self):
+        app = csapi_async.App({'allowed': ['CN=allowed']})
+        self.assertEqual((403, {
+            'code': 'FORBIDDEN', 'msg': 'Client certificate is not allowed: CN=other'}),
+            await call_app(app, 'POST', '/member', b'{}', {'X-Ssl-Client-S-Dn': 'CN=other'}))
+
+    @patch('csapi_async.register_subsystem', new_callable=AsyncMock, return_value='CREATED')
+    @patch('csapi_async.db_connection', side_effect=asyncio.TimeoutError())
+    @patch('csapi_async.get_db_conf', return_value=DB_CONF)
+    async def test_subsystem_api_db_error(
+            self, mock_get_db_conf, mock_db_connection, mock_register_subsystem):
+        self.assertEqual((500, {
+            'code': 'DB_ERROR', 'msg': 'Unclassified database error'}),
+            await call_app(self.app, 'POST', '/subsystem', json.dumps({
+                'member_class': 'GOV', 'member_code': 'CODE',
+                'subsystem_code': 'SUB'}).encode(), {'X-Ssl-Client-S-Dn': 'CN=allowed'}))
+
+    @patch('csapi_async.get_db_conf', return_value={
+        'database': '', 'password': 'centerui_pass', 'username': 'centerui_user'})
+    async def test_subsystem_api_no_database(self, mock_get_db_conf):
+        self.assertEqual((500, {
+            'code': 'DB_CONF_ERROR', 'msg': 'Cannot access database configuration'}),
+            await call_app(self.app, 'POST', '/subsystem', json.dumps({
+                'member_class': 'GOV', 'member_code': 'CODE',
+                'subsystem_code': 'SUB'}).encode()))
+
+    @patch('csapi_async.get_instance_identifier', new_callable=AsyncMock, return_value='EE')
+    @patch('csapi_async.db_connection')
+    @patch('csapi_async.get_db_conf', return_value=DB_CONF)
+    async def test_status_api(
+            self, mock_get_db_conf, mock_db_connection, mock_get_instance_identifier):
+        self.assertEqual(
+            (200, {'code': 'OK', 'msg': 'API is ready'}),
+            await call_app(self.app, 'GET', '/status'))
+        self.assertEqual('EE', csapi._INSTANCE_IDENTIFIER['value'])
+
+        mock_get_instance_identifier.side_effect = asyncpg.PostgresError('DB_ERROR_MSG')
+        self.assertEqual(
+            (500, {'code': 'DB_ERROR', 'msg': 'Unclassified database error'}),
+            await call_app(self.app, 'GET', '/status'))
+
+    @patch('csapi_async.asyncio.sleep', new_callable=AsyncMock)
+    @patch('random.uniform', side_effect=lambda low, high: high / 2)
+    async def test_run_transaction(self, mock_uniform, mock_sleep):
+        func = AsyncMock(side_effect=[
+            asyncpg.SerializationError('could not serialize access'),
+            asyncpg.DeadlockDetectedError('deadlock detected'), 'RESULT'])
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual('RESULT', await csapi_async.run_transaction('member', func))
+            self.assertEqual([
+                'WARNING:csapi:Retrying member transaction in 0.025 s after '
+                'serialization_failure (attempt 1): could not serialize access',
+                'WARNING:csapi:Retrying member transaction in 0.050 s after deadlock '
+                '(attempt 2): deadlock detected'], cm.output)
+        self.assertEqual(3, func.call_count)
+        self.assertEqual([call(0.025), call(0.05)], mock_sleep.call_args_list)
+        self.assertEqual(1, csapi.METRICS.counters[('csapi_db_transaction_retries_total', (
+            ('transaction', 'member'), ('reason', 'deadlock')))])
+
+        # Retries are exhausted, other errors are not retried
+        csapi.configure({'transaction_retry': {'attempts': 1}})
+        func = AsyncMock(side_effect=asyncpg.DeadlockDetectedError('deadlock detected'))
+        with self.assertRaises(asyncpg.DeadlockDetectedError):
+            await csapi_async.run_transaction('member', func)
+        func = AsyncMock(side_effect=asyncpg.PostgresError('DB_ERROR_MSG'))
+        with self.assertRaises(asyncpg.PostgresError):
+            await csapi_async.run_transaction('member', func)
+        self.assertEqual(1, func.call_count)
+        self.assertEqual(2, mock_sleep.call_count)
+
+    async def test_run_registration_unique_violation(self):
+        csapi.configure({'transaction_retry': {'attempts': 1}})
+        register = AsyncMock(side_effect=asyncpg.UniqueViolationError('duplicate key'))
+        with self.assertLogs(csapi.LOGGER, level='INFO') as cm:
+            self.assertEqual('MEMBER_EXISTS', await csapi_async.run_registration(
+                ('member', 'GOV', 'CODE'), register, 'MEMBER_EXISTS'))
+            self.assertEqual(
+                'WARNING:csapi:Concurrent member registration detected: duplicate key',
+                cm.output[-1])
+
+    async def test_run_registration_coalesced(self):
+        started = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def register():
+            started.set()
+            await finish.wait()
+            return 'CREATED'
+
+        key = ('member', 'GOV', 'CODE')
+        leader = asyncio.ensure_future(csapi_async.run_registration(
+            key, register, 'MEMBER_EXISTS'))
+        await started.wait()
+        self.assertTrue(csapi_async.REGISTRATIONS.in_flight(key))
+        follower = asyncio.ensure_future(csapi_async.run_registration(
+            key, register, 'MEMBER_EXISTS'))
+        await asyncio.sleep(0)
+        finish.set()
+        self.assertEqual(['CREATED', 'MEMBER_EXISTS'], await asyncio.gather(leader, follower))
+        self.assertFalse(csapi_async.REGISTRATIONS.in_flight(key))
+        self.assertEqual(1, csapi.METRICS.counters[(
+            'csapi_coalesced_registrations_total', (('type', 'member'),))])
+
+    async def test_single_flight_failed(self):
+        single_flight = csapi_async.SingleFlight()
+        finish = asyncio.Event()
+
+        async def fail():
+            await finish.wait()
+            raise asyncpg.PostgresError('DB_ERROR_MSG')
+
+        leader = asyncio.ensure_future(single_flight.run('KEY', fail))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(single_flight.run('KEY', AsyncMock(return_value=1)))
+        await asyncio.sleep(0)
+        finish.set()
+        with self.assertRaises(asyncpg.PostgresError):
+            await leader
+        # Waiting operation runs itself when operation in flight fails
+        self.assertEqual((1, False), await follower)
+
+    async def test_cache_api(self):
+        csapi.MEMBER_CLASS_CACHE.put('GOV', 12)
+        csapi._INSTANCE_IDENTIFIER['value'] = 'EE'
+        status, body = await call_app(self.app, 'GET', '/cache')
+        self.assertEqual(200, status)
+        self.assertEqual('EE', body['instance_identifier'])
+
+        self.assertEqual(200, (await call_app(self.app, 'DELETE', '/cache'))[0])
+        self.assertEqual((False, None), csapi.MEMBER_CLASS_CACHE.get('GOV'))
+        self.assertEqual(None, csapi._INSTANCE_IDENTIFIER['value'])
+
+        app = csapi_async.App({'allowed': ['CN=allowed']})
+        self.assertEqual(403, (await call_app(
+            app, 'DELETE', '/cache', headers={'X-Ssl-Client-S-Dn': 'CN=other'}))[0])
+
+    async def test_routing_errors(self):
+        self.assertEqual(404, (await call_app(self.app, 'GET', '/unknown'))[0])
+        self.assertEqual(405, (await call_app(self.app, 'GET', '/member'))[0])
+        self.assertEqual(400, (await call_app(self.app, 'POST', '/member', b'{'))[0])
+
+    @patch('csapi_async.close_db_pool', new_callable=AsyncMock)
+    @patch('csapi_async.load_instance_identifier', new_callable=AsyncMock)
+    async def test_lifespan(self, mock_load_instance_identifier, mock_close_db_pool):
+        events = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        messages = []
+
+        async def receive():
+            return next(events)
+
+        async def send(message):
+            messages.append(message)
+
+        await self.app({'type': 'lifespan'}, receive, send)
+        self.assertEqual([
+            {'type': 'lifespan.startup.complete'}, {'type': 'lifespan.shutdown.complete'}],
+            messages)
+        mock_load_instance_identifier.assert_called_once_with()
+        mock_close_db_pool.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()